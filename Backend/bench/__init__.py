@@ -0,0 +1,12 @@
+"""
+PRISME - Benchmarks des moteurs sur donnees synthetiques.
+
+    synthetic.py   generateur de sources (CSV MOCA-O, base INSEE, BAAC,
+                   classeur CepiDc) a taille parametrable
+    suite.py       chronometrage des etapes et des generations completes,
+                   resultats JSON comparables a une reference
+
+Usage (depuis Backend/) :
+    python -m bench                              # echelle par defaut
+    python -m bench --scale communes=2000,years=6 --baseline state/bench/ref.json
+"""
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+PRISME - Suite de benchmarks des moteurs (donnees synthetiques).
+
+Genere des sources (bench/synthetic.py) dans un dossier temporaire, y
+redirige les moteurs (CSV_SOURCES_DIR, INPUTS_DIR, OUTPUT_DIR...) puis
+chronometre :
+    read_csv.<fichier>        csv_reader.read_csv_safe
+    parse.<parser>            parsers MOCA-O (moca, moca_filter, tabular, long, dimension)
+    fill.<dataset>            _fill_variable_data sur toutes les variables
+    aggregate.insee           generate_from_opendata._aggregate_levels
+    write_xlsx / zip          ecriture des classeurs d'un pack, archive
+    e2e.prisme.<dataset>      generate_prisme_excel (derniere annee)
+    e2e.opendata.<theme>      generate_theme (educ, route, mortalite_cardio)
+
+Chaque mesure est repetee (--repeat) : min / mediane / max en secondes. Le
+resultat JSON (PRISME_STATE_DIR/bench/bench_<horodatage>.json par defaut)
+peut servir de reference : --baseline signale toute etape dont la mediane
+depasse celle de la reference de plus de --threshold (code retour 1).
+
+Usage (depuis Backend/) :
+    python -m bench --scale communes=500,years=4 --repeat 5
+    python -m bench --baseline state/bench/ref.json --threshold 0.25
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+STATE_DIR = Path(os.environ.get("PRISME_STATE_DIR", BASE_DIR / "state"))
+RESULTS_DIR = STATE_DIR / "bench"
+
+DEFAULT_THRESHOLD = 0.25
+MIN_DELTA_SECONDS = 0.005   # ecarts plus petits : bruit de mesure
+OPENDATA_THEMES = ("educ", "route", "mortalite_cardio")
+
+
+def _measure(fn, repeat):
+    """Execute fn `repeat` fois (sorties console ignorees) -> stats en secondes."""
+    runs = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            t0 = time.perf_counter()
+            fn()
+            runs.append(time.perf_counter() - t0)
+    return {
+        "min": round(min(runs), 6),
+        "median": round(statistics.median(runs), 6),
+        "max": round(max(runs), 6),
+        "runs": len(runs),
+    }
+
+
+def _git_revision():
+    try:
+        res = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                             capture_output=True, text=True, timeout=5)
+        return res.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _engines(root):
+    """Importe les moteurs et les redirige vers l'arborescence synthetique."""
+    if str(BASE_DIR) not in sys.path:
+        sys.path.insert(0, str(BASE_DIR))
+    import prisme_engine as eng
+    import generate_from_opendata as od
+
+    output = root / "output"
+    output.mkdir(exist_ok=True)
+    eng.CSV_SOURCES_DIR = root / "csv_sources"
+    eng.CONFIG_FILE = root / "themes_config.json"
+    eng.OUTPUT_DIR = output
+    eng.reload_config()
+    od.INPUTS_DIR = root / "inputs" / "opendata"
+    od.OUTPUT_DIR = output
+    od.CEPIDC_SOURCE = od.INPUTS_DIR / "cepidc" / "taux_effectifs_regions_15_23.xlsx"
+    return eng, od
+
+
+def _empty_rows(eng, config, year):
+    """Lignes vides {geo_key: [row]} d'un dataset, comme build_prisme_tables."""
+    dim_id = config.get("multiRowDimension")
+    dim_values = next((c.get("values", []) for c in config["columns"] if c["id"] == dim_id), []) if dim_id else []
+    data = {}
+    for geo_key, entities in eng.GEO_ENTITIES.items():
+        id_col = eng.GEO_ID_COLS[geo_key]
+        if dim_values:
+            data[geo_key] = [{id_col: e, "annee": year, dim_id: dv} for e in entities for dv in dim_values]
+        else:
+            data[geo_key] = [{id_col: e, "annee": year} for e in entities]
+    return data, dim_id
+
+
+def _stage_benchmarks(eng, od, root, years, repeat):
+    import csv_reader
+    from openpyxl import Workbook
+
+    stages = {}
+    year = years[-1]
+    sources = sorted((root / "csv_sources").glob("*.csv"))
+
+    for path in sources + [od.INPUTS_DIR / f"diplomes_formation_{year}.csv"]:
+        stages[f"read_csv.{path.stem}"] = _measure(lambda p=path: csv_reader.read_csv_safe(p), repeat)
+
+    src = root / "csv_sources"
+    parsers = {
+        "parse.moca": lambda: eng.parse_moca_csv(src / "Bench_Moca_GF_REG_DOM_Fh.csv"),
+        "parse.moca_filter": lambda: eng.parse_moca_filter_csv(src / "Bench_Filter_GF_REG_DOM_Fh.csv", 4, "Type A"),
+        "parse.tabular": lambda: eng.parse_tabular_csv(src / "Bench_Tabular_GF_REG_DOM_Fh.csv", value_column=2),
+        "parse.long": lambda: eng.parse_long_format_csv(src / "Bench_Long_GF_REG_DOM_Fh.csv"),
+        "parse.dimension": lambda: eng.parse_moca_csv(src / "Bench_Dim_GF_REG_DOM_Fh.csv", dimension_column=4),
+    }
+    for name, fn in parsers.items():
+        stages[name] = _measure(fn, repeat)
+
+    for dataset_id in ("bench_all", "bench_dim"):
+        config = eng.get_dataset_config(dataset_id)
+        with contextlib.redirect_stdout(io.StringIO()):
+            csv_data = eng.load_dataset_csv(dataset_id)
+
+        def fill(config=config, csv_data=csv_data):
+            data, dim_id = _empty_rows(eng, config, year)
+            for var_id, parsed in csv_data.items():
+                eng._fill_variable_data(data, var_id, parsed, year, "annee", dimension_id=dim_id)
+        stages[f"fill.{dataset_id}"] = _measure(fill, repeat)
+
+    raw, _ = csv_reader.read_csv_safe(od.INPUTS_DIR / f"diplomes_formation_{year}.csv", dtype={"IRIS": str, "COM": str})
+    value_columns = [c for c in raw.columns if c.startswith("P")]
+    stages["aggregate.insee"] = _measure(lambda: od._aggregate_levels(raw, value_columns, code_col="COM"), repeat)
+
+    # Ecriture d'un pack : un classeur par niveau + consolide, puis ZIP
+    with contextlib.redirect_stdout(io.StringIO()):
+        tables = eng.build_prisme_tables("bench_all", year)
+    pack = root / "pack"
+
+    def write_pack():
+        shutil.rmtree(pack, ignore_errors=True)
+        (pack / "bench").mkdir(parents=True)
+        wb_cons = Workbook()
+        wb_cons.remove(wb_cons.active)
+        for geo_key, (headers, rows) in tables.items():
+            wb = Workbook()
+            wb.remove(wb.active)
+            eng._write_sheet(wb.create_sheet(geo_key), headers, rows)
+            wb.save(pack / "bench" / f"bench_{geo_key}.xlsx")
+            eng._write_sheet(wb_cons.create_sheet(geo_key), headers, rows)
+        wb_cons.save(pack / "bench" / "bench_consolidated.xlsx")
+    stages["write_xlsx"] = _measure(write_pack, repeat)
+    stages["zip"] = _measure(lambda: shutil.make_archive(str(root / "pack_bench"), "zip", str(pack), "bench"), repeat)
+    return stages
+
+
+def _e2e_benchmarks(eng, od, years, repeat):
+    stages = {}
+    year = years[-1]
+    for dataset_id in eng.get_available_datasets():
+        stages[f"e2e.prisme.{dataset_id}"] = _measure(lambda d=dataset_id: eng.generate_prisme_excel(d, year), repeat)
+    for theme in OPENDATA_THEMES:
+        stages[f"e2e.opendata.{theme}"] = _measure(lambda t=theme: od.generate_theme(t, year), repeat)
+    return stages
+
+
+def run(scale=None, repeat=3, keep=False):
+    """Genere les sources, chronometre toutes les etapes -> dict de resultats."""
+    from bench import synthetic
+
+    root = Path(tempfile.mkdtemp(prefix="prisme_bench_"))
+    # Caches (source_cache, timing) des moteurs dans le dossier jetable
+    os.environ["PRISME_STATE_DIR"] = str(root / "state")
+    try:
+        t0 = time.perf_counter()
+        info = synthetic.generate(root, scale)
+        generated_in = time.perf_counter() - t0
+        eng, od = _engines(root)
+        stages = _stage_benchmarks(eng, od, root, info["years"], repeat)
+        stages.update(_e2e_benchmarks(eng, od, info["years"], repeat))
+    finally:
+        os.environ["PRISME_STATE_DIR"] = str(STATE_DIR)
+        if keep:
+            print(f"[INFO] Sources synthetiques conservees : {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "scale": info["scale"],
+        "repeat": repeat,
+        "generated_in": round(generated_in, 3),
+        "stages": stages,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """Etapes plus lentes que la reference -> [(etape, mediane ref, mediane, ratio)]."""
+    regressions = []
+    for name, stats in current["stages"].items():
+        ref = baseline.get("stages", {}).get(name)
+        if not ref:
+            continue
+        before, after = ref["median"], stats["median"]
+        if after - before > MIN_DELTA_SECONDS and after > before * (1 + threshold):
+            regressions.append((name, before, after, after / before if before else float("inf")))
+    return regressions
+
+
+def _print_results(results, baseline=None):
+    print(f"[BENCH] echelle {results['scale']} - {results['repeat']} repetition(s)")
+    for name, stats in results["stages"].items():
+        line = f"  {name:<40} {stats['median'] * 1000:>10.1f} ms"
+        ref = (baseline or {}).get("stages", {}).get(name)
+        if ref and ref["median"]:
+            line += f"   ({(stats['median'] / ref['median'] - 1) * 100:+.0f}% vs ref)"
+        print(line)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmarks PRISME sur donnees synthetiques")
+    ap.add_argument("--scale", default=None, help="ex. communes=2000,years=6,dims=20,rows=3,accidents=10")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--out", default=None, help="fichier JSON de resultats")
+    ap.add_argument("--baseline", default=None, help="resultats de reference a comparer")
+    ap.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                    help="regression si mediane > reference x (1 + seuil)")
+    ap.add_argument("--keep", action="store_true", help="conserver les sources synthetiques")
+    args = ap.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+
+    results = run(args.scale, max(1, args.repeat), keep=args.keep)
+    _print_results(results, baseline)
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"[OK] Resultats : {out}")
+
+    if baseline is None:
+        return 0
+    if baseline.get("scale") != results["scale"]:
+        print(f"[ERROR] Echelle differente de la reference ({baseline.get('scale')}) : comparaison impossible")
+        return 2
+    regressions = compare(results, baseline, args.threshold)
+    for name, before, after, ratio in regressions:
+        print(f"[ERROR] Regression {name} : {before * 1000:.1f} ms -> {after * 1000:.1f} ms (x{ratio:.2f})")
+    if regressions:
+        return 1
+    print(f"[OK] Aucune regression au-dela de {args.threshold:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+PRISME - Generateur de sources synthetiques pour les benchmarks.
+
+Ecrit sous `root` une arborescence au format des vraies sources, a une
+echelle parametrable :
+
+    root/themes_config.json               datasets bench_* (un par parser + bench_all)
+    root/csv_sources/*.csv                CSV MOCA-O (moca, moca_filter, tabular, long), cp1252
+    root/inputs/opendata/
+        diplomes_formation_<annee>.csv    base INSEE (IRIS x communes)
+        baac/annees_<annee>/              caract_<annee>.csv + usagers_<annee>.csv
+        cepidc/taux_effectifs_regions_15_23.xlsx
+
+Echelle (dict, cf. DEFAULT_SCALE) :
+    communes   communes par source (les 22 de Guyane d'abord, puis d'autres
+               departements : parsees puis ignorees en MOCA-O, agregees par
+               region en Open Data)
+    years      annees consecutives jusqu'a 2022
+    dims       valeurs de dimension (dataset bench_dim)
+    rows       lignes IRIS par commune (base INSEE)
+    accidents  accidents par commune et par annee (BAAC)
+
+Les valeurs sont tirees d'un random.Random(seed) : meme echelle, memes fichiers.
+"""
+import csv
+import json
+import random
+from pathlib import Path
+
+DEFAULT_SCALE = {"communes": 22, "years": 3, "dims": 5, "rows": 1, "accidents": 5, "seed": 42}
+LAST_YEAR = 2022
+ENCODING = "cp1252"   # comme les exports MOCA-O
+
+COMMUNES_GUYANE = [
+    ("97301", "Régina"), ("97302", "Cayenne"), ("97303", "Iracoubo"), ("97304", "Kourou"),
+    ("97305", "Macouria"), ("97306", "Mana"), ("97307", "Matoury"), ("97308", "Saint-Georges"),
+    ("97309", "Remire-Montjoly"), ("97310", "Roura"), ("97311", "Saint-Laurent-du-Maroni"),
+    ("97312", "Sinnamary"), ("97313", "Montsinéry-Tonnegrande"), ("97314", "Ouanary"),
+    ("97352", "Saül"), ("97353", "Maripasoula"), ("97356", "Camopi"), ("97357", "Grand-Santi"),
+    ("97358", "Saint-Élie"), ("97360", "Apatou"), ("97361", "Awala-Yalimapo"), ("97362", "Papaïchton"),
+]
+
+REGIONS = [
+    ("84", "Auvergne-Rhône-Alpes"), ("27", "Bourgogne-Franche-Comté"), ("53", "Bretagne"),
+    ("24", "Centre-Val de Loire"), ("94", "Corse"), ("44", "Grand Est"), ("32", "Hauts-de-France"),
+    ("11", "Île-de-France"), ("28", "Normandie"), ("75", "Nouvelle-Aquitaine"), ("76", "Occitanie"),
+    ("52", "Pays de la Loire"), ("93", "Provence-Alpes-Côte d'Azur"), ("01", "Guadeloupe"),
+    ("02", "Martinique"), ("03", "Guyane"), ("04", "La Réunion"), ("06", "Mayotte"),
+]
+NATIONAL = ["Departements d'outre mer", "France métropolitaine", "France entière"]
+
+# Departements hors Guyane pour les communes supplementaires
+OTHER_DEPS = ["01", "13", "22", "2A", "31", "33", "35", "44", "59", "67", "69", "75", "971", "972", "974", "976"]
+
+CEPIDC_SHEETS = ["Toutes causes", "Cardio", "Tumeurs", "Respi"]
+
+
+def resolve_scale(scale=None):
+    """'communes=2000,years=6' ou dict partiel -> dict complet (entiers)."""
+    out = dict(DEFAULT_SCALE)
+    if isinstance(scale, str):
+        scale = dict(part.split("=", 1) for part in scale.split(",") if part.strip())
+    for key, value in (scale or {}).items():
+        if key not in DEFAULT_SCALE:
+            raise ValueError(f"Parametre d'echelle inconnu: {key} (attendus: {sorted(DEFAULT_SCALE)})")
+        out[key] = int(value)
+    out["years"] = max(1, min(out["years"], LAST_YEAR - 2000))
+    return out
+
+
+def years_of(scale):
+    return list(range(LAST_YEAR - scale["years"] + 1, LAST_YEAR + 1))
+
+
+def communes(n):
+    """[(code, libelle)] : Guyane puis communes d'autres departements."""
+    out = list(COMMUNES_GUYANE[:n])
+    i = 0
+    while len(out) < n:
+        dep = OTHER_DEPS[i % len(OTHER_DEPS)]
+        num = i // len(OTHER_DEPS) + 1
+        code = f"{dep}{num:02d}" if len(dep) == 3 else f"{dep}{num:03d}"
+        out.append((code, f"Commune {code}"))
+        i += 1
+    return out
+
+
+def _geo_labels(scale):
+    """Libelles geo d'un export MOCA-O : communes, regions, niveaux nationaux."""
+    return ([f"{code} - {name}" for code, name in communes(scale["communes"])]
+            + [name for _, name in REGIONS] + NATIONAL)
+
+
+def _fr(value):
+    return f"{value:.2f}".replace(".", ",")
+
+
+def _write_lines(path, lines):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding=ENCODING, newline="") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# ============================================================================
+# CSV MOCA-O
+# ============================================================================
+
+def write_moca_csv(path, scale, rnd, labels=("Ensemble",)):
+    """Format standard : ;;;annee;libelle;territoire;valeur (valeurs a la francaise)."""
+    lines = [";;;Date#Annee;Type#type;Lieu_domicile#commune;Valeur;;;", ";;;;;;;;;"]
+    for year in years_of(scale):
+        for label in labels:
+            for geo in _geo_labels(scale):
+                lines.append(f";;;{year};{label};{geo};{_fr(rnd.uniform(10, 50000))};;;")
+    _write_lines(path, lines)
+
+
+def write_tabular_csv(path, scale, rnd):
+    """Format tabulaire Open Data : Année#annee;territoire;val1;val2 (en-tete)."""
+    lines = ["Date#Annee;Lieu_domicile#commune;Indicateur_1;Indicateur_2"]
+    for year in years_of(scale):
+        for geo in _geo_labels(scale):
+            lines.append(f"Année#{year};{geo};{rnd.uniform(0.5, 6)};{rnd.uniform(5, 40)}")
+    _write_lines(path, lines)
+
+
+def write_long_csv(path, scale, rnd):
+    """Format long : annee;age;sexe;territoire;valeur (separateur decimal '.')."""
+    lines = ["Date_RP#Annee;Age_personne#age;Sexe_personne#sexe;Lieu_domicile#commune;Population",
+             ";;;;"]
+    for year in years_of(scale):
+        for geo in _geo_labels(scale):
+            lines.append(f"{year};Age : 0,1,2, ..., 65 ou +;Sexe;{geo};{rnd.uniform(10, 90000)}")
+    _write_lines(path, lines)
+
+
+def dimension_values(scale):
+    return [f"dim_{i:03d}" for i in range(scale["dims"])]
+
+
+def _variable(var_id, pattern, parser, **extra):
+    return {"id": var_id, "type": "variable", "label": var_id, "csvPattern": pattern, "parser": parser, **extra}
+
+
+def _dataset(name, variables, dimension=None):
+    columns = [{"id": "geo", "type": "geo_id"}, {"id": "annee", "type": "year"}]
+    if dimension:
+        columns.append({"id": "dim", "type": "dimension", "label": "Dimension", "values": dimension})
+    config = {
+        "name": name,
+        "folderPath": f"Bench/{name}",
+        "fileName": name,
+        "sheets": ["com", "reg", "dom", "fh", "fra"],
+        "columns": columns + variables,
+    }
+    if dimension:
+        config["multiRowDimension"] = "dim"
+    return config
+
+
+def write_moca_sources(root, scale, rnd):
+    """CSV MOCA-O + themes_config.json des datasets bench_* -> liste des datasets."""
+    src = root / "csv_sources"
+    write_moca_csv(src / "Bench_Moca_GF_REG_DOM_Fh.csv", scale, rnd)
+    write_moca_csv(src / "Bench_Filter_GF_REG_DOM_Fh.csv", scale, rnd, labels=("Type A", "Type B"))
+    write_moca_csv(src / "Bench_Dim_GF_REG_DOM_Fh.csv", scale, rnd, labels=dimension_values(scale))
+    write_tabular_csv(src / "Bench_Tabular_GF_REG_DOM_Fh.csv", scale, rnd)
+    write_long_csv(src / "Bench_Long_GF_REG_DOM_Fh.csv", scale, rnd)
+
+    variables = {
+        "moca": [_variable("nb_moca", "Bench_Moca", "moca")],
+        "filter": [_variable("nb_type_a", "Bench_Filter", "moca_filter", filterColumn=4, filterValue="Type A"),
+                   _variable("nb_type_b", "Bench_Filter", "moca_filter", filterColumn=4, filterValue="Type B")],
+        "tabular": [_variable("ind_1", "Bench_Tabular", "tabular", column=2),
+                    _variable("ind_2", "Bench_Tabular", "tabular", column=3)],
+        "long": [_variable("nb_long", "Bench_Long", "long")],
+    }
+    datasets = {f"bench_{kind}": _dataset(f"bench_{kind}", cols) for kind, cols in variables.items()}
+    datasets["bench_dim"] = _dataset("bench_dim", [_variable("nb_dim", "Bench_Dim", "moca", dimensionColumn=4)],
+                                     dimension=dimension_values(scale))
+    datasets["bench_all"] = _dataset("bench_all", [c for cols in variables.values() for c in cols])
+    config = {"version": "bench", "description": f"Datasets synthetiques (echelle {scale})",
+              "themeTree": [], "datasets": datasets}
+    (root / "themes_config.json").write_text(json.dumps(config, ensure_ascii=False, indent=1), encoding="utf-8")
+    return list(datasets)
+
+
+# ============================================================================
+# OPEN DATA : BASE INSEE, BAAC, CEPIDC
+# ============================================================================
+
+INSEE_EDUC_VARS = ["POP0610", "POP1114", "POP1517", "SCOL0610", "SCOL1114", "SCOL1517",
+                   "POP1524", "POP2554", "POP5564", "NSCOL15P_DIPLMIN"]
+
+
+def write_insee_base(root, scale, rnd):
+    """diplomes_formation_<annee>.csv : une ligne par IRIS (theme Open Data educ)."""
+    out = root / "inputs" / "opendata"
+    out.mkdir(parents=True, exist_ok=True)
+    for year in years_of(scale):
+        prefix = f"P{str(year)[2:]}_"
+        with open(out / f"diplomes_formation_{year}.csv", "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f, delimiter=";")
+            w.writerow(["IRIS", "COM"] + [prefix + v for v in INSEE_EDUC_VARS])
+            for code, _ in communes(scale["communes"]):
+                for i in range(scale["rows"]):
+                    w.writerow([f"{code}{i:04d}", code] + [round(rnd.uniform(0, 3000), 4) for _ in INSEE_EDUC_VARS])
+
+
+def write_baac(root, scale, rnd):
+    """baac/annees_<annee>/caract_ + usagers_ : `accidents` accidents par commune."""
+    for year in years_of(scale):
+        out = root / "inputs" / "opendata" / "baac" / f"annees_{year}"
+        out.mkdir(parents=True, exist_ok=True)
+        with open(out / f"caract_{year}.csv", "w", encoding="utf-8", newline="") as fc, \
+                open(out / f"usagers_{year}.csv", "w", encoding="utf-8", newline="") as fu:
+            wc, wu = csv.writer(fc, delimiter=";"), csv.writer(fu, delimiter=";")
+            wc.writerow(["Num_Acc", "jour", "mois", "an", "dep", "com"])
+            wu.writerow(["Num_Acc", "id_usager", "grav"])
+            n = 0
+            for code, _ in communes(scale["communes"]):
+                dep = code[:3] if code.startswith("97") else code[:2]
+                for _ in range(scale["accidents"]):
+                    n += 1
+                    acc = f"{year}{n:08d}"
+                    wc.writerow([acc, rnd.randint(1, 28), f"{rnd.randint(1, 12):02d}", year, dep, code])
+                    for u in range(rnd.randint(1, 3)):
+                        wu.writerow([acc, f"{n}{u}", rnd.choice("1234")])
+
+
+def write_cepidc(root, scale, rnd):
+    """Classeur CepiDc : par onglet, annees sur 2 colonnes (N, Taux), une ligne par region."""
+    from openpyxl import Workbook
+    years = years_of(scale)
+    wb = Workbook()
+    wb.remove(wb.active)
+    for sheet in CEPIDC_SHEETS:
+        ws = wb.create_sheet(sheet)
+        ws.append(["Régions", sheet])
+        ws.append([None] + [v for y in years for v in (y, None)])
+        ws.append([None] + ["N", "Taux"] * len(years))
+        total = [0] * len(years)
+        for _, name in REGIONS:
+            counts = [rnd.randint(50, 20000) for _ in years]
+            total = [t + c for t, c in zip(total, counts)]
+            ws.append([name] + [v for c in counts for v in (c, round(rnd.uniform(100, 400), 1))])
+        ws.append(["France"] + [v for t in total for v in (t, round(rnd.uniform(150, 250), 1))])
+        ws.append(["(p) : provisoire"])
+    out = root / "inputs" / "opendata" / "cepidc"
+    out.mkdir(parents=True, exist_ok=True)
+    wb.save(out / "taux_effectifs_regions_15_23.xlsx")
+
+
+def generate(root, scale=None):
+    """Ecrit toutes les sources synthetiques sous root. -> {scale, years, datasets}"""
+    root = Path(root)
+    scale = resolve_scale(scale)
+    rnd = random.Random(scale["seed"])
+    datasets = write_moca_sources(root, scale, rnd)
+    write_insee_base(root, scale, rnd)
+    write_baac(root, scale, rnd)
+    write_cepidc(root, scale, rnd)
+    return {"scale": scale, "years": years_of(scale), "datasets": datasets}
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Sources synthetiques PRISME (benchmarks)")
+    ap.add_argument("root", help="dossier de sortie")
+    ap.add_argument("--scale", default=None, help="ex. communes=2000,years=6,dims=20")
+    args = ap.parse_args()
+    info = generate(args.root, args.scale)
+    print(f"[OK] Sources synthetiques ecrites dans {args.root} : {json.dumps(info, ensure_ascii=False)}")
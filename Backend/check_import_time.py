@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+PRISME - Budget de temps d'import (python -X importtime)
+
+Mesure le cout d'import des points d'entree (serveur FastAPI, worker, moteurs)
+dans un interpreteur neuf et le compare a un budget. Sert de garde-fou pour le
+demarrage a froid : app.py ne doit pas tirer pandas/openpyxl avant d'ouvrir le
+port (les moteurs sont charges en arriere-plan, cf. _warm_up_engines).
+
+Usage :
+    python Backend/check_import_time.py              # rapport + code retour 1 si budget depasse
+    python Backend/check_import_time.py --top 15     # plus gros imports par module
+"""
+import argparse
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+ROOT_DIR = BASE_DIR.parent
+
+# module -> (repertoire d'import, budget cumule en ms, modules interdits)
+IMPORT_BUDGETS = {
+    "app": (ROOT_DIR, 1500, ("pandas", "openpyxl", "prisme_engine", "generate_from_opendata")),
+    "prisme_worker": (BASE_DIR, 300, ("pandas", "openpyxl")),
+    "csv_reader": (BASE_DIR, 1200, ()),
+    "prisme_engine": (BASE_DIR, 2000, ()),
+    "generate_from_opendata": (BASE_DIR, 2000, ()),
+}
+
+_LINE_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module, cwd):
+    """Retourne [(module, self_us, cumul_us, profondeur)] pour un import a froid."""
+    cmd = [sys.executable, "-X", "importtime", "-c",
+           f"import sys; sys.path.insert(0, {str(cwd)!r}); import {module}"]
+    res = subprocess.run(cmd, cwd=cwd, capture_output=True, text=True)
+    if res.returncode != 0:
+        raise RuntimeError(res.stderr.strip().splitlines()[-1] if res.stderr else f"exit {res.returncode}")
+    rows = []
+    for line in res.stderr.splitlines():
+        m = _LINE_RE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2))
+    return rows
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Budget de temps d'import des points d'entree PRISME")
+    ap.add_argument("--top", type=int, default=5, help="nombre d'imports les plus couteux affiches")
+    ap.add_argument("modules", nargs="*", help="modules a mesurer (defaut : tous)")
+    args = ap.parse_args(argv)
+
+    failures = 0
+    for module in args.modules or IMPORT_BUDGETS:
+        cwd, budget_ms, forbidden = IMPORT_BUDGETS[module]
+        try:
+            rows = measure(module, cwd)
+        except Exception as e:
+            print(f"[ERROR] {module}: {e}")
+            failures += 1
+            continue
+        total_ms = next((c for name, _, c, _ in rows if name == module), 0) / 1000
+        loaded = {name for name, _, _, _ in rows}
+        leaked = [m for m in forbidden if m in loaded]
+
+        status = "OK" if total_ms <= budget_ms and not leaked else "KO"
+        if status == "KO":
+            failures += 1
+        print(f"[{status}] {module}: {total_ms:.0f} ms (budget {budget_ms} ms)")
+        if leaked:
+            print(f"     imports interdits au demarrage : {', '.join(leaked)}")
+        top = sorted((r for r in rows if r[3] == 1), key=lambda r: r[2], reverse=True)[:args.top]
+        for name, _, cumul, _ in top:
+            print(f"     {cumul / 1000:8.1f} ms  {name}")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,6 +11,8 @@ Problèmes récurrents couverts :
 
 Fournit :
 - read_csv_safe(path, sep=None, **kwargs) -> (df, meta)
+- read_csv_chunked(path, reduce, **kwargs) -> (df, meta)  (lecture par morceaux,
+  cf. memory.should_chunk)
 - normalize_geo_code(value, width=5) -> str  (avec zfill conditionnel)
 - log_read(meta)   -> print standardisé [READ] ...
 """
@@ -20,6 +22,8 @@ from pathlib import Path
 from typing import Optional, Tuple, Dict, Any
 import pandas as pd
 
+import timing
+
 
 # Valeurs à interpréter comme NaN (en plus des standards pandas).
 MOCA_NA_VALUES = [
@@ -32,6 +36,9 @@ MOCA_NA_VALUES = [
 ENCODINGS_TRY_ORDER = ("utf-8-sig", "utf-8", "cp1252", "latin-1")
 SEPARATORS_TRY_ORDER = (";", ",", "\t", "|")
 
+CHUNK_ROWS = 200_000   # lignes par morceau (read_csv_chunked)
+PROBE_ROWS = 1_000     # lignes lues pour fixer encodage / separateur
+
 
 def _sniff_separator(sample: str) -> Optional[str]:
     """Devine le séparateur en comptant les occurrences sur la 1ère ligne non vide."""
@@ -87,6 +94,20 @@ def read_csv_safe(
     Raises:
         RuntimeError si aucune combinaison ne parvient à lire.
     """
+    with timing.span("decode", file=Path(path).name):
+        return _read_csv_safe(path, sep=sep, dtype=dtype, usecols=usecols,
+                              extra_na_values=extra_na_values, **read_csv_kwargs)
+
+
+def _read_csv_safe(
+    path: Path | str,
+    sep: Optional[str] = None,
+    dtype: Optional[dict] = None,
+    usecols=None,
+    extra_na_values: Optional[list] = None,
+    **read_csv_kwargs,
+) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """Corps de read_csv_safe (hors chronometrage)."""
     path = Path(path)
     if not path.exists():
         raise FileNotFoundError(f"CSV introuvable : {path}")
@@ -195,6 +216,60 @@ def read_csv_safe(
     )
 
 
+def read_csv_chunked(
+    path: Path | str,
+    reduce,
+    sep: Optional[str] = None,
+    dtype: Optional[dict] = None,
+    chunksize: Optional[int] = None,
+    **read_csv_kwargs,
+) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    """
+    Lecture par morceaux : reduce(chunk) -> DataFrame reduit (colonnes utiles,
+    pre-agregation...) applique a chaque morceau, puis concatenation. Le pic
+    memoire suit la taille d'un morceau et non celle du fichier.
+
+    Encodage et separateur sont fixes sur les PROBE_ROWS premieres lignes
+    (memes regles que read_csv_safe) ; si le decodage echoue plus loin, repli
+    sur read_csv_safe + reduce en une fois.
+    meta : celui de read_csv_safe, rows = lignes brutes lues, + chunks.
+    """
+    path = Path(path)
+    with timing.span("decode", file=path.name, chunked=True):
+        _, probe = _read_csv_safe(path, sep=sep, dtype=dtype, nrows=PROBE_ROWS, **read_csv_kwargs)
+        encoding = probe["encoding"]
+        extra = {}
+        if encoding == "latin-1 (replace)":
+            encoding, extra = "latin-1", {"encoding_errors": "replace"}
+        parts = []
+        rows = columns = 0
+        try:
+            reader = pd.read_csv(
+                path,
+                sep=probe["separator"],
+                encoding=encoding,
+                dtype=dtype,
+                na_values=MOCA_NA_VALUES,
+                keep_default_na=True,
+                chunksize=chunksize or CHUNK_ROWS,
+                **extra,
+                **read_csv_kwargs,
+            )
+            with reader:
+                for chunk in reader:
+                    chunk = _clean_columns(chunk)
+                    rows += len(chunk)
+                    columns = len(chunk.columns)
+                    parts.append(reduce(chunk))
+        except (UnicodeDecodeError, UnicodeError) as exc:
+            print(f"  [WARN] {path.name}: lecture par morceaux impossible ({exc}), lecture complete")
+            df, meta = _read_csv_safe(path, sep=sep, dtype=dtype, **read_csv_kwargs)
+            return reduce(df), {**meta, "chunks": 1}
+    df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    meta = {**probe, "rows": rows, "columns": columns, "chunks": len(parts)}
+    return df, meta
+
+
 def normalize_geo_code(value, width: int = 5) -> str:
     """Normalise un code géo : gère float (93.0 -> '93'), 2A/2B, zfill conditionnel.
 
@@ -220,7 +295,8 @@ def log_read(meta: Dict[str, Any], prefix: str = "  [READ]") -> None:
     """Log standardisé d'une lecture CSV."""
     flag = " (fallback)" if meta.get("fallback_used") else ""
     name = Path(meta["path"]).name
+    chunks = f" chunks={meta['chunks']}" if meta.get("chunks") else ""
     print(
         f"{prefix} {name} -> enc={meta['encoding']} sep={meta['separator']!r} "
-        f"rows={meta['rows']} cols={meta['columns']}{flag}"
+        f"rows={meta['rows']} cols={meta['columns']}{chunks}{flag}"
     )
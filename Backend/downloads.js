@@ -0,0 +1,106 @@
+// ============================================================
+// Module downloads : envoi des artefacts generes (/api/download).
+//
+// Les ZIP / xlsx sont reproductibles (cf. reproducible.py) : a donnees
+// identiques, octets identiques. L'ETag est donc fort et derive du
+// contenu (SHA-256, recalcule seulement si mtime ou taille changent) :
+//   If-None-Match couvrant l'ETag  -> 304 sans corps
+//   Range: bytes=a-b (un intervalle) -> 206, reprise de telechargement
+//   If-Range different de l'ETag   -> Range ignore, fichier complet
+//   intervalle hors fichier          -> 416
+// ============================================================
+
+const fs = require('fs');
+const crypto = require('crypto');
+
+const etags = new Map();   // chemin -> { mtimeMs, size, etag }
+
+function fileEtag(filePath, stat) {
+    const hit = etags.get(filePath);
+    if (hit && hit.mtimeMs === stat.mtimeMs && hit.size === stat.size) {
+        return Promise.resolve(hit.etag);
+    }
+    return new Promise((resolve, reject) => {
+        const hash = crypto.createHash('sha256');
+        fs.createReadStream(filePath)
+            .on('data', chunk => hash.update(chunk))
+            .on('error', reject)
+            .on('end', () => {
+                const etag = `"${hash.digest('hex')}"`;
+                etags.set(filePath, { mtimeMs: stat.mtimeMs, size: stat.size, etag });
+                resolve(etag);
+            });
+    });
+}
+
+function etagMatches(header, etag) {
+    if (!header) return false;
+    return header.split(',').some(tag => {
+        tag = tag.trim();
+        return tag === '*' || tag.replace(/^W\//, '') === etag;
+    });
+}
+
+// -> { start, end } (bornes incluses), null (pas de Range exploitable) ou 'invalid' (416)
+function parseRange(header, size) {
+    const m = /^bytes=(\d*)-(\d*)$/.exec((header || '').trim());
+    if (!m || (m[1] === '' && m[2] === '')) return null;   // absent, multi-intervalles : fichier complet
+    let start, end;
+    if (m[1] === '') {
+        const suffix = parseInt(m[2], 10);
+        if (suffix === 0) return 'invalid';
+        start = Math.max(size - suffix, 0);
+        end = size - 1;
+    } else {
+        start = parseInt(m[1], 10);
+        end = m[2] === '' ? size - 1 : Math.min(parseInt(m[2], 10), size - 1);
+    }
+    if (start >= size || start > end) return 'invalid';
+    return { start, end };
+}
+
+// Envoie filePath avec ETag / 304 / Range ; headers : Content-Type, Content-Disposition...
+async function sendDownload(req, res, filePath, headers) {
+    const stat = fs.statSync(filePath);
+    const etag = await fileEtag(filePath, stat);
+    const base = {
+        ...headers,
+        'ETag': etag,
+        'Cache-Control': 'no-cache',
+        'Accept-Ranges': 'bytes',
+        'Last-Modified': stat.mtime.toUTCString(),
+    };
+
+    if (etagMatches(req.headers['if-none-match'], etag)) {
+        res.writeHead(304, { 'ETag': etag, 'Cache-Control': 'no-cache' });
+        res.end();
+        return 304;
+    }
+
+    const ifRange = req.headers['if-range'];
+    const range = (!ifRange || ifRange === etag) ? parseRange(req.headers.range, stat.size) : null;
+    if (range === 'invalid') {
+        res.writeHead(416, { 'Content-Range': `bytes */${stat.size}`, 'ETag': etag });
+        res.end();
+        return 416;
+    }
+
+    const head = req.method === 'HEAD';
+    if (range) {
+        res.writeHead(206, {
+            ...base,
+            'Content-Range': `bytes ${range.start}-${range.end}/${stat.size}`,
+            'Content-Length': range.end - range.start + 1,
+        });
+        if (head) res.end();
+        else fs.createReadStream(filePath, { start: range.start, end: range.end }).pipe(res);
+        return 206;
+    }
+
+    res.writeHead(200, { ...base, 'Content-Length': stat.size });
+    if (head) res.end();
+    else fs.createReadStream(filePath).pipe(res);
+    return 200;
+}
+
+module.exports = { sendDownload, fileEtag, parseRange };
@@ -13,6 +13,11 @@ const PocketBase = require('pocketbase').default || require('pocketbase');
 const { handleReportData } = require('./report_data');
 const { handleAvatar, userIdFromToken } = require('./avatar');
 const { handleSettings } = require('./settings');
+const pythonWorker = require('./python_worker');
+const prewarm = require('./prewarm');
+const retention = require('./retention');
+const { handleProfiles } = require('./profiles');
+const { sendDownload } = require('./downloads');
 
 // Utility: SHA256 hash
 function sha256(str) {
@@ -363,7 +368,7 @@ const server = http.createServer(async (req, res) => {
 
     // ========== HEALTH CHECK ==========
     if (urlPath === '/health') {
-        jsonResponse(res, 200, { status: 'ok', version: '4.0' });
+        jsonResponse(res, 200, { status: 'ok', version: '4.0', pythonWorkers: pythonWorker.status() });
         return;
     }
 
@@ -456,18 +461,10 @@ const server = http.createServer(async (req, res) => {
             jsonResponse(res, 400, { success: false, error: 'Missing dataset parameter' });
             return;
         }
-        // Use Python to detect years (relies on CSV parsing)
+        // Use Python to detect years (relies on CSV parsing) - worker persistant
         try {
-            const result = await runPython(`
-import sys, json
-sys.path.insert(0, '${__dirname.replace(/\\/g, '/')}')
-from prisme_engine import detect_available_years, reload_config
-reload_config()
-years = detect_available_years('${datasetId}')
-print(json.dumps({"success": True, "years": years}))
-`);
-            const data = JSON.parse(result.stdout.trim().split('\n').pop());
-            jsonResponse(res, 200, data);
+            const { result } = await pythonWorker.call('detect_available_years', { dataset_id: datasetId });
+            jsonResponse(res, 200, { success: true, years: result.years });
         } catch (e) {
             jsonResponse(res, 500, { success: false, years: [], error: e.message });
         }
@@ -481,94 +478,10 @@ print(json.dumps({"success": True, "years": years}))
             jsonResponse(res, 400, { success: false, error: 'Missing dataset parameter' });
             return;
         }
+        // Scan des fichiers : generate_from_opendata.detect_available_years_opendata
         try {
-            const result = await runPython(`
-import sys, json
-sys.path.insert(0, '${__dirname.replace(/\\/g, '/')}')
-from generate_from_opendata import THEME_CONFIGS, INPUTS_DIR
-
-dataset = '${datasetId}'
-if dataset not in THEME_CONFIGS:
-    print(json.dumps({"success": True, "years": []}))
-else:
-    src = THEME_CONFIGS[dataset]["source_type"]
-    years = []
-    if src == "educ":
-        for p in sorted(INPUTS_DIR.glob("diplomes_formation_*.csv")):
-            y = p.stem.split("_")[-1]
-            if y.isdigit(): years.append(int(y))
-    elif src == "couples":
-        for p in sorted(INPUTS_DIR.glob("couples_familles_*.csv")):
-            y = p.stem.split("_")[-1]
-            if y.isdigit(): years.append(int(y))
-    elif src == "caf":
-        import pandas as pd
-        for caf in sorted(INPUTS_DIR.glob("caf_allocataires*.csv")):
-            try:
-                df = pd.read_csv(caf, sep=";", low_memory=False, encoding="utf-8-sig")
-            except Exception:
-                continue
-            if "Date référence" in df.columns:
-                years.extend(int(str(v)[:4]) for v in df["Date référence"].dropna() if str(v)[:4].isdigit())
-            else:
-                # Fallback : année depuis le nom de fichier (ex. caf_allocataires_2023.csv)
-                tail = caf.stem.split("_")[-1]
-                if tail.isdigit() and len(tail) == 4:
-                    years.append(int(tail))
-    elif src == "ircom":
-        for p in INPUTS_DIR.rglob("ircom_communes_complet_revenus_*.xlsx"):
-            y = p.stem.split("_")[-1]
-            if y.isdigit(): years.append(int(y))
-    elif src == "pop_legales":
-        for p in sorted(INPUTS_DIR.glob("populations_*.csv")):
-            y = p.stem.split("_")[-1]
-            if y.isdigit(): years.append(int(y))
-    elif src == "baac":
-        # Données BAAC/ONISR disponibles en open data — années expose même si fichiers pas encore présents sur la VM
-        baac_dir = INPUTS_DIR / "baac"
-        if baac_dir.exists():
-            for p in sorted(baac_dir.glob("caract_*.csv")):
-                y = p.stem.split("_")[-1]
-                if y.isdigit(): years.append(int(y))
-        if not years:
-            years = [2019, 2020, 2021, 2022, 2023, 2024]
-    elif src == "cepidc":
-        cepidc_dir = INPUTS_DIR / "cepidc"
-        src_file = cepidc_dir / "taux_effectifs_regions_15_23.xlsx"
-        if src_file.exists():
-            years = list(range(2015, 2024))
-        if not years:
-            years = list(range(2015, 2024))
-    elif src == "odisse_suicide":
-        years = [2019, 2020, 2021, 2022, 2023]
-    elif src == "odisse_alcool":
-        years = [2000, 2005, 2010, 2014, 2017, 2021]
-    elif src == "odisse_tabac":
-        years = [2000, 2005, 2010, 2014, 2017, 2021]
-    elif src == "spf_noyades":
-        import pandas as pd
-        noyades_dir = INPUTS_DIR / "spf_noyades"
-        for p in sorted(noyades_dir.glob("noyades_departement_*.csv")):
-            try:
-                df = pd.read_csv(p, sep=";", low_memory=False, encoding="utf-8-sig")
-            except Exception:
-                continue
-            yr_col = next((c for c in df.columns if "ann" in c.lower()), None)
-            if yr_col:
-                years.extend(int(v) for v in df[yr_col].dropna() if str(v).strip().isdigit())
-        if not years:
-            years = [2003, 2004, 2006, 2009, 2012, 2015, 2018, 2021]
-    elif src == "drees_eaje":
-        drees_dir = INPUTS_DIR / "drees"
-        for p in sorted(drees_dir.glob("drees_offre_accueil_jeune_enfant_*_series_longues.xlsx")):
-            for tok in p.stem.split("_"):
-                if tok.isdigit() and len(tok) == 4:
-                    years.append(int(tok))
-    years = sorted(set(years))
-    print(json.dumps({"success": True, "years": years}))
-`);
-            const data = JSON.parse(result.stdout.trim().split('\n').pop());
-            jsonResponse(res, 200, data);
+            const { result } = await pythonWorker.call('detect_available_years_opendata', { dataset: datasetId });
+            jsonResponse(res, 200, { success: true, years: result.years });
         } catch (e) {
             jsonResponse(res, 500, { success: false, years: [], error: e.message });
         }
@@ -657,6 +570,7 @@ else:
             // Record import history
             if (saved.length > 0) {
                 recordImportHistory(saved, user, converted);
+                prewarm.notifyIngest();
             }
 
             // Analyze geo levels for each saved CSV
@@ -820,6 +734,7 @@ except Exception as e:
         if (fs.existsSync(filePath)) {
             fs.unlinkSync(filePath);
             logActivity('delete', { filename });
+            prewarm.notifyIngest();
             jsonResponse(res, 200, { success: true, message: `Deleted: ${filename}` });
         } else {
             jsonResponse(res, 404, { success: false, error: 'File not found' });
@@ -830,6 +745,7 @@ except Exception as e:
     // ========== RELOAD CONFIG ==========
     if (urlPath === '/reload-config' && req.method === 'POST') {
         themesConfig = loadConfig();
+        prewarm.notifyIngest();
         jsonResponse(res, 200, { success: true, message: 'Config reloaded' });
         return;
     }
@@ -839,6 +755,7 @@ except Exception as e:
     if (urlPath === '/generate' && req.method === 'POST') {
         const theme = url.searchParams.get('theme') || 'educ';
         const year = url.searchParams.get('year') || '2022';
+        const profile = url.searchParams.get('profile') === '1';
 
         if (!(themesConfig.datasets || {})[theme]) {
             jsonResponse(res, 400, { success: false, error: `Thème inconnu : ${theme}. Vérifiez le sujet sélectionné.` });
@@ -848,11 +765,17 @@ except Exception as e:
         console.log(`\nGeneration requested: ${theme}_${year}`);
 
         try {
-            const result = await generateFile(theme, parseInt(year));
+            // ZIP pre-calcule (prewarm.js) encore valide : reponse immediate.
+            // ?force=1 pour regenerer quand meme (implicite avec ?profile=1).
+            const cached = (url.searchParams.get('force') === '1' || profile) ? null : prewarm.lookup('moca', theme, parseInt(year));
+            const result = cached ? { success: true, cached: true, ...cached } : await generateFile(theme, parseInt(year), { profile });
 
             if (result.success) {
+                if (!result.cached) prewarm.record('moca', theme, parseInt(year), result);
                 logActivity('generate', { source: 'moca', theme, year: parseInt(year), filename: result.filename, warnings: result.warnings || [] });
                 logInfo(`Generation OK (moca): ${result.filename}`);
+                retention.touch(result.filename, { source: 'moca', theme, year: parseInt(year) });
+                retention.enforce();
                 const resp = {
                     success: true,
                     filename: result.filename,
@@ -861,6 +784,8 @@ except Exception as e:
                 if (result.warnings && result.warnings.length > 0) {
                     resp.warnings = result.warnings;
                 }
+                if (result.profileId) resp.profileId = result.profileId;
+                if (result.job) resp.job = result.job;   // durees + pic memoire par etape
                 jsonResponse(res, 200, resp);
             } else {
                 logActivity('error', { source: 'moca', theme, year: parseInt(year), error: result.error });
@@ -880,6 +805,7 @@ except Exception as e:
     if (urlPath === '/generate-opendata' && req.method === 'POST') {
         const theme = url.searchParams.get('theme') || 'educ';
         const year = url.searchParams.get('year') || '2022';
+        const profile = url.searchParams.get('profile') === '1';
 
         console.log(`\nOpen Data generation requested: ${theme}_${year}`);
 
@@ -902,15 +828,21 @@ except Exception as e:
         }
 
         try {
-            const result = await generateOpenDataFile(theme, parseInt(year));
+            const cached = (url.searchParams.get('force') === '1' || profile) ? null : prewarm.lookup('opendata', theme, parseInt(year));
+            const result = cached ? { success: true, cached: true, ...cached } : await generateOpenDataFile(theme, parseInt(year), { profile });
 
             if (result.success) {
+                if (!result.cached) prewarm.record('opendata', theme, parseInt(year), result);
                 logActivity('generate', { source: 'opendata', theme, year: parseInt(year), filename: result.filename });
                 logInfo(`Generation OK (opendata): ${result.filename}`);
+                retention.touch(result.filename, { source: 'opendata', theme, year: parseInt(year) });
+                retention.enforce();
                 jsonResponse(res, 200, {
                     success: true,
                     filename: result.filename,
-                    message: `Open Data file generated: ${result.filename}`
+                    message: `Open Data file generated: ${result.filename}`,
+                    ...(result.profileId ? { profileId: result.profileId } : {}),
+                    ...(result.job ? { job: result.job } : {})
                 });
             } else {
                 logActivity('error', { source: 'opendata', theme, year: parseInt(year), error: result.error });
@@ -934,6 +866,7 @@ except Exception as e:
         const yearStart = parseInt(url.searchParams.get('yearStart') || '0');
         const yearEnd = parseInt(url.searchParams.get('yearEnd') || '0');
         const source = url.searchParams.get('source') || 'moca';
+        const profile = url.searchParams.get('profile') === '1';
 
         if (!theme || !yearStart || !yearEnd || yearEnd < yearStart) {
             jsonResponse(res, 400, { success: false, error: 'Paramètres requis: theme, yearStart, yearEnd (yearEnd >= yearStart)' });
@@ -948,11 +881,17 @@ except Exception as e:
         console.log(`\nConsolidated MOCA-O generation: ${theme} ${yearStart}-${yearEnd} (${source})`);
 
         try {
-            const result = await generateConsolidatedFile(theme, yearStart, yearEnd, source);
+            const result = await generateConsolidatedFile(theme, yearStart, yearEnd, source, { profile });
             if (result.success) {
                 logActivity('generate', { source: `mocao_cons_${source}`, theme, yearStart, yearEnd, filename: result.filename });
                 logInfo(`Generation OK (mocao_cons ${source}): ${result.filename}`);
-                jsonResponse(res, 200, { success: true, filename: result.filename, message: `Consolidated file: ${result.filename}` });
+                retention.touch(result.filename, { source: 'consolidated', theme, yearStart, yearEnd, dataSource: source });
+                retention.enforce();
+                jsonResponse(res, 200, {
+                    success: true, filename: result.filename, message: `Consolidated file: ${result.filename}`,
+                    ...(result.profileId ? { profileId: result.profileId } : {}),
+                    ...(result.job ? { job: result.job } : {})
+                });
             } else {
                 logActivity('error', { source: 'mocao_cons', theme, yearStart, yearEnd, error: result.error });
                 logError(`Generation echouee (mocao_cons ${theme} ${yearStart}-${yearEnd}): ${result.error}`);
@@ -1021,6 +960,8 @@ except Exception as e:
             if (result.success && fs.existsSync(path.join(OUTPUT_DIR, filename))) {
                 logActivity('generate', { source: 'patho_reorg', year, filename });
                 logInfo(`Generation OK (patho_reorg): ${filename}`);
+                retention.touch(filename);
+                retention.enforce();
                 jsonResponse(res, 200, { success: true, filename });
             } else {
                 const fullError = result.error || `Fichier attendu non produit : ${filename}`;
@@ -1056,9 +997,16 @@ except Exception as e:
 
         const filePath = path.join(OUTPUT_DIR, filename);
         if (!fs.existsSync(filePath)) {
-            res.writeHead(404, { 'Content-Type': 'text/plain' });
-            res.end(`File not found: ${filename}`);
-            return;
+            // Artefact evince par retention.js : regeneration transparente.
+            // Uniquement les artefacts marques evinces, depuis leurs parametres
+            // memorises : un nom de fichier arbitraire ne declenche rien.
+            const spec = retention.isEvicted(filename) ? retention.artifactSpec(filename) : null;
+            const regenerated = spec ? await regenerateArtifact(filename, spec) : null;
+            if (!regenerated || !regenerated.success || !fs.existsSync(filePath)) {
+                res.writeHead(404, { 'Content-Type': 'text/plain' });
+                res.end(`File not found: ${filename}`);
+                return;
+            }
         }
 
         let contentType = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet';
@@ -1066,13 +1014,16 @@ except Exception as e:
             contentType = 'application/zip';
         }
 
-        res.writeHead(200, {
+        // ETag fort / 304 / Range (cf. downloads.js)
+        const status = await sendDownload(req, res, filePath, {
             'Content-Type': contentType,
             'Content-Disposition': `attachment; filename="${filename}"`,
         });
-        fs.createReadStream(filePath).pipe(res);
-        logActivity('download', { filename });
-        console.log(`Download: ${filename}`);
+        retention.touch(filename);
+        if (status === 200 || status === 206) {
+            logActivity('download', { filename });
+            console.log(`Download: ${filename}${status === 206 ? ' (partiel)' : ''}`);
+        }
         return;
     }
 
@@ -1569,6 +1520,15 @@ except Exception as e:
     // ========== SETTINGS (contact support editable) ==========
     if (await handleSettings(req, res, urlPath, getPbAdmin)) return;
 
+    // ========== PRE-CALCUL (prewarm.js) ==========
+    if (prewarm.handlePrewarm(req, res, urlPath)) return;
+
+    // ========== RETENTION OUTPUT (retention.js) ==========
+    if (retention.handleRetention(req, res, urlPath, url)) return;
+
+    // ========== PROFILS DES GENERATIONS (profiles.js) ==========
+    if (handleProfiles(req, res, urlPath, url)) return;
+
     // ========== AVATARS (photo de profil) ==========
     if (await handleAvatar(req, res, urlPath)) return;
 
@@ -1643,155 +1603,83 @@ function runPython(script) {
 }
 
 /**
- * Generate a file using the Python engine
+ * Generate a file using the Python engine (worker persistant, cf. python_worker.js)
+ * opts.profile : profil cProfile + flamegraph (profiler.py), cf. GET /api/jobs/<id>/profile
  */
-function generateFile(theme, year) {
-    return new Promise((resolve) => {
-        const scriptPath = path.join(__dirname, 'run_generation.py');
-
-        const pythonScript = `
-import sys
-sys.path.insert(0, '${__dirname.replace(/\\/g, '/')}')
-from prisme_engine import generate_prisme_excel, reload_config
-reload_config()
-result = generate_prisme_excel('${theme}', ${year})
-if result:
-    print(f"SUCCESS:{result.name}")
-else:
-    print("ERROR:Generation failed")
-`;
-
-        fs.writeFileSync(scriptPath, pythonScript, 'utf8');
-
-        const child = spawn(PYTHON_EXE, [scriptPath], { cwd: __dirname });
-
-        let stdout = '';
-        let stderr = '';
-
-        child.stdout.on('data', (data) => {
-            stdout += data.toString();
-            console.log(`   ${data.toString().trim()}`);
-        });
-
-        child.stderr.on('data', (data) => {
-            stderr += data.toString();
-        });
-
-        child.on('close', (code) => {
-            try { fs.unlinkSync(scriptPath); } catch (e) { }
-
-            if (stdout.includes('SUCCESS:')) {
-                const filename = stdout.split('SUCCESS:')[1].trim();
-                console.log(`Generated: ${filename}`);
-                // Extract warnings (year coverage + missing geo data)
-                const warnings = [];
-                const warnLines = stdout.split('\n').filter(l => l.includes('[WARN_YEAR]') || l.includes('[WARN_DATA]'));
-                for (const wl of warnLines) {
-                    const m = wl.match(/\[WARN_(?:YEAR|DATA)\]\s*(.+)/);
-                    if (m) warnings.push(m[1].trim());
-                }
-                resolve({ success: true, filename, warnings });
-            } else {
-                console.log(`Generation failed (exit ${code})`);
-                resolve({ success: false, error: stderr || stdout || 'Unknown error' });
-            }
-        });
-
-        child.on('error', (err) => {
-            resolve({ success: false, error: err.message });
-        });
-    });
+async function generateFile(theme, year, opts = {}) {
+    try {
+        const { result, stdout } = await pythonWorker.call('generate_prisme_excel', { dataset_id: theme, year, profile: !!opts.profile });
+        console.log(`Generated: ${result.filename}`);
+        // Extract warnings (year coverage + missing geo data)
+        const warnings = [];
+        const warnLines = stdout.split('\n').filter(l => l.includes('[WARN_YEAR]') || l.includes('[WARN_DATA]'));
+        for (const wl of warnLines) {
+            const m = wl.match(/\[WARN_(?:YEAR|DATA)\]\s*(.+)/);
+            if (m) warnings.push(m[1].trim());
+        }
+        return { success: true, filename: result.filename, warnings, profileId: result.profile_id, job: result.job };
+    } catch (err) {
+        console.log(`Generation failed: ${err.message}`);
+        return { success: false, error: err.stderr || err.stdout || err.message || 'Unknown error' };
+    }
 }
 
 /**
- * Generate a file using generate_from_opendata.py
+ * Generate a file using generate_from_opendata.generate_theme (worker persistant)
  */
-function generateOpenDataFile(theme, year) {
-    return new Promise((resolve) => {
-        const scriptPath = path.join(__dirname, 'generate_from_opendata.py');
-
-        if (!fs.existsSync(scriptPath)) {
-            resolve({ success: false, error: 'generate_from_opendata.py not found' });
-            return;
-        }
-
-        // Call generate_from_opendata.py --theme <theme> --year <year>
-        const child = spawn(PYTHON_EXE, [scriptPath, '--theme', theme, '--year', year.toString()], { 
-            cwd: __dirname 
-        });
-
-        let stdout = '';
-        let stderr = '';
-
-        child.stdout.on('data', (data) => {
-            stdout += data.toString();
-            console.log(`   ${data.toString().trim()}`);
-        });
-
-        child.stderr.on('data', (data) => {
-            stderr += data.toString();
-            console.error(`   ERROR: ${data.toString().trim()}`);
-        });
-
-        child.on('close', (code) => {
-            if (code === 0 && stdout.includes('[OK]')) {
-                // Extract filename from output: "[OK] educ 2022: .../output/educ_opendata_2022.zip"
-                const match = stdout.match(/([a-z0-9_]+_opendata_\d{4}\.zip)/);
-                if (match) {
-                    const filename = match[1];
-                    console.log(`Generated Open Data: ${filename}`);
-                    resolve({ success: true, filename });
-                } else {
-                    console.log('Generation succeeded but filename not found in output');
-                    resolve({ success: true, filename: `${theme}_opendata_${year}.zip` });
-                }
-            } else {
-                console.log(`Open Data generation failed (exit ${code})`);
-                resolve({ success: false, error: stderr || stdout || 'Unknown error' });
-            }
-        });
-
-        child.on('error', (err) => {
-            resolve({ success: false, error: err.message });
-        });
-    });
+async function generateOpenDataFile(theme, year, opts = {}) {
+    try {
+        const { result } = await pythonWorker.call('generate_theme', { theme, year, profile: !!opts.profile });
+        console.log(`Generated Open Data: ${result.filename}`);
+        return { success: true, filename: result.filename, profileId: result.profile_id, job: result.job };
+    } catch (err) {
+        console.log(`Open Data generation failed: ${err.message}`);
+        return { success: false, error: err.stderr || err.stdout || err.message || 'Unknown error' };
+    }
 }
 
 /**
  * Generate a consolidated multi-year MOCA-O native xlsx
- * Calls Backend/generate_mocao_consolidated.py
+ * Calls generate_mocao_consolidated.generate_consolidated (worker persistant)
  */
-function generateConsolidatedFile(theme, yearStart, yearEnd, source) {
-    return new Promise((resolve) => {
-        const scriptPath = path.join(__dirname, 'generate_mocao_consolidated.py');
-        if (!fs.existsSync(scriptPath)) {
-            resolve({ success: false, error: 'generate_mocao_consolidated.py not found' });
-            return;
-        }
-
-        const args = [scriptPath, theme, String(yearStart), String(yearEnd), '--source', source];
-        const child = spawn(PYTHON_EXE, args, { cwd: __dirname });
-
-        let stdout = '';
-        let stderr = '';
-        child.stdout.on('data', (d) => { stdout += d.toString(); });
-        child.stderr.on('data', (d) => {
-            stderr += d.toString();
-            console.log(`   ${d.toString().trim()}`);
+async function generateConsolidatedFile(theme, yearStart, yearEnd, source, opts = {}) {
+    try {
+        const { result } = await pythonWorker.call('generate_consolidated', {
+            dataset_id: theme, year_start: yearStart, year_end: yearEnd, source, profile: !!opts.profile,
         });
+        console.log(`Generated consolidated: ${result.filename}`);
+        return { success: true, filename: result.filename, profileId: result.profile_id, job: result.job };
+    } catch (err) {
+        return { success: false, error: err.stderr || err.stdout || err.message };
+    }
+}
 
-        child.on('close', (code) => {
-            const filename = stdout.trim().split('\n').pop();
-            if (code === 0 && filename && filename.endsWith('.xlsx')) {
-                console.log(`Generated consolidated: ${filename}`);
-                resolve({ success: true, filename });
-            } else {
-                resolve({ success: false, error: stderr || stdout || `Exit ${code}` });
-            }
-        });
+const regenerations = new Map();   // filename -> Promise (telechargements simultanes)
 
-        child.on('error', (err) => resolve({ success: false, error: err.message }));
-    });
+/**
+ * Regenerate an artifact evicted by retention.js (spec from retention.artifactSpec).
+ * Une seule generation par fichier ; en cas de succes : touch (plus evince),
+ * budget reapplique et, pour les ZIP annuels, entree prewarm a jour.
+ */
+function regenerateArtifact(filename, spec) {
+    if (regenerations.has(filename)) return regenerations.get(filename);
+    let job;
+    if (spec.source === 'moca') job = generateFile(spec.theme, spec.year);
+    else if (spec.source === 'opendata') job = generateOpenDataFile(spec.theme, spec.year);
+    else if (spec.source === 'consolidated') {
+        job = generateConsolidatedFile(spec.theme, spec.yearStart, spec.yearEnd, spec.dataSource);
+    } else return Promise.resolve(null);
+    const done = job.then((result) => {
+        if (result && result.success && result.filename === filename) {
+            if (spec.source === 'moca' || spec.source === 'opendata') prewarm.record(spec.source, spec.theme, spec.year, result);
+            retention.touch(filename, spec);
+            retention.enforce();
+            logInfo(`Regeneration apres eviction : ${filename}`);
+        }
+        return result;
+    }).finally(() => regenerations.delete(filename));
+    regenerations.set(filename, done);
+    return done;
 }
 
 /**
@@ -2092,6 +1980,9 @@ server.listen(PORT, () => {
     console.log(`   - GET  /files               (metadata: filename, date, size, theme)`);
     console.log(`   - GET  /activity-log        (persistent activity logs)`);
     console.log(`   - GET  /logs?lines=200      (journal technique app.log)`);
+    console.log(`   - GET  /prewarm/status      (pre-calcul : hits/misses)`);
+    console.log(`   - GET  /output/retention    (budget disque output/)`);
+    console.log(`   - POST /output/pin?file=X   (epingler un fichier)`);
     console.log(`   - POST /auth/send-code      (OTP: send code by email)`);
     console.log(`   - POST /auth/verify-code    (OTP: verify code & get token)`);
     console.log(`   - POST /auth/create-user    (create new user)`);
@@ -2099,6 +1990,11 @@ server.listen(PORT, () => {
     console.log(`   SMTP: ${SMTP_HOST ? SMTP_HOST + ':' + SMTP_PORT : '(not configured — codes in console)'}`);
     console.log(`${'='.repeat(50)}\n`);
     logInfo(`Serveur demarre sur le port ${PORT}`);
+    // Retention de output/ : orphelins, temporaires, budget disque
+    retention.start({ log: appLog });
+    // Workers Python persistants (moteurs charges une seule fois)
+    pythonWorker.start({ pythonExe: PYTHON_EXE, cwd: __dirname, log: appLog });
+    prewarm.start({ pythonWorker, log: appLog });
     // Initialize PocketBase admin connection
     getPbAdmin().catch(e => console.warn('PB admin init deferred:', e.message));
 });
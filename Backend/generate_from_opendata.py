@@ -18,7 +18,14 @@ import pandas as pd
 from openpyxl import Workbook
 from openpyxl.styles import Font
 
-from csv_reader import read_csv_safe, log_read, normalize_geo_code
+from csv_reader import read_csv_safe, read_csv_chunked, log_read, normalize_geo_code
+import sidecar
+import source_cache
+import memory
+import profiler
+import reproducible
+import timing
+import xlsx_stream
 
 
 BASE_DIR = Path(__file__).parent
@@ -203,13 +210,40 @@ THEME_CONFIGS = {
 }
 
 
-def _read_csv_auto(path: Path, dtype=None) -> pd.DataFrame:
-    """Lecture robuste : encoding + séparateur auto-détectés, NA normalisés."""
-    df, meta = read_csv_safe(path, dtype=dtype)
+def _read_csv_auto(path: Path, dtype=None, reduce=None) -> pd.DataFrame:
+    """Lecture robuste : encoding + séparateur auto-détectés, NA normalisés.
+
+    reduce(chunk) -> DataFrame : si fourni et que le budget memoire le
+    demande (memory.should_chunk), lecture par morceaux reduits a la volee.
+    Le resultat doit alors rester equivalent pour l'appelant.
+    """
+    if reduce is not None and memory.should_chunk(path):
+        df, meta = read_csv_chunked(path, reduce, dtype=dtype)
+        timing.incr("chunked_reads")
+    else:
+        df, meta = read_csv_safe(path, dtype=dtype)
     log_read(meta)
     return df
 
 
+def _commune_reducer(prefixes):
+    """Reduction d'une base INSEE IRIS : colonnes prefixes sommees par commune."""
+    def reduce(chunk):
+        code_col = "COM" if "COM" in chunk.columns else "CODGEO"
+        value_cols = [c for c in chunk.columns if c != code_col and c.startswith(prefixes)]
+        out = chunk[value_cols].apply(pd.to_numeric, errors="coerce").fillna(0)
+        out[code_col] = chunk[code_col].apply(_extract_commune_code)
+        return out.groupby(code_col, sort=False)[value_cols].sum().reset_index()
+    return reduce
+
+
+def _columns_reducer(*columns):
+    """Reduction aux seules colonnes utiles (celles presentes)."""
+    def reduce(chunk):
+        return chunk[[c for c in columns if c in chunk.columns]]
+    return reduce
+
+
 def _safe_numeric(df: pd.DataFrame, candidates) -> pd.Series:
     for col in candidates:
         if col in df.columns:
@@ -418,7 +452,8 @@ def _load_educ_source(year: int) -> Path:
 
 def _build_couples_levels(theme: str, year: int):
     source = _load_couples_source(year)
-    raw = _read_csv_auto(source, dtype={"IRIS": str, "COM": str, "CODGEO": str})
+    raw = _read_csv_auto(source, dtype={"IRIS": str, "COM": str, "CODGEO": str},
+                         reduce=_commune_reducer(("C", "P")))
     code_col = "COM" if "COM" in raw.columns else "CODGEO"
     value_candidates = [c for c in raw.columns if c.startswith("C") or c.startswith("P")]
     base = _aggregate_levels(raw, value_candidates, code_col=code_col)
@@ -428,7 +463,8 @@ def _build_couples_levels(theme: str, year: int):
 
 def _build_educ_levels(year: int):
     source = _load_educ_source(year)
-    raw = _read_csv_auto(source, dtype={"IRIS": str, "COM": str, "CODGEO": str})
+    raw = _read_csv_auto(source, dtype={"IRIS": str, "COM": str, "CODGEO": str},
+                         reduce=_commune_reducer(("P",)))
     code_col = "COM" if "COM" in raw.columns else "CODGEO"
     value_candidates = [c for c in raw.columns if c.startswith("P")]
     base = _aggregate_levels(raw, value_candidates, code_col=code_col)
@@ -474,7 +510,8 @@ def _build_alloc_levels(year: int):
                 continue
         else:
             raise FileNotFoundError(f"Aucun fichier couples-familles disponible pour calculer nb_menages (annee {year})")
-    couples = _read_csv_auto(couples_path, dtype={"IRIS": str, "COM": str, "CODGEO": str})
+    couples = _read_csv_auto(couples_path, dtype={"IRIS": str, "COM": str, "CODGEO": str},
+                             reduce=_commune_reducer(("C",)))
     code_col = "COM" if "COM" in couples.columns else "CODGEO"
     couples["commune_code"] = couples[code_col].apply(_extract_commune_code)
     prefix_c = f"C{str(couples_year)[2:]}_"
@@ -515,77 +552,106 @@ def _find_ircom_source(year: int) -> Path:
     raise FileNotFoundError(f"Aucun fichier IRCOM trouve pour {year} dans inputs/opendata")
 
 
+# Colonnes IRCOM utiles : cle -> predicat sur le libelle (minuscules)
+IRCOM_COLUMNS = {
+    "dep": lambda h: h in ["dép.", "dep", "dép"],
+    "com": lambda h: h == "commune",
+    "tranche": lambda h: "tranche" in h,
+    "total": lambda h: h.strip() == "nombre de foyers fiscaux",
+    "impos": lambda h: "nombre de foyers fiscaux imposés" in h,
+}
+
+
+def _is_ircom_header(values) -> bool:
+    """Ligne d'en-tete IRCOM : contient Dép. et Commune."""
+    return any(v in ["dép.", "dep", "dép"] for v in values) and "commune" in values
+
+
+def _load_ircom_xls(source: Path) -> pd.DataFrame:
+    """Ancien format .xls (xlrd) : lecture complete, memes colonnes que la lecture en flux."""
+    raw = pd.read_excel(source, sheet_name=0, header=None)
+    header_row = None
+    for i in range(min(30, len(raw))):
+        vals = [str(v).strip().lower() if pd.notna(v) else "" for v in raw.iloc[i].tolist()]
+        if _is_ircom_header(vals):
+            header_row = i
+            break
+    if header_row is None:
+        raise ValueError(f"Header IRCOM non detecte dans {source}")
+
+    headers = [str(val).strip() if pd.notna(val) else f"col_{i}"
+               for i, val in enumerate(raw.iloc[header_row].tolist())]
+    cols = xlsx_stream.match_columns(headers, IRCOM_COLUMNS)
+    if not {"dep", "com", "total", "impos"} <= set(cols):
+        raise ValueError("Colonnes IRCOM attendues absentes (dep/commune/foyers/imposes)")
+
+    df = raw.iloc[header_row + 1:].dropna(how="all")
+    df = pd.DataFrame({key: df.iloc[:, idx].tolist() for key, idx in cols.items()})
+    if "tranche" in cols:
+        df = df[df["tranche"].astype(str).str.strip().str.lower() == "total"].copy()
+    return df
+
+
+def _stream_ircom_xlsx(source: Path) -> pd.DataFrame:
+    """Lecture en flux : en-tete repere une fois par version du fichier (cache),
+    seules les colonnes utiles et les lignes de tranche "Total" sont chargees."""
+    try:
+        header_row, headers = xlsx_stream.locate_header(
+            source, _is_ircom_header, sheet=0, max_scan=30, cache_kind="ircom_header")
+    except ValueError:
+        raise ValueError(f"Header IRCOM non detecte dans {source}")
+    cols = xlsx_stream.match_columns(headers, IRCOM_COLUMNS)
+    if not {"dep", "com", "total", "impos"} <= set(cols):
+        raise ValueError("Colonnes IRCOM attendues absentes (dep/commune/foyers/imposes)")
+    where = None
+    if "tranche" in cols:
+        where = lambda rec: str(rec["tranche"]).strip().lower() == "total"
+    records = xlsx_stream.iter_records(source, header_row, cols, sheet=0, where=where)
+    return pd.DataFrame(list(records), columns=list(cols))
+
+
 def _load_ircom_dataframe(source: Path) -> pd.DataFrame:
     ext = source.suffix.lower()
     if ext in [".csv", ".txt"]:
         return _read_csv_auto(source)
+    if ext == ".xlsx":
+        df = _stream_ircom_xlsx(source)
+    elif ext == ".xls":
+        df = _load_ircom_xls(source)
+    else:
+        raise ValueError(f"Format IRCOM non supporte: {source}")
 
-    if ext in [".xlsx", ".xls"]:
-        raw = pd.read_excel(source, sheet_name=0, header=None)
-        header_row = None
-        for i in range(min(30, len(raw))):
-            vals = [str(v).strip().lower() if pd.notna(v) else "" for v in raw.iloc[i].tolist()]
-            has_dep = any(v in ["dép.", "dep", "dép"] for v in vals)
-            has_com = "commune" in vals
-            if has_dep and has_com:
-                header_row = i
-                break
-        if header_row is None:
-            raise ValueError(f"Header IRCOM non detecte dans {source}")
-
-        headers = []
-        for i, val in enumerate(raw.iloc[header_row].tolist()):
-            headers.append(str(val).strip() if pd.notna(val) else f"col_{i}")
-
-        df = raw.iloc[header_row + 1:].copy()
-        df.columns = headers
-        df = df.dropna(how="all")
-
-        dep_col = next((c for c in df.columns if c.lower() in ["dép.", "dep", "dép"]), None)
-        com_col = next((c for c in df.columns if c.lower() == "commune"), None)
-        tranche_col = next((c for c in df.columns if "tranche" in c.lower()), None)
-        total_col = next((c for c in df.columns if c.strip().lower() == "nombre de foyers fiscaux"), None)
-        impos_col = next((c for c in df.columns if "nombre de foyers fiscaux imposés" in c.lower()), None)
-
-        if not dep_col or not com_col or not total_col or not impos_col:
-            raise ValueError("Colonnes IRCOM attendues absentes (dep/commune/foyers/imposes)")
-
-        if tranche_col:
-            df = df[df[tranche_col].astype(str).str.strip().str.lower() == "total"].copy()
-
-        def _fmt_dep(v):
-            s = str(v).split(".")[0].strip().upper()
-            if s in ["2A", "2B"]:
-                return s
-            return s if s.isdigit() else s
-
-        def _fmt_com(v):
-            return str(v).split(".")[0].strip().upper()
-
-        def _code_commune(dep, com):
-            d = _fmt_dep(dep)
-            c = _fmt_com(com)
-            if d in ["2A", "2B"]:
-                return d + c.zfill(3)
-            if d.isdigit():
-                if d.startswith("97"):
-                    return d.zfill(3) + c.zfill(3)[-2:]
-                return d.zfill(2)[-2:] + c.zfill(3)
-            return d + c.zfill(3)
+    def _fmt_dep(v):
+        s = str(v).split(".")[0].strip().upper()
+        if s in ["2A", "2B"]:
+            return s
+        return s if s.isdigit() else s
 
-        code_commune = [_code_commune(dep, com) for dep, com in zip(df[dep_col], df[com_col])]
-        foyers_total = pd.to_numeric(df[total_col], errors="coerce").fillna(0)
-        foyers_imposes = pd.to_numeric(df[impos_col], errors="coerce").fillna(0)
+    def _fmt_com(v):
+        return str(v).split(".")[0].strip().upper()
 
-        return pd.DataFrame(
-            {
-                "code_commune": code_commune,
-                "nb_foyers_imposes": foyers_imposes,
-                "nb_foyers_non_impo": (foyers_total - foyers_imposes).clip(lower=0),
-            }
-        )
-
-    raise ValueError(f"Format IRCOM non supporte: {source}")
+    def _code_commune(dep, com):
+        d = _fmt_dep(dep)
+        c = _fmt_com(com)
+        if d in ["2A", "2B"]:
+            return d + c.zfill(3)
+        if d.isdigit():
+            if d.startswith("97"):
+                return d.zfill(3) + c.zfill(3)[-2:]
+            return d.zfill(2)[-2:] + c.zfill(3)
+        return d + c.zfill(3)
+
+    code_commune = [_code_commune(dep, com) for dep, com in zip(df["dep"], df["com"])]
+    foyers_total = pd.to_numeric(df["total"], errors="coerce").fillna(0)
+    foyers_imposes = pd.to_numeric(df["impos"], errors="coerce").fillna(0)
+
+    return pd.DataFrame(
+        {
+            "code_commune": code_commune,
+            "nb_foyers_imposes": foyers_imposes,
+            "nb_foyers_non_impo": (foyers_total - foyers_imposes).clip(lower=0),
+        }
+    )
 
 
 def _build_revenu_levels(year: int):
@@ -708,8 +774,10 @@ def _build_route_levels(year: int):
         print(f"  [WARN] BAAC {year}: seule la source Guyane (baac_guyane/) est disponible."
               " Les niveaux FH/FRA ne contiendront que les données Guyane.")
 
-    caract = _read_csv_auto(caract_path, dtype={"com": str, "dep": str})
-    usagers = _read_csv_auto(usagers_path, dtype={"grav": str})
+    caract = _read_csv_auto(caract_path, dtype={"com": str, "dep": str},
+                            reduce=_columns_reducer("Num_Acc", "Accident_Id", "com"))
+    usagers = _read_csv_auto(usagers_path, dtype={"grav": str},
+                             reduce=_columns_reducer("Num_Acc", "Accident_Id", "grav"))
 
     # Normalize accident ID column (2022 uses Accident_Id, others use Num_Acc)
     acc_col_c = "Num_Acc" if "Num_Acc" in caract.columns else "Accident_Id"
@@ -792,82 +860,136 @@ def _normalize_region_name(name: str) -> str:
     return s
 
 
+_REGION_CODE_BY_NAME = {name.lower(): code for name, code in REGION_NAME_TO_CODE.items()}
+
+CEPIDC_SOURCE = INPUTS_DIR / "cepidc" / "taux_effectifs_regions_15_23.xlsx"
+CEPIDC_CUBE_VERSION = 2
+
+
+def _region_code(region_name: str):
+    """Code region d'un libelle source : correspondance exacte, sinon inclusion."""
+    name = region_name.lower()
+    code = _REGION_CODE_BY_NAME.get(name)
+    if code is not None:
+        return code
+    for ref_name, ref_code in _REGION_CODE_BY_NAME.items():
+        if ref_name in name or name in ref_name:
+            return ref_code
+    return None
+
+
+def _cepidc_number(value):
+    """Cellule CepiDc -> 0 si non numerique, int si entiere (effectifs), sinon float.
+
+    Meme type que la lecture historique : les effectifs restent entiers
+    dans /api/data, l'index geo et les sidecars.
+    """
+    if pd.isna(value):
+        return 0
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def _reshape_cepidc_workbook(source: Path) -> dict:
+    """Classeur CepiDc complet -> cube {onglet: {annee: [[codgeo, n, taux], ...]}}.
+
+    Une seule lecture pour toutes les causes et annees. Chaque onglet a deux
+    lignes d'en-tete (ligne 1 : annees, fusionnees ; ligne 2 : N / Taux) puis
+    une ligne par region et une ligne France (codgeo "__france__"). Les
+    valeurs non numeriques valent 0, comme dans la lecture historique.
+    """
+    raw = pd.read_excel(source, sheet_name=None, header=None)
+    cube = {}
+    for sname, df in raw.items():
+        values = df.values
+        cube[sname] = {}
+        if len(values) < 3:
+            continue
+        year_row, type_row = values[1], values[2]
+
+        # Colonnes N / Taux de chaque annee (annee reportee sur les cellules fusionnees)
+        columns = {}
+        current_yr = None
+        for i in range(1, len(year_row)):
+            yr_val = year_row[i]
+            if pd.notna(yr_val):
+                try:
+                    current_yr = int(float(yr_val))
+                except (ValueError, TypeError):
+                    continue
+            if current_yr is None:
+                continue
+            type_val = str(type_row[i]).strip().lower() if pd.notna(type_row[i]) else ""
+            slot = columns.setdefault(current_yr, [None, None])
+            if type_val.startswith("n") and slot[0] is None:
+                slot[0] = i
+            elif "taux" in type_val and slot[1] is None:
+                slot[1] = i
+
+        # Lignes de donnees (apres les 3 lignes d'en-tete), codes resolus une fois
+        rows = []
+        for line in values[3:]:
+            if pd.isna(line[0]):
+                continue
+            region_name = _normalize_region_name(line[0])
+            if region_name == "__skip__":
+                continue
+            codgeo = "__france__" if region_name == "__france__" else _region_code(region_name)
+            if codgeo is not None:
+                rows.append((codgeo, line))
+
+        for yr, (n_col, tx_col) in columns.items():
+            if n_col is None:
+                continue
+            records = []
+            for codgeo, line in rows:
+                n_val = pd.to_numeric(line[n_col], errors="coerce")
+                tx_val = pd.to_numeric(line[tx_col], errors="coerce") if tx_col is not None else 0
+                records.append([codgeo, _cepidc_number(n_val), _cepidc_number(tx_val)])
+            cube[sname][str(yr)] = records
+    return cube
+
+
+def _cepidc_cube() -> dict:
+    """Cube CepiDc, relu depuis PRISME_STATE_DIR/cache tant que le classeur ne change pas."""
+    if not CEPIDC_SOURCE.exists():
+        raise FileNotFoundError(f"Source CepiDc manquante: {CEPIDC_SOURCE}")
+    return source_cache.cached("cepidc_cube", CEPIDC_SOURCE,
+                               lambda: _reshape_cepidc_workbook(CEPIDC_SOURCE),
+                               version=CEPIDC_CUBE_VERSION)
+
+
 def _build_cepidc_levels(theme: str, year: int):
     cfg = THEME_CONFIGS[theme]
     sheet_name = cfg["cepidc_sheet"]
     var_n = cfg["variables"][0]  # e.g. nb_deces_toutes_causes
     var_tx = cfg["variables"][1]  # e.g. tx_mortalite_toutes_causes
 
-    cepidc_dir = INPUTS_DIR / "cepidc"
-    source = cepidc_dir / "taux_effectifs_regions_15_23.xlsx"
-    if not source.exists():
-        raise FileNotFoundError(f"Source CepiDc manquante: {source}")
-
-    raw = pd.read_excel(source, sheet_name=None, header=None)
+    cube = _cepidc_cube()
 
     # Find the right sheet (handle encoding in sheet names)
     target_sheet = None
-    for sname in raw:
+    for sname in cube:
         clean = sname.replace("\ufffd", "").strip()
         if sheet_name.lower() in clean.lower() or clean.lower() in sheet_name.lower():
             target_sheet = sname
             break
     if target_sheet is None:
-        raise ValueError(f"Feuille '{sheet_name}' introuvable dans CepiDc. Feuilles: {list(raw.keys())}")
-
-    df = raw[target_sheet]
-
-    # Parse multi-row header: row 1 = years, row 2 = N/Taux
-    year_row = df.iloc[1].tolist()
-    type_row = df.iloc[2].tolist()
+        raise ValueError(f"Feuille '{sheet_name}' introuvable dans CepiDc. Feuilles: {list(cube.keys())}")
 
-    # Find column indices for requested year
-    n_col = None
-    tx_col = None
-    for i in range(1, len(year_row)):
-        yr_val = year_row[i]
-        if pd.notna(yr_val):
-            try:
-                current_yr = int(float(yr_val))
-            except (ValueError, TypeError):
-                continue
-        if current_yr == year:
-            type_val = str(type_row[i]).strip().lower() if pd.notna(type_row[i]) else ""
-            if type_val.startswith("n") and n_col is None:
-                n_col = i
-            elif "taux" in type_val and tx_col is None:
-                tx_col = i
-
-    if n_col is None:
+    records = cube[target_sheet].get(str(year))
+    if records is None:
         raise ValueError(f"Annee {year} introuvable dans CepiDc sheet '{sheet_name}'")
 
-    # Extract data rows (skip header rows 0-2 and footer)
     regions_data = []
     france_n = 0
     france_tx = 0
-    for row_idx in range(3, len(df)):
-        region_name = _normalize_region_name(df.iloc[row_idx, 0])
-        if region_name == "__skip__" or pd.isna(df.iloc[row_idx, 0]):
-            continue
-
-        n_val = pd.to_numeric(df.iloc[row_idx, n_col], errors="coerce")
-        tx_val = pd.to_numeric(df.iloc[row_idx, tx_col], errors="coerce") if tx_col is not None else 0
-        n_val = 0 if pd.isna(n_val) else n_val
-        tx_val = 0 if pd.isna(tx_val) else tx_val
-
-        if region_name == "__france__":
+    for codgeo, n_val, tx_val in records:
+        if codgeo == "__france__":
             france_n = n_val
             france_tx = tx_val
-            continue
-
-        # Match to region code
-        reg_code = None
-        for ref_name, ref_code in REGION_NAME_TO_CODE.items():
-            if ref_name.lower() in region_name.lower() or region_name.lower() in ref_name.lower():
-                reg_code = ref_code
-                break
-        if reg_code:
-            regions_data.append({"codgeo": reg_code, var_n: n_val, var_tx: tx_val})
+        else:
+            regions_data.append({"codgeo": codgeo, var_n: n_val, var_tx: tx_val})
 
     if not regions_data:
         raise ValueError(f"Aucune donnee regionale CepiDc pour {year}")
@@ -1218,9 +1340,9 @@ def _build_spf_noyades_levels(year: int):
     return _add_year(levels, year)
 
 
-def _add_note_to_sheet(ws, df, note_text, note_color="FF0000"):
+def _add_note_to_sheet(ws, rows, note_text, note_color="FF0000"):
     """Ajoute une note informative sous les données dans une feuille Excel."""
-    note_row = len(df) + 3
+    note_row = len(rows) + 3
     note_cell = ws.cell(row=note_row, column=1, value=note_text)
     note_cell.font = Font(italic=True, color=note_color)
 
@@ -1266,32 +1388,37 @@ def _build_eaje_levels_2021(year: int):
     if not source.exists():
         raise FileNotFoundError(f"Source DREES EAJE manquante: {source}")
 
-    raw = pd.read_excel(source, sheet_name=None, header=None)
+    names = xlsx_stream.sheet_names(source)
 
     def _find_sheet(*needles):
-        for sname in raw:
+        for sname in names:
             low = sname.lower()
             if all(n.lower() in low for n in needles):
                 return sname
-        raise ValueError(f"Feuille EAJE 2021 introuvable pour {needles}. Feuilles: {list(raw.keys())}")
-
-    t1 = raw[_find_sheet("t1", "total")]      # etab accueil collectif
-    t7 = raw[_find_sheet("t7", "total")]      # places accueil collectif
-    t11 = raw[_find_sheet("t11", "places")]   # places accueil familial
-    t5 = raw[_find_sheet("t5", "familial")]   # services accueil familial
-    t6 = raw[_find_sheet("t6", "mam")]        # MAM
-
-    def _index_by_dep(df, cols):
+        raise ValueError(f"Feuille EAJE 2021 introuvable pour {needles}. Feuilles: {names}")
+
+    # Seuls les 5 onglets utiles sont lus (le classeur en compte plusieurs dizaines)
+    wanted = {
+        "t1": _find_sheet("t1", "total"),      # etab accueil collectif
+        "t7": _find_sheet("t7", "total"),      # places accueil collectif
+        "t11": _find_sheet("t11", "places"),   # places accueil familial
+        "t5": _find_sheet("t5", "familial"),   # services accueil familial
+        "t6": _find_sheet("t6", "mam"),        # MAM
+    }
+    sheets = xlsx_stream.read_sheets(source, set(wanted.values()))
+    t1, t7, t11, t5, t6 = (sheets[wanted[k]] for k in ("t1", "t7", "t11", "t5", "t6"))
+
+    def _index_by_dep(rows, cols):
         """Retourne {dep_code: {var: value}} pour les lignes data valides."""
         out = {}
-        for i in range(len(df)):
-            c0 = df.iloc[i, 0]
+        for i in range(len(rows)):
+            c0 = xlsx_stream.cell(rows, i, 0)
             if not _is_valid_dep_code(c0):
                 continue
             dep = _eaje_dep_code(c0)
             rec = {}
             for var, col in cols.items():
-                v = pd.to_numeric(df.iloc[i, col], errors="coerce")
+                v = pd.to_numeric(xlsx_stream.cell(rows, i, col), errors="coerce")
                 rec[var] = None if pd.isna(v) else float(v)
             out[dep] = rec
         return out
@@ -1330,12 +1457,13 @@ def _build_eaje_levels_2022plus(year: int):
     if not source.exists():
         raise FileNotFoundError(f"Source DREES EAJE manquante: {source}")
 
-    raw = pd.read_excel(source, sheet_name=None, header=None)
-    tab1 = raw["Tab1-PMI"]    # etab
-    tab17 = raw["Tab17-PMI"]  # places
-    tab34 = raw["Tab34-PMI"]  # MAM series longues
+    # Seuls les 3 onglets utiles sont lus (le classeur en compte plusieurs dizaines)
+    sheets = xlsx_stream.read_sheets(source, ["Tab1-PMI", "Tab17-PMI", "Tab34-PMI"])
+    tab1 = sheets["Tab1-PMI"]    # etab
+    tab17 = sheets["Tab17-PMI"]  # places
+    tab34 = sheets["Tab34-PMI"]  # MAM series longues
 
-    def _read_dep_block(df, mapping):
+    def _read_dep_block(rows, mapping):
         """Lit les lignes département (col[1]=code dep) jusqu'au 1er bloc TOTAL/région.
 
         Le bloc départemental se termine dès qu'on rencontre une ligne dont col[0]
@@ -1343,9 +1471,9 @@ def _build_eaje_levels_2022plus(year: int):
         """
         out = {}
         started = False
-        for i in range(5, len(df)):
-            c0 = df.iloc[i, 0]
-            c1 = df.iloc[i, 1]
+        for i in range(5, len(rows)):
+            c0 = xlsx_stream.cell(rows, i, 0)
+            c1 = xlsx_stream.cell(rows, i, 1)
             c0s = "" if c0 is None or (isinstance(c0, float) and pd.isna(c0)) else str(c0).strip()
             if c0s.upper().startswith("TOTAL"):
                 if started:
@@ -1359,7 +1487,7 @@ def _build_eaje_levels_2022plus(year: int):
             dep = _eaje_dep_code(c1)
             rec = {}
             for var, col in mapping.items():
-                v = pd.to_numeric(df.iloc[i, col], errors="coerce")
+                v = pd.to_numeric(xlsx_stream.cell(rows, i, col), errors="coerce")
                 rec[var] = None if pd.isna(v) else float(v)
             out[dep] = rec
         return out
@@ -1376,7 +1504,7 @@ def _build_eaje_levels_2022plus(year: int):
     })
 
     # MAM : Tab34-PMI, colonne de l'année demandée (en-tête ligne 5 / index 4)
-    header34 = tab34.iloc[4].tolist()
+    header34 = list(tab34[4]) if len(tab34) > 4 else []
     mam_col = None
     for j in range(3, len(header34)):
         hv = header34[j]
@@ -1390,8 +1518,8 @@ def _build_eaje_levels_2022plus(year: int):
     mam = {}
     if mam_col is not None:
         for i in range(5, len(tab34)):
-            c1 = tab34.iloc[i, 1]
-            c0 = tab34.iloc[i, 0]
+            c1 = xlsx_stream.cell(tab34, i, 1)
+            c0 = xlsx_stream.cell(tab34, i, 0)
             c0s = "" if c0 is None or (isinstance(c0, float) and pd.isna(c0)) else str(c0).strip()
             if c0s.upper().startswith("TOTAL"):
                 if mam:
@@ -1401,7 +1529,7 @@ def _build_eaje_levels_2022plus(year: int):
                 if mam:
                     break
                 continue
-            v = pd.to_numeric(tab34.iloc[i, mam_col], errors="coerce")
+            v = pd.to_numeric(xlsx_stream.cell(tab34, i, mam_col), errors="coerce")
             mam[_eaje_dep_code(c1)] = None if pd.isna(v) else float(v)
     else:
         print(f"  [WARN_DATA] DREES EAJE {year}: colonne MAM (annee {year}) introuvable dans Tab34-PMI. nb_mam laisse vide.")
@@ -1479,165 +1607,251 @@ def _build_eaje_levels(year: int):
     return _add_year(all_levels, year)
 
 
-def _generate_excel_and_zip(theme: str, year: int, all_levels, guyane_only: bool = False):
-    """Génère les fichiers Excel par niveau géo et crée le ZIP final.
+def theme_tables(theme: str, year: int, all_levels):
+    """{geo_key: (headers, rows)} : les lignes exactes des classeurs Open Data.
 
-    guyane_only=True : la source BAAC ne contient que la Guyane.
-    Une note d'avertissement est ajoutée dans les onglets FH/FRA.
+    Étape commune à _generate_excel_and_zip et à l'API /api/data de app.py.
     """
     cfg = THEME_CONFIGS[theme]
-    all_variables = cfg["variables"]
     # Exclure les variables calculées (tx_*) — PRISME les recalcule côté client,
     # SAUF si le thème demande explicitement de livrer ses taux (emit_calculated_rates).
     emit_rates = cfg.get("emit_calculated_rates", False)
     variables = []
-    for v in all_variables:
+    for v in cfg["variables"]:
         if is_calculated_variable(v) and not emit_rates:
             print(f"  [FILTER] Skipped calculated variable: {v}")
         else:
             variables.append(v)
-    excel_name = cfg["excel_name"]
 
-    # Note BAAC Guyane-only pour onglets FH et FRA
-    BAAC_GUYANE_NOTE = (
-        "ATTENTION : Les donnees BAAC disponibles pour cette annee ne couvrent que la Guyane (973). "
-        "Les chiffres de France Hexagonale et France Entiere sont incomplets. "
-        "Source : BAAC local Guyane (baac_guyane/) — le fichier national n'etait pas disponible lors de la generation."
-    )
+    with timing.span("fill"):
+        tables = {}
+        for geo_key in GEO_FOLDER_MAPPING:
+            headers = [geo_key, "annee"] + variables
+            df = all_levels[geo_key].copy()
+            for var in variables:
+                if var not in df.columns:
+                    df[var] = None
+            rows = []
+            for _, row in df.iterrows():
+                line = [
+                    str(row.get("codgeo", "")) if pd.notna(row.get("codgeo")) else "",
+                    int(row.get("annee", year)) if pd.notna(row.get("annee")) else year,
+                ]
+                for var in variables:
+                    val = row.get(var)
+                    line.append(float(val) if pd.notna(val) else None)
+                rows.append(line)
+            tables[geo_key] = (headers, rows)
+    return tables
+
+
+def _write_level_sheet(ws, headers, rows):
+    for idx, h in enumerate(headers, 1):
+        c = ws.cell(row=1, column=idx, value=h)
+        c.font = Font(bold=True)
+    for row_idx, line in enumerate(rows, 2):
+        for col_idx, val in enumerate(line, 1):
+            ws.cell(row=row_idx, column=col_idx, value=val)
+
+
+def _annotate_level_sheet(ws, geo_key, rows, cfg, guyane_only):
+    """Notes d'avertissement sous les données (CepiDc, BAAC Guyane-only, taux agrégés)."""
+    # CepiDc commune annotation: data is regional-only
+    if geo_key == "com" and cfg.get("source_type") == "cepidc":
+        _add_note_to_sheet(ws, rows,
+            "NOTE: La source CepiDc ne fournit pas de donnees communales. "
+            "Les effectifs sont vides. Les taux correspondent au taux regional Guyane (proxy).")
+
+    # BAAC Guyane-only annotation in FH and FRA sheets
+    if guyane_only and geo_key in ("fh", "fra"):
+        _add_note_to_sheet(ws, rows,
+            "ATTENTION : Les donnees BAAC disponibles pour cette annee ne couvrent que la Guyane (973). "
+            "Les chiffres de France Hexagonale et France Entiere sont incomplets. "
+            "Source : BAAC local Guyane (baac_guyane/) — le fichier national n'etait pas disponible lors de la generation.")
+
+    # CepiDc / Odisse rate annotation for DOM/FH/FRA: rates may be NaN (no population weighting)
+    if geo_key in ("dom", "fh", "fra") and cfg.get("source_type") in ("cepidc", "odisse_alcool", "odisse_tabac"):
+        _add_note_to_sheet(ws, rows,
+            "NOTE: Les taux agreges (DOM/FH/FRA) ne sont pas disponibles dans la source. "
+            "Une moyenne non ponderee serait statistiquement incorrecte (populations regionales differentes). "
+            "Les cellules de taux vides correspondent a cette limitation.",
+            note_color="0000FF")
+
+
+def _generate_excel_and_zip(theme: str, year: int, all_levels, guyane_only: bool = False, formats=None):
+    """Génère les fichiers Excel par niveau géo et crée le ZIP final.
+
+    guyane_only=True : la source BAAC ne contient que la Guyane.
+    Une note d'avertissement est ajoutée dans les onglets FH/FRA.
+    formats : xlsx et/ou sidecars parquet/csv (cf. sidecar.resolve_formats).
+    """
+    formats = sidecar.resolve_formats(formats)
+    cfg = THEME_CONFIGS[theme]
+    excel_name = cfg["excel_name"]
+    tables = theme_tables(theme, year, all_levels)
 
     root_dir = OUTPUT_DIR / f"{theme}_opendata" / str(year)
     if root_dir.exists():
         shutil.rmtree(root_dir)
     root_dir.mkdir(parents=True, exist_ok=True)
 
-    for geo_key, folder_name in GEO_FOLDER_MAPPING.items():
-        folder = root_dir / folder_name
-        folder.mkdir(exist_ok=True)
-
-        wb = Workbook()
-        ws = wb.active
-        ws.title = geo_key
-
-        headers = [geo_key, "annee"] + variables
-        for idx, h in enumerate(headers, 1):
-            c = ws.cell(row=1, column=idx, value=h)
-            c.font = Font(bold=True)
-
-        df = all_levels[geo_key].copy()
-        for var in variables:
-            if var not in df.columns:
-                df[var] = None
-
-        for row_idx, (_, row) in enumerate(df.iterrows(), 2):
-            ws.cell(row=row_idx, column=1, value=str(row.get("codgeo", "")) if pd.notna(row.get("codgeo")) else "")
-            ws.cell(row=row_idx, column=2, value=int(row.get("annee", year)) if pd.notna(row.get("annee")) else year)
-            for i, var in enumerate(variables):
-                val = row.get(var)
-                if pd.notna(val):
-                    data_cell = ws.cell(row=row_idx, column=3 + i, value=float(val))
-                else:
-                    data_cell = ws.cell(row=row_idx, column=3 + i, value=None)
-
-        # CepiDc commune annotation: data is regional-only
-        if geo_key == "com" and cfg.get("source_type") == "cepidc":
-            _add_note_to_sheet(ws, df,
-                "NOTE: La source CepiDc ne fournit pas de donnees communales. "
-                "Les effectifs sont vides. Les taux correspondent au taux regional Guyane (proxy).")
-
-        # BAAC Guyane-only annotation in FH and FRA sheets
-        if guyane_only and geo_key in ("fh", "fra"):
-            _add_note_to_sheet(ws, df, BAAC_GUYANE_NOTE)
-
-        # CepiDc / Odisse rate annotation for DOM/FH/FRA: rates may be NaN (no population weighting)
-        if geo_key in ("dom", "fh", "fra") and cfg.get("source_type") in ("cepidc", "odisse_alcool", "odisse_tabac"):
-            _add_note_to_sheet(ws, df,
-                "NOTE: Les taux agreges (DOM/FH/FRA) ne sont pas disponibles dans la source. "
-                "Une moyenne non ponderee serait statistiquement incorrecte (populations regionales differentes). "
-                "Les cellules de taux vides correspondent a cette limitation.",
-                note_color="0000FF")
-
-        wb.save(folder / f"{excel_name}.xlsx")
-
-    wb_cons = Workbook()
-    wb_cons.remove(wb_cons.active)
-    for geo_key in GEO_FOLDER_MAPPING:
-        ws = wb_cons.create_sheet(geo_key)
-        headers = [geo_key, "annee"] + variables
-        for idx, h in enumerate(headers, 1):
-            c = ws.cell(row=1, column=idx, value=h)
-            c.font = Font(bold=True)
-        df = all_levels[geo_key].copy()
-        for var in variables:
-            if var not in df.columns:
-                df[var] = None
-        for row_idx, (_, row) in enumerate(df.iterrows(), 2):
-            ws.cell(row=row_idx, column=1, value=str(row.get("codgeo", "")) if pd.notna(row.get("codgeo")) else "")
-            ws.cell(row=row_idx, column=2, value=int(row.get("annee", year)) if pd.notna(row.get("annee")) else year)
-            for i, var in enumerate(variables):
-                val = row.get(var)
-                if pd.notna(val):
-                    data_cell = ws.cell(row=row_idx, column=3 + i, value=float(val))
-                else:
-                    data_cell = ws.cell(row=row_idx, column=3 + i, value=None)
-
-        # CepiDc commune annotation in consolidated
-        if geo_key == "com" and cfg.get("source_type") == "cepidc":
-            _add_note_to_sheet(ws, df,
-                "NOTE: La source CepiDc ne fournit pas de donnees communales. "
-                "Les effectifs sont vides. Les taux correspondent au taux regional Guyane (proxy).")
-
-        # BAAC Guyane-only annotation in FH and FRA sheets of consolidated
-        if guyane_only and geo_key in ("fh", "fra"):
-            _add_note_to_sheet(ws, df, BAAC_GUYANE_NOTE)
-
-        # CepiDc / Odisse rate annotation for DOM/FH/FRA in consolidated
-        if geo_key in ("dom", "fh", "fra") and cfg.get("source_type") in ("cepidc", "odisse_alcool", "odisse_tabac"):
-            _add_note_to_sheet(ws, df,
-                "NOTE: Les taux agreges (DOM/FH/FRA) ne sont pas disponibles dans la source. "
-                "Une moyenne non ponderee serait statistiquement incorrecte (populations regionales differentes). "
-                "Les cellules de taux vides correspondent a cette limitation.",
-                note_color="0000FF")
-
-    wb_cons.save(root_dir / f"{excel_name}_consolidated_{year}.xlsx")
-    zip_path = shutil.make_archive(str(OUTPUT_DIR / f"{theme}_opendata_{year}"), "zip", str(OUTPUT_DIR / f"{theme}_opendata"), str(year))
+    with timing.span("write_xlsx"):
+        for geo_key, folder_name in GEO_FOLDER_MAPPING.items():
+            folder = root_dir / folder_name
+            folder.mkdir(exist_ok=True)
+
+            wb = Workbook()
+            ws = wb.active
+            ws.title = geo_key
+            headers, rows = tables[geo_key]
+            _write_level_sheet(ws, headers, rows)
+            _annotate_level_sheet(ws, geo_key, rows, cfg, guyane_only)
+
+            if "xlsx" in formats:
+                reproducible.save_workbook(wb, folder / f"{excel_name}.xlsx")
+            if sidecar.wants_sidecar(formats):
+                sidecar.write_workbook_tables(folder / f"{excel_name}.xlsx", wb, formats)
+
+        wb_cons = Workbook()
+        wb_cons.remove(wb_cons.active)
+        for geo_key in GEO_FOLDER_MAPPING:
+            ws = wb_cons.create_sheet(geo_key)
+            headers, rows = tables[geo_key]
+            _write_level_sheet(ws, headers, rows)
+            _annotate_level_sheet(ws, geo_key, rows, cfg, guyane_only)
+
+        if "xlsx" in formats:
+            reproducible.save_workbook(wb_cons, root_dir / f"{excel_name}_consolidated_{year}.xlsx")
+        if sidecar.wants_sidecar(formats):
+            sidecar.write_workbook_tables(root_dir / f"{excel_name}_consolidated_{year}.xlsx", wb_cons, formats)
+    with timing.span("zip"):
+        # Sidecars hors du livrable (archive interne, cf. sidecar.extract_pack)
+        sidecar.extract_pack(OUTPUT_DIR / f"{theme}_opendata_{year}.zip", OUTPUT_DIR / f"{theme}_opendata", str(year))
+        zip_path = reproducible.make_archive(OUTPUT_DIR / f"{theme}_opendata_{year}", OUTPUT_DIR / f"{theme}_opendata", str(year))
+    timing.incr("bytes_written", Path(zip_path).stat().st_size)
     return root_dir, Path(zip_path)
 
 
-def generate_theme(theme: str, year: int):
+def build_theme_levels(theme: str, year: int):
+    """Données agrégées par niveau géo : (all_levels, guyane_only)."""
     source_type = THEME_CONFIGS[theme]["source_type"]
     guyane_only = False  # Positionné à True uniquement pour BAAC Guyane-seulement
 
-    if source_type == "educ":
-        all_levels = _build_educ_levels(year)
-    elif source_type == "couples":
-        all_levels = _build_couples_levels(theme, year)
-    elif source_type == "caf":
-        all_levels = _build_alloc_levels(year)
-    elif source_type == "ircom":
-        all_levels = _build_revenu_levels(year)
-    elif source_type == "pop_legales":
-        all_levels = _build_densite_levels(year)
-    elif source_type == "baac":
-        all_levels, guyane_only = _build_route_levels(year)
-    elif source_type == "cepidc":
-        all_levels = _build_cepidc_levels(theme, year)
-    elif source_type == "odisse_suicide":
-        all_levels = _build_odisse_suicide_levels(year)
-    elif source_type == "odisse_alcool":
-        all_levels = _build_odisse_consommation_levels(year, "alcool")
-    elif source_type == "odisse_tabac":
-        all_levels = _build_odisse_consommation_levels(year, "tabac")
-    elif source_type == "spf_noyades":
-        all_levels = _build_spf_noyades_levels(year)
-    elif source_type == "drees_eaje":
-        all_levels = _build_eaje_levels(year)
-    else:
-        raise ValueError(f"Source type inconnu: {source_type}")
+    with timing.span("parse", source_type=source_type):
+        if source_type == "educ":
+            all_levels = _build_educ_levels(year)
+        elif source_type == "couples":
+            all_levels = _build_couples_levels(theme, year)
+        elif source_type == "caf":
+            all_levels = _build_alloc_levels(year)
+        elif source_type == "ircom":
+            all_levels = _build_revenu_levels(year)
+        elif source_type == "pop_legales":
+            all_levels = _build_densite_levels(year)
+        elif source_type == "baac":
+            all_levels, guyane_only = _build_route_levels(year)
+        elif source_type == "cepidc":
+            all_levels = _build_cepidc_levels(theme, year)
+        elif source_type == "odisse_suicide":
+            all_levels = _build_odisse_suicide_levels(year)
+        elif source_type == "odisse_alcool":
+            all_levels = _build_odisse_consommation_levels(year, "alcool")
+        elif source_type == "odisse_tabac":
+            all_levels = _build_odisse_consommation_levels(year, "tabac")
+        elif source_type == "spf_noyades":
+            all_levels = _build_spf_noyades_levels(year)
+        elif source_type == "drees_eaje":
+            all_levels = _build_eaje_levels(year)
+        else:
+            raise ValueError(f"Source type inconnu: {source_type}")
+    return all_levels, guyane_only
 
-    root_dir, zip_path = _generate_excel_and_zip(theme, year, all_levels, guyane_only=guyane_only)
-    print(f"[OK] {theme} {year}: {zip_path}")
-    print("     dossiers:", ", ".join(GEO_FOLDER_MAPPING.values()))
-    return root_dir
+
+def generate_theme(theme: str, year: int, formats=None):
+    with profiler.profile("opendata", dataset=theme, year=year), \
+            timing.job("opendata", dataset=theme, year=year):
+        all_levels, guyane_only = build_theme_levels(theme, year)
+        root_dir, zip_path = _generate_excel_and_zip(theme, year, all_levels, guyane_only=guyane_only, formats=formats)
+        print(f"[OK] {theme} {year}: {zip_path}")
+        print("     dossiers:", ", ".join(GEO_FOLDER_MAPPING.values()))
+        return root_dir
+
+
+def detect_available_years_opendata(dataset: str):
+    """Annees disponibles pour un theme open data (scan de INPUTS_DIR).
+
+    Anciennement embarque en script inline dans file_server.js
+    (/api/available-years-opendata) ; expose ici pour le worker Python.
+    """
+    if dataset not in THEME_CONFIGS:
+        return []
+    src = THEME_CONFIGS[dataset]["source_type"]
+    years = []
+    if src == "educ":
+        for p in sorted(INPUTS_DIR.glob("diplomes_formation_*.csv")):
+            y = p.stem.split("_")[-1]
+            if y.isdigit(): years.append(int(y))
+    elif src == "couples":
+        for p in sorted(INPUTS_DIR.glob("couples_familles_*.csv")):
+            y = p.stem.split("_")[-1]
+            if y.isdigit(): years.append(int(y))
+    elif src == "caf":
+        for caf in sorted(INPUTS_DIR.glob("caf_allocataires*.csv")):
+            try:
+                df = pd.read_csv(caf, sep=";", low_memory=False, encoding="utf-8-sig")
+            except Exception:
+                continue
+            if "Date référence" in df.columns:
+                years.extend(int(str(v)[:4]) for v in df["Date référence"].dropna() if str(v)[:4].isdigit())
+            else:
+                # Fallback : année depuis le nom de fichier (ex. caf_allocataires_2023.csv)
+                tail = caf.stem.split("_")[-1]
+                if tail.isdigit() and len(tail) == 4:
+                    years.append(int(tail))
+    elif src == "ircom":
+        for p in INPUTS_DIR.rglob("ircom_communes_complet_revenus_*.xlsx"):
+            y = p.stem.split("_")[-1]
+            if y.isdigit(): years.append(int(y))
+    elif src == "pop_legales":
+        for p in sorted(INPUTS_DIR.glob("populations_*.csv")):
+            y = p.stem.split("_")[-1]
+            if y.isdigit(): years.append(int(y))
+    elif src == "baac":
+        # Données BAAC/ONISR disponibles en open data — années expose même si fichiers pas encore présents sur la VM
+        baac_dir = INPUTS_DIR / "baac"
+        if baac_dir.exists():
+            for p in sorted(baac_dir.glob("caract_*.csv")):
+                y = p.stem.split("_")[-1]
+                if y.isdigit(): years.append(int(y))
+        if not years:
+            years = [2019, 2020, 2021, 2022, 2023, 2024]
+    elif src == "cepidc":
+        years = list(range(2015, 2024))
+    elif src == "odisse_suicide":
+        years = [2019, 2020, 2021, 2022, 2023]
+    elif src == "odisse_alcool":
+        years = [2000, 2005, 2010, 2014, 2017, 2021]
+    elif src == "odisse_tabac":
+        years = [2000, 2005, 2010, 2014, 2017, 2021]
+    elif src == "spf_noyades":
+        noyades_dir = INPUTS_DIR / "spf_noyades"
+        for p in sorted(noyades_dir.glob("noyades_departement_*.csv")):
+            try:
+                df = pd.read_csv(p, sep=";", low_memory=False, encoding="utf-8-sig")
+            except Exception:
+                continue
+            yr_col = next((c for c in df.columns if "ann" in c.lower()), None)
+            if yr_col:
+                years.extend(int(v) for v in df[yr_col].dropna() if str(v).strip().isdigit())
+        if not years:
+            years = [2003, 2004, 2006, 2009, 2012, 2015, 2018, 2021]
+    elif src == "drees_eaje":
+        drees_dir = INPUTS_DIR / "drees"
+        for p in sorted(drees_dir.glob("drees_offre_accueil_jeune_enfant_*_series_longues.xlsx")):
+            for tok in p.stem.split("_"):
+                if tok.isdigit() and len(tok) == 4:
+                    years.append(int(tok))
+    return sorted(set(years))
 
 
 def main():
@@ -1645,12 +1859,16 @@ def main():
     if len(sys.argv) == 2 and sys.argv[1].isdigit():
         year = int(sys.argv[1])
         themes = list(THEME_CONFIGS.keys())
+        formats = None
     else:
         parser = argparse.ArgumentParser(description="PRISME - Generation Open Data")
         parser.add_argument("--theme", default="all", help=f"Theme: {', '.join(THEME_CONFIGS.keys())} ou all")
         parser.add_argument("--year", type=int, default=2022, help="Annee (defaut: 2022)")
+        parser.add_argument("--formats", default=None,
+                            help="xlsx,parquet,csv (defaut: PRISME_OUTPUT_FORMATS ou xlsx)")
         args = parser.parse_args()
         year = args.year
+        formats = args.formats
         if args.theme == "all":
             themes = list(THEME_CONFIGS.keys())
         elif args.theme in THEME_CONFIGS:
@@ -1663,7 +1881,7 @@ def main():
     print("=" * 70)
     for theme in themes:
         try:
-            generate_theme(theme, year)
+            generate_theme(theme, year, formats=formats)
         except Exception as exc:
             print(f"[ERROR] {theme}: {exc}")
 
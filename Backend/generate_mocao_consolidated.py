@@ -26,12 +26,17 @@ import os
 import argparse
 import subprocess
 import zipfile
-import tempfile
-import shutil
-from pathlib import Path
+from contextlib import nullcontext
+from io import BytesIO
+from pathlib import Path, PurePosixPath
 from openpyxl import load_workbook, Workbook
 from openpyxl.styles import Font
 
+import profiler
+import reproducible
+import sidecar
+import timing
+
 # Meme convention que prisme_engine.py / generate_from_opendata.py
 
 BASE = Path(__file__).parent
@@ -88,68 +93,106 @@ def _run(cmd, cwd=None, check=True):
 
 
 def generate_year_zip(dataset_id: str, year: int, source: str = "moca") -> Path:
-    """Generate or locate existing ZIP for a given year."""
+    """Generate or locate existing ZIP for a given year.
+
+    Dans le worker Python (prisme_worker.py) le moteur est deja importe : on
+    l'appelle en process au lieu de relancer un interpreteur. Les packs generes
+    ici ont des sidecars (sidecar.INTERNAL_FORMATS), ranges hors du ZIP livre
+    (sidecar.pack_path) et relus par read_data_from_zip sans openpyxl.
+    """
+    formats = ",".join(sidecar.INTERNAL_FORMATS)
     if source == "opendata":
         candidate = OUTPUT_DIR / f"{dataset_id}_opendata_{year}.zip"
         if candidate.exists():
             return candidate
         print(f"[GEN] opendata {dataset_id} {year}...", file=sys.stderr)
-        code = (
-            f"import sys; sys.path.insert(0, r'{BASE}');\n"
-            f"from generate_from_opendata import generate_theme;\n"
-            f"generate_theme('{dataset_id}', {year})\n"
-        )
-        _run([PYTHON_EXE, "-c", code])
+        if "generate_from_opendata" in sys.modules:
+            sys.modules["generate_from_opendata"].generate_theme(dataset_id, year, formats=formats)
+        else:
+            code = (
+                f"import sys; sys.path.insert(0, r'{BASE}');\n"
+                f"from generate_from_opendata import generate_theme;\n"
+                f"generate_theme('{dataset_id}', {year}, formats='{formats}')\n"
+            )
+            _run([PYTHON_EXE, "-c", code])
     else:
         candidate = OUTPUT_DIR / f"{dataset_id}_{year}.zip"
         if candidate.exists():
             return candidate
         print(f"[GEN] moca {dataset_id} {year}...", file=sys.stderr)
-        code = (
-            f"import sys; sys.path.insert(0, r'{BASE}');\n"
-            f"from prisme_engine import generate_prisme_excel;\n"
-            f"generate_prisme_excel('{dataset_id}', {year})\n"
-        )
-        _run([PYTHON_EXE, "-c", code])
+        if "prisme_engine" in sys.modules:
+            sys.modules["prisme_engine"].generate_prisme_excel(dataset_id, year, formats=formats)
+        else:
+            code = (
+                f"import sys; sys.path.insert(0, r'{BASE}');\n"
+                f"from prisme_engine import generate_prisme_excel;\n"
+                f"generate_prisme_excel('{dataset_id}', {year}, formats='{formats}')\n"
+            )
+            _run([PYTHON_EXE, "-c", code])
 
     if not candidate.exists():
         raise FileNotFoundError(f"ZIP not generated: {candidate}")
     return candidate
 
 
-def read_data_from_zip(zip_path: Path, tmpdir: Path) -> dict:
+def _read_xlsx_member(zf, member):
+    """[(headers, body)] d'un classeur du ZIP via openpyxl (pack sans sidecar)."""
+    blocks = []
+    wb = load_workbook(BytesIO(zf.read(member)), read_only=True, data_only=True)
+    try:
+        for sn in wb.sheetnames:
+            rows = list(wb[sn].iter_rows(values_only=True))
+            if rows:
+                blocks.append((rows[0], rows[1:]))
+    finally:
+        wb.close()
+    return blocks
+
+
+def read_data_from_zip(zip_path: Path) -> dict:
     """
-    Extract ZIP and read each territory xlsx.
+    Read each territory table of a yearly ZIP, without extracting it.
+    Prefers the parquet/csv sidecars (internal pack sidecar.pack_path, or
+    embedded in packs generated before it existed) and falls back to openpyxl
+    for packs generated without them.
     Returns {terr_key: [(headers, rows), ...]} where terr_key in {com, reg, dom, fra, fh}
     """
-    extract_dir = tmpdir / zip_path.stem
-    extract_dir.mkdir(exist_ok=True)
-    with zipfile.ZipFile(zip_path) as z:
-        z.extractall(extract_dir)
-
     data = {}
-    # Walk the extracted tree looking for territory folders
-    for xlsx_path in extract_dir.rglob("*.xlsx"):
-        parent = xlsx_path.parent.name  # e.g., "Commune", "Région", "DOM"
-        # Skip consolidated files at year-level
-        if "consolidated" in xlsx_path.name.lower():
-            continue
-        terr_key = TERR_TO_SHEETKEY.get(parent)
-        if not terr_key:
-            continue
-        try:
-            wb = load_workbook(xlsx_path, read_only=True, data_only=True)
-            for sn in wb.sheetnames:
-                ws = wb[sn]
-                rows = list(ws.iter_rows(values_only=True))
-                if not rows:
-                    continue
-                headers = rows[0]
-                body = [r for r in rows[1:] if r and any(c is not None and c != '' for c in r)]
-                data.setdefault(terr_key, []).append((headers, body))
-            wb.close()
-        except Exception as e:
-            print(f"[WARN] skip {xlsx_path}: {e}", file=sys.stderr)
+    pack = sidecar.pack_path(zip_path)
+    with zipfile.ZipFile(zip_path) as zf, \
+            (zipfile.ZipFile(pack) if pack.is_file() else nullcontext()) as pack_zf:
+        # Un classeur = un xlsx et/ou un manifeste de sidecars (zip qui le contient)
+        workbooks = {}
+        manifests = {}
+        for z in (zf, pack_zf) if pack_zf is not None else (zf,):
+            for name in z.namelist():
+                p = PurePosixPath(name)
+                if name.endswith(".tables.json"):
+                    stem = str(p.parent / p.name[:-len(".tables.json")])
+                    workbooks.setdefault(stem, name)
+                    manifests[stem] = z
+                elif name.endswith(".xlsx"):
+                    workbooks.setdefault(str(p.with_suffix("")), name)
+
+        for stem, member in sorted(workbooks.items()):
+            parent = PurePosixPath(stem).parent.name  # e.g., "Commune", "Région", "DOM"
+            # Skip consolidated files at year-level
+            if "consolidated" in PurePosixPath(stem).name.lower():
+                continue
+            terr_key = TERR_TO_SHEETKEY.get(parent)
+            if not terr_key:
+                continue
+            try:
+                tables = sidecar.read_tables_from_zip(manifests[stem], stem) if stem in manifests else None
+                if tables is not None:
+                    blocks = list(tables.values())
+                else:
+                    blocks = _read_xlsx_member(zf, f"{stem}.xlsx")
+                for headers, rows in blocks:
+                    body = [r for r in rows if r and any(c is not None and c != '' for c in r)]
+                    data.setdefault(terr_key, []).append((tuple(headers), body))
+            except Exception as e:
+                print(f"[WARN] skip {member}: {e}", file=sys.stderr)
     return data
 
 
@@ -181,11 +224,19 @@ def _style_sheet(ws):
 
 
 def build_consolidated_xlsx(dataset_id: str, years: list[int],
-                            year_data: dict, out_path: Path):
+                            year_data: dict, out_path: Path, formats=None):
     """
     Build final consolidated xlsx.
     year_data[year] = {com: [(headers, rows), ...], reg: [...], dom: [...], fra: [...], fh: [...]}
+    formats : xlsx et/ou sidecars parquet/csv ecrits a cote (cf. sidecar.py).
+    Profile si demande (cf. profiler.py) ; sans effet sous generate_consolidated.
     """
+    with profiler.profile("consolidated_xlsx", dataset=dataset_id, years=f"{years[0]}-{years[-1]}" if years else ""):
+        _build_consolidated_xlsx(dataset_id, years, year_data, out_path, formats)
+
+
+def _build_consolidated_xlsx(dataset_id, years, year_data, out_path, formats):
+    formats = sidecar.resolve_formats(formats)
     wb = Workbook()
     wb.remove(wb.active)
 
@@ -266,36 +317,54 @@ def build_consolidated_xlsx(dataset_id: str, years: list[int],
         _style_sheet(ws)
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    wb.save(out_path)
+    if "xlsx" in formats:
+        reproducible.save_workbook(wb, out_path, dedupe=True)
+    if sidecar.wants_sidecar(formats):
+        sidecar.write_workbook_tables(out_path, wb, formats)
 
 
-def main():
-    ap = argparse.ArgumentParser()
-    ap.add_argument("dataset_id")
-    ap.add_argument("year_start", type=int)
-    ap.add_argument("year_end", type=int)
-    ap.add_argument("--source", choices=["moca", "opendata"], default="moca")
-    args = ap.parse_args()
+def generate_consolidated(dataset_id, year_start, year_end, source="moca", formats=None):
+    """Genere le consolide multi-annees et retourne son chemin (Path).
 
-    years = list(range(args.year_start, args.year_end + 1))
-    print(f"[MOCA-CONS] dataset={args.dataset_id} years={years} source={args.source}", file=sys.stderr)
+    Point d'entree commun a la CLI et au worker Python de file_server.js.
+    """
+    with profiler.profile("consolidated", dataset=dataset_id, years=f"{year_start}-{year_end}", source=source), \
+            timing.job("consolidated", dataset=dataset_id, years=f"{year_start}-{year_end}", source=source):
+        years = list(range(year_start, year_end + 1))
+        print(f"[MOCA-CONS] dataset={dataset_id} years={years} source={source}", file=sys.stderr)
 
-    tmpdir = Path(tempfile.mkdtemp(prefix="mocao_cons_"))
-    try:
         year_data = {}
         for y in years:
             try:
-                zp = generate_year_zip(args.dataset_id, y, source=args.source)
-                year_data[y] = read_data_from_zip(zp, tmpdir)
+                with timing.span("resolve", year=y):
+                    zp = generate_year_zip(dataset_id, y, source=source)
+                with timing.span("parse", year=y):
+                    year_data[y] = read_data_from_zip(zp)
             except Exception as e:
                 print(f"[WARN] year {y} skipped: {e}", file=sys.stderr)
                 year_data[y] = {}
 
-        out_path = OUTPUT_DIR / f"{args.dataset_id}_mocao_{args.year_start}_{args.year_end}.xlsx"
-        build_consolidated_xlsx(args.dataset_id, years, year_data, out_path)
-        print(out_path.name)  # stdout = filename for file_server.js
-    finally:
-        shutil.rmtree(tmpdir, ignore_errors=True)
+        out_path = OUTPUT_DIR / f"{dataset_id}_mocao_{year_start}_{year_end}.xlsx"
+        with timing.span("write_xlsx"):
+            build_consolidated_xlsx(dataset_id, years, year_data, out_path, formats=formats)
+        if out_path.exists():
+            timing.incr("bytes_written", out_path.stat().st_size)
+        return out_path
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("dataset_id")
+    ap.add_argument("year_start", type=int)
+    ap.add_argument("year_end", type=int)
+    ap.add_argument("--source", choices=["moca", "opendata"], default="moca")
+    ap.add_argument("--formats", default=None,
+                    help="xlsx,parquet,csv (defaut: PRISME_OUTPUT_FORMATS ou xlsx)")
+    args = ap.parse_args()
+
+    out_path = generate_consolidated(args.dataset_id, args.year_start, args.year_end,
+                                     args.source, formats=args.formats)
+    print(out_path.name)  # stdout = filename for file_server.js
 
 
 if __name__ == "__main__":
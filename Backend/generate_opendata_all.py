@@ -26,6 +26,8 @@ import argparse
 import sys
 import os
 
+import reproducible
+
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
@@ -144,74 +146,88 @@ THEME_CONFIGS = {
 # FONCTIONS DE CHARGEMENT ET FILTRAGE
 # =============================================================================
 
-def load_and_filter_csv(source_path: Path, year: int) -> pd.DataFrame:
-    """Charge le CSV INSEE et filtre les données Guyane, agrégées par commune."""
+GEO_COLUMNS = ('COM', 'CODGEO')
+
+
+def _dep_codes(commune_code: pd.Series) -> pd.Series:
+    """Département d'un code commune (3 caractères en outre-mer, 2 sinon)."""
+    return commune_code.str[:3].where(commune_code.str.startswith('97'), commune_code.str[:2])
+
+
+def _insee_columns(year: int):
+    """Colonnes utiles d'une base INSEE : code géo + variables P{aa}_ / C{aa}_."""
+    prefixes = (f"P{str(year)[2:]}_", f"C{str(year)[2:]}_")
+    return lambda col: col in GEO_COLUMNS or col.startswith(prefixes)
+
+
+def load_insee_data(source_path: Path, year: int) -> dict:
+    """Charge le CSV INSEE en une lecture et l'agrège une fois de l'IRIS à la commune.
+
+    Retourne {'com': communes Guyane, 'reg', 'dom', 'fh', 'fra'} (cf. _national_levels) ;
+    'com' vide si la Guyane est absente du fichier.
+    """
     print(f"  [LOAD] Chargement {source_path.name}...")
-    
-    df = pd.read_csv(source_path, sep=';', dtype={'COM': str, 'IRIS': str}, low_memory=False)
-    print(f"  [OK] {len(df)} lignes lues, {len(df.columns)} colonnes")
-    
-    # Extraire code commune (5 premiers caractères de IRIS ou COM)
+
+    df = pd.read_csv(source_path, sep=';', dtype={'COM': str, 'CODGEO': str},
+                     usecols=_insee_columns(year), low_memory=False)
+    print(f"  [OK] {len(df)} lignes lues, {len(df.columns)} colonnes utiles")
+
+    # Code commune (5 premiers caractères de COM ou CODGEO)
     geo_col = 'COM' if 'COM' in df.columns else 'CODGEO'
-    df['commune_code'] = df[geo_col].astype(str).str[:5]
-    
-    # Filtrer Guyane
-    df_guyane = df[df['commune_code'].isin(COMMUNES_GUYANE)].copy()
-    print(f"  [FILTER] {len(df_guyane)} lignes Guyane ({df_guyane['commune_code'].nunique()} communes)")
-    
+    commune_code = df[geo_col].astype(str).str[:5]
+
+    # Agréger par commune (les données sont au niveau IRIS)
+    numeric_cols = df.select_dtypes(include='number').columns.tolist()
+    df_com = df[numeric_cols].groupby(commune_code.rename('commune_code')).sum().reset_index()
+    del df
+
+    # Communes de Guyane
+    guyane = commune_code.isin(COMMUNES_GUYANE)
+    df_guyane = df_com[df_com['commune_code'].isin(COMMUNES_GUYANE)].reset_index(drop=True)
+    print(f"  [FILTER] {int(guyane.sum())} lignes Guyane ({len(df_guyane)} communes)")
     if df_guyane.empty:
         print("  [WARN] Aucune donnée pour la Guyane !")
-        return pd.DataFrame()
-    
-    # Agréger par commune (les données sont au niveau IRIS)
-    numeric_cols = df_guyane.select_dtypes(include='number').columns.tolist()
-    df_communal = df_guyane.groupby('commune_code')[numeric_cols].sum().reset_index()
-    print(f"  [AGG] {len(df_communal)} communes après agrégation")
-    
-    return df_communal
+    else:
+        print(f"  [AGG] {len(df_guyane)} communes après agrégation")
 
+    levels = _national_levels(df_com, numeric_cols)
+    levels['com'] = df_guyane
+    return levels
+
+
+def _national_levels(df: pd.DataFrame, numeric_cols: list) -> dict:
+    """Agrège des lignes communales (colonne commune_code) en reg/dom/fh/fra.
+
+    Chaque niveau est un DataFrame prêt pour CALC_FUNCTIONS : commune_code
+    porte le code région, 'DOM', '0' (France hexagonale) ou '99' (France).
+    """
+    reg = _dep_codes(df['commune_code']).map(DEP_TO_REG)
+
+    # Régions (communes hors DEP_TO_REG ignorées)
+    df_reg = df[numeric_cols].groupby(reg.rename('reg')).sum().reset_index()
+    df_reg['commune_code'] = df_reg['reg']
+
+    def _total(mask, code):
+        total = df_reg[mask][numeric_cols].sum().to_frame().T
+        total['commune_code'] = code
+        return total
 
-def load_national_data(source_path: Path, year: int) -> pd.DataFrame:
-    """Charge et agrège les données nationales pour les niveaux reg/dom/fh/fra."""
-    print(f"  [NATIONAL] Chargement données nationales pour agrégation...")
-    
-    df = pd.read_csv(source_path, sep=';', dtype={'COM': str, 'IRIS': str}, low_memory=False)
-    
-    geo_col = 'COM' if 'COM' in df.columns else 'CODGEO'
-    df['commune_code'] = df[geo_col].astype(str).str[:5]
-    
-    # Déterminer le département
-    df['dep'] = df['commune_code'].apply(lambda x: x[:3] if x.startswith('97') else x[:2])
-    
-    # Mapper vers la région
-    df['reg'] = df['dep'].map(DEP_TO_REG)
-    
-    # Agréger par commune d'abord (depuis IRIS)
-    numeric_cols = df.select_dtypes(include='number').columns.tolist()
-    df_com = df.groupby(['commune_code', 'dep', 'reg'])[numeric_cols].sum().reset_index()
-    
-    # Agréger par région
-    df_reg = df_com.groupby('reg')[numeric_cols].sum().reset_index()
-    
-    # DOM = somme des régions DOM
-    df_dom = df_reg[df_reg['reg'].isin(DOM_CODES)][numeric_cols].sum()
-    
-    # France Hexagonale = somme des régions métropoles
-    df_fh = df_reg[df_reg['reg'].isin(FH_REGIONS)][numeric_cols].sum()
-    
-    # France entière = somme totale
-    df_fra = df_reg[numeric_cols].sum()
-    
     print(f"  [OK] {len(df_reg)} régions, agrégations DOM/FH/FR calculées")
-    
     return {
         'reg': df_reg,
-        'dom': df_dom,
-        'fh': df_fh,
-        'fra': df_fra
+        'dom': _total(df_reg['reg'].isin(DOM_CODES), 'DOM'),
+        'fh': _total(df_reg['reg'].isin(FH_REGIONS), '0'),
+        'fra': _total(slice(None), '99'),
     }
 
 
+def _calc_levels(levels: dict, calc_fn, year: int) -> dict:
+    """Applique la fonction de calcul du thème à chaque niveau géographique."""
+    data = {geo_key: calc_fn(df, year) for geo_key, df in levels.items()}
+    data['reg'] = data['reg'].rename(columns={'codgeo': 'reg_code'})
+    return data
+
+
 # =============================================================================
 # FONCTIONS DE CALCUL PAR THÈME
 # =============================================================================
@@ -388,8 +404,8 @@ def load_caf_data(source_path: Path, year: int, calc_fn):
     print(f"  [OK] {len(df)} lignes lues")
     
     # Filtrer par année (format: "2022-12")
-    df['year'] = df['Date référence'].str[:4].astype(int)
-    df_year = df[df['year'] == year].copy()
+    df_year = df[df['Date référence'].str[:4].astype(int) == year].copy()
+    del df
     print(f"  [FILTER] {len(df_year)} lignes pour l'année {year}")
     
     if df_year.empty:
@@ -399,49 +415,17 @@ def load_caf_data(source_path: Path, year: int, calc_fn):
     # Code commune
     df_year['commune_code'] = df_year['Numéro commune'].astype(str).str.zfill(5)
     
-    # === Communes Guyane ===
-    df_guyane = df_year[df_year['commune_code'].isin(COMMUNES_GUYANE)].copy()
+    # === Communes Guyane (déjà au niveau commune) ===
+    df_guyane = df_year[df_year['commune_code'].isin(COMMUNES_GUYANE)]
     print(f"  [GUYANE] {len(df_guyane)} communes Guyane")
-    data_com = calc_fn(df_guyane, year) if not df_guyane.empty else pd.DataFrame()
     
     # === Agrégation nationale ===
-    # Département
-    df_year['dep'] = df_year['commune_code'].apply(lambda x: x[:3] if x.startswith('97') else x[:2])
-    df_year['reg'] = df_year['dep'].map(DEP_TO_REG)
-    
-    # Régions : agréger les colonnes numériques
     num_cols = df_year.select_dtypes(include='number').columns.tolist()
-    num_cols = [c for c in num_cols if c != 'year']
-    
-    df_reg = df_year.dropna(subset=['reg']).groupby('reg')[num_cols].sum().reset_index()
-    df_reg['commune_code'] = df_reg['reg']
-    data_reg = calc_fn(df_reg, year)
-    data_reg.rename(columns={'codgeo': 'reg_code'}, inplace=True)
-    
-    # DOM
-    df_dom_data = df_reg[df_reg['reg'].isin(DOM_CODES)][num_cols].sum().to_frame().T
-    df_dom_data['commune_code'] = 'DOM'
-    data_dom = calc_fn(df_dom_data, year)
-    
-    # France Hexagonale
-    df_fh_data = df_reg[df_reg['reg'].isin(FH_REGIONS)][num_cols].sum().to_frame().T
-    df_fh_data['commune_code'] = '0'
-    data_fh = calc_fn(df_fh_data, year)
+    levels = _national_levels(df_year, num_cols)
     
-    # France entière
-    df_fra_data = df_reg[num_cols].sum().to_frame().T
-    df_fra_data['commune_code'] = '99'
-    data_fra = calc_fn(df_fra_data, year)
-    
-    print(f"  [OK] {len(df_reg)} régions, agrégations nationales calculées")
-    
-    return {
-        'com': data_com,
-        'reg': data_reg,
-        'dom': data_dom,
-        'fh': data_fh,
-        'fra': data_fra
-    }
+    data = _calc_levels(levels, calc_fn, year)
+    data['com'] = calc_fn(df_guyane, year) if not df_guyane.empty else pd.DataFrame()
+    return data
 
 
 def generate_excel_prisme(theme: str, year: int) -> Path:
@@ -464,43 +448,20 @@ def generate_excel_prisme(theme: str, year: int) -> Path:
         print(f"  [INFO] Lancez : py download_opendata.py --source {'caf' if loader_type == 'caf' else 'couples'} --years {year}")
         return None
     
-    # 2. Charger et calculer selon le loader
+    # 2. Charger (une lecture) et calculer selon le loader
     if loader_type == 'caf':
         # Loader CAF spécifique
-        all_levels = load_caf_data(source_path, year, calc_fn)
-        if all_levels is None:
+        all_data = load_caf_data(source_path, year, calc_fn)
+        if all_data is None:
             return None
-        data_com = all_levels['com']
-        data_reg_calc = all_levels['reg']
-        data_dom = all_levels['dom']
-        data_fh = all_levels['fh']
-        data_fra = all_levels['fra']
     else:
-        # Loader INSEE standard
-        df_com = load_and_filter_csv(source_path, year)
-        if df_com.empty:
+        # Loader INSEE standard : communes Guyane + niveaux nationaux
+        levels = load_insee_data(source_path, year)
+        if levels['com'].empty:
             return None
-        data_com = calc_fn(df_com, year)
-        
-        # Données nationales
-        nat_data = load_national_data(source_path, year)
-        
-        df_reg = nat_data['reg'].copy()
-        df_reg['commune_code'] = df_reg['reg']
-        data_reg_calc = calc_fn(df_reg, year)
-        data_reg_calc.rename(columns={'codgeo': 'reg_code'}, inplace=True)
-        
-        dom_series = nat_data['dom'].to_frame().T.copy()
-        dom_series['commune_code'] = 'DOM'
-        data_dom = calc_fn(dom_series, year)
-        
-        fh_series = nat_data['fh'].to_frame().T.copy()
-        fh_series['commune_code'] = '0'
-        data_fh = calc_fn(fh_series, year)
-        
-        fra_series = nat_data['fra'].to_frame().T.copy()
-        fra_series['commune_code'] = '99'
-        data_fra = calc_fn(fra_series, year)
+        all_data = _calc_levels(levels, calc_fn, year)
+    data_com = all_data['com']
+    data_reg_calc = all_data['reg']
     
     variables = config['variables']
     
@@ -512,15 +473,6 @@ def generate_excel_prisme(theme: str, year: int) -> Path:
     
     print(f"\n  [DIR] {theme_dir}")
     
-    # Structure all_data pour la génération
-    all_data = {
-        'com': data_com,
-        'reg': data_reg_calc,
-        'dom': data_dom,
-        'fh': data_fh,
-        'fra': data_fra
-    }
-    
     geo_id_cols = {
         'com': 'codgeo',
         'reg': 'reg_code' if 'reg_code' in data_reg_calc.columns else 'codgeo',
@@ -565,7 +517,7 @@ def generate_excel_prisme(theme: str, year: int) -> Path:
             ws.column_dimensions[chr(67 + i)].width = 20
         
         filepath = sub_dir / f"{config['excel_name']}.xlsx"
-        wb.save(filepath)
+        reproducible.save_workbook(wb, filepath)
         print(f"  [OK] {folder_name}/{config['excel_name']}.xlsx ({len(df_level)} lignes)")
     
     # 6. Fichier consolidé
@@ -593,17 +545,12 @@ def generate_excel_prisme(theme: str, year: int) -> Path:
                     cell.value = val
     
     cons_path = theme_dir / f"{config['excel_name']}_consolidated_{year}.xlsx"
-    wb_cons.save(cons_path)
+    reproducible.save_workbook(wb_cons, cons_path)
     print(f"  [OK] {config['excel_name']}_consolidated_{year}.xlsx")
     
     # 7. ZIP
     zip_name = f"{theme}_opendata_{year}"
-    zip_path = shutil.make_archive(
-        str(OUTPUT_DIR / zip_name),
-        'zip',
-        str(OUTPUT_DIR / config['folder']),
-        str(year)
-    )
+    zip_path = reproducible.make_archive(OUTPUT_DIR / zip_name, OUTPUT_DIR / config['folder'], str(year))
     print(f"\n  [ZIP] {zip_path}")
     
     # 8. Résumé
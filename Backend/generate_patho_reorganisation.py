@@ -16,9 +16,18 @@ Avec --single-file, les memes 5 feuilles sont ecrites dans UN seul classeur
 `mortalite_patho_<annee>.xlsx` (onglets com, dom, fra, fh, reg dans cet ordre),
 chaque onglet strictement identique a celui du fichier separe correspondant.
 
+Mode lot : plusieurs sources et plusieurs annees en un passage. Chaque source
+n'est lue qu'une fois ; une annee presente dans plusieurs sources est prise dans
+la DERNIERE citee (la plus recente en pratique). Les classeurs sont ecrits en
+parallele (PRISME_PATHO_WORKERS processus, defaut min(4, nb CPU)) ; en mode
+5 fichiers, chaque annee a son sous-dossier <outdir>/<annee>/ des qu'il y en a
+plus d'une.
+
 Usage :
-    python generate_patho_reorganisation.py <source.xls> <annee> [--outdir DIR]
-                                            [--no-fill] [--single-file]
+    python generate_patho_reorganisation.py <source.xls> [<source.xls> ...] <annee>
+                                            [--outdir DIR] [--no-fill] [--single-file]
+                                            [--workers N]
+    <annee> : 2018 | 2018-2023 | 2018,2020 | all
 
 Structure du fichier source (cf. README de synthese) :
   - 237 colonnes, mais SEULES les colonnes A-G portent des donnees. Les 230 autres
@@ -28,6 +37,9 @@ Structure du fichier source (cf. README de synthese) :
     France avec Mayotte), chacune precedee de 2 lignes d'en-tete.
   - sexe : "Sexe" = ensemble, "masculin" = H, "feminin" = F.
   - valeur -999 = secret statistique -> cellule vide dans les sorties.
+
+Les valeurs lues sont rangees dans un cube float64 [geo, sexe, annee, cause]
+(cf. Cube, NaN = secret statistique) ; chaque feuille est un decoupage de ce cube.
   - 3 causes ont perdu leur libelle en colonne F (la cellule vaut
     "Causes_de_deces_alphabetique" sans "#libelle") : BPCO, Chap 5 troubles mentaux
     et Insuffisance cardiaque. Elles sont retrouvees par POSITION : chaque triplet
@@ -37,15 +49,21 @@ Structure du fichier source (cf. README de synthese) :
 from __future__ import annotations
 
 import argparse
+import os
 import sys
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from decimal import Decimal, ROUND_DOWN
 from pathlib import Path
 
+import numpy as np
 import xlrd
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill
 
+import reproducible
+import sidecar
+
 # --------------------------------------------------------------------------
 # Causes : ordre d'apparition dans le fichier source (= ordre des blocs ligne 1)
 # --------------------------------------------------------------------------
@@ -77,11 +95,13 @@ INDICATEURS = [
     "insuff_cardiaque", "foie", "parkinson", "hypertensive", "avc", "sida",
 ]
 COLONNES_INDICATEURS = ["m_" + s for s in INDICATEURS]
+CAUSE_INDEX = {slug: i for i, slug in enumerate(INDICATEURS)}
 
 SECRET_STAT = -999.0
 
 # sexe cible -> sexe source
 SEXES = {"Ens": "Sexe", "H": "masculin", "F": "feminin"}
+SEXE_INDEX = {sexe: i for i, sexe in enumerate(SEXES)}
 
 # code region -> nom normalise (ASCII) tel que present dans le source
 REGIONS = [
@@ -111,6 +131,9 @@ GEO_FRANCE_ENTIERE = "france (y compris mayotte)"
 HEADER_FILL_RGB = "FFABBBDB"
 FREEZE_PANES = "D2"
 
+# Ecriture des classeurs en parallele (mode lot)
+PATHO_WORKERS = int(os.environ.get("PRISME_PATHO_WORKERS", "0") or 0) or min(4, os.cpu_count() or 1)
+
 
 def tronquer15(valeur: float) -> float:
     """Tronque a 15 chiffres significatifs, comme le stockage Excel des cibles."""
@@ -134,11 +157,36 @@ def normalise(libelle: str) -> str:
 # --------------------------------------------------------------------------
 # Lecture du source
 # --------------------------------------------------------------------------
+class Cube:
+    """Valeurs du source : tableau dense float64 data[geo, sexe, annee, cause].
+
+    geos / annees : libelle -> indice (ordre d'apparition dans le source) ;
+    sexes dans l'ordre de SEXES, causes dans celui des colonnes cibles
+    (INDICATEURS). NaN = secret statistique (-999) ou valeur absente.
+    """
+    __slots__ = ("data", "geos", "annees")
+
+    def __init__(self, data, geos, annees):
+        self.data = data
+        self.geos = geos
+        self.annees = annees
+
+    def lignes(self, geos, sexes, annee):
+        """Series des 17 indicateurs, sexe par sexe puis geo par geo.
+
+        Un seul decoupage du cube par feuille ; NaN -> None (cellule vide).
+        """
+        g = [self.geos[geo] for geo in geos]
+        s = [SEXE_INDEX[sexe] for sexe in sexes]
+        bloc = self.data[:, :, self.annees[annee], :][np.ix_(g, s)]
+        bloc = bloc.transpose(1, 0, 2).reshape(len(s) * len(g), len(INDICATEURS))
+        return [[None if v != v else v for v in ligne] for ligne in bloc.tolist()]
+
+
 def lire_source(chemin: Path):
-    """Retourne (valeurs, communes) ou
+    """Retourne (cube, communes) ou
 
-    valeurs  : dict[(geo_normalise, sexe_cible, annee, slug_cause)] -> float | None
-               (None = secret statistique -999)
+    cube     : Cube des valeurs (NaN = secret statistique -999)
     communes : liste ordonnee des (code_insee, geo_normalise)
     """
     classeur = xlrd.open_workbook(str(chemin))
@@ -146,7 +194,9 @@ def lire_source(chemin: Path):
 
     sexe_inverse = {v: k for k, v in SEXES.items()}
     compteur = Counter()
-    valeurs = {}
+    geos = {}
+    annees = {}
+    pos_geo, pos_sexe, pos_annee, pos_cause, nombres = [], [], [], [], []
     communes = []
     communes_vues = set()
     incoherences = []
@@ -185,11 +235,15 @@ def lire_source(chemin: Path):
         try:
             valeur = float(ligne[6])
         except (TypeError, ValueError):
-            valeur = None
+            valeur = np.nan
         if valeur == SECRET_STAT:
-            valeur = None
+            valeur = np.nan
 
-        valeurs[(geo, sexe, annee, slug)] = valeur
+        pos_geo.append(geos.setdefault(geo, len(geos)))
+        pos_sexe.append(SEXE_INDEX[sexe])
+        pos_annee.append(annees.setdefault(annee, len(annees)))
+        pos_cause.append(CAUSE_INDEX[slug])
+        nombres.append(valeur)
 
         code = geo_brut.split(" - ", 1)[0].strip()
         if code.isdigit() and len(code) == 5 and geo not in communes_vues:
@@ -211,7 +265,9 @@ def lire_source(chemin: Path):
             f"{len(CAUSES_SOURCE_ORDER)} causes, ex. {mauvais[0]}"
         )
 
-    return valeurs, communes
+    data = np.full((len(geos), len(SEXES), len(annees), len(INDICATEURS)), np.nan)
+    data[pos_geo, pos_sexe, pos_annee, pos_cause] = nombres
+    return Cube(data, geos, annees), communes
 
 
 # --------------------------------------------------------------------------
@@ -261,38 +317,35 @@ def ecrire_feuille(feuille, onglet, entetes, lignes, formats, avec_fill=True):
     return derniere - 1
 
 
-def serie(valeurs, geo, sexe, annee):
-    """Les 17 indicateurs, dans l'ordre des colonnes cibles."""
-    return [valeurs.get((geo, sexe, annee, slug)) for slug in INDICATEURS]
-
-
-def construire_feuilles(valeurs, communes, annee):
+def construire_feuilles(cube, communes, annee):
     """Definition des 5 feuilles, dans l'ordre du classeur unique.
 
     Retourne une liste de dicts : onglet, fichier (mode 5 fichiers), entetes,
     lignes, formats. C'est la seule source de verite pour les deux modes.
     """
+    sexes = ("Ens", "H", "F")
+    codes_com = [code for code, _ in communes]
+    codes_reg = [code for code, _ in REGIONS]
     return [
         {
             "onglet": "com",
             "fichier": "mortalite_com.xlsx",
             "entetes": ["com", "sexe", "annee"] + COLONNES_INDICATEURS,
             "formats": "brut",
-            "lignes": [
-                ((code, sexe, annee), serie(valeurs, geo, sexe, annee))
-                for sexe in ("Ens", "H", "F")
-                for code, geo in communes
-            ],
+            "lignes": list(zip(
+                [(code, sexe, annee) for sexe in sexes for code in codes_com],
+                cube.lignes([geo for _, geo in communes], sexes, annee),
+            )),
         },
         {
             "onglet": "dom",
             "fichier": "mortalite_drom.xlsx",
             "entetes": ["dom", "sexe", "annee"] + COLONNES_INDICATEURS,
             "formats": "texte",
-            "lignes": [
-                (("999", sexe, str(annee)), serie(valeurs, GEO_DROM, sexe, annee))
-                for sexe in ("Ens", "H", "F")
-            ],
+            "lignes": list(zip(
+                [("999", sexe, str(annee)) for sexe in sexes],
+                cube.lignes([GEO_DROM], sexes, annee),
+            )),
         },
         {
             # France entiere : colonnes fra / annee / sexe, ordre Ens, F, H
@@ -300,84 +353,158 @@ def construire_feuilles(valeurs, communes, annee):
             "fichier": "mortalite_fe.xlsx",
             "entetes": ["fra", "annee", "sexe"] + COLONNES_INDICATEURS,
             "formats": "arrondi",
-            "lignes": [
-                (("99", str(annee), sexe), serie(valeurs, GEO_FRANCE_ENTIERE, sexe, annee))
-                for sexe in ("Ens", "F", "H")
-            ],
+            "lignes": list(zip(
+                [("99", str(annee), sexe) for sexe in ("Ens", "F", "H")],
+                cube.lignes([GEO_FRANCE_ENTIERE], ("Ens", "F", "H"), annee),
+            )),
         },
         {
             "onglet": "fh",
             "fichier": "mortalite_fh.xlsx",
             "entetes": ["fh", "sexe", "annee"] + COLONNES_INDICATEURS,
             "formats": "arrondi",
-            "lignes": [
-                (("000", sexe, str(annee)), serie(valeurs, GEO_FRANCE_HEXA, sexe, annee))
-                for sexe in ("Ens", "H", "F")
-            ],
+            "lignes": list(zip(
+                [("000", sexe, str(annee)) for sexe in sexes],
+                cube.lignes([GEO_FRANCE_HEXA], sexes, annee),
+            )),
         },
         {
             "onglet": "reg",
             "fichier": "mortalite_Re.xlsx",
             "entetes": ["reg", "sexe", "annee"] + COLONNES_INDICATEURS,
             "formats": "arrondi",
-            "lignes": [
-                ((code, sexe, str(annee)), serie(valeurs, geo, sexe, annee))
-                for sexe in ("Ens", "H", "F")
-                for code, geo in REGIONS
-            ],
+            "lignes": list(zip(
+                [(code, sexe, str(annee)) for sexe in sexes for code in codes_reg],
+                cube.lignes([geo for _, geo in REGIONS], sexes, annee),
+            )),
         },
     ]
 
 
-def generer(source: Path, annee: int, outdir: Path, avec_fill=True, single_file=False):
-    valeurs, communes = lire_source(source)
+def _enregistrer(classeur, chemin, sorties):
+    """xlsx et/ou sidecars parquet/csv (valeurs telles qu'ecrites dans les feuilles)."""
+    if "xlsx" in sorties:
+        reproducible.save_workbook(classeur, chemin)
+    if sidecar.wants_sidecar(sorties):
+        sidecar.write_workbook_tables(chemin, classeur, sorties)
 
-    annees = sorted({cle[2] for cle in valeurs})
-    if annee not in annees:
-        raise SystemExit(
-            f"annee {annee} absente du fichier source (disponibles : "
-            f"{', '.join(str(a) for a in annees)})"
-        )
 
-    geos = {cle[0] for cle in valeurs}
+def _ecrire_classeur(tache):
+    """Ecrit un classeur (une ou plusieurs feuilles) -> (chemin, nb lignes).
+
+    tache : (specs, chemin, avec_fill, sorties) ; execute dans un processus du
+    pool en mode lot, d'ou un seul argument picklable.
+    """
+    specs, chemin, avec_fill, sorties = tache
+    classeur = Workbook()
+    total = 0
+    for i, spec in enumerate(specs):
+        feuille = classeur.active if i == 0 else classeur.create_sheet()
+        total += ecrire_feuille(feuille, spec["onglet"], spec["entetes"],
+                                spec["lignes"], spec["formats"], avec_fill)
+    _enregistrer(classeur, chemin, sorties)
+    return chemin, total
+
+
+def _verifier_geos(cube, source):
+    geos = cube.geos
     for attendu in (GEO_DROM, GEO_FRANCE_HEXA, GEO_FRANCE_ENTIERE):
         if attendu not in geos:
-            raise SystemExit(f"niveau geographique absent du source : {attendu!r}")
+            raise SystemExit(f"niveau geographique absent du source {source.name} : {attendu!r}")
     for code, nom in REGIONS:
         if nom not in geos:
-            raise SystemExit(f"region absente du source : {code} / {nom!r}")
+            raise SystemExit(f"region absente du source {source.name} : {code} / {nom!r}")
+
 
+def charger_sources(sources):
+    """Lit chaque source une seule fois -> {annee: (cube, communes)}.
+
+    Une annee presente dans plusieurs sources est prise dans la derniere.
+    """
+    par_annee = {}
+    for source in sources:
+        cube, communes = lire_source(source)
+        _verifier_geos(cube, source)
+        for annee in sorted(cube.annees):
+            par_annee[annee] = (cube, communes)
+    return par_annee
+
+
+def _executer(taches, workers):
+    workers = min(workers or PATHO_WORKERS, len(taches))
+    if workers <= 1:
+        return [_ecrire_classeur(t) for t in taches]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_ecrire_classeur, taches))
+
+
+def generer_lot(sources, annees=None, outdir: Path = Path("."), avec_fill=True,
+                single_file=False, sorties=None, workers=None):
+    """Genere les classeurs de plusieurs annees a partir d'une ou plusieurs sources.
+
+    annees : liste d'annees, None = toutes celles des sources.
+    Retourne [(chemin, nb lignes)] dans l'ordre annee puis feuille.
+    """
+    sorties = sidecar.resolve_formats(sorties)
+    par_annee = charger_sources([Path(s) for s in sources])
+
+    disponibles = sorted(par_annee)
+    if annees is None:
+        annees = disponibles
+    absentes = [a for a in annees if a not in par_annee]
+    if absentes:
+        origine = "du fichier source" if len(sources) == 1 else "des fichiers sources"
+        raise SystemExit(
+            f"annee {', '.join(str(a) for a in absentes)} absente {origine} (disponibles : "
+            f"{', '.join(str(a) for a in disponibles)})"
+        )
+
+    sous_dossiers = not single_file and len(annees) > 1
     outdir.mkdir(parents=True, exist_ok=True)
-    feuilles = construire_feuilles(valeurs, communes, annee)
-
-    if single_file:
-        classeur = Workbook()
-        total = 0
-        for i, spec in enumerate(feuilles):
-            feuille = classeur.active if i == 0 else classeur.create_sheet()
-            total += ecrire_feuille(feuille, spec["onglet"], spec["entetes"],
-                                    spec["lignes"], spec["formats"], avec_fill)
-        chemin = outdir / f"mortalite_patho_{annee}.xlsx"
-        classeur.save(str(chemin))
-        return [(chemin, total)]
-
-    produits = []
-    for spec in feuilles:
-        classeur = Workbook()
-        n = ecrire_feuille(classeur.active, spec["onglet"], spec["entetes"],
-                           spec["lignes"], spec["formats"], avec_fill)
-        chemin = outdir / spec["fichier"]
-        classeur.save(str(chemin))
-        produits.append((chemin, n))
-    return produits
+    taches = []
+    for annee in annees:
+        cube, communes = par_annee[annee]
+        feuilles = construire_feuilles(cube, communes, annee)
+        if single_file:
+            taches.append((feuilles, outdir / f"mortalite_patho_{annee}.xlsx", avec_fill, sorties))
+            continue
+        dossier = outdir / str(annee) if sous_dossiers else outdir
+        dossier.mkdir(exist_ok=True)
+        taches.extend(([spec], dossier / spec["fichier"], avec_fill, sorties) for spec in feuilles)
+
+    return _executer(taches, workers)
+
+
+def generer(source: Path, annee: int, outdir: Path, avec_fill=True, single_file=False,
+            sorties=None, workers=None):
+    """Une source, une annee (appel historique, cf. file_server.js)."""
+    return generer_lot([source], [annee], outdir, avec_fill=avec_fill,
+                       single_file=single_file, sorties=sorties, workers=workers)
+
+
+def _annees(valeur):
+    """Argument annee : 2018 | 2018-2023 | 2018,2020 | all -> liste (None = toutes)."""
+    if valeur.strip().lower() in ("all", "toutes"):
+        return None
+    annees = []
+    try:
+        for morceau in valeur.split(","):
+            debut, _, fin = morceau.strip().partition("-")
+            annees.extend(range(int(debut), int(fin or debut) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"annee(s) invalide(s) : {valeur!r}")
+    if not annees:
+        raise argparse.ArgumentTypeError(f"plage d'annees vide : {valeur!r}")
+    return sorted(set(annees))
 
 
 def main(argv=None):
     parseur = argparse.ArgumentParser(
         description="Genere les 5 classeurs pathologies PRISME a partir de l'export MOCA-O."
     )
-    parseur.add_argument("source", type=Path, help="fichier .xls MOCA-O")
-    parseur.add_argument("annee", type=int, help="annee a extraire (ex. 2018)")
+    parseur.add_argument("sources", type=Path, nargs="+", help="fichier(s) .xls MOCA-O")
+    parseur.add_argument("annee", type=_annees,
+                         help="annee(s) a extraire : 2018, 2018-2023, 2018,2020 ou all")
     parseur.add_argument("--outdir", type=Path, default=Path("."),
                          help="repertoire de sortie (defaut : repertoire courant)")
     parseur.add_argument("--no-fill", action="store_true",
@@ -387,13 +514,20 @@ def main(argv=None):
                          help="produire un unique classeur mortalite_patho_<annee>.xlsx "
                               "a 5 onglets (com, dom, fra, fh, reg) au lieu des "
                               "5 fichiers separes")
+    parseur.add_argument("--formats", default=None,
+                         help="xlsx,parquet,csv : sidecars ecrits a cote des classeurs "
+                              "(defaut : PRISME_OUTPUT_FORMATS ou xlsx)")
+    parseur.add_argument("--workers", type=int, default=None,
+                         help=f"processus d'ecriture (defaut : PRISME_PATHO_WORKERS ou {PATHO_WORKERS})")
     args = parseur.parse_args(argv)
 
-    if not args.source.is_file():
-        raise SystemExit(f"fichier source introuvable : {args.source}")
+    for source in args.sources:
+        if not source.is_file():
+            raise SystemExit(f"fichier source introuvable : {source}")
 
-    produits = generer(args.source, args.annee, args.outdir,
-                       avec_fill=not args.no_fill, single_file=args.single_file)
+    produits = generer_lot(args.sources, args.annee, args.outdir,
+                           avec_fill=not args.no_fill, single_file=args.single_file,
+                           sorties=args.formats, workers=args.workers)
     for chemin, nb in produits:
         print(f"OK  {chemin}  ({nb} lignes)")
     return 0
@@ -2,17 +2,32 @@
 """
 PRISME Engine - Génération de rapports Excel pour ORSG
 Intégration PocketBase + logique prisme_engine_simple.py
+
+Mode watchdog : les inputs 'pending' sont reçus par l'API realtime (SSE) de
+PocketBase, avec un polling de secours, et traités par un pool de workers
+borné (PRISME_WATCH_WORKERS). POCKETBASE_URL permet de viser une instance de
+test ; test_watchdog.py l'exerce contre une PocketBase locale simulée.
 """
 
+import hashlib
+import io
+import json
 import time
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 from openpyxl import Workbook
 from openpyxl.styles import Font
 from pathlib import Path
 import warnings
 import os
+import uuid
+
+import reproducible
 
 warnings.filterwarnings('ignore')
 
@@ -20,7 +35,7 @@ warnings.filterwarnings('ignore')
 # CONFIGURATION
 # ============================================================================
 
-POCKETBASE_URL = "http://127.0.0.1:8090"
+POCKETBASE_URL = os.getenv("POCKETBASE_URL", "http://127.0.0.1:8090")
 ADMIN_EMAIL = os.getenv("POCKETBASE_ADMIN_EMAIL", "admin@example.com")
 ADMIN_PASSWORD = os.getenv("POCKETBASE_ADMIN_PASSWORD", "ChangeMe123!")
 
@@ -32,6 +47,26 @@ OUTPUT_DIR = BASE_DIR / "output"
 TEMP_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+# Watchdog
+WATCH_WORKERS = int(os.getenv("PRISME_WATCH_WORKERS", "4"))
+POLL_INTERVAL = float(os.getenv("PRISME_WATCH_POLL", "5"))           # sans realtime
+POLL_INTERVAL_REALTIME = float(os.getenv("PRISME_WATCH_POLL_SSE", "60"))  # filet de securite
+REALTIME = os.getenv("PRISME_WATCH_REALTIME", "1").lower() not in ("0", "false", "no", "off")
+REALTIME_READ_TIMEOUT = 360   # PocketBase coupe un client inactif apres 5 min
+REALTIME_MAX_BACKOFF = 30
+
+# HTTP : timeouts (connexion, lecture), retries avec backoff exponentiel
+HTTP_TIMEOUT = (5, 120)
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+DOWNLOAD_CHUNK = 1024 * 1024
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Upload des rapports : corps multipart en flux, rejoue idempotent
+UPLOAD_RETRIES = 4
+UPLOAD_PROGRESS_STEP = 10     # % entre deux mises a jour du statut de l'input
+UPLOAD_PROGRESS_MIN_GAP = 1.0  # s
+
 
 # ============================================================================
 # REGION & COMMUNE CONSTANTS
@@ -199,8 +234,13 @@ def find_csv_file(pattern, search_dir=None):
 
 import shutil
 
-def generate_prisme_excel(dataset_name, year, csv_dir=None):
-    """Génère une archive ZIP contenant la structure de fichiers PRISME (Structure SharePoint)."""
+def generate_prisme_excel(dataset_name, year, csv_dir=None, output_dir=None):
+    """Génère une archive ZIP contenant la structure de fichiers PRISME (Structure SharePoint).
+
+    output_dir (défaut OUTPUT_DIR) : dossier propre à un job du watchdog, pour
+    que deux générations de la même année ne se marchent pas dessus.
+    """
+    output_dir = Path(output_dir) if output_dir else OUTPUT_DIR
     
     if dataset_name not in DATASET_CONFIGS:
         print(f"Dataset inconnu: {dataset_name}")
@@ -286,10 +326,10 @@ def generate_prisme_excel(dataset_name, year, csv_dir=None):
     }
 
     # Création du dossier racine temporaire pour l'année
-    root_year_dir = OUTPUT_DIR / f"{year}"
+    root_year_dir = output_dir / f"{year}"
     if root_year_dir.exists():
         shutil.rmtree(root_year_dir)
-    root_year_dir.mkdir()
+    root_year_dir.mkdir(parents=True)
 
     # Génération des fichiers par niveau géographique
     # Configuration des feuilles (clé_data, nom_colonne_id)
@@ -337,7 +377,7 @@ def generate_prisme_excel(dataset_name, year, csv_dir=None):
 
         # Sauvegarder avec le nom générique (ex: educ.xlsx)
         filename = f"{dataset_name}.xlsx"
-        wb.save(sub_dir / filename)
+        reproducible.save_workbook(wb, sub_dir / filename)
 
     # --- GÉNÉRATION FICHIER CONSOLIDÉ (TYPE A) ---
     print(f"  [INFO] Génération fichier consolidé (Type A)...")
@@ -374,16 +414,16 @@ def generate_prisme_excel(dataset_name, year, csv_dir=None):
             
         # Sauvegarder le fichier consolidé à la racine de l'année
         cons_filename = f"{dataset_name}_consolidated.xlsx"
-        wb_cons.save(root_year_dir / cons_filename)
+        reproducible.save_workbook(wb_cons, root_year_dir / cons_filename)
         print(f"  [OK] Fichier consolidé créé: {cons_filename}")
         
     except Exception as e:
         print(f"  [ERROR] Erreur création consolidé: {e}")
         
     # Créer le ZIP final
-    zip_base_name = OUTPUT_DIR / f"{dataset_name}_{year}"
+    zip_base_name = output_dir / f"{dataset_name}_{year}"
 
-    zip_path = shutil.make_archive(str(zip_base_name), 'zip', str(OUTPUT_DIR), str(year)) # Zip uniquement le dossier de l'année
+    zip_path = reproducible.make_archive(zip_base_name, output_dir, str(year)) # Zip uniquement le dossier de l'année
     
     # Nettoyage du dossier temporaire
     # shutil.rmtree(root_year_dir) # MODIFICATION: On garde les fichiers pour permettre le téléchargement sélectif
@@ -396,16 +436,123 @@ def generate_prisme_excel(dataset_name, year, csv_dir=None):
 # POCKETBASE CLIENT
 # ============================================================================
 
+def _http_session(pool_size=WATCH_WORKERS):
+    """Session HTTP partagee : connexions reutilisees, retries avec backoff.
+
+    Les erreurs de connexion sont rejouees pour toutes les methodes ; les
+    reponses 429/5xx seulement pour GET/PATCH (un POST rejoue creerait un
+    doublon de rapport).
+    """
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "PATCH"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=2, pool_maxsize=pool_size + 2)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _sse_events(chunks):
+    """Decoupe un flux text/event-stream en evenements (event, data)."""
+    event, data, buf = "message", [], b""
+    for chunk in chunks:
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+        for raw in lines:
+            line = raw.rstrip(b"\r").decode("utf-8", errors="replace")
+            if not line:
+                if data:
+                    yield event, "\n".join(data)
+                event, data = "message", []
+            elif not line.startswith(":"):
+                field, _, value = line.partition(":")
+                value = value[1:] if value.startswith(" ") else value
+                if field == "event":
+                    event = value
+                elif field == "data":
+                    data.append(value)
+
+
+class MultipartStream:
+    """Corps multipart/form-data lu a la demande : memoire constante quelle que
+    soit la taille du fichier, Content-Length connu (pas de chunked).
+
+    progress(envoye, total) est appele a chaque lecture de requests.
+    """
+
+    def __init__(self, fields, file_field, file_path, progress=None,
+                 content_type="application/octet-stream"):
+        file_path = Path(file_path)
+        self.boundary = uuid.uuid4().hex
+        head = b"".join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+            for name, value in fields.items()
+        )
+        head += (
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+            f'filename="{file_path.name}"\r\nContent-Type: {content_type}\r\n\r\n'
+        ).encode()
+        tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self.len = len(head) + file_path.stat().st_size + len(tail)
+        self.sent = 0
+        self.progress = progress
+        self._parts = [io.BytesIO(head), open(file_path, "rb"), io.BytesIO(tail)]
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self.len
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len
+        out = []
+        while size > 0 and self._parts:
+            data = self._parts[0].read(size)
+            if not data:
+                self._parts.pop(0).close()
+                continue
+            out.append(data)
+            size -= len(data)
+        chunk = b"".join(out)
+        self.sent += len(chunk)
+        if self.progress and chunk:
+            self.progress(self.sent, self.len)
+        return chunk
+
+    def close(self):
+        for part in self._parts:
+            part.close()
+        self._parts = []
+
+
+def _report_id(upload_key):
+    """Id PocketBase (15 caracteres [a-z0-9]) derive de la cle d'upload : un
+    POST rejoue bute sur l'id existant au lieu de creer un doublon."""
+    return hashlib.sha1(str(upload_key).encode("utf-8")).hexdigest()[:15]
+
+
 class PocketBaseClient:
-    def __init__(self, url):
-        self.url = url
+    def __init__(self, url, session=None):
+        self.url = url.rstrip("/")
         self.token = None
+        self.session = session or _http_session()
+
+    def _headers(self):
+        return {"Authorization": self.token} if self.token else {}
 
     def auth(self, email, password):
         try:
-            resp = requests.post(f"{self.url}/api/admins/auth-with-password", json={
+            resp = self.session.post(f"{self.url}/api/admins/auth-with-password", json={
                 "identity": email, "password": password
-            })
+            }, timeout=HTTP_TIMEOUT)
             if resp.status_code == 200:
                 self.token = resp.json()["token"]
                 print("[OK] Authentifie via PocketBase Admin")
@@ -415,47 +562,313 @@ class PocketBaseClient:
         return False
 
     def get_pending_inputs(self):
-        headers = {"Authorization": self.token}
-        resp = requests.get(
+        resp = self.session.get(
             f"{self.url}/api/collections/inputs/records",
-            headers=headers,
-            params={"filter": "status='pending'"}
+            headers=self._headers(),
+            params={"filter": "status='pending'", "sort": "created", "perPage": 200},
+            timeout=HTTP_TIMEOUT,
         )
         if resp.status_code == 200:
             return resp.json().get("items", [])
         return []
 
-    def download_file(self, collection, record_id, filename):
+    def download_file(self, collection, record_id, filename, dest_dir=None):
+        """Telecharge un fichier en flux vers le disque (.part puis renommage)."""
         file_url = f"{self.url}/api/files/{collection}/{record_id}/{filename}"
-        r = requests.get(file_url, headers={"Authorization": self.token})
-        local_path = TEMP_DIR / filename
-        with open(local_path, 'wb') as f:
-            f.write(r.content)
+        local_path = Path(dest_dir or TEMP_DIR) / filename
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = local_path.with_name(local_path.name + ".part")
+        with self.session.get(file_url, headers=self._headers(), stream=True, timeout=HTTP_TIMEOUT) as r:
+            r.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                    f.write(chunk)
+        os.replace(tmp_path, local_path)
         return local_path
 
     def update_input_status(self, record_id, status, logs=""):
-        requests.patch(
+        resp = self.session.patch(
             f"{self.url}/api/collections/inputs/records/{record_id}",
-            headers={"Authorization": self.token, "Content-Type": "application/json"},
-            json={"status": status, "logs": logs}
+            headers=self._headers(),
+            json={"status": status, "logs": logs},
+            timeout=HTTP_TIMEOUT,
         )
-
-    def create_report(self, year, file_path):
+        return resp.status_code == 200
+
+    def get_input_status(self, record_id):
+        """Statut courant d'un input (None si introuvable)."""
+        resp = self.session.get(f"{self.url}/api/collections/inputs/records/{record_id}",
+                                headers=self._headers(), timeout=HTTP_TIMEOUT)
+        if resp.status_code != 200:
+            return None
+        return resp.json().get("status")
+
+    def report_exists(self, report_id):
+        resp = self.session.get(f"{self.url}/api/collections/reports/records/{report_id}",
+                                headers=self._headers(), timeout=HTTP_TIMEOUT)
+        return resp.status_code == 200
+
+    def create_report(self, year, file_path, upload_key=None, progress=None):
+        """Uploade un rapport en flux, avec rejeu idempotent.
+
+        upload_key (defaut : nom, taille et date du fichier) fixe l'id du
+        record : apres une coupure, un rapport deja cree n'est pas reposte.
+        progress(envoye, total) suit l'envoi (cf. MultipartStream).
+        """
+        file_path = Path(file_path)
         url = f"{self.url}/api/collections/reports/records"
+        if upload_key is None:
+            st = file_path.stat()
+            upload_key = f"{file_path.name}:{st.st_size}:{st.st_mtime_ns}"
+        report_id = _report_id(upload_key)
+        fields = {"id": report_id, "year": year, "status": "completed"}
         
-        with open(file_path, 'rb') as f:
-            files = {'file': f}
-            data = {
-                "year": year,
-                "status": "completed"
-            }
-            resp = requests.post(url, headers={"Authorization": self.token}, data=data, files=files)
+        error = None
+        for attempt in range(UPLOAD_RETRIES + 1):
+            if attempt:
+                time.sleep(HTTP_BACKOFF * 2 ** attempt)
+                try:
+                    if self.report_exists(report_id):
+                        print(f"[OK] Report deja uploade: {file_path.name}")
+                        return True
+                except requests.RequestException:
+                    pass
+            body = MultipartStream(fields, "file", file_path, progress=progress)
+            try:
+                resp = self.session.post(url, data=body, timeout=HTTP_TIMEOUT,
+                                         headers={**self._headers(), "Content-Type": body.content_type})
+            except requests.RequestException as e:
+                error = str(e)
+                print(f"[WARN] Upload {file_path.name} interrompu ({e}), tentative {attempt + 1}/{UPLOAD_RETRIES + 1}")
+                continue
+            finally:
+                body.close()
             if resp.status_code == 200:
                 print(f"[OK] Report uploade: {file_path.name}")
                 return True
-            else:
-                print(f"[ERROR] Upload failed: {resp.text}")
+            error = resp.text
+            # 400 : id deja pris (tentative precedente ou autre traitement du meme input) ?
+            if resp.status_code == 400 and self.report_exists(report_id):
+                print(f"[OK] Report deja uploade: {file_path.name}")
+                return True
+            if resp.status_code not in RETRY_STATUSES:
+                break
+        print(f"[ERROR] Upload failed: {error}")
+        return False
+
+    def listen(self, collection, on_event, on_connect=None):
+        """Abonnement realtime (SSE) a une collection.
+
+        on_event(action, record) a chaque create/update/delete ; on_connect()
+        une fois l'abonnement actif. Bloque jusqu'a la fin du flux (exception
+        requests sur coupure ou timeout de lecture).
+        """
+        with self.session.get(f"{self.url}/api/realtime", stream=True,
+                              headers={"Accept": "text/event-stream"},
+                              timeout=(HTTP_TIMEOUT[0], REALTIME_READ_TIMEOUT)) as resp:
+            resp.raise_for_status()
+            # chunk_size=None : les evenements sont rendus des leur arrivee
+            for event, data in _sse_events(resp.iter_content(chunk_size=None)):
+                if event == "PB_CONNECT":
+                    client_id = json.loads(data)["clientId"]
+                    sub = self.session.post(
+                        f"{self.url}/api/realtime",
+                        headers=self._headers(),
+                        json={"clientId": client_id, "subscriptions": [collection]},
+                        timeout=HTTP_TIMEOUT,
+                    )
+                    sub.raise_for_status()
+                    if on_connect:
+                        on_connect()
+                elif event == collection:
+                    msg = json.loads(data)
+                    on_event(msg.get("action"), msg.get("record") or {})
+
+
+# ============================================================================
+# TRAITEMENT D'UN INPUT
+# ============================================================================
+
+_publish_lock = threading.Lock()
+
+
+def _publish_output(job_dir, zip_path, year):
+    """Remplace OUTPUT_DIR/<annee> et le ZIP par ceux d'un job (telechargement selectif)."""
+    with _publish_lock:
+        year_dir = OUTPUT_DIR / str(year)
+        if year_dir.exists():
+            shutil.rmtree(year_dir)
+        shutil.move(str(job_dir / str(year)), str(year_dir))
+        os.replace(zip_path, OUTPUT_DIR / zip_path.name)
+
+
+def _upload_progress(pb, record_id):
+    """Callback de progression de l'upload -> logs de l'input (par pas de UPLOAD_PROGRESS_STEP %)."""
+    state = {"pct": None, "at": 0.0}
+
+    def report(sent, total):
+        pct = sent * 100 // total if total else 100
+        now = time.monotonic()
+        last = state["pct"]
+        if last is not None and (abs(pct - last) < UPLOAD_PROGRESS_STEP or now - state["at"] < UPLOAD_PROGRESS_MIN_GAP):
+            return
+        state.update(pct=pct, at=now)
+        try:
+            pb.update_input_status(record_id, "processing", f"Upload {pct}% ({sent / 1e6:.1f}/{total / 1e6:.1f} Mo)")
+        except requests.RequestException:
+            pass
+
+    return report
+
+
+def process_input(pb, item):
+    """Genere et uploade le rapport d'un input (appele depuis le pool de workers)."""
+    record_id = item['id']
+    print(f"[>] Traitement {record_id}...")
+    
+    # Input deja pris en charge (evenement realtime et polling, autre watchdog) ?
+    # PocketBase n'offre pas de compare-and-set : ce controle reduit les doublons
+    # sans les exclure, l'unicite du rapport tient a la cle d'upload ci-dessous.
+    status = pb.get_input_status(record_id)
+    if status != "pending":
+        print(f"[INFO] {record_id} : statut '{status}', deja traite ou en cours, input ignore")
+        return False
+    if not pb.update_input_status(record_id, "processing"):
+        print(f"[WARN] {record_id} : passage en 'processing' refuse, input ignore")
+        return False
+    
+    # Dossier propre a ce traitement : deux traitements du meme input ne
+    # s'ecrasent pas (ni ne suppriment) leurs fichiers
+    job_dir = TEMP_DIR / "jobs" / f"{record_id}_{uuid.uuid4().hex[:8]}"
+    try:
+        # Déterminer l'année et le thème
+        year = int(item.get('year', 2022))
+        theme = item.get('theme', 'educ')
+        
+        # Générer le fichier Excel avec les CSV sources locaux
+        output_path = generate_prisme_excel(theme, year, CSV_SOURCES_DIR, output_dir=job_dir)
+        
+        if output_path and output_path.exists():
+            # Cle d'upload propre a la version de l'input (et non a cette generation) :
+            # deux traitements concurrents du meme input visent le meme record
+            # report, le second constate qu'il existe au lieu d'en creer un autre.
+            # Un input remis en 'pending' change de version -> nouveau rapport.
+            upload_key = f"input:{record_id}:{item.get('updated', '')}"
+            uploaded = pb.create_report(year, output_path, upload_key=upload_key,
+                                        progress=_upload_progress(pb, record_id))
+            _publish_output(job_dir, output_path, year)
+            if uploaded:
+                pb.update_input_status(record_id, "processed", f"Généré: {output_path.name}")
+                return True
+            pb.update_input_status(record_id, "error", f"Upload échoué: {output_path.name}")
+            return False
+        pb.update_input_status(record_id, "error", "Génération échouée")
+    except Exception as e:
+        print(f"[ERROR] Erreur: {e}")
+        pb.update_input_status(record_id, "error", str(e))
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+    return False
+
+
+# ============================================================================
+# WATCHDOG
+# ============================================================================
+
+class Watchdog:
+    """Inputs 'pending' -> pool de workers borne.
+
+    Les evenements realtime declenchent le traitement immediatement ; le
+    polling rattrape ce que le flux a manque (reconnexion, PocketBase sans
+    realtime) : toutes les POLL_INTERVAL s sans realtime, POLL_INTERVAL_REALTIME
+    s avec, et a chaque (re)connexion du flux.
+    """
+
+    def __init__(self, pb, workers=WATCH_WORKERS, poll_interval=POLL_INTERVAL,
+                 realtime=REALTIME, collection="inputs"):
+        self.pb = pb
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.realtime = realtime
+        self.connected = threading.Event()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._inflight = set()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="prisme-watch")
+
+    def submit(self, record):
+        """Confie un input 'pending' au pool (ignore s'il y est deja)."""
+        if record.get("status") != "pending" or self._stop.is_set():
+            return False
+        record_id = record["id"]
+        with self._lock:
+            if record_id in self._inflight:
                 return False
+            self._inflight.add(record_id)
+        self._pool.submit(self._process, record)
+        return True
+
+    def _process(self, record):
+        # Le futur du pool n'est pas conserve : une exception non rattrapee ici
+        # (ex. get_input_status sur une coupure reseau) serait perdue sans trace
+        try:
+            process_input(self.pb, record)
+        except Exception as e:
+            print(f"[ERROR] {record['id']} : {e}")
+            try:
+                self.pb.update_input_status(record["id"], "error", str(e))
+            except requests.RequestException as e2:
+                print(f"[WARN] {record['id']} : statut 'error' non ecrit ({e2})")
+        finally:
+            with self._lock:
+                self._inflight.discard(record["id"])
+
+    def poll(self):
+        inputs = self.pb.get_pending_inputs()
+        submitted = sum(self.submit(item) for item in inputs)
+        if submitted:
+            print(f"\n[INPUT] {submitted} input(s) en attente")
+        return submitted
+
+    def _on_event(self, action, record):
+        if action in ("create", "update") and self.submit(record):
+            print(f"\n[INPUT] {record['id']} (realtime)")
+
+    def _on_connect(self):
+        print("[WATCH] Realtime actif")
+        self.connected.set()
+        self._wake.set()
+
+    def _listen(self):
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                self.pb.listen(self.collection, self._on_event, self._on_connect)
+                backoff = 1
+            except (requests.RequestException, ValueError, KeyError) as e:
+                if self.connected.is_set() or backoff == 1:
+                    print(f"[WARN] Realtime indisponible ({e}), polling toutes les {self.poll_interval:g}s")
+                backoff = min(backoff * 2, REALTIME_MAX_BACKOFF)
+            self.connected.clear()
+            self._stop.wait(backoff)
+
+    def run(self):
+        if self.realtime:
+            threading.Thread(target=self._listen, name="prisme-realtime", daemon=True).start()
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Erreur boucle: {e}")
+            self._wake.wait(POLL_INTERVAL_REALTIME if self.connected.is_set() else self.poll_interval)
+
+    def stop(self, wait=True):
+        """Arrete le polling ; attend (wait) les traitements en cours."""
+        self._stop.set()
+        self._wake.set()
+        self._pool.shutdown(wait=wait)
 
 
 # ============================================================================
@@ -473,45 +886,14 @@ def main():
         print("[ERROR] Impossible de s'authentifier. Arret.")
         return
 
-    print("[WATCH] En attente de nouveaux inputs...")
+    print(f"[WATCH] En attente de nouveaux inputs ({WATCH_WORKERS} worker(s))...")
     
-    while True:
-        try:
-            inputs = pb.get_pending_inputs()
-            
-            if inputs:
-                print(f"\n[INPUT] {len(inputs)} input(s) en attente")
-                
-                for item in inputs:
-                    print(f"[>] Traitement {item['id']}...")
-                    
-                    try:
-                        # Déterminer l'année et le thème
-                        year = int(item.get('year', 2022))
-                        theme = item.get('theme', 'educ')
-                        
-                        # Générer le fichier Excel avec les CSV sources locaux
-                        output_path = generate_prisme_excel(theme, year, CSV_SOURCES_DIR)
-                        
-                        if output_path and output_path.exists():
-                            # Uploader le rapport
-                            pb.create_report(year, output_path)
-                            pb.update_input_status(item['id'], "processed", f"Généré: {output_path.name}")
-                        else:
-                            pb.update_input_status(item['id'], "error", "Génération échouée")
-                            
-                    except Exception as e:
-                        print(f"[ERROR] Erreur: {e}")
-                        pb.update_input_status(item['id'], "error", str(e))
-            
-            time.sleep(5)
-            
-        except KeyboardInterrupt:
-            print("\n[STOP] Arret demande.")
-            break
-        except Exception as e:
-            print(f"Erreur boucle: {e}")
-            time.sleep(5)
+    watchdog = Watchdog(pb)
+    try:
+        watchdog.run()
+    except KeyboardInterrupt:
+        print("\n[STOP] Arret demande.")
+        watchdog.stop()
 
 
 # ============================================================================
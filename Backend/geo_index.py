@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+PRISME - Index geographique transverse (codgeo, annee).
+
+Une ligne par valeur publiee : source, dataset, niveau, codgeo, annee,
+dimension, variable, valeur. L'index est construit depuis les tables par
+niveau des moteurs, sans passer par les classeurs :
+    - MOCA-O    : build_prisme_tables, pour chaque dataset de themes_config.json
+                  (CSV parses une seule fois par dataset, toutes annees)
+    - Open Data : build_theme_levels + theme_tables, pour chaque theme
+Il repond a "tous les indicateurs de la commune 97307, toutes annees" en une
+lecture (GET /api/geo/{codgeo} dans app.py).
+
+Stockage (PRISME_STATE_DIR, defaut Backend/state) :
+    geo_index_<horodatage>.index.parquet   table en colonnes (csv si pyarrow absent)
+    geo_index.json                          table courante, empreinte des sources, erreurs
+
+Usage :
+    python geo_index.py            # reconstruit l'index
+    python geo_index.py 97307      # profil d'un territoire
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import sidecar
+
+BASE_DIR = Path(__file__).parent
+STATE_DIR = Path(os.environ.get("PRISME_STATE_DIR", BASE_DIR / "state"))
+META_FILE = STATE_DIR / "geo_index.json"
+CONFIG_FILE = BASE_DIR / "themes_config.json"
+
+COLUMNS = ["source", "dataset", "niveau", "codgeo", "annee", "dimension", "variable", "valeur"]
+GEO_LEVELS = ("com", "reg", "dom", "fh", "fra")
+
+# Duree de validite de l'empreinte des sources (s)
+SIGNATURE_TTL = float(os.environ.get("PRISME_SIGNATURE_TTL", "5"))
+
+_loaded = {"table": None, "by_geo": None}
+_load_lock = threading.Lock()
+_signatures = {}   # source -> (echeance monotonic, (mtime max, nb fichiers))
+_signature_lock = threading.Lock()
+
+
+# ============================================================================
+# EMPREINTE DES SOURCES
+# ============================================================================
+
+def _scan_signature(source):
+    roots = [CONFIG_FILE, BASE_DIR / "csv_sources"] if source == "moca" \
+        else [BASE_DIR / "inputs" / "opendata"]
+    latest, count = 0.0, 0
+    for root in roots:
+        if root.is_file():
+            latest = max(latest, root.stat().st_mtime)
+            continue
+        for dirpath, _, filenames in os.walk(root):
+            latest = max(latest, os.stat(dirpath).st_mtime)
+            for name in filenames:
+                try:
+                    latest = max(latest, os.stat(os.path.join(dirpath, name)).st_mtime)
+                    count += 1
+                except OSError:
+                    pass
+    return latest, count
+
+
+def sources_signature(source, refresh=False):
+    """(mtime max, nb fichiers) des sources d'un mode : change apres tout import.
+
+    Les imports passent par file_server.js (autre process) : pas de
+    notification ici, le parcours des dossiers est memorise SIGNATURE_TTL
+    secondes au lieu d'etre refait a chaque requete /api/data ou /api/geo.
+    """
+    now = time.monotonic()
+    if not refresh:
+        with _signature_lock:
+            hit = _signatures.get(source)
+        if hit and now < hit[0]:
+            return hit[1]
+    signature = _scan_signature(source)
+    with _signature_lock:
+        _signatures[source] = (now + SIGNATURE_TTL, signature)
+    return signature
+
+
+def index_signature(refresh=False):
+    return {source: list(sources_signature(source, refresh)) for source in ("moca", "opendata")}
+
+
+def normalize_codgeo(value):
+    """97301 / '97301', 1 / '01', 0 / '0' -> meme cle texte."""
+    text = str(value).strip()
+    if text.isdigit():
+        return str(int(text))
+    return text
+
+
+def _plain(value):
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+# ============================================================================
+# CONSTRUCTION
+# ============================================================================
+
+def _table_records(source, dataset, level, headers, rows, dimension_ids=(), errors=None):
+    """Lignes d'une table par niveau -> enregistrements de l'index (valeurs non vides).
+
+    Les cellules non numeriques ("s", "nd"...) sont ignorees et
+    comptees dans errors, sans interrompre la construction.
+    """
+    time_idx = 1
+    dim_idx = [i for i, h in enumerate(headers) if h in dimension_ids]
+    var_idx = [i for i in range(2, len(headers)) if i not in dim_idx]
+    skipped = 0
+    for row in rows:
+        codgeo = normalize_codgeo(row[0])
+        annee = str(row[time_idx])
+        dimension = ";".join(f"{headers[i]}={row[i]}" for i in dim_idx) or None
+        for i in var_idx:
+            valeur = _plain(row[i]) if i < len(row) else None
+            if valeur is None or valeur == "":
+                continue
+            try:
+                valeur = float(valeur)
+            except (TypeError, ValueError):
+                skipped += 1
+                continue
+            yield [source, dataset, level, codgeo, annee, dimension, headers[i], valeur]
+    if skipped and errors is not None:
+        errors.append(f"{source} {dataset} {level}: {skipped} valeur(s) non numerique(s) ignoree(s)")
+
+
+def _moca_records(errors):
+    import prisme_engine as eng
+    for dataset_id in eng.get_available_datasets():
+        config = eng.get_dataset_config(dataset_id)
+        dimension_ids = {c['id'] for c in config.get('columns', []) if c['type'] == 'dimension'}
+        try:
+            csv_data = eng.load_dataset_csv(dataset_id)
+        except Exception as e:
+            errors.append(f"moca {dataset_id}: {e}")
+            continue
+        years = set()
+        for parsed in csv_data.values():
+            for df in parsed.values():
+                if not df.empty and 'annee' in df.columns:
+                    years.update(int(y) for y in df['annee'].unique())
+        for year in sorted(years):
+            try:
+                tables = eng.build_prisme_tables(dataset_id, year, csv_data=csv_data)
+            except Exception as e:
+                errors.append(f"moca {dataset_id} {year}: {e}")
+                continue
+            for level, (headers, rows) in (tables or {}).items():
+                yield from _table_records("moca", dataset_id, level, headers, rows, dimension_ids, errors)
+
+
+def _opendata_records(errors):
+    import generate_from_opendata as od
+    for theme in od.THEME_CONFIGS:
+        for year in od.detect_available_years_opendata(theme):
+            try:
+                all_levels, _ = od.build_theme_levels(theme, year)
+                tables = od.theme_tables(theme, year, all_levels)
+            except Exception as e:
+                errors.append(f"opendata {theme} {year}: {e}")
+                continue
+            for level, (headers, rows) in tables.items():
+                yield from _table_records("opendata", theme, level, headers, rows, errors=errors)
+
+
+def build_index():
+    """Reconstruit l'index complet et bascule geo_index.json dessus. -> meta"""
+    t0 = time.time()
+    signature = index_signature(refresh=True)
+    errors = []
+    records = list(_moca_records(errors)) + list(_opendata_records(errors))
+
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    stem = f"geo_index_{int(time.time())}"
+    formats = sidecar.resolve_formats(("parquet",))
+    sidecar.write_tables(STATE_DIR / stem, [("index", COLUMNS, records)], formats)
+
+    previous = _read_meta()
+    meta = {
+        "table": stem,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "seconds": round(time.time() - t0, 1),
+        "rows": len(records),
+        "signature": signature,
+        "errors": errors,
+    }
+    tmp = META_FILE.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, META_FILE)
+
+    # Ancienne table : supprimee une fois la bascule faite
+    if previous and previous.get("table") and previous["table"] != stem:
+        for p in STATE_DIR.glob(f"{previous['table']}.*"):
+            try:
+                p.unlink()
+            except OSError:
+                pass
+    print(f"[OK] Index geo : {len(records)} valeurs en {meta['seconds']}s ({len(errors)} erreur(s))")
+    return meta
+
+
+# ============================================================================
+# LECTURE
+# ============================================================================
+
+def _read_meta():
+    try:
+        return json.loads(META_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def status():
+    """Etat de l'index : None si absent, sinon meta + stale (sources modifiees depuis)."""
+    meta = _read_meta()
+    if not meta:
+        return None
+    return {**meta, "stale": meta.get("signature") != index_signature()}
+
+
+def _by_geo():
+    """{codgeo: [enregistrements]} de la table courante, charge une fois par table."""
+    meta = _read_meta()
+    if not meta:
+        return None
+    with _load_lock:
+        if _loaded["table"] != meta["table"]:
+            tables = sidecar.read_tables(STATE_DIR / meta["table"])
+            if tables is None:
+                return None
+            _, rows = tables["index"]
+            by_geo = {}
+            for row in rows:
+                by_geo.setdefault(normalize_codgeo(row[3]), []).append(row)
+            _loaded.update(table=meta["table"], by_geo=by_geo)
+        return _loaded["by_geo"]
+
+
+def lookup(codgeo, level=None):
+    """Toutes les variables d'un territoire.
+
+    -> {niveaux: [...], sources: {source: {dataset: {annee: {variable: valeur}}}}}
+    Les variables multi-dimension sont suffixees : "pop[age_quinq=0-4]".
+    Retourne None si l'index n'est pas encore construit.
+    """
+    by_geo = _by_geo()
+    if by_geo is None:
+        return None
+    niveaux = set()
+    sources = {}
+    for source, dataset, niveau, _, annee, dimension, variable, valeur in by_geo.get(normalize_codgeo(codgeo), []):
+        if level and niveau != level:
+            continue
+        niveaux.add(niveau)
+        name = f"{variable}[{dimension}]" if dimension else variable
+        (sources.setdefault(source, {}).setdefault(dataset, {})
+                .setdefault(str(annee), {}))[name] = valeur
+    return {"niveaux": sorted(niveaux), "sources": sources}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Index geographique transverse PRISME (codgeo, annee)")
+    ap.add_argument("codgeo", nargs="?", help="territoire a afficher (sinon : reconstruction)")
+    ap.add_argument("--level", choices=GEO_LEVELS, default=None)
+    args = ap.parse_args(argv)
+
+    if args.codgeo is None:
+        build_index()
+        return 0
+    profile = lookup(args.codgeo, args.level)
+    if profile is None:
+        print("[ERROR] Index absent : lancer d'abord `python geo_index.py`")
+        return 1
+    print(json.dumps(profile, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+PRISME - Suivi memoire des generations et budget memoire.
+
+Mesures (ajoutees aux spans / jobs de timing.py, donc a timings.jsonl) :
+    rss_mb, rss_peak_mb    RSS en fin d'etape et pic pendant l'etape (releve
+                           par un thread toutes les PRISME_MEMORY_INTERVAL ms)
+    top_allocations        PRISME_MEMORY_TRACE=1 : lignes de code qui ont le
+                           plus alloue pendant le job et les etapes de
+                           PRISME_MEMORY_TRACE_STAGES (tracemalloc, couteux :
+                           un instantane du tas par etape suivie)
+
+Budget (PRISME_MEMORY_BUDGET_MB, defaut 80 % de la limite cgroup du
+conteneur, aucun hors conteneur) compare a l'usage du conteneur (cgroup
+memory.current) ou a defaut au RSS du process. Au-dela de
+PRISME_MEMORY_SOFT (0.75) du budget :
+    gate()          les generations passent une par une (app.py)
+    over_budget()   le pool de parsing de prisme_engine repasse en serie
+    should_chunk()  les gros CSV (BAAC, bases INSEE) sont lus par morceaux
+                    et reduits a la volee (csv_reader.read_csv_chunked) ;
+                    aussi si le fichier ne tient pas dans le budget restant.
+PRISME_CHUNKED_READS=always|never force ou coupe la lecture par morceaux.
+"""
+import contextlib
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+ENABLED = os.environ.get("PRISME_MEMORY", "1").lower() not in ("0", "false", "no", "off")
+TRACE = os.environ.get("PRISME_MEMORY_TRACE", "0").lower() in ("1", "true", "yes", "on")
+SAMPLE_INTERVAL = float(os.environ.get("PRISME_MEMORY_INTERVAL", "20")) / 1000
+SOFT_RATIO = float(os.environ.get("PRISME_MEMORY_SOFT", "0.75"))
+CHUNK_MODE = os.environ.get("PRISME_CHUNKED_READS", "auto").lower()
+GATE_MAX_WAIT = float(os.environ.get("PRISME_MEMORY_GATE_WAIT", "600"))
+TRACE_STAGES = frozenset(os.environ.get("PRISME_MEMORY_TRACE_STAGES", "parse,fill,write_xlsx").split(","))
+TOP_ALLOCATIONS = 5
+
+# Un CSV charge en DataFrame occupe plusieurs fois sa taille sur disque
+# (objets str, colonnes object) : estimation volontairement pessimiste.
+CSV_EXPANSION = 6
+
+_MB = 1024 * 1024
+
+_CGROUP_USAGE = ("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes")
+_CGROUP_LIMIT = ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def _read_int(paths):
+    for p in paths:
+        try:
+            raw = Path(p).read_text().strip()
+        except OSError:
+            continue
+        if raw.isdigit():
+            return int(raw)
+    return None
+
+
+def rss_bytes():
+    """RSS courant du process (None si indisponible sur la plateforme)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _default_budget():
+    env = os.environ.get("PRISME_MEMORY_BUDGET_MB")
+    if env:
+        return int(float(env) * _MB) or None
+    limit = _read_int(_CGROUP_LIMIT)
+    # cgroup v1 sans limite : valeur proche de 2**63
+    if limit and limit < 1 << 60:
+        return int(limit * 0.8)
+    return None
+
+
+BUDGET_BYTES = _default_budget()
+
+
+def usage_bytes():
+    """Memoire comptee contre le budget : conteneur (cgroup) sinon process."""
+    return _read_int(_CGROUP_USAGE) or rss_bytes()
+
+
+def pressure():
+    """usage / budget (0.0 sans budget)."""
+    if not BUDGET_BYTES:
+        return 0.0
+    return (usage_bytes() or 0) / BUDGET_BYTES
+
+
+def over_budget(ratio=None):
+    return pressure() >= (SOFT_RATIO if ratio is None else ratio)
+
+
+def should_chunk(path=None):
+    """Lecture par morceaux conseillee (pression memoire, gros fichier) ?"""
+    if CHUNK_MODE in ("always", "1", "on"):
+        return True
+    if CHUNK_MODE in ("never", "0", "off") or not BUDGET_BYTES:
+        return False
+    usage = usage_bytes() or 0
+    if usage >= BUDGET_BYTES * SOFT_RATIO:
+        return True
+    if path is not None:
+        try:
+            estimate = Path(path).stat().st_size * CSV_EXPANSION
+        except OSError:
+            return False
+        return usage + estimate > BUDGET_BYTES * SOFT_RATIO
+    return False
+
+
+def report():
+    """Etat memoire courant (payloads, /api/health, reponses du worker)."""
+    usage = usage_bytes()
+    return {
+        "rss_mb": _mb(rss_bytes()),
+        "usage_mb": _mb(usage),
+        "budget_mb": _mb(BUDGET_BYTES),
+        "pressure": round(usage / BUDGET_BYTES, 3) if BUDGET_BYTES and usage else 0.0,
+    }
+
+
+def status():
+    """report() + file d'attente des generations (memory.gate)."""
+    return {**report(), "generations_active": _gate.active, "generations_waiting": _gate.waiting}
+
+
+def _mb(value):
+    return None if value is None else round(value / _MB, 1)
+
+
+# ============================================================================
+# PIC RSS PAR ETAPE
+# ============================================================================
+
+class _Watcher:
+    """Thread unique qui releve le RSS tant qu'au moins une etape est ouverte."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = set()
+        self._thread = None
+
+    def add(self, stage):
+        with self._lock:
+            self._stages.add(stage)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="prisme-memory", daemon=True)
+                self._thread.start()
+
+    def remove(self, stage):
+        with self._lock:
+            self._stages.discard(stage)
+
+    def _run(self):
+        while True:
+            time.sleep(SAMPLE_INTERVAL)
+            rss = rss_bytes() or 0
+            with self._lock:
+                if not self._stages:
+                    self._thread = None
+                    return
+                for stage in self._stages:
+                    if rss > stage.peak:
+                        stage.peak = rss
+
+
+_watcher = _Watcher()
+
+
+class Stage:
+    __slots__ = ("start", "peak", "snapshot")
+
+    def __init__(self):
+        self.start = self.peak = rss_bytes() or 0
+        self.snapshot = None
+
+
+def begin(name=None):
+    """Debut d'une etape (timing._Span / _Job, name=None) -> jeton pour end()."""
+    stage = Stage()
+    if TRACE and (name is None or name in TRACE_STAGES):
+        import tracemalloc
+        # Demarrage au premier job et non a l'import : les allocations des
+        # imports (pandas, openpyxl) restent hors des instantanes.
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        stage.snapshot = tracemalloc.take_snapshot()
+    _watcher.add(stage)
+    return stage
+
+
+def end(stage):
+    """Fin d'etape -> {rss_mb, rss_peak_mb, rss_delta_mb[, top_allocations]}."""
+    _watcher.remove(stage)
+    rss = rss_bytes() or 0
+    peak = max(stage.peak, rss)
+    out = {
+        "rss_mb": _mb(rss),
+        "rss_peak_mb": _mb(peak),
+        "rss_delta_mb": _mb(rss - stage.start),
+    }
+    if stage.snapshot is not None:
+        out["top_allocations"] = _top_allocations(stage.snapshot)
+    return out
+
+
+def _top_allocations(before):
+    import tracemalloc
+    filters = (
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    )
+    after = tracemalloc.take_snapshot().filter_traces(filters)
+    top = []
+    for diff in after.compare_to(before.filter_traces(filters), "lineno")[:TOP_ALLOCATIONS]:
+        frame = diff.traceback[0]
+        top.append({
+            "where": f"{Path(frame.filename).name}:{frame.lineno}",
+            "size_diff_kb": round(diff.size_diff / 1024, 1),
+            "count_diff": diff.count_diff,
+        })
+    return top
+
+
+def enable_trace(flag=True):
+    """Active / coupe tracemalloc (top_allocations par etape)."""
+    global TRACE
+    import tracemalloc
+    TRACE = bool(flag)
+    if not TRACE and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+# ============================================================================
+# ADMISSION DES GENERATIONS
+# ============================================================================
+
+class _Gate:
+    """Sous pression memoire, une nouvelle generation attend que les autres finissent."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+
+    @contextlib.contextmanager
+    def __call__(self):
+        t0 = time.perf_counter()
+        with self._cond:
+            self.waiting += 1
+            try:
+                while self.active > 0 and over_budget():
+                    if time.perf_counter() - t0 > GATE_MAX_WAIT:
+                        print(f"[WARN] memoire : attente > {GATE_MAX_WAIT:.0f}s, generation lancee malgre la pression")
+                        break
+                    # La memoire peut redescendre sans fin de generation : re-test periodique
+                    self._cond.wait(timeout=1.0)
+            finally:
+                self.waiting -= 1
+            self.active += 1
+        waited = time.perf_counter() - t0
+        if waited > 1:
+            print(f"[INFO] memoire : generation retardee de {waited:.1f}s (pression {pressure():.0%})")
+        try:
+            yield round(waited, 3)
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+
+_gate = _Gate()
+
+
+def gate():
+    """with memory.gate() as waited : admission d'une generation (cf. _Gate)."""
+    return _gate()
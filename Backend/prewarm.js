@@ -0,0 +1,239 @@
+// ============================================================
+// Module prewarm : pre-calcul des ZIP les plus demandes.
+//
+// Apres le demarrage et apres chaque import de donnees (upload / suppression
+// de CSV, rechargement de config), genere en tache de fond la derniere annee
+// de chaque dataset (liste `prewarm_targets` du worker Python) pour que le
+// premier clic d'un analyste soit servi sans attendre la generation.
+//
+//   PRISME_PREWARM=0                    desactive le pre-calcul
+//   PRISME_PREWARM_TARGETS=moca:educ:2022,opendata:route:2023
+//                                       remplace la liste par defaut
+//   PRISME_PREWARM_DELAY_MS             delai apres demarrage / import (def. 20 s)
+//
+// Les appels passent en priorite 'background' dans python_worker.js : ils
+// cedent la place aux requetes interactives et laissent toujours un worker
+// libre ; avec un seul worker Python (PRISME_WORKERS=1) pas de pre-calcul. Etat + compteurs hits/misses
+// dans PRISME_STATE_DIR/prewarm.json ; GET /api/prewarm/status.
+// ============================================================
+
+const fs = require('fs');
+const path = require('path');
+
+const STATE_DIR = process.env.PRISME_STATE_DIR || path.join(__dirname, 'state');
+const PREWARM_FILE = path.join(STATE_DIR, 'prewarm.json');
+const OUTPUT_DIR = path.join(__dirname, 'output');
+const CONFIG_FILE = path.join(__dirname, 'themes_config.json');
+// Sources surveillees (mtime) en plus des imports notifies par file_server.js
+const WATCHED_PATHS = [
+    CONFIG_FILE,
+    path.join(__dirname, 'csv_sources'),
+    path.join(__dirname, 'inputs', 'opendata'),
+];
+const ENABLED = process.env.PRISME_PREWARM !== '0';
+const DELAY_MS = parseInt(process.env.PRISME_PREWARM_DELAY_MS || '20000', 10);
+const STATS_SAVE_DELAY_MS = 10 * 1000;
+
+let pythonWorker = null;
+let log = () => {};
+let timer = null;
+let running = false;
+let rerun = false;
+let saveTimer = null;
+
+function jsonResponse(res, statusCode, data) {
+    res.writeHead(statusCode, {
+        'Content-Type': 'application/json; charset=utf-8',
+        'Cache-Control': 'no-store',
+    });
+    res.end(JSON.stringify(data));
+}
+
+function emptyState() {
+    return {
+        lastIngest: 0,
+        entries: {},
+        stats: { hits: 0, misses: 0, prewarmed: 0, failed: 0, lastRun: null },
+    };
+}
+
+let state = emptyState();
+
+function loadState() {
+    try {
+        if (fs.existsSync(PREWARM_FILE)) {
+            state = { ...emptyState(), ...JSON.parse(fs.readFileSync(PREWARM_FILE, 'utf8')) };
+        }
+    } catch (e) { state = emptyState(); }
+}
+
+function saveState() {
+    if (saveTimer) { clearTimeout(saveTimer); saveTimer = null; }
+    try {
+        fs.mkdirSync(STATE_DIR, { recursive: true });
+        fs.writeFileSync(PREWARM_FILE, JSON.stringify(state, null, 2), 'utf8');
+    } catch (e) { log('WARN', `prewarm: ecriture ${PREWARM_FILE} impossible (${e.message})`); }
+}
+
+// Compteurs hits/misses : ecrits au plus toutes les STATS_SAVE_DELAY_MS
+// (ou avec le prochain record()), pas a chaque /generate.
+function scheduleSave() {
+    if (saveTimer) return;
+    saveTimer = setTimeout(saveState, STATS_SAVE_DELAY_MS);
+    saveTimer.unref();
+}
+
+function entryKey(source, theme, year) {
+    return `${source}:${theme}:${year}`;
+}
+
+// Une entree est valide si son fichier existe et qu'elle est posterieure au
+// dernier import et a la derniere modification des sources surveillees.
+function freshnessFloor() {
+    let floor = state.lastIngest || 0;
+    for (const p of WATCHED_PATHS) {
+        try { floor = Math.max(floor, fs.statSync(p).mtimeMs); } catch (e) { }
+    }
+    return floor;
+}
+
+function isFresh(entry) {
+    if (!entry || !entry.filename) return false;
+    const file = path.join(OUTPUT_DIR, entry.filename);
+    if (!fs.existsSync(file)) return false;
+    return entry.generatedAt >= freshnessFloor();
+}
+
+/**
+ * Resultat deja calcule pour (source, theme, year) ou null. Compte hit/miss.
+ */
+function lookup(source, theme, year) {
+    const entry = state.entries[entryKey(source, theme, year)];
+    if (isFresh(entry)) {
+        state.stats.hits += 1;
+        scheduleSave();
+        return entry;
+    }
+    state.stats.misses += 1;
+    scheduleSave();
+    return null;
+}
+
+/**
+ * Memorise une generation reussie (interactive ou pre-calcul).
+ */
+function record(source, theme, year, result) {
+    state.entries[entryKey(source, theme, year)] = {
+        filename: result.filename,
+        warnings: result.warnings || [],
+        generatedAt: Date.now(),
+    };
+    saveState();
+}
+
+function parseTargetsEnv() {
+    const raw = process.env.PRISME_PREWARM_TARGETS;
+    if (!raw) return null;
+    return raw.split(',').map(s => s.trim()).filter(Boolean).map((item) => {
+        const [source, theme, year] = item.split(':');
+        return { source, theme, year: parseInt(year, 10) };
+    }).filter(t => (t.source === 'moca' || t.source === 'opendata') && t.theme && t.year);
+}
+
+async function runOnce() {
+    let targets = parseTargetsEnv();
+    if (!targets) {
+        const { result } = await pythonWorker.call('prewarm_targets', {}, { priority: 'background' });
+        targets = result.targets || [];
+    }
+    log('INFO', `prewarm: ${targets.length} cible(s)`);
+
+    for (const t of targets) {
+        if (rerun) return;  // un import est arrive entre-temps : on repart de zero
+        if (isFresh(state.entries[entryKey(t.source, t.theme, t.year)])) continue;
+        try {
+            let result;
+            if (t.source === 'moca') {
+                const r = await pythonWorker.call('generate_prisme_excel',
+                    { dataset_id: t.theme, year: t.year }, { priority: 'background' });
+                const warnings = r.stdout.split('\n')
+                    .map(l => l.match(/\[WARN_(?:YEAR|DATA)\]\s*(.+)/))
+                    .filter(Boolean).map(m => m[1].trim());
+                result = { filename: r.result.filename, warnings };
+            } else {
+                const r = await pythonWorker.call('generate_theme',
+                    { theme: t.theme, year: t.year }, { priority: 'background' });
+                result = { filename: r.result.filename };
+            }
+            record(t.source, t.theme, t.year, result);
+            state.stats.prewarmed += 1;
+        } catch (e) {
+            state.stats.failed += 1;
+            log('WARN', `prewarm ${t.source} ${t.theme} ${t.year}: ${e.message}`);
+        }
+    }
+    state.stats.lastRun = new Date().toISOString();
+    saveState();
+}
+
+async function run() {
+    if (running) { rerun = true; return; }
+    running = true;
+    try {
+        do {
+            rerun = false;
+            await runOnce();
+        } while (rerun);
+    } catch (e) {
+        log('WARN', `prewarm: ${e.message}`);
+    } finally {
+        running = false;
+    }
+}
+
+function schedule(delayMs = DELAY_MS) {
+    if (!ENABLED || !pythonWorker) return;
+    if (timer) clearTimeout(timer);
+    timer = setTimeout(() => { timer = null; run(); }, delayMs);
+    timer.unref();
+}
+
+/**
+ * A appeler apres un import de donnees : invalide les entrees et relance.
+ */
+function notifyIngest() {
+    state.lastIngest = Date.now();
+    state.entries = {};
+    saveState();
+    if (running) rerun = true;
+    schedule();
+}
+
+function start(opts) {
+    log = opts.log || log;
+    loadState();
+    // Compteurs en attente d'ecriture : sauves a l'arret du serveur
+    process.on('exit', () => { if (saveTimer) saveState(); });
+    if (!opts.pythonWorker.backgroundAllowed()) {
+        if (ENABLED) log('INFO', 'prewarm: un seul worker Python, pre-calcul desactive');
+        return;
+    }
+    pythonWorker = opts.pythonWorker;
+    schedule();
+}
+
+function handlePrewarm(req, res, urlPath) {
+    if (urlPath !== '/prewarm/status' || req.method !== 'GET') return false;
+    const entries = Object.entries(state.entries).map(([key, e]) => ({ key, ...e, fresh: isFresh(e) }));
+    jsonResponse(res, 200, {
+        success: true,
+        enabled: ENABLED && pythonWorker !== null,
+        running,
+        stats: state.stats,
+        lastIngest: state.lastIngest ? new Date(state.lastIngest).toISOString() : null,
+        entries,
+    });
+    return true;
+}
+
+module.exports = { start, lookup, record, notifyIngest, handlePrewarm };
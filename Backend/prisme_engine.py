@@ -5,9 +5,17 @@ Version: 4.0 - Architecture config-driven
 Utilise themes_config.json pour la configuration des datasets
 """
 
+import contextlib
+import io
 import json
+import multiprocessing
+import os
 import re
 import shutil
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pandas as pd
 from openpyxl import Workbook
 from openpyxl.styles import Font
@@ -15,6 +23,12 @@ from pathlib import Path
 import warnings
 import tempfile
 
+import memory
+import sidecar
+import profiler
+import reproducible
+import timing
+
 warnings.filterwarnings('ignore')
 
 
@@ -28,23 +42,24 @@ def _read_lines_autoenc(filepath):
     Essaie dans l'ordre : utf-8-sig (BOM), utf-8, cp1252, latin-1.
     Retourne (lines, encoding_utilisé).
     """
-    for enc in ('utf-8-sig', 'utf-8', 'cp1252', 'latin-1'):
-        try:
-            with open(filepath, 'r', encoding=enc, errors='strict') as f:
-                lines = f.readlines()
-            # Heuristique : si on trouve des caractères français courants bien décodés,
-            # on considère l'encodage correct.
-            sample = ''.join(lines[:20])
-            # Rejeter si on voit des séquences manifestement corrompues (cp1252 mal interprété)
-            if '\ufffd' in sample:
+    with timing.span("decode", file=Path(filepath).name):
+        for enc in ('utf-8-sig', 'utf-8', 'cp1252', 'latin-1'):
+            try:
+                with open(filepath, 'r', encoding=enc, errors='strict') as f:
+                    lines = f.readlines()
+                # Heuristique : si on trouve des caractères français courants bien décodés,
+                # on considère l'encodage correct.
+                sample = ''.join(lines[:20])
+                # Rejeter si on voit des séquences manifestement corrompues (cp1252 mal interprété)
+                if '\ufffd' in sample:
+                    continue
+                return lines, enc
+            except (UnicodeDecodeError, UnicodeError):
                 continue
-            return lines, enc
-        except (UnicodeDecodeError, UnicodeError):
-            continue
-    # Dernier recours : latin-1 avec remplacement (jamais d'erreur)
-    with open(filepath, 'r', encoding='latin-1', errors='replace') as f:
-        lines = f.readlines()
-    return lines, 'latin-1 (fallback)'
+        # Dernier recours : latin-1 avec remplacement (jamais d'erreur)
+        with open(filepath, 'r', encoding='latin-1', errors='replace') as f:
+            lines = f.readlines()
+        return lines, 'latin-1 (fallback)'
 
 
 # ============================================================================
@@ -160,27 +175,60 @@ def load_themes_config():
         print(f"[ERROR] Failed to load config: {e}")
         return {"datasets": {}, "themeTree": [], "geoLevels": {}}
 
+def _config_key():
+    """Signature du fichier de config : (chemin, mtime)."""
+    try:
+        return (str(CONFIG_FILE), CONFIG_FILE.stat().st_mtime_ns)
+    except OSError:
+        return (str(CONFIG_FILE), None)
+
+
 # Charger la config au démarrage
 THEMES_CONFIG = load_themes_config()
+_config_state = {"key": _config_key()}
+
+
+def current_config():
+    """THEMES_CONFIG, relu automatiquement si themes_config.json a changé
+    (mtime) : plus besoin d'appeler reload_config() après une mise à jour.
+    Un fichier illisible (écriture en cours) garde la config précédente."""
+    global THEMES_CONFIG
+    key = _config_key()
+    if key != _config_state["key"] and key != _config_state.get("failed"):
+        try:
+            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            # Nouvel essai des que le mtime bouge (fin d'ecriture)
+            _config_state["failed"] = key
+            print(f"[WARN] Config illisible ({e}), configuration precedente conservee")
+            return THEMES_CONFIG
+        THEMES_CONFIG = config
+        _config_state["key"] = key
+        _plans.clear()
+        print(f"[INFO] Config rechargee: {CONFIG_FILE.name}")
+    return THEMES_CONFIG
 
 def reload_config():
-    """Recharge la configuration (utile après mise à jour)."""
+    """Recharge la configuration sans attendre le contrôle de mtime."""
     global THEMES_CONFIG
     THEMES_CONFIG = load_themes_config()
+    _config_state["key"] = _config_key()
+    _plans.clear()
     return THEMES_CONFIG
 
 def get_dataset_config(dataset_id):
     """Récupère la configuration d'un dataset depuis themes_config.json."""
-    datasets = THEMES_CONFIG.get('datasets', {})
+    datasets = current_config().get('datasets', {})
     return datasets.get(dataset_id)
 
 def get_available_datasets():
     """Retourne la liste des datasets disponibles."""
-    return list(THEMES_CONFIG.get('datasets', {}).keys())
+    return list(current_config().get('datasets', {}).keys())
 
 def get_theme_tree():
     """Retourne l'arborescence des thèmes."""
-    return THEMES_CONFIG.get('themeTree', [])
+    return current_config().get('themeTree', [])
 
 # ============================================================================
 # REGION & COMMUNE CONSTANTS
@@ -822,14 +870,14 @@ def find_csv_file(pattern, search_dir=None):
 
 def detect_available_years(dataset_id):
     """Détecte les années disponibles dans les fichiers CSV pour un dataset."""
-    config = get_dataset_config(dataset_id)
-    if not config:
+    plan = get_plan(dataset_id)
+    if plan is None:
         return []
     
     years = set()
-    columns = config.get('columns', [])
+    paths = plan.source_paths()
     
-    for col in columns:
+    for col in plan.config.get('columns', []):
         if col.get('type') != 'variable':
             continue
         
@@ -837,7 +885,7 @@ def detect_available_years(dataset_id):
         if not csv_pattern:
             continue
             
-        csv_file = find_csv_file(csv_pattern)
+        csv_file = paths.get(csv_pattern)
         if not csv_file:
             continue
         
@@ -896,21 +944,25 @@ GEO_ENTITIES = {
 # EXCEL SHEET WRITER HELPER
 # ============================================================================
 
-def _write_sheet(ws, headers, rows_data, col_keys):
-    """Écrit les en-têtes et les données dans une feuille Excel."""
+def _write_sheet(ws, headers, rows):
+    """Écrit les en-têtes et les données (listes, cf. _sheet_rows) dans une feuille Excel."""
     for col_idx, h in enumerate(headers, 1):
         cell = ws.cell(row=1, column=col_idx, value=h)
         cell.font = Font(bold=True)
 
-    for row_idx, row_dict in enumerate(rows_data, 2):
-        for col_idx, key in enumerate(col_keys, 1):
-            val = row_dict.get(key)
+    for row_idx, row in enumerate(rows, 2):
+        for col_idx, val in enumerate(row, 1):
             cell = ws.cell(row=row_idx, column=col_idx, value=val)
 
     ws.column_dimensions['A'].width = 15
     ws.column_dimensions['B'].width = 10
 
 
+def _sheet_rows(rows_data, col_keys):
+    """Lignes d'une feuille : dicts de donnees -> listes dans l'ordre des colonnes."""
+    return [[row_dict.get(key) for key in col_keys] for row_dict in rows_data]
+
+
 # ============================================================================
 # FILL VARIABLE DATA FROM CSV
 # ============================================================================
@@ -985,113 +1037,349 @@ def _fill_variable_data(data, var_id, parsed, year, time_col_id, dimension_id=No
 # EXCEL GENERATOR - VERSION CONFIG-DRIVEN (SIMPLE + MULTI-DIMENSION)
 # ============================================================================
 
-def generate_prisme_excel(dataset_id, year):
-    """Génère une archive ZIP contenant les fichiers Excel PRISME.
+# ============================================================================
+# CHARGEMENT PARALLELE DES CSV (une tache par fichier + config de parsing)
+# ============================================================================
 
-    Supporte 3 types de datasets :
-    - Simple : [geo, annee, var1, var2, ...]
-    - Multi-dimension : [geo, annee, dim, var1, var2, ...]
-      (une ligne par combinaison geo × dimension_value)
-    - Période : [geo, periode, var1, ...] (au lieu d'annee)
+# PRISME_PARSE_POOL : process (defaut, vrai parallelisme : le parsing est du
+# Python pur) | thread | off ; PRISME_PARSE_WORKERS : taille du pool.
+# Sous pression memoire (memory.over_budget) le parsing repasse en serie :
+# chaque process du pool porte une copie de pandas et de ses DataFrames.
+# Les process du pool partent d'un serveur forkserver, jamais d'un fork du
+# process courant : app.py (threadpool uvicorn) et prisme_worker.py (veille
+# memoire, profiler) ont des threads, et un fork peut heriter d'un verrou pris.
+PARSE_POOL = os.environ.get("PRISME_PARSE_POOL", "process").lower()
+PARSE_WORKERS = int(os.environ.get("PRISME_PARSE_WORKERS", "0") or 0) or min(4, os.cpu_count() or 1)
+
+_PARSERS = {
+    'long': lambda path, **kw: parse_long_format_csv(path),
+    'tabular': lambda path, **kw: parse_tabular_csv(path, **kw),
+    'moca_filter': lambda path, **kw: parse_moca_filter_csv(path, **kw),
+    'moca': lambda path, **kw: parse_moca_csv(path, **kw),
+}
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _parse_job(col, csv_file):
+    """(parser, chemin, kwargs) d'une variable, d'apres sa config."""
+    parser_type = col.get('parser', 'moca')
+    dim_col = col.get('dimensionColumn')
+    if parser_type == 'long':
+        kwargs = {}
+    elif parser_type == 'tabular':
+        kwargs = dict(value_column=col.get('column', 2), year_column=col.get('yearColumn', 0),
+                      geo_column=col.get('geoColumn', 1), dimension_column=dim_col,
+                      compute_fra_from_fh_dom=col.get('computeFraFromFhDom', False))
+    elif parser_type == 'moca_filter':
+        kwargs = dict(filter_column=col.get('filterColumn', 4), filter_value=col.get('filterValue', ''),
+                      year_column=col.get('yearColumn', 3), geo_column=col.get('geoColumn', 5),
+                      value_column=col.get('valueColumn', 6), dimension_column=dim_col,
+                      compute_fra_from_fh_dom=col.get('computeFraFromFhDom', False))
+    else:
+        # Standard moca parser
+        parser_type = 'moca'
+        kwargs = dict(year_column=col.get('yearColumn', 3), geo_column=col.get('geoColumn', 5),
+                      value_column=col.get('valueColumn', 6), dimension_column=dim_col)
+    return parser_type, str(csv_file), kwargs
 
-    Args:
-        dataset_id: Identifiant du dataset (ex: 'educ', 'pers_sup65ans_seules')
-        year: Année ou période à générer (ex: 2021 ou '2015-2020')
 
-    Returns:
-        Path du fichier ZIP généré ou None en cas d'erreur
+def _run_parse_job(job):
+    """Execute un parsing dans le thread courant -> (parsed, "").
+
+    Les logs du parser partent directement sur sys.stdout : celui-ci est
+    partage par les threads de app.py et n'est jamais remplace ici.
     """
+    parser_type, path, kwargs = job
+    return _PARSERS[parser_type](path, **kwargs), ""
 
-    # Récupérer la config du dataset
-    config = get_dataset_config(dataset_id)
-    if not config:
-        print(f"[ERROR] Dataset inconnu: {dataset_id}")
-        print(f"[INFO] Datasets disponibles: {get_available_datasets()}")
-        return None
 
-    print(f"[ENGINE] Generation {dataset_id} ({config.get('name', dataset_id)}) pour {year}...")
+def _run_parse_job_captured(job):
+    """Execute un parsing dans un process du pool -> (parsed, sortie console).
+
+    Un process du pool n'execute qu'une tache a la fois : rediriger son
+    propre sys.stdout est sans effet sur les requetes du process principal,
+    qui reecrit la sortie dans l'ordre des variables.
+    """
+    parser_type, path, kwargs = job
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        parsed = _PARSERS[parser_type](path, **kwargs)
+    return parsed, buf.getvalue()
+
+
+def _get_process_pool():
+    """Pool garde entre deux generations (worker Python persistant)."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            context = multiprocessing.get_context("forkserver")
+            # Moteur importe une fois dans le serveur : process du pool demarres sans re-import
+            context.set_forkserver_preload(["prisme_engine"])
+            _process_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=context)
+        return _process_pool
+
+
+def _drop_process_pool(pool):
+    """Oublie un pool casse (si un autre thread ne l'a pas deja remplace)."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _map_parse_jobs(jobs):
+    """Resultats des jobs dans l'ordre de la liste, en parallele si possible."""
+    if len(jobs) <= 1 or PARSE_POOL == "off" or PARSE_WORKERS <= 1:
+        return [_run_parse_job(job) for job in jobs]
+    if memory.over_budget():
+        print(f"  [WARN] Pression memoire ({memory.pressure():.0%} du budget), parsing sequentiel")
+        timing.incr("memory_serial_parse")
+        return [_run_parse_job(job) for job in jobs]
+    workers = min(PARSE_WORKERS, len(jobs))
+    if PARSE_POOL == "thread":
+        # Logs des parsers ecrits au fil de l'eau (ordre non garanti entre fichiers)
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            return list(ex.map(_run_parse_job, jobs))
+    pool = None
+    try:
+        pool = _get_process_pool()
+        return list(pool.map(_run_parse_job_captured, jobs))
+    except (BrokenProcessPool, OSError) as e:
+        print(f"  [WARN] Pool de parsing indisponible ({e}), lecture sequentielle")
+        if pool is not None:
+            _drop_process_pool(pool)
+        return [_run_parse_job(job) for job in jobs]
 
-    # ---- Analyser les colonnes depuis la config ----
-    columns = config.get('columns', [])
 
-    # Colonnes par type
-    geo_col = next((c for c in columns if c['type'] == 'geo_id'), None)
+# ============================================================================
+# PLAN D'EXECUTION COMPILE (themes_config.json -> DatasetPlan)
+# ============================================================================
+# Tout ce qui ne depend que de la config est calcule une fois par dataset :
+# classement des colonnes, variables calculees ecartees, specs de parsing,
+# en-tetes et cles de lignes par niveau, dimensions. Le plan est invalide
+# quand themes_config.json change (current_config) ; la resolution des
+# csvPattern (glob) est gardee tant que le dossier CSV_SOURCES_DIR ne change
+# pas (mtime du dossier : ajout, suppression ou renommage de fichier).
+
+_COLUMN_TYPES = ('geo_id', 'year', 'period', 'dimension', 'variable')
+_PARSER_TYPES = ('moca', 'moca_filter', 'tabular', 'long', 'external')
+
+_plans = {}
+
+
+class VariablePlan:
+    """Variable exportee : spec de parsing, chemin resolu a part."""
+    __slots__ = ('id', 'parser', 'csv_pattern', 'source', 'dimension_column', 'config')
+
+    def __init__(self, col):
+        self.id = col['id']
+        self.parser = col.get('parser', 'moca')
+        self.csv_pattern = col.get('csvPattern')
+        self.source = col.get('source', '?')
+        self.dimension_column = col.get('dimensionColumn')
+        self.config = col
+
+
+class DatasetPlan:
+    """Plan compile d'un dataset (cf. compile_plan)."""
+    __slots__ = ('id', 'name', 'config', 'file_name', 'folder_path', 'theme_folder_name',
+                 'time_col_id', 'multi_row_dim', 'has_multi_row_dim', 'dim_values', 'default_dims',
+                 'variables', 'skipped', 'variable_ids', 'patterns', 'headers', 'row_keys',
+                 'warnings', '_sources_key', '_paths', '_steps', '_jobs')
+
+    def source_paths(self):
+        """{csvPattern: Path | None} pour toutes les variables (calculees comprises)."""
+        self._resolve()
+        return self._paths
+
+    def sources(self):
+        """(etapes, jobs) : etapes [(VariablePlan, message | index du job)] dans
+        l'ordre des variables exportees, jobs de parsing dedupliques."""
+        self._resolve()
+        return self._steps, self._jobs
+
+    def _resolve(self):
+        try:
+            key = (str(CSV_SOURCES_DIR), CSV_SOURCES_DIR.stat().st_mtime_ns)
+        except OSError:
+            key = (str(CSV_SOURCES_DIR), None)
+        if key == self._sources_key:
+            return
+        with timing.span("resolve"):
+            paths = {pattern: find_csv_file(pattern, CSV_SOURCES_DIR) for pattern in self.patterns}
+            steps, jobs, job_index = [], [], {}
+            for var in self.variables:
+                if not var.csv_pattern:
+                    steps.append((var, f"  [WARN] {var.id} -> Pas de pattern CSV defini"))
+                    continue
+                # Skip external data sources (not CSV-based)
+                if var.parser == 'external':
+                    steps.append((var, f"  [INFO] {var.id} -> Source externe ({var.source}), pas de CSV"))
+                    continue
+                csv_file = paths[var.csv_pattern]
+                if not csv_file:
+                    steps.append((var, f"  [WARN] {var.id} -> Fichier non trouve (pattern: {var.csv_pattern})"))
+                    continue
+                job = _parse_job(var.config, csv_file)
+                job_key = json.dumps(job, sort_keys=True, default=str)
+                if job_key not in job_index:
+                    job_index[job_key] = len(jobs)
+                    jobs.append(job)
+                steps.append((var, job_index[job_key]))
+        self._paths, self._steps, self._jobs = paths, steps, jobs
+        self._sources_key = key
+
+
+def compile_plan(dataset_id, config):
+    """Valide la config d'un dataset et precalcule son plan d'execution."""
+    plan = DatasetPlan()
+    plan.id = dataset_id
+    plan.config = config
+    plan.name = config.get('name', dataset_id)
+    plan.file_name = config.get('fileName', dataset_id)
+    plan.folder_path = config.get('folderPath', dataset_id.capitalize())
+    plan.theme_folder_name = plan.folder_path.split('/')[-1] if '/' in plan.folder_path else plan.folder_path
+    warnings_ = []
+
+    columns = []
+    seen = set()
+    for i, c in enumerate(config.get('columns', [])):
+        if not isinstance(c, dict) or 'id' not in c or c.get('type') not in _COLUMN_TYPES:
+            warnings_.append(f"colonne {i} ignoree (id ou type invalide): {c!r:.80}")
+            continue
+        if c['id'] in seen:
+            warnings_.append(f"colonne {c['id']} en double")
+        seen.add(c['id'])
+        if c['type'] == 'variable' and c.get('parser', 'moca') not in _PARSER_TYPES:
+            warnings_.append(f"{c['id']}: parser inconnu {c.get('parser')!r}, traite comme moca")
+        columns.append(c)
+
     time_col = next((c for c in columns if c['type'] in ('year', 'period')), None)
     dim_cols = [c for c in columns if c['type'] == 'dimension']
-    var_cols_all = [c for c in columns if c['type'] == 'variable']
-    # Exclure les variables calculées (ex: tx_*) — PRISME les recalcule côté client
-    var_cols = []
-    for c in var_cols_all:
-        if is_calculated_variable(c):
-            print(f"  [FILTER] Skipped calculated variable: {c.get('id')}")
-        else:
-            var_cols.append(c)
+    plan.time_col_id = time_col['id'] if time_col else 'annee'
 
-    time_col_id = time_col['id'] if time_col else 'annee'
-    variable_ids = [c['id'] for c in var_cols]
+    # Exclure les variables calculées (ex: tx_*) — PRISME les recalcule côté client
+    var_cols_all = [c for c in columns if c['type'] == 'variable']
+    plan.skipped = [c.get('id') for c in var_cols_all if is_calculated_variable(c)]
+    plan.variables = [VariablePlan(c) for c in var_cols_all if not is_calculated_variable(c)]
+    plan.variable_ids = [v.id for v in plan.variables]
+    plan.patterns = list(dict.fromkeys(c['csvPattern'] for c in var_cols_all if c.get('csvPattern')))
 
     # Multi-dimension ?
-    multi_row_dim = config.get('multiRowDimension')
-    dim_values = []
-    if multi_row_dim:
-        dim_config = next((c for c in dim_cols if c['id'] == multi_row_dim), None)
+    plan.multi_row_dim = config.get('multiRowDimension')
+    plan.dim_values = []
+    dim_config = next((c for c in dim_cols if c['id'] == plan.multi_row_dim), None) if plan.multi_row_dim else None
+    plan.has_multi_row_dim = dim_config is not None
+    if plan.multi_row_dim:
         if dim_config:
-            dim_values = dim_config.get('values', [])
-            if dim_values:
-                print(f"  [DIM] {multi_row_dim} : {len(dim_values)} valeurs ({', '.join(str(v) for v in dim_values[:5])}{'...' if len(dim_values) > 5 else ''})")
-            else:
-                print(f"  [WARN] Dimension {multi_row_dim} sans valeurs definies")
+            plan.dim_values = dim_config.get('values', [])
+        else:
+            warnings_.append(f"multiRowDimension {plan.multi_row_dim} absente des colonnes dimension")
+    # Lignes simples : dimensions non multi-lignes a leur premiere valeur
+    plan.default_dims = {dc['id']: dc['values'][0] for dc in dim_cols if dc.get('values')}
+
+    # ---- Ordre des colonnes (headers) ----
+    # Suit l'ordre exact du config : geo (varie par niveau), time, dimensions, variables
+    suffix = [c['id'] for c in columns
+              if c['type'] in ('year', 'period', 'dimension')
+              or (c['type'] == 'variable' and not is_calculated_variable(c))]
+    plan.headers = {geo_key: [GEO_ID_COLS[geo_key]] + suffix for geo_key in GEO_FOLDER_MAPPING}
+    plan.row_keys = plan.headers
+
+    plan.warnings = warnings_
+    for w in warnings_:
+        print(f"  [WARN] Config {dataset_id}: {w}")
+    plan._sources_key = None
+    return plan
+
+
+def get_plan(dataset_id):
+    """Plan compile du dataset (cache, invalide au changement de config) ou None."""
+    config = get_dataset_config(dataset_id)
+    if not config:
+        return None
+    plan = _plans.get(dataset_id)
+    if plan is None or plan.config is not config:
+        plan = _plans[dataset_id] = compile_plan(dataset_id, config)
+    return plan
 
-    # ---- Charger les données CSV pour chaque variable ----
+
+def _load_plan_data(plan):
+    """Parse le CSV de chaque variable -> {var_id: {geo_key: DataFrame}} (toutes années).
+
+    Les fichiers sont parsés en parallèle (PRISME_PARSE_POOL) ; un fichier
+    partagé par plusieurs variables avec la même config n'est parsé qu'une
+    fois. Résultats et logs restent dans l'ordre des variables.
+    """
     empty_dfs = lambda: {k: pd.DataFrame(columns=['annee', 'codgeo', 'valeur'])
                          for k in ['com', 'reg', 'dom', 'fh', 'fra']}
-    csv_data = {}
 
-    for col in var_cols:
-        var_id = col['id']
-        csv_pattern = col.get('csvPattern')
-        parser_type = col.get('parser', 'moca')
+    steps, jobs = plan.sources()
+    with timing.span("parse", jobs=len(jobs)):
+        results = _map_parse_jobs(jobs)
 
-        if not csv_pattern:
-            print(f"  [WARN] {var_id} -> Pas de pattern CSV defini")
-            csv_data[var_id] = empty_dfs()
+    # ---- Fusion dans l'ordre des variables ----
+    csv_data = {}
+    logged = set()
+    for var, step in steps:
+        if isinstance(step, str):
+            print(step)
+            csv_data[var.id] = empty_dfs()
             continue
+        parsed, output = results[step]
+        if step not in logged:
+            sys.stdout.write(output)
+            logged.add(step)
+        csv_data[var.id] = parsed
+        print(f"  [OK] {var.id} -> {Path(jobs[step][1]).name} (parser: {var.parser}, dim_col: {var.dimension_column})")
+    return csv_data
 
-        # Skip external data sources (not CSV-based)
-        if parser_type == 'external':
-            print(f"  [INFO] {var_id} -> Source externe ({col.get('source', '?')}), pas de CSV")
-            csv_data[var_id] = empty_dfs()
-            continue
 
-        csv_file = find_csv_file(csv_pattern, CSV_SOURCES_DIR)
-        if csv_file:
-            # Get dimension column from variable config if present
-            dim_col = col.get('dimensionColumn')
+def build_prisme_tables(dataset_id, year, csv_data=None):
+    """Tables PRISME d'un dataset pour une année, sans écrire de fichier.
 
-            if parser_type == 'long':
-                csv_data[var_id] = parse_long_format_csv(csv_file)
-            elif parser_type == 'tabular':
-                value_col = col.get('column', 2)
-                year_col = col.get('yearColumn', 0)
-                geo_col = col.get('geoColumn', 1)
-                csv_data[var_id] = parse_tabular_csv(csv_file, value_column=value_col, year_column=year_col, geo_column=geo_col, dimension_column=dim_col, compute_fra_from_fh_dom=col.get('computeFraFromFhDom', False))
-            elif parser_type == 'moca_filter':
-                filter_col = col.get('filterColumn', 4)
-                filter_val = col.get('filterValue', '')
-                year_col = col.get('yearColumn', 3)
-                geo_col = col.get('geoColumn', 5)
-                value_col = col.get('valueColumn', 6)
-                csv_data[var_id] = parse_moca_filter_csv(csv_file, filter_col, filter_val, year_col, geo_col, value_col, dimension_column=dim_col, compute_fra_from_fh_dom=col.get('computeFraFromFhDom', False))
-            else:
-                # Standard moca parser
-                year_col = col.get('yearColumn', 3)
-                geo_col = col.get('geoColumn', 5)
-                value_col = col.get('valueColumn', 6)
-                csv_data[var_id] = parse_moca_csv(csv_file, year_column=year_col, geo_column=geo_col, value_column=value_col, dimension_column=dim_col)
-            print(f"  [OK] {var_id} -> {csv_file.name} (parser: {parser_type}, dim_col: {dim_col})")
+    Supporte 3 types de datasets :
+    - Simple : [geo, annee, var1, var2, ...]
+    - Multi-dimension : [geo, annee, dim, var1, var2, ...]
+      (une ligne par combinaison geo × dimension_value)
+    - Période : [geo, periode, var1, ...] (au lieu d'annee)
+
+    Étape commune à generate_prisme_excel (classeurs + ZIP) et à l'API
+    /api/data de app.py (JSON / Arrow). csv_data (cf. load_dataset_csv)
+    évite de re-parser les CSV quand on enchaîne plusieurs années.
+
+    Returns:
+        {geo_key: (headers, rows)} dans l'ordre de GEO_FOLDER_MAPPING,
+        ou None en cas d'erreur (dataset inconnu, aucun CSV)
+    """
+
+    # Plan compilé du dataset (config validée, colonnes classées, sources)
+    plan = get_plan(dataset_id)
+    if plan is None:
+        print(f"[ERROR] Dataset inconnu: {dataset_id}")
+        print(f"[INFO] Datasets disponibles: {get_available_datasets()}")
+        return None
+
+    print(f"[ENGINE] Generation {dataset_id} ({plan.name}) pour {year}...")
+
+    for var_id in plan.skipped:
+        print(f"  [FILTER] Skipped calculated variable: {var_id}")
+
+    time_col_id = plan.time_col_id
+    variable_ids = plan.variable_ids
+    multi_row_dim = plan.multi_row_dim
+    dim_values = plan.dim_values
+    if plan.has_multi_row_dim:
+        if dim_values:
+            print(f"  [DIM] {multi_row_dim} : {len(dim_values)} valeurs ({', '.join(str(v) for v in dim_values[:5])}{'...' if len(dim_values) > 5 else ''})")
         else:
-            print(f"  [WARN] {var_id} -> Fichier non trouve (pattern: {csv_pattern})")
-            csv_data[var_id] = empty_dfs()
+            print(f"  [WARN] Dimension {multi_row_dim} sans valeurs definies")
+
+    # ---- Charger les données CSV pour chaque variable ----
+    if csv_data is None:
+        csv_data = _load_plan_data(plan)
 
     # ---- Vérifier qu'au moins une variable a des données ----
     vars_with_data = []
@@ -1108,10 +1396,9 @@ def generate_prisme_excel(dataset_id, year):
 
     if not vars_with_data:
         missing_patterns = []
-        for col in var_cols:
-            p = col.get('csvPattern', '?')
-            if col.get('parser') != 'external':
-                missing_patterns.append(f"{col['id']} ({p})")
+        for var in plan.variables:
+            if var.config.get('parser') != 'external':
+                missing_patterns.append(f"{var.id} ({var.csv_pattern or '?'})")
         print(f"[ERROR] Aucun fichier CSV trouvé pour {dataset_id}. Variables manquantes: {', '.join(missing_patterns)}")
         print(f"[ERROR] Placez les fichiers CSV dans: {CSV_SOURCES_DIR}")
         return None
@@ -1119,161 +1406,172 @@ def generate_prisme_excel(dataset_id, year):
     if vars_without_data:
         print(f"  [WARN] Variables sans données: {', '.join(vars_without_data)} (les colonnes seront vides)")
 
-    # ---- Construire les structures de données par niveau géo ----
-    data = {}
-    for geo_key, entities in GEO_ENTITIES.items():
-        rows = []
-        for entity in entities:
-            if dim_values:
-                # Multi-dimension : une ligne par entité × valeur de dimension
-                for dv in dim_values:
-                    row = {GEO_ID_COLS[geo_key]: entity, time_col_id: year, multi_row_dim: dv}
+    with timing.span("fill"):
+        # ---- Construire les structures de données par niveau géo ----
+        data = {}
+        for geo_key, entities in GEO_ENTITIES.items():
+            rows = []
+            for entity in entities:
+                if dim_values:
+                    # Multi-dimension : une ligne par entité × valeur de dimension
+                    for dv in dim_values:
+                        row = {GEO_ID_COLS[geo_key]: entity, time_col_id: year, multi_row_dim: dv}
+                        rows.append(row)
+                else:
+                    # Colonnes dimension non-multi-row avec valeur par défaut
+                    row = {GEO_ID_COLS[geo_key]: entity, time_col_id: year, **plan.default_dims}
                     rows.append(row)
-            else:
-                row = {GEO_ID_COLS[geo_key]: entity, time_col_id: year}
-                # Ajouter les colonnes dimension non-multi-row avec valeur par défaut
-                for dc in dim_cols:
-                    if dc.get('values'):
-                        row[dc['id']] = dc['values'][0]
-                rows.append(row)
-        data[geo_key] = rows
-
-    # ---- Remplir les données pour chaque variable ----
-    for var_id in variable_ids:
-        parsed = csv_data.get(var_id, {})
-        _fill_variable_data(data, var_id, parsed, year, time_col_id, dimension_id=multi_row_dim)
-
-    # ---- Vérifier la couverture par année pour chaque variable ----
-    for var_id in vars_with_data:
-        parsed = csv_data.get(var_id, {})
-        # Check if this variable has data for the requested year
-        has_year_data = False
-        available_years = set()
-        for geo_key, df in parsed.items():
-            if isinstance(df, pd.DataFrame) and not df.empty and 'annee' in df.columns:
-                df_years = set(int(y) for y in df['annee'].unique())
-                available_years.update(df_years)
-                if year in df_years:
-                    has_year_data = True
-        if not has_year_data and available_years:
-            yr_range = f"{min(available_years)}-{max(available_years)}"
-            print(f"  [WARN_YEAR] {var_id} : CSV trouvé mais pas de données pour {year} (couverture: {yr_range})")
-
-    # ---- Vérifier les niveaux géographiques manquants pour chaque variable ----
-    GEO_LABELS = {'com': 'Communes', 'reg': 'Régions', 'dom': 'DOM', 'fh': 'France hexagonale', 'fra': 'France entière'}
-    for var_id in vars_with_data:
-        parsed = csv_data.get(var_id, {})
-        levels_with_data = []
-        levels_without_data = []
-        for geo_key in ['com', 'reg', 'dom', 'fh', 'fra']:
-            df = parsed.get(geo_key, pd.DataFrame())
-            if isinstance(df, pd.DataFrame) and not df.empty:
-                levels_without_data.append(geo_key) if df[df['annee'] == year].empty else levels_with_data.append(geo_key)
-            else:
-                levels_without_data.append(geo_key)
-        if levels_with_data and levels_without_data:
-            missing_labels = ', '.join(GEO_LABELS.get(l, l) for l in levels_without_data)
-            print(f"  [WARN_DATA] {var_id} : données absentes au niveau {missing_labels} — les colonnes seront vides. Vérifiez le fichier CSV source.")
-
-    # ---- Vérifier la couverture partielle des communes ----
-    for var_id in vars_with_data:
-        parsed = csv_data.get(var_id, {})
-        com_df = parsed.get('com', pd.DataFrame())
-        if isinstance(com_df, pd.DataFrame) and not com_df.empty and 'annee' in com_df.columns:
-            com_year = com_df[com_df['annee'] == year]
-            if not com_year.empty:
-                com_with_data = set(com_year['codgeo'].unique())
-                com_expected = set(COMMUNES_GUYANE)
-                missing_com = com_expected - com_with_data
-                if missing_com:
-                    print(f"  [WARN_DATA] {var_id} : {len(com_with_data)}/{len(com_expected)} communes ont des données pour {year}. "
-                          f"Communes sans données (secret stat. ou absence) : {', '.join(str(c) for c in sorted(missing_com))}")
-
-    # ---- Construire l'ordre des colonnes (headers) ----
-    # Suit l'ordre exact du config : geo, time, dimensions, variables
-    col_keys_template = []  # clés pour extraire les données (sans geo qui varie)
-    header_suffixes = []     # noms de colonnes (sans geo qui varie)
-
-    for c in columns:
-        if c['type'] == 'geo_id':
-            continue  # géré séparément (varie par niveau)
-        elif c['type'] in ('year', 'period'):
-            col_keys_template.append(c['id'])
-            header_suffixes.append(c['id'])
-        elif c['type'] == 'dimension':
-            col_keys_template.append(c['id'])
-            header_suffixes.append(c['id'])
-        elif c['type'] == 'variable':
-            if is_calculated_variable(c):
-                # Sécurité : ne jamais écrire une variable calculée dans l'Excel
-                continue
-            col_keys_template.append(c['id'])
-            header_suffixes.append(c['id'])
-
-    # ---- Noms fichier/dossier ----
-    file_name = config.get('fileName', dataset_id)
-    folder_path = config.get('folderPath', dataset_id.capitalize())
-    theme_folder_name = folder_path.split('/')[-1] if '/' in folder_path else folder_path
-
-    # ---- Dossier temporaire ----
-    temp_base = Path(tempfile.mkdtemp())
-    root_theme_dir = temp_base / theme_folder_name / str(year)
-    root_theme_dir.mkdir(parents=True)
-
-    # ---- Générer un fichier Excel par niveau géographique ----
-    for geo_key, folder_name in GEO_FOLDER_MAPPING.items():
-        sub_dir = root_theme_dir / folder_name
-        sub_dir.mkdir(exist_ok=True)
-
-        wb = Workbook()
-        wb.remove(wb.active)
-
-        id_col = GEO_ID_COLS[geo_key]
-        ws = wb.create_sheet(geo_key)
-
-        headers = [id_col] + header_suffixes
-        col_keys = [id_col] + col_keys_template
-
-        _write_sheet(ws, headers, data[geo_key], col_keys)
-
-        wb.save(sub_dir / f"{file_name}.xlsx")
-
-    # ---- Fichier Consolidé ----
-    print(f"  [INFO] Generation fichier consolide...")
-    wb_cons = Workbook()
-    wb_cons.remove(wb_cons.active)
-
+            data[geo_key] = rows
+
+        # ---- Remplir les données pour chaque variable ----
+        for var_id in variable_ids:
+            parsed = csv_data.get(var_id, {})
+            _fill_variable_data(data, var_id, parsed, year, time_col_id, dimension_id=multi_row_dim)
+
+    with timing.span("validate"):
+        # ---- Vérifier la couverture par année pour chaque variable ----
+        for var_id in vars_with_data:
+            parsed = csv_data.get(var_id, {})
+            # Check if this variable has data for the requested year
+            has_year_data = False
+            available_years = set()
+            for geo_key, df in parsed.items():
+                if isinstance(df, pd.DataFrame) and not df.empty and 'annee' in df.columns:
+                    df_years = set(int(y) for y in df['annee'].unique())
+                    available_years.update(df_years)
+                    if year in df_years:
+                        has_year_data = True
+            if not has_year_data and available_years:
+                yr_range = f"{min(available_years)}-{max(available_years)}"
+                print(f"  [WARN_YEAR] {var_id} : CSV trouvé mais pas de données pour {year} (couverture: {yr_range})")
+
+        # ---- Vérifier les niveaux géographiques manquants pour chaque variable ----
+        GEO_LABELS = {'com': 'Communes', 'reg': 'Régions', 'dom': 'DOM', 'fh': 'France hexagonale', 'fra': 'France entière'}
+        for var_id in vars_with_data:
+            parsed = csv_data.get(var_id, {})
+            levels_with_data = []
+            levels_without_data = []
+            for geo_key in ['com', 'reg', 'dom', 'fh', 'fra']:
+                df = parsed.get(geo_key, pd.DataFrame())
+                if isinstance(df, pd.DataFrame) and not df.empty:
+                    levels_without_data.append(geo_key) if df[df['annee'] == year].empty else levels_with_data.append(geo_key)
+                else:
+                    levels_without_data.append(geo_key)
+            if levels_with_data and levels_without_data:
+                missing_labels = ', '.join(GEO_LABELS.get(l, l) for l in levels_without_data)
+                print(f"  [WARN_DATA] {var_id} : données absentes au niveau {missing_labels} — les colonnes seront vides. Vérifiez le fichier CSV source.")
+
+        # ---- Vérifier la couverture partielle des communes ----
+        for var_id in vars_with_data:
+            parsed = csv_data.get(var_id, {})
+            com_df = parsed.get('com', pd.DataFrame())
+            if isinstance(com_df, pd.DataFrame) and not com_df.empty and 'annee' in com_df.columns:
+                com_year = com_df[com_df['annee'] == year]
+                if not com_year.empty:
+                    com_with_data = set(com_year['codgeo'].unique())
+                    com_expected = set(COMMUNES_GUYANE)
+                    missing_com = com_expected - com_with_data
+                    if missing_com:
+                        print(f"  [WARN_DATA] {var_id} : {len(com_with_data)}/{len(com_expected)} communes ont des données pour {year}. "
+                              f"Communes sans données (secret stat. ou absence) : {', '.join(str(c) for c in sorted(missing_com))}")
+
+    tables = {}
     for geo_key in GEO_FOLDER_MAPPING:
-        id_col = GEO_ID_COLS[geo_key]
-        ws = wb_cons.create_sheet(geo_key)
+        tables[geo_key] = (list(plan.headers[geo_key]),
+                           _sheet_rows(data[geo_key], plan.row_keys[geo_key]))
+    return tables
 
-        headers = [id_col] + header_suffixes
-        col_keys = [id_col] + col_keys_template
 
-        _write_sheet(ws, headers, data[geo_key], col_keys)
+def load_dataset_csv(dataset_id):
+    """CSV parsés d'un dataset, toutes années (réutilisables par build_prisme_tables)."""
+    plan = get_plan(dataset_id)
+    if plan is None:
+        return {}
+    return _load_plan_data(plan)
 
-    cons_filename = f"{file_name}_consolidated_{year}.xlsx"
-    wb_cons.save(root_theme_dir / cons_filename)
-    print(f"  [OK] Fichier consolide cree: {cons_filename}")
 
-    # ---- ZIP final ----
-    zip_filename = f"{file_name}_{year}.zip"
-    zip_path = OUTPUT_DIR / zip_filename
-
-    if zip_path.exists():
-        zip_path.unlink()
+def generate_prisme_excel(dataset_id, year, formats=None):
+    """Génère une archive ZIP contenant les fichiers Excel PRISME.
 
-    shutil.make_archive(
-        str(OUTPUT_DIR / f"{file_name}_{year}"),
-        'zip',
-        str(temp_base),
-        theme_folder_name
-    )
+    Args:
+        dataset_id: Identifiant du dataset (ex: 'educ', 'pers_sup65ans_seules')
+        year: Année ou période à générer (ex: 2021 ou '2015-2020')
+        formats: "xlsx", "parquet", "csv" ou combinaison (cf. sidecar.py) ;
+            défaut PRISME_OUTPUT_FORMATS, sinon xlsx seul
 
-    shutil.rmtree(temp_base)
+    Returns:
+        Path du fichier ZIP généré ou None en cas d'erreur
+    """
 
-    print(f"[OK] Archive generee: {zip_path}")
-    return zip_path
+    with profiler.profile("prisme", dataset=dataset_id, year=year), \
+            timing.job("prisme", dataset=dataset_id, year=year):
+        formats = sidecar.resolve_formats(formats)
+
+        tables = build_prisme_tables(dataset_id, year)
+        if tables is None:
+            return None
+        plan = get_plan(dataset_id)
+
+        # ---- Noms fichier/dossier ----
+        file_name = plan.file_name
+        theme_folder_name = plan.theme_folder_name
+
+        # ---- Dossier temporaire ----
+        temp_base = Path(tempfile.mkdtemp(prefix="prisme_"))  # prefixe : nettoyage au demarrage (retention.js)
+        root_theme_dir = temp_base / theme_folder_name / str(year)
+        root_theme_dir.mkdir(parents=True)
+
+        with timing.span("write_xlsx"):
+            # ---- Générer un fichier Excel par niveau géographique ----
+            for geo_key, folder_name in GEO_FOLDER_MAPPING.items():
+                sub_dir = root_theme_dir / folder_name
+                sub_dir.mkdir(exist_ok=True)
+
+                wb = Workbook()
+                wb.remove(wb.active)
+
+                ws = wb.create_sheet(geo_key)
+                headers, rows = tables[geo_key]
+                _write_sheet(ws, headers, rows)
+
+                if "xlsx" in formats:
+                    reproducible.save_workbook(wb, sub_dir / f"{file_name}.xlsx")
+                if sidecar.wants_sidecar(formats):
+                    sidecar.write_tables(sub_dir / f"{file_name}.xlsx", [(geo_key, headers, rows)], formats)
+
+            # ---- Fichier Consolidé ----
+            print(f"  [INFO] Generation fichier consolide...")
+            wb_cons = Workbook()
+            wb_cons.remove(wb_cons.active)
+
+            for geo_key in GEO_FOLDER_MAPPING:
+                ws = wb_cons.create_sheet(geo_key)
+                headers, rows = tables[geo_key]
+                _write_sheet(ws, headers, rows)
+
+            cons_filename = f"{file_name}_consolidated_{year}.xlsx"
+            if "xlsx" in formats:
+                reproducible.save_workbook(wb_cons, root_theme_dir / cons_filename)
+            if sidecar.wants_sidecar(formats):
+                sidecar.write_tables(root_theme_dir / cons_filename,
+                                     [(geo_key, *tables[geo_key]) for geo_key in GEO_FOLDER_MAPPING], formats)
+            print(f"  [OK] Fichier consolide cree: {cons_filename}")
+
+        with timing.span("zip"):
+            # ---- ZIP final ----
+            zip_filename = f"{file_name}_{year}.zip"
+            zip_path = OUTPUT_DIR / zip_filename
+
+            # Sidecars hors du livrable (archive interne, cf. sidecar.extract_pack)
+            sidecar.extract_pack(zip_path, temp_base, theme_folder_name)
+            # Archive existante de meme contenu conservee (ETag inchange)
+            reproducible.make_archive(OUTPUT_DIR / f"{file_name}_{year}", temp_base, theme_folder_name)
+
+            shutil.rmtree(temp_base)
+
+        timing.incr("bytes_written", zip_path.stat().st_size)
+        print(f"[OK] Archive generee: {zip_path}")
+        return zip_path
 
 
 # ============================================================================
@@ -1282,7 +1580,7 @@ def generate_prisme_excel(dataset_id, year):
 
 def get_datasets_info():
     """Retourne les infos de tous les datasets pour l'API."""
-    datasets = THEMES_CONFIG.get('datasets', {})
+    datasets = current_config().get('datasets', {})
     result = {}
     for ds_id, ds_config in datasets.items():
         result[ds_id] = {
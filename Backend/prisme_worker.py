@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+PRISME - Worker Python persistant pour file_server.js
+
+Evite de payer a chaque requete le demarrage de l'interpreteur, l'import de
+pandas/openpyxl et le chargement de themes_config.json : file_server.js lance
+un (ou quelques) worker(s) au demarrage et leur parle en JSON-RPC ligne a ligne
+sur stdin/stdout.
+
+Requete  : {"id": 1, "method": "generate_prisme_excel", "params": {"dataset_id": "educ", "year": 2022}}
+Reponse  : {"id": 1, "ok": true,  "result": {...}, "stdout": "...", "stderr": "..."}
+           {"id": 1, "ok": false, "error": "...", "traceback": "...", "stdout": "...", "stderr": "..."}
+
+Les methodes de generation acceptent "profile": true (cf. profiler.py) et
+renvoient alors "profile_id" dans result ; result.job resume le job (durees
+et pic memoire par etape). Chaque reponse porte "memory" (RSS, usage et
+pression vs budget, cf. memory.py) : python_worker.js s'en sert pour reduire
+le nombre de generations simultanees.
+
+stdout/stderr contiennent les print() du moteur pendant l'appel (les lignes
+[WARN_YEAR]/[WARN_DATA] sont toujours analysees cote Node). Tout ce que le
+moteur ecrit sur le descripteur 1 est redirige vers stderr : seul le canal
+protocole ecrit sur le vrai stdout.
+
+Usage :
+    python prisme_worker.py                        # boucle JSON-RPC (file_server.js)
+    python prisme_worker.py --once <methode> '<params json>'
+                                                   # un seul appel (repli sans worker)
+"""
+import io
+import json
+import os
+import sys
+import time
+import traceback
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+sys.path.insert(0, str(BASE_DIR))
+
+import memory    # legers (stdlib)
+import profiler
+import timing
+
+# Jobs chronometres (timings.jsonl, pic memoire par etape) : resume renvoye
+# dans result.job ; PRISME_METRICS=0 pour couper, comme app.py.
+if os.environ.get("PRISME_METRICS", "1") != "0":
+    timing.enable()
+
+STARTED_AT = time.time()
+
+_state = {"calls": 0}
+
+
+# ============================================================================
+# Moteurs (imports paresseux, gardes chauds entre les appels)
+# ============================================================================
+
+def _prisme_engine():
+    # themes_config.json est relu par le moteur lui-meme quand son mtime
+    # change (prisme_engine.current_config, plans compiles invalides).
+    import prisme_engine
+    return prisme_engine
+
+
+def _opendata_engine():
+    import generate_from_opendata
+    return generate_from_opendata
+
+
+def _consolidated_engine():
+    import generate_mocao_consolidated
+    return generate_mocao_consolidated
+
+
+def warm_up():
+    """Importe les moteurs une fois au demarrage (pandas, openpyxl, config)."""
+    t0 = time.time()
+    for loader in (_prisme_engine, _opendata_engine, _consolidated_engine):
+        try:
+            loader()
+        except Exception as e:
+            print(f"[WARN] worker warm-up {loader.__name__}: {e}", file=sys.stderr)
+    print(f"[INFO] worker {os.getpid()} pret en {time.time() - t0:.2f}s", file=sys.stderr)
+
+
+# ============================================================================
+# Methodes exposees
+# ============================================================================
+
+def rpc_ping():
+    return {
+        "pid": os.getpid(),
+        "uptime": round(time.time() - STARTED_AT, 1),
+        "calls": _state["calls"],
+        "engines": [m for m in ("prisme_engine", "generate_from_opendata",
+                                "generate_mocao_consolidated") if m in sys.modules],
+    }
+
+
+def _with_profile(result, prof, cap):
+    """Ajoute l'identifiant du profil ecrit (cf. profiler.py) et le resume du
+    job (timing.capture) au resultat."""
+    if prof.job_id:
+        result["profile_id"] = prof.job_id
+    job = cap.summary()
+    if job is not None:
+        result["job"] = job
+    return result
+
+
+def rpc_generate_prisme_excel(dataset_id, year, profile=False):
+    with profiler.request(force=profile) as prof, timing.capture() as cap:
+        zip_path = _prisme_engine().generate_prisme_excel(dataset_id, int(year))
+    if not zip_path:
+        raise RuntimeError("Generation failed")
+    return _with_profile({"filename": Path(zip_path).name}, prof, cap)
+
+
+def rpc_detect_available_years(dataset_id):
+    return {"years": _prisme_engine().detect_available_years(dataset_id)}
+
+
+def rpc_generate_theme(theme, year, profile=False):
+    engine = _opendata_engine()
+    if theme not in engine.THEME_CONFIGS:
+        raise ValueError(f"Theme inconnu: {theme}")
+    with profiler.request(force=profile) as prof, timing.capture() as cap:
+        engine.generate_theme(theme, int(year))
+    return _with_profile({"filename": f"{theme}_opendata_{int(year)}.zip"}, prof, cap)
+
+
+def rpc_detect_available_years_opendata(dataset):
+    return {"years": _opendata_engine().detect_available_years_opendata(dataset)}
+
+
+def rpc_generate_consolidated(dataset_id, year_start, year_end, source="moca", profile=False):
+    with profiler.request(force=profile) as prof, timing.capture() as cap:
+        out_path = _consolidated_engine().generate_consolidated(
+            dataset_id, int(year_start), int(year_end), source)
+    return _with_profile({"filename": out_path.name}, prof, cap)
+
+
+def rpc_prewarm_targets():
+    """Liste de pre-calcul par defaut : derniere annee de chaque dataset.
+
+    MOCA-O : datasets de themes_config.json (annees detectees dans les CSV).
+    Open Data : themes de THEME_CONFIGS (equivalent dynamique d'OPENDATA_YEARS
+    d'app.py, annees scannees dans inputs/opendata).
+    """
+    targets = []
+    engine = _prisme_engine()
+    for dataset_id in engine.get_available_datasets():
+        try:
+            years = engine.detect_available_years(dataset_id)
+        except Exception as e:
+            print(f"[WARN] prewarm {dataset_id}: {e}")
+            continue
+        if years:
+            targets.append({"source": "moca", "theme": dataset_id, "year": max(years)})
+    opendata = _opendata_engine()
+    for theme in opendata.THEME_CONFIGS:
+        years = opendata.detect_available_years_opendata(theme)
+        if years:
+            targets.append({"source": "opendata", "theme": theme, "year": max(years)})
+    return {"targets": targets}
+
+
+METHODS = {
+    "ping": rpc_ping,
+    "generate_prisme_excel": rpc_generate_prisme_excel,
+    "detect_available_years": rpc_detect_available_years,
+    "generate_theme": rpc_generate_theme,
+    "detect_available_years_opendata": rpc_detect_available_years_opendata,
+    "generate_consolidated": rpc_generate_consolidated,
+    "prewarm_targets": rpc_prewarm_targets,
+}
+
+
+# ============================================================================
+# Boucle JSON-RPC
+# ============================================================================
+
+class _Tee(io.TextIOBase):
+    """Capture les ecritures d'un appel tout en les relayant (logs Node)."""
+
+    def __init__(self, relay):
+        self.relay = relay
+        self.buffer_ = io.StringIO()
+
+    def write(self, s):
+        self.buffer_.write(s)
+        try:
+            self.relay.write(s)
+            self.relay.flush()
+        except Exception:
+            pass
+        return len(s)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return self.buffer_.getvalue()
+
+
+def handle(request, relay):
+    """Execute une requete et retourne la reponse (dict serialisable)."""
+    req_id = request.get("id")
+    method = request.get("method")
+    params = request.get("params") or {}
+    fn = METHODS.get(method)
+    if fn is None:
+        return {"id": req_id, "ok": False, "error": f"Methode inconnue: {method}"}
+
+    out, err = _Tee(relay), _Tee(relay)
+    saved = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = out, err
+    try:
+        result = fn(**params)
+        response = {"id": req_id, "ok": True, "result": result}
+    except Exception as e:
+        response = {
+            "id": req_id,
+            "ok": False,
+            "error": str(e) or e.__class__.__name__,
+            "traceback": traceback.format_exc(),
+        }
+    finally:
+        sys.stdout, sys.stderr = saved
+        _state["calls"] += 1
+    response["stdout"] = out.getvalue()
+    response["stderr"] = err.getvalue()
+    response["memory"] = memory.report()
+    return response
+
+
+def _protocol_channel():
+    """Isole le vrai stdout pour le protocole ; le fd 1 part vers stderr."""
+    proto = os.fdopen(os.dup(1), "w", encoding="utf-8", newline="\n")
+    os.dup2(2, 1)
+    sys.stdout = io.TextIOWrapper(os.fdopen(1, "wb", closefd=False),
+                                  encoding="utf-8", errors="replace", line_buffering=True)
+    return proto
+
+
+def serve():
+    proto = _protocol_channel()
+    sys.stdin.reconfigure(encoding="utf-8")
+    relay = sys.stderr
+    if os.environ.get("PRISME_WORKER_WARMUP", "1") != "0":
+        warm_up()
+    proto.write(json.dumps({"id": None, "ok": True, "result": {"ready": True, "pid": os.getpid()}}) + "\n")
+    proto.flush()
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = {"id": None, "ok": False, "error": f"JSON invalide: {e}"}
+        else:
+            if request.get("method") == "shutdown":
+                break
+            response = handle(request, relay)
+        proto.write(json.dumps(response, default=str, ensure_ascii=False) + "\n")
+        proto.flush()
+
+
+def run_once(method, params_json):
+    proto = _protocol_channel()
+    request = {"id": 0, "method": method, "params": json.loads(params_json or "{}")}
+    response = handle(request, sys.stderr)
+    proto.write(json.dumps(response, default=str, ensure_ascii=False) + "\n")
+    proto.flush()
+    return 0 if response.get("ok") else 1
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "--once":
+        sys.exit(run_once(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else "{}"))
+    serve()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+PRISME - Profilage a la demande des generations (cProfile + flamegraph).
+
+Les points d'entree des moteurs (generate_prisme_excel, generate_theme,
+generate_consolidated / build_consolidated_xlsx) s'executent dans
+profiler.profile(...). Le profilage est coupe par defaut ; il s'active :
+    - pour toutes les generations : PRISME_PROFILE=1
+    - pour un appel : with profiler.request(force=True) as prof: ...
+      (?profile=1 sur les endpoints de generation), prof.job_id ensuite
+
+Chaque generation profilee ecrit PRISME_STATE_DIR/profiles/<job_id>/ :
+    profile.prof       cProfile (pstats, snakeviz, gprof2dot...)
+    stacks.collapsed   piles echantillonnees (flamegraph.pl, speedscope)
+    meta.json          labels, duree, statut, fonctions les plus couteuses
+
+Les piles sont relevees par un thread d'echantillonnage (sys._current_frames
+toutes les PRISME_PROFILE_INTERVAL ms) sur le thread de la generation. Les
+workers de parsing en processus (PRISME_PARSE_POOL=process) n'y figurent pas.
+Un profilage ouvert dans un autre est sans effet (un seul profil par job).
+"""
+import contextvars
+import cProfile
+import json
+import os
+import pstats
+import re
+import shutil
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+STATE_DIR = Path(os.environ.get("PRISME_STATE_DIR", BASE_DIR / "state"))
+PROFILES_DIR = STATE_DIR / "profiles"
+
+ENABLED = os.environ.get("PRISME_PROFILE", "0").lower() in ("1", "true", "yes", "on")
+SAMPLE_INTERVAL = float(os.environ.get("PRISME_PROFILE_INTERVAL", "5")) / 1000
+MAX_PROFILES = int(os.environ.get("PRISME_PROFILE_KEEP", "50"))
+TOP_FUNCTIONS = 30
+
+FILES = {
+    "prof": "profile.prof",
+    "collapsed": "stacks.collapsed",
+    "json": "meta.json",
+}
+
+_JOB_ID_RE = re.compile(r"^[A-Za-z0-9_.-]{1,120}$")
+
+_requested = contextvars.ContextVar("prisme_profile_request", default=None)
+_active = contextvars.ContextVar("prisme_profile_active", default=False)
+_prune_lock = threading.Lock()
+
+
+class _Null:
+    """Contexte vide rendu quand le profilage est coupe."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _Null()
+
+
+def enable(flag=True):
+    global ENABLED
+    ENABLED = bool(flag)
+
+
+class Request:
+    """Demande de profilage d'un appel ; job_id renseigne apres la generation."""
+    __slots__ = ("force", "job_id", "token")
+
+    def __init__(self, force):
+        self.force = force
+        self.job_id = None
+
+    def __enter__(self):
+        self.token = _requested.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _requested.reset(self.token)
+        return False
+
+
+def request(force=False):
+    """with request(force=...) as prof : force le profilage (si force) et
+    recupere l'identifiant du profil ecrit (prof.job_id, None sinon)."""
+    return Request(bool(force))
+
+
+# ============================================================================
+# ECHANTILLONNAGE DES PILES
+# ============================================================================
+
+def _frame_name(code):
+    return f"{Path(code.co_filename).stem}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class _Sampler(threading.Thread):
+    """Releve la pile d'un thread a intervalle fixe -> {pile repliee: nb}."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name="prisme-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+                self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# ============================================================================
+# PROFIL D'UN JOB
+# ============================================================================
+
+def _slug(kind, labels):
+    parts = [kind] + [str(v) for v in labels.values() if v is not None]
+    return re.sub(r"[^A-Za-z0-9_.-]+", "-", "_".join(parts))[:80]
+
+
+def _top_functions(stats, limit=TOP_FUNCTIONS):
+    rows = []
+    for (filename, line, func), (cc, nc, tt, ct, _callers) in stats.stats.items():
+        rows.append({
+            "function": f"{Path(filename).name}:{line}({func})" if line else func,
+            "calls": nc,
+            "tottime": round(tt, 6),
+            "cumtime": round(ct, 6),
+        })
+    rows.sort(key=lambda r: r["cumtime"], reverse=True)
+    return rows[:limit]
+
+
+class _Profile:
+    __slots__ = ("kind", "labels", "job_id", "prof", "sampler", "token", "t0", "started_at")
+
+    def __init__(self, kind, labels):
+        self.kind = kind
+        self.labels = {k: v if isinstance(v, (int, float, bool)) or v is None else str(v)
+                       for k, v in labels.items()}
+        self.job_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{_slug(kind, self.labels)}_{uuid.uuid4().hex[:6]}"
+
+    def __enter__(self):
+        self.token = _active.set(True)
+        self.started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.sampler = _Sampler(threading.get_ident(), SAMPLE_INTERVAL)
+        self.sampler.start()
+        self.prof = cProfile.Profile()
+        try:
+            self.prof.enable()
+        except ValueError as e:
+            # Un autre profileur tient deja l'interpreteur : piles seules
+            print(f"[WARN] profiler : cProfile indisponible ({e}), echantillonnage seul")
+            self.prof = None
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.t0
+        if self.prof is not None:
+            self.prof.disable()
+        self.sampler.stop()
+        _active.reset(self.token)
+        try:
+            self._write(seconds, exc_type, exc)
+        except OSError as e:
+            print(f"[WARN] profiler : ecriture du profil {self.job_id} impossible ({e})")
+            return False
+        req = _requested.get()
+        if req is not None and req.job_id is None:
+            req.job_id = self.job_id
+        print(f"[INFO] Profil {self.job_id} ({seconds:.2f}s, {self.sampler.samples} echantillons)")
+        return False
+
+    def _write(self, seconds, exc_type, exc):
+        out = PROFILES_DIR / self.job_id
+        out.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "labels": self.labels,
+            "started_at": self.started_at,
+            "seconds": round(seconds, 6),
+            "status": "ok" if exc_type is None else "error",
+            "samples": self.sampler.samples,
+            "sample_interval_ms": round(SAMPLE_INTERVAL * 1000, 3),
+            "files": [FILES["collapsed"]],
+            "top": [],
+        }
+        if exc_type is not None:
+            meta["error"] = f"{exc_type.__name__}: {exc}"
+        if self.prof is not None:
+            self.prof.dump_stats(str(out / FILES["prof"]))
+            meta["files"].insert(0, FILES["prof"])
+            meta["top"] = _top_functions(pstats.Stats(self.prof))
+        with open(out / FILES["collapsed"], "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.sampler.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        (out / FILES["json"]).write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+        _prune()
+
+
+def profile(kind, **labels):
+    """Profile le bloc si PRISME_PROFILE ou request(force=True) ; sinon contexte vide."""
+    if _active.get():
+        return _NULL
+    req = _requested.get()
+    if not (ENABLED or (req is not None and req.force)):
+        return _NULL
+    return _Profile(kind, labels)
+
+
+def _prune():
+    """Ne garde que les MAX_PROFILES profils les plus recents."""
+    if MAX_PROFILES <= 0:
+        return
+    with _prune_lock:
+        dirs = sorted((d for d in PROFILES_DIR.iterdir() if d.is_dir()), key=lambda d: d.name)
+        for d in dirs[:-MAX_PROFILES]:
+            shutil.rmtree(d, ignore_errors=True)
+
+
+# ============================================================================
+# LECTURE (endpoints /api/jobs/{id}/profile)
+# ============================================================================
+
+def find(job_id):
+    """Dossier du profil job_id, ou None (identifiant invalide ou inconnu)."""
+    if not job_id or not _JOB_ID_RE.match(job_id) or job_id.startswith("."):
+        return None
+    path = PROFILES_DIR / job_id
+    return path if (path / FILES["json"]).is_file() else None
+
+
+def read_meta(job_id):
+    path = find(job_id)
+    if path is None:
+        return None
+    return json.loads((path / FILES["json"]).read_text(encoding="utf-8"))
+
+
+def list_profiles(limit=50):
+    """Metadonnees des profils les plus recents d'abord."""
+    if not PROFILES_DIR.is_dir():
+        return []
+    out = []
+    for d in sorted(PROFILES_DIR.iterdir(), key=lambda d: d.name, reverse=True):
+        meta = read_meta(d.name)
+        if meta is not None:
+            meta.pop("top", None)
+            out.append(meta)
+        if len(out) >= limit:
+            break
+    return out
@@ -0,0 +1,97 @@
+// ============================================================
+// Module profiles : profils des generations (cf. profiler.py).
+//
+// Une generation lancee avec ?profile=1 (ou tout le worker sous
+// PRISME_PROFILE=1) laisse dans PRISME_STATE_DIR/profiles/<id>/ :
+//   profile.prof       cProfile (pstats, snakeviz)
+//   stacks.collapsed   piles repliees (flamegraph.pl, speedscope)
+//   meta.json          labels, duree, fonctions les plus couteuses
+//
+//   GET /api/jobs                                   -> { success, profiles }
+//   GET /api/jobs/<id>/profile                      -> meta.json
+//   GET /api/jobs/<id>/profile?format=prof|collapsed -> fichier brut
+// ============================================================
+
+const fs = require('fs');
+const path = require('path');
+
+const STATE_DIR = process.env.PRISME_STATE_DIR || path.join(__dirname, 'state');
+const PROFILES_DIR = path.join(STATE_DIR, 'profiles');
+const JOB_ID_RE = /^[A-Za-z0-9_.-]{1,120}$/;
+
+const FORMATS = {
+    json: { file: 'meta.json', type: 'application/json; charset=utf-8' },
+    prof: { file: 'profile.prof', type: 'application/octet-stream' },
+    collapsed: { file: 'stacks.collapsed', type: 'text/plain; charset=utf-8' },
+};
+
+function jsonResponse(res, statusCode, data) {
+    res.writeHead(statusCode, {
+        'Content-Type': 'application/json; charset=utf-8',
+        'Cache-Control': 'no-store',
+    });
+    res.end(JSON.stringify(data));
+}
+
+function readMeta(id) {
+    try {
+        return JSON.parse(fs.readFileSync(path.join(PROFILES_DIR, id, 'meta.json'), 'utf8'));
+    } catch (e) {
+        return null;
+    }
+}
+
+function listProfiles(limit = 50) {
+    let ids = [];
+    try {
+        ids = fs.readdirSync(PROFILES_DIR).filter(id => JOB_ID_RE.test(id)).sort().reverse();
+    } catch (e) {
+        return [];
+    }
+    const out = [];
+    for (const id of ids) {
+        const meta = readMeta(id);
+        if (!meta) continue;
+        delete meta.top;
+        out.push(meta);
+        if (out.length >= limit) break;
+    }
+    return out;
+}
+
+function handleProfiles(req, res, urlPath, url) {
+    if (req.method !== 'GET') return false;
+
+    if (urlPath === '/jobs') {
+        jsonResponse(res, 200, { success: true, profiles: listProfiles() });
+        return true;
+    }
+
+    const m = urlPath.match(/^\/jobs\/([^/]+)\/profile$/);
+    if (!m) return false;
+
+    const id = decodeURIComponent(m[1]);
+    const format = FORMATS[url.searchParams.get('format') || 'json'];
+    if (!format) {
+        jsonResponse(res, 400, { success: false, error: 'format attendu : json, prof ou collapsed' });
+        return true;
+    }
+    if (!JOB_ID_RE.test(id) || id.startsWith('.') || !readMeta(id)) {
+        jsonResponse(res, 404, { success: false, error: `Profil introuvable : ${id}` });
+        return true;
+    }
+    const filePath = path.join(PROFILES_DIR, id, format.file);
+    if (!fs.existsSync(filePath)) {
+        jsonResponse(res, 404, { success: false, error: `${format.file} absent pour ${id}` });
+        return true;
+    }
+    const headers = { 'Content-Type': format.type, 'Cache-Control': 'no-store' };
+    if (format.file !== 'meta.json') {
+        headers['Content-Disposition'] = `attachment; filename="${id}_${format.file}"`;
+    }
+    res.writeHead(200, headers);
+    fs.createReadStream(filePath).pipe(res);
+    return true;
+}
+
+module.exports = { handleProfiles };
@@ -0,0 +1,360 @@
+// ============================================================
+// Module python_worker : pool de workers Python persistants.
+//
+// Remplace le spawn d'un interpreteur (et l'ecriture d'un script
+// jetable) a chaque generation : les workers prisme_worker.py gardent
+// pandas/openpyxl, themes_config.json et les moteurs charges, et
+// recoivent les appels en JSON-RPC ligne a ligne sur stdin/stdout.
+//
+//   call(method, params, { timeoutMs, priority })
+//     -> Promise<{ result, stdout, stderr }>   (rejet : Error + .stdout/.stderr)
+//
+// priority 'background' (pre-calcul, cf. prewarm.js) : l'appel ne part
+// que si aucun appel interactif n'attend, et n'occupe jamais plus de
+// maxConcurrent() - 1 workers pour en laisser un libre aux requetes
+// utilisateur (sous pression memoire : aucun). Avec un seul worker
+// (PRISME_WORKERS=1, ou 0 en repli) les appels 'background' sont refuses.
+//
+// Memoire : chaque reponse du worker porte son etat memoire (memory.py).
+// Au-dela de PRISME_MEMORY_SOFT (0.75) du budget (PRISME_MEMORY_BUDGET_MB
+// sinon budget vu par les workers), un seul appel part a la fois : les
+// suivants attendent la fin du precedent plutot que de declencher l'OOM.
+//
+// Sante : ping periodique, respawn automatique sur crash / timeout.
+// Repli : si aucun worker n'a pu demarrer (ou PRISME_WORKERS=0), l'appel
+// est execute par `prisme_worker.py --once` (un process par requete).
+// ============================================================
+
+const fs = require('fs');
+const path = require('path');
+const { spawn } = require('child_process');
+
+const WORKER_SCRIPT = path.join(__dirname, 'prisme_worker.py');
+const POOL_SIZE = Math.max(0, parseInt(process.env.PRISME_WORKERS || '2', 10) || 0);
+const CALL_TIMEOUT_MS = parseInt(process.env.PRISME_WORKER_TIMEOUT_MS || String(15 * 60 * 1000), 10);
+const PING_INTERVAL_MS = 30 * 1000;
+const PING_TIMEOUT_MS = 10 * 1000;
+const RESPAWN_DELAY_MS = 1000;
+const RESPAWN_DELAY_MAX_MS = 30 * 1000;
+const MEMORY_BUDGET_MB = parseFloat(process.env.PRISME_MEMORY_BUDGET_MB || '0') || null;
+const MEMORY_SOFT_RATIO = parseFloat(process.env.PRISME_MEMORY_SOFT || '0.75');
+
+let options = { pythonExe: 'py', cwd: __dirname, log: () => {} };
+const workers = [];
+const queue = [];            // appels interactifs
+const backgroundQueue = [];  // pre-calculs (cedent la place aux appels interactifs)
+let nextId = 1;
+let stopping = false;
+let pingTimer = null;
+
+function createWorker(slot) {
+    const w = {
+        slot,
+        child: null,
+        ready: false,
+        busy: null,          // appel en cours { id, method, resolve, reject, timer }
+        pingPending: null,
+        restarts: workers[slot] ? workers[slot].restarts : 0,
+        respawnDelay: workers[slot] ? workers[slot].respawnDelay : RESPAWN_DELAY_MS,
+        lastError: null,
+        pid: null,
+        memory: null,        // dernier etat memoire rapporte (rss_mb, usage_mb, budget_mb, pressure)
+    };
+    workers[slot] = w;
+
+    let child;
+    try {
+        child = spawn(options.pythonExe, [WORKER_SCRIPT], {
+            cwd: options.cwd,
+            env: { ...process.env, PYTHONIOENCODING: 'utf-8', PYTHONUNBUFFERED: '1' },
+        });
+    } catch (e) {
+        w.lastError = e.message;
+        scheduleRespawn(w);
+        return w;
+    }
+    w.child = child;
+    w.pid = child.pid;
+    child.stdin.on('error', () => { });   // EPIPE si le worker meurt : gere par 'exit'
+
+    let buffer = '';
+    child.stdout.on('data', (data) => {
+        buffer += data.toString('utf8');
+        let idx;
+        while ((idx = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, idx).trim();
+            buffer = buffer.slice(idx + 1);
+            if (line) onMessage(w, line);
+        }
+    });
+
+    child.stderr.on('data', (data) => {
+        const text = data.toString('utf8').trim();
+        if (text) console.log(`   [py${slot}] ${text}`);
+    });
+
+    child.on('error', (err) => {
+        w.lastError = err.message;
+        options.log('WARN', `Worker Python ${slot} : ${err.message}`);
+        if (!child.pid && w.child === child) {
+            // Interpreteur introuvable : pas d'evenement exit, on bascule en repli.
+            w.child = null;
+            if (!poolAvailable()) flushToFallback();
+            scheduleRespawn(w);
+        }
+    });
+
+    child.on('exit', (code, signal) => {
+        if (w.child !== child) return;
+        w.child = null;
+        w.ready = false;
+        const msg = `Worker Python ${slot} arrete (code=${code}, signal=${signal})`;
+        if (w.busy) failCall(w, new Error(msg));
+        if (w.pingPending) { clearTimeout(w.pingPending.timer); w.pingPending = null; }
+        if (!stopping) {
+            options.log('WARN', msg);
+            scheduleRespawn(w);
+        }
+    });
+
+    return w;
+}
+
+function scheduleRespawn(w) {
+    if (stopping) return;
+    const delay = w.respawnDelay;
+    w.respawnDelay = Math.min(delay * 2, RESPAWN_DELAY_MAX_MS);
+    setTimeout(() => {
+        if (stopping) return;
+        w.restarts += 1;
+        createWorker(w.slot);
+    }, delay).unref();
+}
+
+function onMessage(w, line) {
+    let msg;
+    try { msg = JSON.parse(line); }
+    catch (e) {
+        console.log(`   [py${w.slot}] ${line}`);
+        return;
+    }
+
+    if (msg.id === null && msg.ok && msg.result && msg.result.ready) {
+        w.ready = true;
+        w.respawnDelay = RESPAWN_DELAY_MS;
+        options.log('INFO', `Worker Python ${w.slot} pret (pid ${msg.result.pid})`);
+        drain();
+        return;
+    }
+
+    if (msg.memory) w.memory = msg.memory;
+
+    if (w.pingPending && msg.id === w.pingPending.id) {
+        clearTimeout(w.pingPending.timer);
+        w.pingPending = null;
+        drain();
+        return;
+    }
+
+    const call = w.busy;
+    if (!call || msg.id !== call.id) return;
+    clearTimeout(call.timer);
+    w.busy = null;
+    if (msg.ok) {
+        call.resolve({ result: msg.result, stdout: msg.stdout || '', stderr: msg.stderr || '' });
+    } else {
+        const err = new Error(msg.error || 'Erreur worker Python');
+        err.stdout = msg.stdout || '';
+        err.stderr = (msg.stderr || '') + (msg.traceback || '');
+        call.reject(err);
+    }
+    drain();
+}
+
+function failCall(w, err) {
+    const call = w.busy;
+    w.busy = null;
+    clearTimeout(call.timer);
+    err.stdout = err.stdout || '';
+    err.stderr = err.stderr || '';
+    call.reject(err);
+}
+
+function send(w, call) {
+    w.busy = call;
+    call.timer = setTimeout(() => {
+        // Appel bloque : on tue le worker, l'evenement exit le relance.
+        // ready=false d'abord : idleWorker() ne doit pas lui confier un appel
+        // en attente, que l'exit ferait echouer.
+        w.ready = false;
+        failCall(w, new Error(`Timeout worker Python (${call.method}, ${call.timeoutMs} ms)`));
+        try { w.child.kill('SIGKILL'); } catch (e) { }
+    }, call.timeoutMs);
+    w.child.stdin.write(JSON.stringify({ id: call.id, method: call.method, params: call.params }) + '\n');
+}
+
+function idleWorker() {
+    return workers.find(x => x && x.ready && x.child && !x.busy && !x.pingPending);
+}
+
+/**
+ * Pression memoire : usage conteneur (cgroup, identique pour tous les workers)
+ * ou somme des RSS rapportes, rapporte au budget.
+ */
+function memoryPressure() {
+    const reports = workers.filter(w => w && w.child && w.memory).map(w => w.memory);
+    if (reports.length === 0) return 0;
+    const budget = MEMORY_BUDGET_MB || reports.map(m => m.budget_mb).find(b => b) || null;
+    if (!budget) return 0;
+    const cgroup = reports.some(m => m.usage_mb !== m.rss_mb);
+    const used = cgroup
+        ? Math.max(...reports.map(m => m.usage_mb || 0))
+        : reports.reduce((sum, m) => sum + (m.rss_mb || 0), 0);
+    return used / budget;
+}
+
+function maxConcurrent() {
+    return memoryPressure() >= MEMORY_SOFT_RATIO ? 1 : POOL_SIZE;
+}
+
+function busyCount() {
+    return workers.filter(x => x && x.busy).length;
+}
+
+function drain() {
+    while (queue.length > 0) {
+        if (busyCount() >= maxConcurrent()) return;
+        const w = idleWorker();
+        if (!w) return;
+        send(w, queue.shift());
+    }
+    // Jamais le dernier worker libre (ni aucun sous pression memoire)
+    const maxBackground = maxConcurrent() - 1;
+    while (backgroundQueue.length > 0) {
+        const running = workers.filter(x => x && x.busy && x.busy.priority === 'background').length;
+        if (running >= maxBackground || busyCount() >= maxConcurrent()) return;
+        const w = idleWorker();
+        if (!w) return;
+        send(w, backgroundQueue.shift());
+    }
+}
+
+function pingAll() {
+    for (const w of workers) {
+        if (!w || !w.ready || !w.child || w.busy || w.pingPending) continue;
+        const id = nextId++;
+        w.pingPending = {
+            id,
+            timer: setTimeout(() => {
+                options.log('WARN', `Worker Python ${w.slot} ne repond plus au ping, redemarrage`);
+                w.ready = false;
+                w.pingPending = null;
+                try { w.child.kill('SIGKILL'); } catch (e) { }
+            }, PING_TIMEOUT_MS),
+        };
+        w.child.stdin.write(JSON.stringify({ id, method: 'ping' }) + '\n');
+    }
+}
+
+function poolAvailable() {
+    return workers.some(w => w && w.child);
+}
+
+function flushToFallback() {
+    for (const q of [queue, backgroundQueue]) {
+        while (q.length > 0) {
+            const c = q.shift();
+            callOnce(c.method, c.params, c.timeoutMs).then(c.resolve, c.reject);
+        }
+    }
+}
+
+/**
+ * Repli sans pool : un process `prisme_worker.py --once` par appel.
+ */
+function callOnce(method, params, timeoutMs) {
+    return new Promise((resolve, reject) => {
+        const child = spawn(options.pythonExe, [WORKER_SCRIPT, '--once', method, JSON.stringify(params || {})], {
+            cwd: options.cwd,
+            env: { ...process.env, PYTHONIOENCODING: 'utf-8' },
+        });
+        let stdout = '';
+        let stderr = '';
+        const timer = setTimeout(() => { try { child.kill('SIGKILL'); } catch (e) { } }, timeoutMs);
+        child.stdout.on('data', (d) => { stdout += d.toString('utf8'); });
+        child.stderr.on('data', (d) => { stderr += d.toString('utf8'); });
+        child.on('error', (err) => { clearTimeout(timer); reject(err); });
+        child.on('close', (code) => {
+            clearTimeout(timer);
+            let msg = null;
+            try { msg = JSON.parse(stdout.trim().split('\n').pop()); } catch (e) { }
+            if (msg && msg.ok) {
+                resolve({ result: msg.result, stdout: msg.stdout || '', stderr: msg.stderr || '' });
+            } else {
+                const err = new Error((msg && msg.error) || stderr || `Python exited with code ${code}`);
+                err.stdout = (msg && msg.stdout) || '';
+                err.stderr = (msg && (msg.stderr || '') + (msg.traceback || '')) || stderr;
+                reject(err);
+            }
+        });
+    });
+}
+
+function call(method, params = {}, { timeoutMs = CALL_TIMEOUT_MS, priority = 'interactive' } = {}) {
+    if (priority === 'background' && !backgroundAllowed()) {
+        return Promise.reject(new Error('Appel background refuse : un seul worker Python (PRISME_WORKERS)'));
+    }
+    if (POOL_SIZE === 0 || !poolAvailable()) {
+        return callOnce(method, params, timeoutMs);
+    }
+    return new Promise((resolve, reject) => {
+        const lane = priority === 'background' ? backgroundQueue : queue;
+        lane.push({ id: nextId++, method, params, timeoutMs, priority, resolve, reject });
+        drain();
+    });
+}
+
+// Appels 'background' possibles seulement s'il reste un worker pour l'interactif
+function backgroundAllowed() {
+    return POOL_SIZE > 1;
+}
+
+function start(opts = {}) {
+    options = { ...options, ...opts };
+    if (POOL_SIZE === 0 || !fs.existsSync(WORKER_SCRIPT)) return;
+    for (let slot = 0; slot < POOL_SIZE; slot++) createWorker(slot);
+    pingTimer = setInterval(pingAll, PING_INTERVAL_MS);
+    pingTimer.unref();
+}
+
+function stop() {
+    stopping = true;
+    if (pingTimer) clearInterval(pingTimer);
+    for (const w of workers) {
+        if (w && w.child) {
+            try { w.child.stdin.write(JSON.stringify({ method: 'shutdown' }) + '\n'); } catch (e) { }
+        }
+    }
+}
+
+function status() {
+    return {
+        size: POOL_SIZE,
+        queued: queue.length,
+        queuedBackground: backgroundQueue.length,
+        memoryPressure: Math.round(memoryPressure() * 1000) / 1000,
+        maxConcurrent: maxConcurrent(),
+        workers: workers.map(w => ({
+            slot: w.slot,
+            pid: w.pid,
+            ready: w.ready,
+            busy: w.busy ? w.busy.method : null,
+            priority: w.busy ? w.busy.priority : null,
+            restarts: w.restarts,
+            lastError: w.lastError,
+            memory: w.memory,
+        })),
+    };
+}
+
+module.exports = { start, stop, call, status, backgroundAllowed };
@@ -10,9 +10,17 @@ drom / fh / Re stockent parfois les cles et/ou les valeurs en texte : tout est
 converti avant comparaison. Une cellule vide (secret statistique) ne peut
 correspondre qu'a une cellule vide.
 
+Les lignes sont jointes par table de hachage sur la cle, puis toutes les
+valeurs d'un onglet sont comparees d'un bloc (tableaux NumPy, cellules vides
+en masque, ecart > tolerance).
+
 Usage :
     python qa_compare_patho.py <genere.xlsx> <cible.xlsx> [--tolerance 1e-6]
     python qa_compare_patho.py --sheet com <multi_onglets.xlsx> <cible.xlsx>
+    python qa_compare_patho.py <genere.xlsx> <cible.xlsx> --detail ecarts.csv
+
+La sortie console est un resume (nombre d'ecarts par onglet et par type, puis
+les premiers ecarts) ; --detail ecrit tous les ecarts (CSV ';' ou .json).
 
 Avec --sheet, seul l'onglet nomme du classeur genere est compare (utile pour
 verifier un classeur multi-onglets contre les fichiers cibles mono-onglet) ;
@@ -21,11 +29,18 @@ cote cible on prend l'onglet de meme nom, ou son unique onglet.
 from __future__ import annotations
 
 import argparse
+import csv
+import json
 import sys
+from collections import Counter
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 from openpyxl import load_workbook
 
+import sidecar
+
 TOLERANCE = 1e-6
 NB_CLES = 3
 
@@ -50,6 +65,22 @@ def _cle(valeur):
     return str(valeur).strip()
 
 
+def _nombres(valeurs):
+    """Colonne -> (float64, masque vide) ; meme regle que _nombre, d'un bloc.
+
+    Vide = None, texte blanc ou non numerique. Le texte numerique ('1,5',
+    ' 12 ') est converti apres le passage rapide de pd.to_numeric.
+    """
+    serie = pd.Series(valeurs, dtype=object)
+    nombres = pd.to_numeric(serie, errors="coerce")
+    textes = nombres.isna() & serie.map(lambda v: isinstance(v, str))
+    if textes.any():
+        nombres[textes] = pd.to_numeric(
+            serie[textes].str.strip().str.replace(",", ".", regex=False), errors="coerce")
+    nombres = nombres.to_numpy(dtype=float)
+    return nombres, np.isnan(nombres)
+
+
 def _nombre(valeur):
     if valeur is None:
         return None
@@ -64,13 +95,60 @@ def _nombre(valeur):
         return None
 
 
+def _feuilles(chemin: Path):
+    """[(onglet, lignes)] : sidecars parquet/csv s'ils sont a jour, sinon le xlsx."""
+    manifeste = chemin.with_suffix(".tables.json")
+    if manifeste.exists() and (not chemin.exists()
+                               or manifeste.stat().st_mtime >= chemin.stat().st_mtime):
+        tables = sidecar.read_tables(chemin)
+        if tables is not None:
+            return [(onglet, [tuple(entete)] + [tuple(l) for l in lignes])
+                    for onglet, (entete, lignes) in tables.items()]
+    classeur = load_workbook(str(chemin), read_only=True, data_only=True)
+    try:
+        return [(f.title, list(f.iter_rows(values_only=True))) for f in classeur.worksheets]
+    finally:
+        classeur.close()
+
+
+class Onglet:
+    """Onglet lu : en-tete, cles normalisees et valeurs typees (NumPy)."""
+    __slots__ = ("entete", "cles", "lignes", "valeurs", "vides")
+
+    def __init__(self, entete, donnees):
+        self.entete = entete
+        self.lignes = donnees
+        self.cles = [tuple(_cle(c) for c in ligne[:NB_CLES]) for ligne in donnees]
+        nb_valeurs = max(0, len(entete) - NB_CLES)
+        self.valeurs = np.empty((len(donnees), nb_valeurs), dtype=float)
+        self.vides = np.empty(self.valeurs.shape, dtype=bool)
+        if not donnees or not nb_valeurs:
+            return
+        # Le constructeur pandas type en C les colonnes purement numeriques
+        # (None -> NaN) ; seules les colonnes contenant du texte passent par _nombres
+        bloc = pd.DataFrame([ligne[NB_CLES:] for ligne in donnees], columns=range(nb_valeurs))
+        for j in range(nb_valeurs):
+            colonne = bloc[j]
+            if colonne.dtype.kind in "fiu":
+                valeurs = colonne.to_numpy(dtype=float)
+                self.valeurs[:, j], self.vides[:, j] = valeurs, np.isnan(valeurs)
+            else:
+                self.valeurs[:, j], self.vides[:, j] = _nombres(colonne)
+
+    def brut(self, i, j):
+        """Cellule telle que lue (messages d'ecart)."""
+        return self.lignes[i][NB_CLES + j]
+
+    def positions(self):
+        """{cle: rang} ; en cas de doublon la derniere ligne l'emporte."""
+        return {cle: i for i, cle in enumerate(self.cles)}
+
+
 def _lire(chemin: Path):
-    classeur = load_workbook(str(chemin), data_only=True)
     contenu = {}
-    for feuille in classeur.worksheets:
-        lignes = list(feuille.iter_rows(values_only=True))
+    for titre, lignes in _feuilles(chemin):
         if not lignes:
-            contenu[feuille.title] = ([], [])
+            contenu[titre] = Onglet([], [])
             continue
         nb = _colonnes_utiles(lignes[0])
         entete = [str(c).strip() for c in lignes[0][:nb]]
@@ -80,82 +158,132 @@ def _lire(chemin: Path):
             if all(c is None or str(c).strip() == "" for c in ligne):
                 continue
             donnees.append(ligne)
-        contenu[feuille.title] = (entete, donnees)
+        contenu[titre] = Onglet(entete, donnees)
     return contenu
 
 
-def comparer(genere: Path, cible: Path, tolerance=TOLERANCE, onglet_cible=None):
+def _ecart(onglet, type_, message, cle=None, colonne=None, genere=None, cible=None, ecart=None):
+    return {"onglet": onglet, "type": type_, "cle": cle, "colonne": colonne,
+            "genere": genere, "cible": cible, "ecart": ecart, "message": message}
+
+
+def _comparer_onglet(nom, a, b, tolerance):
+    """Ecarts d'un onglet (meme en-tete des deux cotes)."""
     ecarts = []
+    pos_a, pos_b = a.positions(), b.positions()
+
+    for k in pos_b:
+        if k not in pos_a:
+            ecarts.append(_ecart(nom, "absente", f"[{nom}] ligne absente du genere : {k}", cle=k))
+    for k in pos_a:
+        if k not in pos_b:
+            ecarts.append(_ecart(nom, "en_trop", f"[{nom}] ligne en trop dans le genere : {k}", cle=k))
+
+    # Jointure sur la cle, dans l'ordre de la cible
+    communes = [k for k in pos_b if k in pos_a]
+    if not communes:
+        return ecarts
+    ia = np.fromiter((pos_a[k] for k in communes), dtype=np.intp, count=len(communes))
+    ib = np.fromiter((pos_b[k] for k in communes), dtype=np.intp, count=len(communes))
+
+    va, vb = a.valeurs[ia], b.valeurs[ib]
+    vide_a, vide_b = a.vides[ia], b.vides[ib]
+    # Vide contre vide : egal ; vide contre valeur : ecart ; sinon tolerance
+    un_vide = vide_a != vide_b
+    with np.errstate(invalid="ignore"):
+        delta = np.abs(va - vb)
+        hors_tolerance = ~(vide_a | vide_b) & (delta > tolerance)
+    differentes = un_vide | hors_tolerance
+    desordre = ia != ib
+
+    colonnes = b.entete[NB_CLES:]
+    for r in np.flatnonzero(desordre | differentes.any(axis=1)):
+        cle = communes[r]
+        if desordre[r]:
+            ecarts.append(_ecart(nom, "ordre",
+                                 f"[{nom}] ligne {cle} a l'ordre {ia[r] + 2} au lieu de {ib[r] + 2}",
+                                 cle=cle, genere=int(ia[r]) + 2, cible=int(ib[r]) + 2))
+        for j in np.flatnonzero(differentes[r]):
+            if un_vide[r, j]:
+                brut_a, brut_b = a.brut(ia[r], j), b.brut(ib[r], j)
+                ecarts.append(_ecart(nom, "vide",
+                                     f"[{nom}] {cle} / {colonnes[j]} : genere={brut_a!r} cible={brut_b!r}",
+                                     cle=cle, colonne=colonnes[j], genere=brut_a, cible=brut_b))
+            else:
+                x, y, d = float(va[r, j]), float(vb[r, j]), float(delta[r, j])
+                ecarts.append(_ecart(nom, "valeur",
+                                     f"[{nom}] {cle} / {colonnes[j]} : genere={x} cible={y} (ecart {d:.3g})",
+                                     cle=cle, colonne=colonnes[j], genere=x, cible=y, ecart=d))
+    return ecarts
+
+
+def comparer_detail(genere: Path, cible: Path, tolerance=TOLERANCE, onglet_cible=None):
+    """Ecarts detailles : [{onglet, type, cle, colonne, genere, cible, ecart, message}].
+
+    type : onglets, colonnes, absente, en_trop, ordre, vide, valeur.
+    """
     a = _lire(genere)
     b = _lire(cible)
 
     if onglet_cible is not None:
         if onglet_cible not in a:
-            return [f"onglet {onglet_cible!r} absent du genere : {list(a)}"]
+            return [_ecart(onglet_cible, "onglets", f"onglet {onglet_cible!r} absent du genere : {list(a)}")]
         if onglet_cible in b:
             reference = b[onglet_cible]
         elif len(b) == 1:
             reference = next(iter(b.values()))
         else:
-            return [f"onglet {onglet_cible!r} absent de la cible : {list(b)}"]
+            return [_ecart(onglet_cible, "onglets", f"onglet {onglet_cible!r} absent de la cible : {list(b)}")]
         a = {onglet_cible: a[onglet_cible]}
         b = {onglet_cible: reference}
 
     if list(a) != list(b):
-        ecarts.append(f"onglets differents : genere={list(a)} cible={list(b)}")
-        return ecarts
+        return [_ecart(None, "onglets", f"onglets differents : genere={list(a)} cible={list(b)}")]
 
+    ecarts = []
     for onglet in b:
-        entete_a, lignes_a = a[onglet]
-        entete_b, lignes_b = b[onglet]
-        if entete_a != entete_b:
-            ecarts.append(
-                f"[{onglet}] colonnes differentes\n"
-                f"    genere : {entete_a}\n"
-                f"    cible  : {entete_b}"
-            )
+        if a[onglet].entete != b[onglet].entete:
+            ecarts.append(_ecart(onglet, "colonnes",
+                                 f"[{onglet}] colonnes differentes\n"
+                                 f"    genere : {a[onglet].entete}\n"
+                                 f"    cible  : {b[onglet].entete}"))
             continue
-
-        index_a = {}
-        for i, ligne in enumerate(lignes_a):
-            index_a[tuple(_cle(c) for c in ligne[:NB_CLES])] = (i, ligne)
-        index_b = {}
-        for i, ligne in enumerate(lignes_b):
-            index_b[tuple(_cle(c) for c in ligne[:NB_CLES])] = (i, ligne)
-
-        manquantes = [k for k in index_b if k not in index_a]
-        en_trop = [k for k in index_a if k not in index_b]
-        for k in manquantes:
-            ecarts.append(f"[{onglet}] ligne absente du genere : {k}")
-        for k in en_trop:
-            ecarts.append(f"[{onglet}] ligne en trop dans le genere : {k}")
-
-        for cle, (rang_b, ligne_b) in index_b.items():
-            if cle not in index_a:
-                continue
-            rang_a, ligne_a = index_a[cle]
-            if rang_a != rang_b:
-                ecarts.append(
-                    f"[{onglet}] ligne {cle} a l'ordre {rang_a + 2} "
-                    f"au lieu de {rang_b + 2}"
-                )
-            for j in range(NB_CLES, len(entete_b)):
-                va, vb = _nombre(ligne_a[j]), _nombre(ligne_b[j])
-                if va is None and vb is None:
-                    continue
-                if va is None or vb is None:
-                    ecarts.append(
-                        f"[{onglet}] {cle} / {entete_b[j]} : "
-                        f"genere={ligne_a[j]!r} cible={ligne_b[j]!r}"
-                    )
-                elif abs(va - vb) > tolerance:
-                    ecarts.append(
-                        f"[{onglet}] {cle} / {entete_b[j]} : "
-                        f"genere={va} cible={vb} (ecart {abs(va - vb):.3g})"
-                    )
+        ecarts.extend(_comparer_onglet(onglet, a[onglet], b[onglet], tolerance))
     return ecarts
 
 
+def comparer(genere: Path, cible: Path, tolerance=TOLERANCE, onglet_cible=None):
+    """Messages d'ecart (liste vide si les classeurs concordent)."""
+    return [e["message"] for e in comparer_detail(genere, cible, tolerance, onglet_cible)]
+
+
+def resume(ecarts):
+    """Resume compact : 'com: 3 valeur, 1 absente ; fra: 1 ordre'."""
+    par_onglet = {}
+    for e in ecarts:
+        par_onglet.setdefault(e["onglet"] or "*", Counter())[e["type"]] += 1
+    return " ; ".join(
+        f"{onglet}: " + ", ".join(f"{n} {type_}" for type_, n in compte.most_common())
+        for onglet, compte in par_onglet.items()
+    )
+
+
+def ecrire_detail(ecarts, chemin: Path):
+    """Tous les ecarts dans un fichier : JSON si .json, sinon CSV ';' UTF-8."""
+    chemin = Path(chemin)
+    chemin.parent.mkdir(parents=True, exist_ok=True)
+    if chemin.suffix.lower() == ".json":
+        chemin.write_text(json.dumps(ecarts, ensure_ascii=False, indent=1, default=str), encoding="utf-8")
+        return
+    champs = ["onglet", "type", "cle", "colonne", "genere", "cible", "ecart"]
+    with open(chemin, "w", encoding="utf-8", newline="") as f:
+        ecrivain = csv.writer(f, delimiter=";")
+        ecrivain.writerow(champs)
+        for e in ecarts:
+            ligne = dict(e, cle="|".join(e["cle"]) if e["cle"] else None)
+            ecrivain.writerow(["" if ligne[k] is None else ligne[k] for k in champs])
+
+
 def main(argv=None):
     parseur = argparse.ArgumentParser(
         description="Compare un classeur pathologies genere a la cible client."
@@ -168,22 +296,28 @@ def main(argv=None):
     parseur.add_argument("--sheet", default=None,
                          help="ne comparer que cet onglet du classeur genere "
                               "(ex. com, dom, fra, fh, reg)")
+    parseur.add_argument("--detail", type=Path, default=None,
+                         help="ecrire tous les ecarts dans ce fichier (.csv ou .json)")
     args = parseur.parse_args(argv)
 
     for chemin in (args.genere, args.cible):
         if not chemin.is_file():
             raise SystemExit(f"fichier introuvable : {chemin}")
 
-    ecarts = comparer(args.genere, args.cible, args.tolerance, args.sheet)
+    ecarts = comparer_detail(args.genere, args.cible, args.tolerance, args.sheet)
+    if args.detail is not None:
+        ecrire_detail(ecarts, args.detail)
     suffixe = f" [onglet {args.sheet}]" if args.sheet else ""
     if not ecarts:
         print(f"OK 0 ecart{suffixe}  ({args.genere.name} == {args.cible.name})")
         return 0
     print(f"KO {len(ecarts)} ecart(s){suffixe}  ({args.genere.name} vs {args.cible.name})")
-    for message in ecarts[:args.max]:
-        print("  -", message)
+    print(f"  {resume(ecarts)}")
+    for e in ecarts[:args.max]:
+        print("  -", e["message"])
     if len(ecarts) > args.max:
-        print(f"  ... {len(ecarts) - args.max} ecart(s) supplementaire(s)")
+        print(f"  ... {len(ecarts) - args.max} ecart(s) supplementaire(s)"
+              + (f" (detail : {args.detail})" if args.detail else ""))
     return 1
 
 
@@ -3,7 +3,19 @@
 QA Excel - Verification format des fichiers generés par PRISME Engine et generate_from_opendata.
 Genere dans Backend/output/, verifie : onglets, colonnes, absence de remplissage
 colore sur les cellules, remplissage donnees.
-Usage : python qa_excel_check.py
+
+Les classeurs sont lus depuis le ZIP (jamais extraits sur disque) en mode
+read_only : une passe en flux par feuille, les remplissages ne sont inspectes
+que si la table des styles du classeur contient un fond colore. Les packs
+sont verifies en parallele (PRISME_QA_WORKERS processus) via check_packs(),
+appelable juste apres une generation.
+
+Usage :
+    python qa_excel_check.py                      generation + recette complete
+    python qa_excel_check.py --zip a.zip b.zip    recette de packs existants
+                             [--dataset educ] [--json rapport.json]
+Rapport JSON : {generated_at, summary: {OK, KO, indisponible}, results}.
+Code retour 1 si un pack est KO.
 NE MODIFIE AUCUN FICHIER SOURCE.
 """
 
@@ -11,7 +23,10 @@ import sys
 import os
 import zipfile
 import json
+import time
+import argparse
 import traceback
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from io import BytesIO
 
@@ -21,15 +36,17 @@ sys.path.insert(0, str(BASE_DIR))
 OUTPUT_DIR = BASE_DIR / "output"
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+QA_WORKERS = int(os.environ.get("PRISME_QA_WORKERS", "0") or 0) or min(4, os.cpu_count() or 1)
+DEFAULT_GEO = ['com', 'reg', 'dom', 'fh', 'fra']
+
 import openpyxl
 
 # =============================================================================
 # HELPERS VERIFICATION
 # =============================================================================
 
-def _cell_has_color_fill(cell):
-    """True si la cellule porte un remplissage colore (solid + couleur non nulle)."""
-    fill = cell.fill
+def _fill_is_colored(fill):
+    """True si le remplissage est colore (solid + couleur non nulle)."""
     if fill is None or fill.fill_type != "solid":
         return False
     fg = fill.fgColor
@@ -43,49 +60,76 @@ def _cell_has_color_fill(cell):
     return rgb not in ("", "00000000", "FFFFFFFF")
 
 
-def _find_color_fills(ws):
+def _cell_has_color_fill(cell):
+    """True si la cellule porte un remplissage colore (solid + couleur non nulle)."""
+    return _fill_is_colored(cell.fill)
+
+
+def _colored_style_ids(wb):
+    """Index des styles de cellule a fond colore.
+
+    Vide dans le cas courant (aucune couleur dans la table des styles) : les
+    feuilles ne sont alors pas parcourues pour les remplissages.
+    """
+    colored_fills = {i for i, fill in enumerate(wb._fills) if _fill_is_colored(fill)}
+    if not colored_fills:
+        return frozenset()
+    return frozenset(i for i, style in enumerate(wb._cell_styles) if style.fillId in colored_fills)
+
+
+def _find_color_fills(ws, colored_styles=None):
     """Retourne les coordonnees des cellules ayant un remplissage colore.
 
     Balaie la feuille entiere (en-tetes ligne 1 incluses) : le client ne veut
-    aucune couleur sur les cellules generees.
+    aucune couleur sur les cellules generees. En read_only, seules les
+    cellules portant un style de colored_styles sont examinees.
     """
+    if colored_styles is None:
+        colored_styles = _colored_style_ids(ws.parent)
+    if not colored_styles:
+        return []
     found = []
-    for row in ws.iter_rows(min_row=1, max_row=ws.max_row):
+    for row in ws.iter_rows(min_row=1):
         for cell in row:
-            if _cell_has_color_fill(cell):
-                found.append(f"{cell.coordinate}={cell.fill.fgColor.rgb}")
+            style_id = getattr(cell, '_style_id', None)
+            if style_id is None:
+                # Cellule vide (EmptyCell) ou classeur non read_only
+                if not hasattr(cell, 'coordinate') or not _cell_has_color_fill(cell):
+                    continue
+            elif style_id not in colored_styles:
+                continue
+            found.append(f"{cell.coordinate}={cell.fill.fgColor.rgb}")
     return found
 
 def _count_data_rows(ws):
     """Nombre de lignes de donnees (hors header, hors None)."""
     count = 0
-    for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
-        if any(cell.value is not None for cell in row):
+    for row in ws.iter_rows(min_row=2, values_only=True):
+        if any(value is not None for value in row):
             count += 1
     return count
 
 def _get_headers(ws):
     """Retourne les headers de la premiere ligne."""
-    return [cell.value for cell in list(ws.iter_rows(min_row=1, max_row=1))[0]]
+    for row in ws.iter_rows(min_row=1, max_row=1, values_only=True):
+        return list(row)
+    return []
 
-def check_xlsx(xlsx_bytes_or_path, expected_sheets, expected_variables, label=""):
-    """
-    Verifie un fichier xlsx (bytes ou Path).
-    Retourne un dict de resultats.
-    """
+
+def _open_workbook(source):
+    """Classeur read_only depuis des bytes, un flux ou un chemin."""
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    elif not hasattr(source, 'read'):
+        source = str(source)
+    return openpyxl.load_workbook(source, read_only=True)
+
+
+def _check_workbook(wb, colored_styles, expected_sheets, expected_variables):
+    """Verifications d'un classeur ouvert (cf. check_xlsx)."""
     issues = []
     fills_found = {}
     sheet_data_rows = {}
-    sheets_found = []
-
-    try:
-        if isinstance(xlsx_bytes_or_path, (bytes, BytesIO)):
-            wb = openpyxl.load_workbook(BytesIO(xlsx_bytes_or_path) if isinstance(xlsx_bytes_or_path, bytes) else xlsx_bytes_or_path)
-        else:
-            wb = openpyxl.load_workbook(str(xlsx_bytes_or_path))
-    except Exception as e:
-        return {"ok": False, "issues": [f"Impossible d'ouvrir le fichier: {e}"], "fills": {}, "rows": {}}
-
     sheets_found = wb.sheetnames
 
     # Verifier onglets attendus
@@ -108,7 +152,7 @@ def check_xlsx(xlsx_bytes_or_path, expected_sheets, expected_variables, label=""
                 issues.append(f"[{sheet_name}] Colonne '{var}' absente (headers: {headers_clean})")
 
         # Absence de remplissage colore
-        fills_found[sheet_name] = _find_color_fills(ws)
+        fills_found[sheet_name] = _find_color_fills(ws, colored_styles)
         if fills_found[sheet_name]:
             sample = ", ".join(fills_found[sheet_name][:5])
             issues.append(
@@ -132,6 +176,21 @@ def check_xlsx(xlsx_bytes_or_path, expected_sheets, expected_variables, label=""
     }
 
 
+def check_xlsx(xlsx_bytes_or_path, expected_sheets, expected_variables, label=""):
+    """
+    Verifie un fichier xlsx (bytes, flux ou Path).
+    Retourne un dict de resultats.
+    """
+    try:
+        wb = _open_workbook(xlsx_bytes_or_path)
+    except Exception as e:
+        return {"ok": False, "issues": [f"Impossible d'ouvrir le fichier: {e}"], "fills": {}, "rows": {}}
+    try:
+        return _check_workbook(wb, _colored_style_ids(wb), expected_sheets, expected_variables)
+    finally:
+        wb.close()
+
+
 def check_zip_pack(zip_path, expected_geo_levels, expected_variables, file_name):
     """
     Verifie un ZIP pack : contient des dossiers geo avec chacun un xlsx.
@@ -155,6 +214,17 @@ def check_zip_pack(zip_path, expected_geo_levels, expected_variables, file_name)
 
     issues = []
     per_sheet = {}
+    opened = {}
+
+    def workbook(zf, name):
+        # Un membre partage par plusieurs niveaux (MOCA-O) n'est ouvert qu'une fois
+        if name not in opened:
+            try:
+                wb = _open_workbook(BytesIO(zf.read(name)))
+                opened[name] = (wb, _colored_style_ids(wb))
+            except Exception as e:
+                opened[name] = e
+        return opened[name]
 
     try:
         with zipfile.ZipFile(zip_path, 'r') as zf:
@@ -186,23 +256,91 @@ def check_zip_pack(zip_path, expected_geo_levels, expected_variables, file_name)
                     continue
 
                 if found_xlsx:
-                    data = zf.read(found_xlsx)
-                    if is_opendata:
-                        # Chaque xlsx opendata = 1 onglet nomme par geo_key
-                        res = check_xlsx(data, [geo_key], expected_variables, label=f"{geo_key}")
+                    # opendata : 1 xlsx par niveau, onglet nomme par geo_key ;
+                    # MOCA-O : 1 xlsx avec plusieurs onglets (un par geo)
+                    opened_wb = workbook(zf, found_xlsx)
+                    if isinstance(opened_wb, Exception):
+                        res = {"ok": False, "issues": [f"Impossible d'ouvrir le fichier: {opened_wb}"], "fills": {}, "rows": {}}
                     else:
-                        # MOCA-O: 1 xlsx avec plusieurs onglets (un par geo)
-                        res = check_xlsx(data, [geo_key], expected_variables, label=f"{geo_key}")
+                        res = _check_workbook(opened_wb[0], opened_wb[1], [geo_key], expected_variables)
                     per_sheet[geo_key] = res
                     issues.extend([f"[{geo_key}] {i}" for i in res.get("issues", [])])
 
     except Exception as e:
         return {"ok": False, "issues": [f"Erreur lecture ZIP: {e}"], "per_sheet": {}}
+    finally:
+        for item in opened.values():
+            if not isinstance(item, Exception):
+                item[0].close()
 
     ok = len(issues) == 0
     return {"ok": ok, "issues": issues, "per_sheet": per_sheet}
 
 
+def _check_consolidated_member(zip_path, expected_sheets, expected_vars):
+    """Consolide d'un pack MOCA-O (membre '*consolidated*.xlsx' du ZIP)."""
+    with zipfile.ZipFile(str(zip_path), 'r') as zf:
+        cons_files = [n for n in zf.namelist() if 'consolidated' in n and n.endswith('.xlsx')]
+        if not cons_files:
+            return None, None
+        return cons_files[0], check_xlsx(zf.read(cons_files[0]), expected_sheets, expected_vars, label="consolidated")
+
+
+def check_pack(job):
+    """Recette d'un pack (execute dans un processus de check_packs).
+
+    job : {label, zip, geo, variables[, consolidated]} ; consolidated vaut
+    "zip" (membre *consolidated*.xlsx du ZIP), un chemin de xlsx, ou absent.
+    Retourne {label, pack, consolidated, consolidated_name, error}.
+    """
+    out = {"label": job["label"], "pack": None, "consolidated": None, "consolidated_name": None, "error": None}
+    out["pack"] = check_zip_pack(str(job["zip"]), job["geo"], job["variables"], job.get("file_name", ""))
+    cons = job.get("consolidated")
+    try:
+        if cons == "zip":
+            out["consolidated_name"], out["consolidated"] = _check_consolidated_member(job["zip"], job["geo"], job["variables"])
+        elif cons:
+            if Path(cons).exists():
+                out["consolidated_name"] = str(cons)
+                out["consolidated"] = check_xlsx(str(cons), job["geo"], job["variables"], label="consolidated")
+    except Exception as e:
+        out["error"] = f"Erreur lecture consolide: {e}"
+    return out
+
+
+def check_packs(jobs, workers=None):
+    """Recette de plusieurs packs, en parallele (processus) -> {label: resultat check_pack}."""
+    jobs = list(jobs)
+    workers = min(workers or QA_WORKERS, len(jobs))
+    if workers <= 1:
+        return {job["label"]: check_pack(job) for job in jobs}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return {res["label"]: res for res in pool.map(check_pack, jobs)}
+
+
+def _print_pack_details(res):
+    for sh, sr in res.get('per_sheet', {}).items():
+        rows = sr.get('rows', {}).get(sh, '?')
+        fills = sr.get('fills', {}).get(sh, [])
+        print(f"  [{sh}] rows={rows} | couleurs={len(fills)} | {'OK' if sr.get('ok') else 'KO: ' + str(sr.get('issues'))}")
+
+
+def _pack_result(job, checked):
+    """Resultat QA d'un pack (format qa_report.json)."""
+    res = checked["pack"]
+    all_issues = res['issues'] + job.get("extra_issues", [])
+    if checked["error"]:
+        all_issues.append(checked["error"])
+    status = "OK" if not all_issues else "KO"
+    return {
+        "status": status,
+        "year": job.get("year"),
+        "reason": "; ".join(all_issues) if all_issues else "",
+        "zip": str(job["zip"]),
+        "fills_by_sheet": {sh: sr.get('fills', {}).get(sh, []) for sh, sr in res.get('per_sheet', {}).items()},
+    }
+
+
 # =============================================================================
 # QA MOCA-O : generate_prisme_excel
 # =============================================================================
@@ -220,6 +358,7 @@ def qa_mocao():
         return {}
 
     results = {}
+    jobs = []
 
     datasets = eng.get_available_datasets()
     print(f"Datasets detectes dans themes_config.json: {datasets}\n")
@@ -266,46 +405,37 @@ def qa_mocao():
             continue
 
         print(f"  ZIP genere: {zip_path}")
-
-        # Verification ZIP
-        res = check_zip_pack(str(zip_path), expected_sheets_raw, expected_vars, config.get('fileName', dataset_id))
+        jobs.append({
+            "label": label, "zip": str(zip_path), "year": year,
+            "geo": expected_sheets_raw, "variables": expected_vars,
+            "file_name": config.get('fileName', dataset_id), "consolidated": "zip",
+        })
+
+    # Verification des packs generes (en parallele)
+    checked_packs = check_packs(jobs)
+    for job in jobs:
+        label = job["label"]
+        checked = checked_packs[label]
+        print(f"\n--- {label} ---")
 
         # Verification fichier consolide dans le ZIP
         cons_issues = []
-        try:
-            with zipfile.ZipFile(str(zip_path), 'r') as zf:
-                cons_files = [n for n in zf.namelist() if 'consolidated' in n and n.endswith('.xlsx')]
-                if cons_files:
-                    cons_data = zf.read(cons_files[0])
-                    cons_res = check_xlsx(cons_data, expected_sheets_raw, expected_vars, label="consolidated")
-                    if not cons_res['ok']:
-                        cons_issues.append(f"Consolide {cons_files[0]}: {cons_res['issues']}")
-                    print(f"  [CONSOLIDE] {cons_files[0]}: {'OK' if cons_res['ok'] else 'KO'}")
-                    # Absence de couleur consolide
-                    for sh, fills in cons_res['fills'].items():
-                        status = "AUCUNE COULEUR" if not fills else f"{len(fills)} cellule(s) coloree(s)"
-                        print(f"    Remplissage [{sh}]: {status}")
-                else:
-                    cons_issues.append("Fichier consolide absent du ZIP")
-        except Exception as e:
-            cons_issues.append(f"Erreur lecture consolide: {e}")
-
-        all_issues = res['issues'] + cons_issues
+        cons_name, cons_res = checked["consolidated_name"], checked["consolidated"]
+        if cons_res is None:
+            if not checked["error"]:
+                cons_issues.append("Fichier consolide absent du ZIP")
+        else:
+            if not cons_res['ok']:
+                cons_issues.append(f"Consolide {cons_name}: {cons_res['issues']}")
+            print(f"  [CONSOLIDE] {cons_name}: {'OK' if cons_res['ok'] else 'KO'}")
+            # Absence de couleur consolide
+            for sh, fills in cons_res['fills'].items():
+                status = "AUCUNE COULEUR" if not fills else f"{len(fills)} cellule(s) coloree(s)"
+                print(f"    Remplissage [{sh}]: {status}")
 
         # Afficher details
-        for sh, sr in res.get('per_sheet', {}).items():
-            rows = sr.get('rows', {}).get(sh, '?')
-            fills = sr.get('fills', {}).get(sh, [])
-            print(f"  [{sh}] rows={rows} | couleurs={len(fills)} | {'OK' if sr.get('ok') else 'KO: ' + str(sr.get('issues'))}")
-
-        status = "OK" if not all_issues else "KO"
-        results[label] = {
-            "status": status,
-            "year": year,
-            "reason": "; ".join(all_issues) if all_issues else "",
-            "zip": str(zip_path),
-            "fills_by_sheet": {sh: sr.get('fills', {}).get(sh, []) for sh, sr in res.get('per_sheet', {}).items()},
-        }
+        _print_pack_details(checked["pack"])
+        results[label] = _pack_result(dict(job, extra_issues=cons_issues), checked)
 
     return results
 
@@ -326,7 +456,8 @@ def qa_opendata():
         return {}
 
     results = {}
-    EXPECTED_GEO = ['com', 'reg', 'dom', 'fh', 'fra']
+    jobs = []
+    EXPECTED_GEO = DEFAULT_GEO
 
     # Annees candidates par source_type
     YEAR_CANDIDATES = {
@@ -377,38 +508,33 @@ def qa_opendata():
             continue
 
         print(f"  ZIP genere: {zip_path}")
-
-        # Verifier ZIP
-        res = check_zip_pack(str(zip_path), EXPECTED_GEO, variables, cfg['excel_name'])
-
-        # Afficher details
-        for sh, sr in res.get('per_sheet', {}).items():
-            rows = sr.get('rows', {}).get(sh, '?')
-            fills = sr.get('fills', {}).get(sh, [])
-            print(f"  [{sh}] rows={rows} | couleurs={len(fills)} | {'OK' if sr.get('ok') else 'KO: ' + str(sr.get('issues'))}")
+        jobs.append({
+            "label": label, "zip": str(zip_path), "year": year,
+            "geo": EXPECTED_GEO, "variables": variables, "file_name": cfg['excel_name'],
+            "consolidated": str(root_dir / f"{cfg['excel_name']}_consolidated_{year}.xlsx"),
+        })
+
+    # Verification des packs generes (en parallele)
+    checked_packs = check_packs(jobs)
+    for job in jobs:
+        label = job["label"]
+        checked = checked_packs[label]
+        print(f"\n--- {label} ---")
+        _print_pack_details(checked["pack"])
 
         # Verifier le .xlsx consolide (dans root_dir)
         cons_issues = []
-        cons_path = root_dir / f"{cfg['excel_name']}_consolidated_{year}.xlsx"
-        if cons_path.exists():
-            cons_res = check_xlsx(str(cons_path), EXPECTED_GEO, variables, label="consolidated")
+        cons_res = checked["consolidated"]
+        if cons_res is not None:
             if not cons_res['ok']:
                 cons_issues.append(f"Consolide KO: {cons_res['issues']}")
             print(f"  [CONSOLIDE] {'OK' if cons_res['ok'] else 'KO'}")
             for sh, fills in cons_res['fills'].items():
                 print(f"    Remplissage [{sh}]: {'AUCUNE COULEUR' if not fills else str(len(fills)) + ' cellule(s) coloree(s)'}")
-        else:
-            print(f"  [CONSOLIDE] Absent ({cons_path})")
+        elif not checked["error"]:
+            print(f"  [CONSOLIDE] Absent ({job['consolidated']})")
 
-        all_issues = res['issues'] + cons_issues
-        status = "OK" if not all_issues else "KO"
-        results[label] = {
-            "status": status,
-            "year": year,
-            "reason": "; ".join(all_issues) if all_issues else "",
-            "zip": str(zip_path),
-            "fills_by_sheet": {sh: sr.get('fills', {}).get(sh, []) for sh, sr in res.get('per_sheet', {}).items()},
-        }
+        results[label] = _pack_result(dict(job, extra_issues=cons_issues), checked)
 
     return results
 
@@ -565,30 +691,81 @@ def print_report(all_results):
             print(f"  [COULEUR RESIDUELLE] {label} sur: {colored}")
 
 
+def write_report(all_results, report_path):
+    """Rapport JSON lisible par une machine (CI, recette apres generation)."""
+    summary = {status: 0 for status in ("OK", "KO", "indisponible")}
+    for r in all_results.values():
+        summary[r.get("status", "KO")] = summary.get(r.get("status", "KO"), 0) + 1
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "summary": summary,
+        "results": all_results,
+    }
+    report_path = Path(report_path)
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False, default=str)
+    return report
+
+
+def qa_existing_packs(zip_paths, dataset_id=None):
+    """Recette de packs deja generes (sans generation)."""
+    geo, variables = DEFAULT_GEO, []
+    if dataset_id:
+        import prisme_engine as eng
+        config = eng.get_dataset_config(dataset_id) or {}
+        geo = config.get('sheets', DEFAULT_GEO)
+        variables = [c['id'] for c in config.get('columns', [])
+                     if c.get('type') == 'variable' and not eng.is_calculated_variable(c)]
+    jobs = [{"label": f"ZIP/{Path(z).name}", "zip": str(z), "geo": geo, "variables": variables,
+             "consolidated": "zip"} for z in zip_paths]
+    results = {}
+    checked_packs = check_packs(jobs)
+    for job in jobs:
+        checked = checked_packs[job["label"]]
+        extra = []
+        if checked["consolidated"] is not None and not checked["consolidated"]["ok"]:
+            extra.append(f"Consolide {checked['consolidated_name']}: {checked['consolidated']['issues']}")
+        results[job["label"]] = _pack_result(dict(job, extra_issues=extra), checked)
+    return results
+
+
 # =============================================================================
 # MAIN
 # =============================================================================
 
-if __name__ == "__main__":
-    all_results = {}
+def main(argv=None):
+    global QA_WORKERS
+    ap = argparse.ArgumentParser(description="Recette format Excel des packs PRISME")
+    ap.add_argument("--zip", nargs="+", default=None, help="packs existants a verifier (sans generation)")
+    ap.add_argument("--dataset", default=None, help="dataset des packs --zip (colonnes et onglets attendus)")
+    ap.add_argument("--json", default=str(OUTPUT_DIR / "qa_report.json"), help="rapport JSON")
+    ap.add_argument("--workers", type=int, default=None, help=f"processus de verification (defaut {QA_WORKERS})")
+    args = ap.parse_args(argv)
+    if args.workers:
+        QA_WORKERS = args.workers
 
-    # Mode 1 : MOCA-O
-    mocao_results = qa_mocao()
-    all_results.update(mocao_results)
+    all_results = {}
+    if args.zip:
+        all_results.update(qa_existing_packs(args.zip, args.dataset))
+    else:
+        # Mode 1 : MOCA-O
+        all_results.update(qa_mocao())
 
-    # Mode 2 : Open Data
-    opendata_results = qa_opendata()
-    all_results.update(opendata_results)
+        # Mode 2 : Open Data
+        all_results.update(qa_opendata())
 
-    # Mode 3 : MOCA-O Consolide
-    cons_results = qa_mocao_consolidated()
-    all_results.update(cons_results)
+        # Mode 3 : MOCA-O Consolide
+        all_results.update(qa_mocao_consolidated())
 
     # Rapport final
     print_report(all_results)
 
     # Sauvegarder JSON
-    report_path = OUTPUT_DIR / "qa_report.json"
-    with open(report_path, 'w', encoding='utf-8') as f:
-        json.dump(all_results, f, indent=2, ensure_ascii=False, default=str)
-    print(f"\nRapport JSON sauvegarde: {report_path}")
+    report = write_report(all_results, args.json)
+    print(f"\nRapport JSON sauvegarde: {args.json}")
+    return 1 if report["summary"]["KO"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
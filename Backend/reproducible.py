@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+PRISME - Sorties reproductibles (ZIP et xlsx identiques octet pour octet).
+
+Deux generations sur les memes donnees donnaient des fichiers differents :
+horodatage des entrees ZIP (shutil.make_archive, openpyxl) et proprietes
+created / modified des classeurs. En mode reproductible (PRISME_REPRODUCIBLE,
+actif par defaut) :
+    save_workbook(wb, path)     proprietes du classeur et dates des parties
+                                xlsx figees
+    make_archive(base, root, d) remplace shutil.make_archive(base, "zip", root, d) :
+                                entrees triees, dates et droits figes ; si
+                                l'archive existante a deja le meme contenu,
+                                elle est conservee telle quelle (meme mtime)
+    etag(path)                  ETag fort (SHA-256 du contenu, memorise par
+                                (mtime, taille)) pour /api/download
+
+La date figee est SOURCE_DATE_EPOCH si defini (convention reproducible
+builds), sinon 1980-01-01, la plus ancienne date representable en ZIP.
+"""
+import datetime
+import hashlib
+import os
+import shutil
+import threading
+import zipfile
+from pathlib import Path
+
+ENABLED = os.environ.get("PRISME_REPRODUCIBLE", "1").lower() not in ("0", "false", "no", "off")
+
+
+def _fixed_datetime():
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    if epoch and epoch.isdigit():
+        stamp = datetime.datetime.fromtimestamp(int(epoch), tz=datetime.timezone.utc).replace(tzinfo=None)
+        return max(stamp, datetime.datetime(1980, 1, 1))
+    return datetime.datetime(1980, 1, 1)
+
+
+FIXED_DATETIME = _fixed_datetime()
+ZIP_DATE_TIME = FIXED_DATETIME.timetuple()[:6]
+
+# Droits Unix des entrees (ceux du disque dependent de l'umask de la machine)
+_FILE_ATTR = 0o100644 << 16
+_DIR_ATTR = (0o040755 << 16) | 0x10
+
+_digests = {}   # chemin -> ((mtime_ns, taille), sha256)
+_lock = threading.Lock()
+
+
+class StableZipFile(zipfile.ZipFile):
+    """ZipFile dont les entrees portent toutes la meme date, les memes droits
+    et le meme systeme d'origine, quel que soit l'appelant (openpyxl ecrit
+    via writestr() et write())."""
+
+    def _stable(self, zinfo, is_dir=False):
+        zinfo.date_time = ZIP_DATE_TIME
+        zinfo.create_system = 3
+        zinfo.external_attr = _DIR_ATTR if is_dir else _FILE_ATTR
+        return zinfo
+
+    def writestr(self, zinfo_or_arcname, data, compress_type=None, compresslevel=None):
+        if isinstance(zinfo_or_arcname, zipfile.ZipInfo):
+            zinfo = zinfo_or_arcname
+        else:
+            zinfo = zipfile.ZipInfo(zinfo_or_arcname)
+            zinfo.compress_type = self.compression
+            zinfo._compresslevel = self.compresslevel
+        self._stable(zinfo, zinfo.is_dir())
+        super().writestr(zinfo, data, compress_type, compresslevel)
+
+    def write(self, filename, arcname=None, compress_type=None, compresslevel=None):
+        zinfo = zipfile.ZipInfo.from_file(filename, arcname, strict_timestamps=self._strict_timestamps)
+        if zinfo.is_dir():
+            zinfo.compress_size = 0
+            zinfo.CRC = 0
+            self.mkdir(self._stable(zinfo, is_dir=True))
+            return
+        zinfo.compress_type = self.compression if compress_type is None else compress_type
+        zinfo._compresslevel = self.compresslevel if compresslevel is None else compresslevel
+        self._stable(zinfo)
+        with open(filename, "rb") as src, self.open(zinfo, "w") as dest:
+            shutil.copyfileobj(src, dest, 1024 * 1024)
+
+
+# ============================================================================
+# CLASSEURS
+# ============================================================================
+
+def save_workbook(wb, path, dedupe=False):
+    """wb.save(path) a contenu identique => octets identiques.
+
+    dedupe : artefact final telecharge tel quel ; un fichier existant de meme
+    contenu est conserve (mtime et ETag inchanges).
+    """
+    if not ENABLED:
+        wb.save(path)
+        return
+    from openpyxl.writer.excel import ExcelWriter
+
+    path = Path(path)
+    wb.properties.created = FIXED_DATETIME
+    wb.properties.modified = FIXED_DATETIME
+    target = tmp_path(path) if dedupe else path
+    archive = StableZipFile(target, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+    ExcelWriter(wb, archive).save()
+    if dedupe:
+        replace_if_changed(target, path)
+
+
+# ============================================================================
+# ARCHIVES
+# ============================================================================
+
+def make_archive(base_name, root_dir, base_dir):
+    """Equivalent reproductible de shutil.make_archive(base_name, "zip", root_dir, base_dir).
+
+    Retourne le chemin de l'archive (str), comme shutil.
+    """
+    if not ENABLED:
+        return shutil.make_archive(str(base_name), "zip", str(root_dir), str(base_dir))
+    root = Path(root_dir)
+    target = Path(f"{base_name}.zip")
+    tmp = tmp_path(target)
+    base = os.path.normpath(base_dir)
+    with StableZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+        if base != os.curdir:
+            zf.write(root / base, base)
+        for dirpath, dirnames, filenames in os.walk(root / base):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, root)
+            for name in dirnames + sorted(filenames):
+                zf.write(os.path.join(dirpath, name), os.path.normpath(os.path.join(rel, name)))
+    replace_if_changed(tmp, target)
+    return str(target)
+
+
+def tmp_path(target):
+    """Fichier temporaire propre a l'appelant (generations concurrentes du
+    meme artefact : chacune ecrit le sien avant os.replace)."""
+    return target.with_name(f"{target.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+
+
+def replace_if_changed(tmp, target):
+    """Remplace target par tmp, sauf si target a deja exactement ce contenu.
+
+    Retourne True si target a ete remplace.
+    """
+    tmp, target = Path(tmp), Path(target)
+    try:
+        same = target.stat().st_size == tmp.stat().st_size and file_digest(target) == file_digest(tmp)
+    except OSError:
+        same = False
+    if same:
+        tmp.unlink()
+        print(f"[INFO] {target.name} inchange (contenu identique), fichier existant conserve")
+        return False
+    os.replace(tmp, target)
+    # Empreinte deja calculee pour tmp : reprise pour target (memes mtime / taille)
+    with _lock:
+        hit = _digests.pop(str(tmp.resolve()), None)
+        if hit:
+            _digests[str(target.resolve())] = hit
+    return True
+
+
+# ============================================================================
+# EMPREINTES / ETAG
+# ============================================================================
+
+def file_digest(path):
+    """SHA-256 du contenu, recalcule seulement si (mtime, taille) change."""
+    path = Path(path)
+    stat = path.stat()
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    key = str(path.resolve())
+    with _lock:
+        hit = _digests.get(key)
+    if hit and hit[0] == stamp:
+        return hit[1]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    digest = h.hexdigest()
+    with _lock:
+        _digests[key] = (stamp, digest)
+    return digest
+
+
+def etag(path):
+    """ETag fort (entre guillemets) d'un fichier."""
+    return f'"{file_digest(path)}"'
+
+
+def etag_matches(if_none_match, current):
+    """If-None-Match (liste, W/ et * admis) couvre-t-il l'ETag courant ?"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == current:
+            return True
+    return False
@@ -0,0 +1,298 @@
+// ============================================================
+// Module retention : budget disque de Backend/output (LRU).
+//
+// Chaque generation laisse un ZIP (et, en Open Data, l'arborescence
+// depliee <theme>_opendata/<year>) sur le volume persistant. Ce module :
+//   - tient a jour la date du dernier telechargement (/api/download)
+//   - evince les artefacts les moins recemment utilises au-dela du budget
+//     PRISME_OUTPUT_MAX_MB (defaut 2048 Mo), sauf ceux epingles
+//   - supprime au demarrage les arborescences depliees orphelines et les
+//     dossiers temporaires laisses par un crash (prisme_*, mocao_cons_*, ...)
+//   - memorise les parametres de generation de chaque artefact (touch(f, spec))
+//     pour regenerer un artefact evince : seul un artefact marque evince
+//     (isEvicted) est reconstruit par le telechargement suivant, depuis ces
+//     parametres (artifactSpec), jamais depuis un nom de fichier quelconque
+//
+//   GET  /api/output/retention                 -> { success, budget, used, artifacts }
+//   POST /api/output/pin?file=X&pinned=1|0     -> epingle / desepingle
+//
+// Etat dans PRISME_STATE_DIR/retention.json.
+// ============================================================
+
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+
+const STATE_DIR = process.env.PRISME_STATE_DIR || path.join(__dirname, 'state');
+const RETENTION_FILE = path.join(STATE_DIR, 'retention.json');
+const PACKS_DIR = path.join(STATE_DIR, 'sidecars');
+const OUTPUT_DIR = path.join(__dirname, 'output');
+const MAX_BYTES = parseInt(process.env.PRISME_OUTPUT_MAX_MB || '2048', 10) * 1024 * 1024;
+const TEMP_MAX_AGE_MS = 60 * 60 * 1000;
+
+// Dossiers temporaires des moteurs (tempfile.mkdtemp) et de file_server.js
+const TEMP_PREFIXES = ['prisme_', 'mocao_cons_'];
+const TEMP_LOCATIONS = [
+    { dir: os.tmpdir(), match: (name) => TEMP_PREFIXES.some(p => name.startsWith(p)) },
+    { dir: path.join(__dirname, 'tmp_uploads'), match: (name) => name.startsWith('patho_') },
+    { dir: path.join(__dirname, 'csv_sources'), match: (name) => name.startsWith('_tmp_') },
+    { dir: __dirname, match: (name) => name === '_tmp_api.py' || name === 'run_generation.py' },
+];
+
+let log = () => {};
+let state = { artifacts: {} };
+
+function jsonResponse(res, statusCode, data) {
+    res.writeHead(statusCode, {
+        'Content-Type': 'application/json; charset=utf-8',
+        'Cache-Control': 'no-store',
+    });
+    res.end(JSON.stringify(data));
+}
+
+function loadState() {
+    try {
+        if (fs.existsSync(RETENTION_FILE)) {
+            state = JSON.parse(fs.readFileSync(RETENTION_FILE, 'utf8'));
+            state.artifacts = state.artifacts || {};
+        }
+    } catch (e) { state = { artifacts: {} }; }
+}
+
+function saveState() {
+    try {
+        fs.mkdirSync(STATE_DIR, { recursive: true });
+        fs.writeFileSync(RETENTION_FILE, JSON.stringify(state, null, 2), 'utf8');
+    } catch (e) { log('WARN', `retention: ecriture ${RETENTION_FILE} impossible (${e.message})`); }
+}
+
+/**
+ * Deduit du nom de fichier de quoi regenerer l'artefact (null si impossible,
+ * ex. classeur pathologies construit depuis un upload). Le consolide MOCA-O
+ * n'indique pas sa source (moca / opendata) : seule la spec memorisee par
+ * touch() permet de le regenerer (cf. artifactSpec).
+ */
+function regenerationSpec(filename) {
+    let m = filename.match(/^(.+)_opendata_(\d{4})\.zip$/);
+    if (m) return { source: 'opendata', theme: m[1], year: parseInt(m[2], 10) };
+    m = filename.match(/^(.+)_mocao_(\d{4})_(\d{4})\.xlsx$/);
+    if (m) return { source: 'consolidated', theme: m[1], yearStart: parseInt(m[2], 10), yearEnd: parseInt(m[3], 10) };
+    m = filename.match(/^(.+)_(\d{4})\.zip$/);
+    if (m) return { source: 'moca', theme: m[1], year: parseInt(m[2], 10) };
+    return null;
+}
+
+/**
+ * Parametres de regeneration d'un artefact : ceux memorises a sa generation,
+ * sinon ceux du nom de fichier quand il est sans ambiguite (ZIP annuels).
+ */
+function artifactSpec(filename) {
+    const meta = state.artifacts[filename];
+    if (meta && meta.spec) return meta.spec;
+    const spec = regenerationSpec(filename);
+    return spec && spec.source !== 'consolidated' ? spec : null;
+}
+
+function isEvicted(filename) {
+    const meta = state.artifacts[filename];
+    return !!(meta && meta.evictedAt);
+}
+
+function dirSize(dir) {
+    let total = 0;
+    let entries = [];
+    try { entries = fs.readdirSync(dir, { withFileTypes: true }); } catch (e) { return 0; }
+    for (const e of entries) {
+        const p = path.join(dir, e.name);
+        if (e.isDirectory()) total += dirSize(p);
+        else { try { total += fs.statSync(p).size; } catch (err) { } }
+    }
+    return total;
+}
+
+// Arborescence depliee associee a un ZIP Open Data (<theme>_opendata/<year>)
+function unpackedTreeFor(filename) {
+    const m = filename.match(/^(.+_opendata)_(\d{4})\.zip$/);
+    return m ? path.join(OUTPUT_DIR, m[1], m[2]) : null;
+}
+
+// Sidecars parquet/csv d'un classeur (cf. sidecar.py) : X.tables.json, X.<onglet>.csv ...
+function sidecarFilesFor(filename, names) {
+    if (!filename.endsWith('.xlsx')) return [];
+    const stem = filename.slice(0, -'.xlsx'.length) + '.';
+    if (!names.includes(stem + 'tables.json')) return [];
+    return names.filter(n => n.startsWith(stem) && /\.(tables\.json|parquet|csv)$/.test(n));
+}
+
+// Archive interne des sidecars d'un ZIP livre (cf. sidecar.extract_pack)
+function sidecarPackFor(filename) {
+    return filename.endsWith('.zip') ? path.join(PACKS_DIR, filename) : null;
+}
+
+function listArtifacts() {
+    let names = [];
+    try { names = fs.readdirSync(OUTPUT_DIR); } catch (e) { return []; }
+    const artifacts = [];
+    for (const name of names) {
+        if (!(name.endsWith('.zip') || name.endsWith('.xlsx')) || name.startsWith('~$')) continue;
+        const filePath = path.join(OUTPUT_DIR, name);
+        let stat;
+        try { stat = fs.statSync(filePath); } catch (e) { continue; }
+        if (!stat.isFile()) continue;
+        const meta = state.artifacts[name] || {};
+        const tree = unpackedTreeFor(name);
+        const treeBytes = tree && fs.existsSync(tree) ? dirSize(tree) : 0;
+        let sidecarBytes = 0;
+        for (const s of sidecarFilesFor(name, names)) {
+            try { sidecarBytes += fs.statSync(path.join(OUTPUT_DIR, s)).size; } catch (e) { }
+        }
+        const pack = sidecarPackFor(name);
+        if (pack) {
+            try { sidecarBytes += fs.statSync(pack).size; } catch (e) { }
+        }
+        artifacts.push({
+            filename: name,
+            bytes: stat.size + treeBytes + sidecarBytes,
+            lastAccess: meta.lastAccess || stat.mtimeMs,
+            pinned: !!meta.pinned,
+            regenerable: !!artifactSpec(name),
+        });
+    }
+    return artifacts;
+}
+
+function removeArtifact(filename) {
+    let names = [];
+    try { names = fs.readdirSync(OUTPUT_DIR); } catch (e) { }
+    for (const s of sidecarFilesFor(filename, names)) {
+        try { fs.unlinkSync(path.join(OUTPUT_DIR, s)); } catch (e) { }
+    }
+    const pack = sidecarPackFor(filename);
+    if (pack) {
+        try { fs.unlinkSync(pack); } catch (e) { }
+    }
+    try { fs.unlinkSync(path.join(OUTPUT_DIR, filename)); } catch (e) { }
+    const tree = unpackedTreeFor(filename);
+    if (tree) {
+        try { fs.rmSync(tree, { recursive: true, force: true }); } catch (e) { }
+        // <theme>_opendata/ vide -> supprime aussi
+        try { fs.rmdirSync(path.dirname(tree)); } catch (e) { }
+    }
+}
+
+/**
+ * Evince (LRU sur le dernier acces) jusqu'a repasser sous le budget.
+ * Les artefacts epingles et ceux qu'on ne sait pas regenerer sont gardes.
+ */
+function enforce() {
+    const artifacts = listArtifacts();
+    let used = artifacts.reduce((s, a) => s + a.bytes, 0);
+    if (used <= MAX_BYTES) return { used, evicted: [] };
+
+    const evicted = [];
+    const candidates = artifacts
+        .filter(a => !a.pinned && a.regenerable)
+        .sort((a, b) => a.lastAccess - b.lastAccess);
+    for (const a of candidates) {
+        if (used <= MAX_BYTES) break;
+        removeArtifact(a.filename);
+        used -= a.bytes;
+        evicted.push(a.filename);
+        const meta = state.artifacts[a.filename] || {};
+        state.artifacts[a.filename] = { ...meta, evictedAt: Date.now() };
+    }
+    if (evicted.length > 0) {
+        saveState();
+        log('INFO', `retention: ${evicted.length} artefact(s) evince(s) (${(used / 1048576).toFixed(0)} Mo utilises) : ${evicted.join(', ')}`);
+    }
+    return { used, evicted };
+}
+
+/**
+ * Dernier acces a un artefact. spec (a la generation) : parametres de
+ * regeneration { source: moca|opendata|consolidated, theme, year |
+ * yearStart, yearEnd, dataSource (consolide : moca|opendata) }.
+ */
+function touch(filename, spec = null) {
+    const meta = state.artifacts[filename] || {};
+    state.artifacts[filename] = { ...meta, lastAccess: Date.now(), ...(spec ? { spec } : {}) };
+    delete state.artifacts[filename].evictedAt;
+    saveState();
+}
+
+function setPinned(filename, pinned) {
+    const meta = state.artifacts[filename] || {};
+    state.artifacts[filename] = { ...meta, pinned: !!pinned };
+    saveState();
+}
+
+function cleanupOrphans() {
+    let removed = 0;
+    // Arborescences Open Data depliees sans ZIP correspondant
+    let names = [];
+    try { names = fs.readdirSync(OUTPUT_DIR, { withFileTypes: true }); } catch (e) { }
+    for (const d of names) {
+        if (!d.isDirectory() || !d.name.endsWith('_opendata')) continue;
+        const themeDir = path.join(OUTPUT_DIR, d.name);
+        let years = [];
+        try { years = fs.readdirSync(themeDir); } catch (e) { continue; }
+        for (const y of years) {
+            if (!fs.existsSync(path.join(OUTPUT_DIR, `${d.name}_${y}.zip`))) {
+                try { fs.rmSync(path.join(themeDir, y), { recursive: true, force: true }); removed++; } catch (e) { }
+            }
+        }
+        try { fs.rmdirSync(themeDir); } catch (e) { }   // seulement si vide
+    }
+    // Dossiers / fichiers temporaires laisses par un crash
+    const now = Date.now();
+    for (const loc of TEMP_LOCATIONS) {
+        let entries = [];
+        try { entries = fs.readdirSync(loc.dir); } catch (e) { continue; }
+        for (const name of entries) {
+            if (!loc.match(name)) continue;
+            const p = path.join(loc.dir, name);
+            try {
+                if (now - fs.statSync(p).mtimeMs < TEMP_MAX_AGE_MS) continue;
+                fs.rmSync(p, { recursive: true, force: true });
+                removed++;
+            } catch (e) { }
+        }
+    }
+    // Entrees d'etat pour des fichiers disparus et non regenerables
+    for (const name of Object.keys(state.artifacts)) {
+        if (!fs.existsSync(path.join(OUTPUT_DIR, name)) && !artifactSpec(name)) delete state.artifacts[name];
+    }
+    saveState();
+    if (removed > 0) log('INFO', `retention: ${removed} orphelin(s) / temporaire(s) supprime(s)`);
+    return removed;
+}
+
+function start(opts = {}) {
+    log = opts.log || log;
+    loadState();
+    cleanupOrphans();
+    enforce();
+}
+
+function handleRetention(req, res, urlPath, url) {
+    if (urlPath === '/output/retention' && req.method === 'GET') {
+        const artifacts = listArtifacts().sort((a, b) => b.lastAccess - a.lastAccess);
+        const used = artifacts.reduce((s, a) => s + a.bytes, 0);
+        jsonResponse(res, 200, { success: true, budget: MAX_BYTES, used, artifacts });
+        return true;
+    }
+    if (urlPath === '/output/pin' && req.method === 'POST') {
+        const filename = url.searchParams.get('file') || '';
+        if (!filename || filename.includes('..') || filename.includes('/') || filename.includes('\\')) {
+            jsonResponse(res, 400, { success: false, error: 'Invalid filename' });
+            return true;
+        }
+        const pinned = url.searchParams.get('pinned') !== '0';
+        setPinned(filename, pinned);
+        jsonResponse(res, 200, { success: true, filename, pinned });
+        return true;
+    }
+    return false;
+}
+
+module.exports = { start, enforce, touch, isEvicted, artifactSpec, regenerationSpec, handleRetention };
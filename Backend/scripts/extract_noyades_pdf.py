@@ -15,6 +15,13 @@ Format de sortie : identique à noyades_departement_2003_2021.csv
     Nombres de noyades accidentelles suivies de décès;Région;Région Code
 Séparateur ';' ; encoding utf-8-sig (BOM conservée pour cohérence avec source).
 
+Les tableaux extraits sont mis en cache page par page (source_cache, sous
+PRISME_STATE_DIR/cache, indexés par l'empreinte SHA-1 du PDF) : seules les pages
+d'un PDF nouveau ou modifié sont repassées dans pdfplumber, en parallèle
+(PRISME_PDF_WORKERS processus, défaut min(4, nb CPU)). La fusion dans le CSV
+historique est incrémentale : seules les années absentes y sont ajoutées (supprimer
+le CSV fusionné pour le reconstruire).
+
 Lancement :
     python Backend/scripts/extract_noyades_pdf.py
 Produit :
@@ -23,10 +30,14 @@ Produit :
 """
 from __future__ import annotations
 
+import contextlib
 import csv
 import io
+import os
 import re
+import shutil
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import pdfplumber
@@ -34,6 +45,9 @@ import pdfplumber
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", errors="replace")
 
 ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "Backend"))
+import source_cache  # noqa: E402
+
 PDF_DIR = Path(r"C:/Users/chad9/Documents/003.ORSG/Dernier fichiers sources client")
 PDF_FILE = PDF_DIR / "Bilan Noyades -2024-2025.pdf"
 OUT_DIR = ROOT / "Backend" / "inputs" / "opendata" / "spf_noyades"
@@ -41,6 +55,10 @@ OUT_NEW = OUT_DIR / "noyades_departement_2022_2024.csv"
 OUT_FULL = OUT_DIR / "noyades_departement_2003_2024.csv"
 OLD_CSV = OUT_DIR / "noyades_departement_2003_2021.csv"
 
+PDF_WORKERS = int(os.environ.get("PRISME_PDF_WORKERS", "0") or 0) or min(4, os.cpu_count() or 1)
+# À incrémenter si les réglages d'extraction (extract_tables) changent
+TABLES_CACHE_VERSION = 1
+
 # Région -> (nom officiel CSV, code INSEE 2-chiffres)
 REGIONS = {
     "Auvergne-Rhône-Alpes": ("Auvergne-Rhône-Alpes", "84"),
@@ -193,38 +211,78 @@ def _clean_count(raw: str):
     return val
 
 
+def _page_tables(job) -> list:
+    """Tableaux d'une page du PDF (exécuté dans un processus du pool)."""
+    pdf_path, page_num = job
+    with pdfplumber.open(pdf_path) as pdf:
+        return pdf.pages[page_num].extract_tables() or []
+
+
+def extract_page_tables(pdf_path: Path, pages, workers=None) -> dict[int, list]:
+    """Tableaux des pages demandées : {indice page: [tableau, ...]}.
+
+    Depuis le cache si le PDF (empreinte SHA-1) a déjà été traité, sinon
+    extraits en parallèle et mis en cache dès que chaque page est prête : une
+    extraction interrompue reprend aux pages manquantes. Les entrées sont
+    écrites par ce processus (pas par le pool), via un fichier temporaire
+    propre à chaque écrivain (source_cache) : deux extractions simultanées
+    du même PDF ne se corrompent pas.
+    """
+    pdf_path = Path(pdf_path)
+    digest = source_cache.file_hash(pdf_path)
+    tables = {}
+    for page_num in pages:
+        hit = source_cache.lookup(f"noyades_p{page_num}", pdf_path, digest, TABLES_CACHE_VERSION)
+        if hit is not None:
+            tables[page_num] = hit
+    missing = [p for p in pages if p not in tables]
+    if missing:
+        jobs = [(str(pdf_path), p) for p in missing]
+        workers = min(workers or PDF_WORKERS, len(jobs))
+        with contextlib.ExitStack() as stack:
+            if workers <= 1:
+                extracted = map(_page_tables, jobs)
+            else:
+                pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+                extracted = pool.map(_page_tables, jobs)
+            # Résultats dans l'ordre des pages, mis en cache au fil de l'eau
+            for page_num, page_tables in zip(missing, extracted):
+                source_cache.store(f"noyades_p{page_num}", pdf_path, page_tables, digest, TABLES_CACHE_VERSION)
+                tables[page_num] = page_tables
+    print(f"[INFO] {pdf_path.name} : {len(pages) - len(missing)} page(s) en cache, "
+          f"{len(missing)} extraite(s)")
+    return tables
+
+
 def parse_dep_tables() -> list[dict]:
     """Retourne les lignes par département pour 2023 et 2024."""
     rows: list[dict] = []
-    with pdfplumber.open(PDF_FILE) as pdf:
-        # Pages 5,6,7 (indices 4,5,6) contiennent le Tableau 3
-        for page_num in (4, 5, 6):
-            page = pdf.pages[page_num]
-            tables = page.extract_tables()
-            if not tables:
-                continue
-            for t in tables:
-                for line in t:
-                    if not line or not line[0]:
-                        continue
-                    label = str(line[0]).strip()
-                    # Match ligne département "Nom (code)"
-                    m = DEP_CODE_RE.search(label)
-                    if not m:
-                        continue
-                    code = _normalize_code(m.group(1))
-                    # Valeurs colonnes: 2023_N, 2023_deces, 2023_%, 2024_N, 2024_deces, 2024_%
-                    try:
-                        n23 = _clean_count(line[1])
-                        d23 = _clean_count(line[2])
-                        n24 = _clean_count(line[4])
-                        d24 = _clean_count(line[5])
-                    except (ValueError, IndexError):
-                        continue
-                    if code not in DEP_NAME_FIX:
-                        continue
-                    rows.append({"code": code, "n": n23, "d": d23, "year": 2023})
-                    rows.append({"code": code, "n": n24, "d": d24, "year": 2024})
+    # Pages 5,6,7 (indices 4,5,6) contiennent le Tableau 3
+    pages = (4, 5, 6)
+    tables = extract_page_tables(PDF_FILE, pages)
+    for page_num in pages:
+        for t in tables[page_num]:
+            for line in t:
+                if not line or not line[0]:
+                    continue
+                label = str(line[0]).strip()
+                # Match ligne département "Nom (code)"
+                m = DEP_CODE_RE.search(label)
+                if not m:
+                    continue
+                code = _normalize_code(m.group(1))
+                # Valeurs colonnes: 2023_N, 2023_deces, 2023_%, 2024_N, 2024_deces, 2024_%
+                try:
+                    n23 = _clean_count(line[1])
+                    d23 = _clean_count(line[2])
+                    n24 = _clean_count(line[4])
+                    d24 = _clean_count(line[5])
+                except (ValueError, IndexError):
+                    continue
+                if code not in DEP_NAME_FIX:
+                    continue
+                rows.append({"code": code, "n": n23, "d": d23, "year": 2023})
+                rows.append({"code": code, "n": n24, "d": d24, "year": 2024})
     return rows
 
 
@@ -258,25 +316,40 @@ def write_new_csv(rows: list[dict]):
     print(f"[OK] {OUT_NEW} : {len(rows)} lignes")
 
 
-def merge_with_old():
-    """Concatène 2003-2021 + 2022-2024 dans 2003-2024."""
-    if not OLD_CSV.exists():
-        print(f"[WARN] {OLD_CSV} introuvable, skip fusion.")
+def _csv_years(path: Path) -> set[str]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f, delimiter=";")
+        next(reader, None)  # header
+        return {row[0] for row in reader if row}
+
+
+def merge_new_years(new_csv: Path = OUT_NEW, full_csv: Path = OUT_FULL, base_csv: Path | None = OLD_CSV):
+    """Ajoute à full_csv les années de new_csv qu'il ne contient pas encore.
+
+    Fusion incrémentale : les années déjà présentes ne sont ni relues ni
+    réécrites. Si full_csv n'existe pas, il est initialisé depuis base_csv.
+    """
+    if not full_csv.exists():
+        if base_csv is None or not base_csv.exists():
+            print(f"[WARN] {full_csv} introuvable, skip fusion.")
+            return
+        shutil.copyfile(base_csv, full_csv)
+    known = _csv_years(full_csv)
+    with open(new_csv, "r", encoding="utf-8-sig", newline="") as f:
+        next(f)  # skip header
+        fresh = [line for line in f if line.strip() and line.split(";", 1)[0] not in known]
+    if not fresh:
+        print(f"[SKIP] {new_csv.name} : années déjà présentes dans {full_csv.name}")
         return
-    total = 0
-    with open(OUT_FULL, "w", encoding="utf-8-sig", newline="") as fout:
-        # Recopier l'ancien fichier entièrement (incluant header)
-        with open(OLD_CSV, "r", encoding="utf-8-sig") as fold:
-            for i, line in enumerate(fold):
-                fout.write(line)
-                total += 1
-        # Ajouter le nouveau (sans son header)
-        with open(OUT_NEW, "r", encoding="utf-8-sig") as fnew:
-            next(fnew)  # skip header
-            for line in fnew:
-                fout.write(line)
-                total += 1
-    print(f"[OK] {OUT_FULL} : {total} lignes (header inclus)")
+    with open(full_csv, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        needs_newline = f.read(1) != b"\n"
+    with open(full_csv, "a", encoding="utf-8", newline="") as fout:
+        if needs_newline:
+            fout.write("\n")
+        fout.writelines(fresh)
+    years = sorted({line.split(";", 1)[0] for line in fresh})
+    print(f"[OK] {full_csv.name} : +{len(fresh)} lignes ({', '.join(years)})")
 
 
 if __name__ == "__main__":
@@ -287,5 +360,5 @@ if __name__ == "__main__":
     guyane = [r for r in rows if r["code"] == "973"]
     print(f"Guyane : {guyane}")
     write_new_csv(rows)
-    merge_with_old()
+    merge_new_years()
 
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+PRISME - Tables "sidecar" (Parquet / CSV UTF-8) a cote des classeurs xlsx.
+
+Le livrable client reste le xlsx ; les sidecars portent exactement les memes
+tableaux pour les usages internes (consolidation, QA, comparaison) qui
+evitent ainsi de re-parser les classeurs avec openpyxl.
+
+Pour un classeur `X.xlsx` (ou `X` seul si le xlsx n'est pas demande) :
+    X.<onglet>.parquet    une table par onglet (si pyarrow est installe)
+    X.<onglet>.csv        UTF-8, separateur ';', chaines entre guillemets
+    X.tables.json         manifeste : ordre des onglets + formats ecrits
+
+Formats : parametre `formats` des generateurs, sinon variable d'environnement
+PRISME_OUTPUT_FORMATS (defaut "xlsx"), ex. "xlsx,parquet,csv" ou "parquet".
+
+Les ZIP livres (/api/download) ne contiennent que les classeurs : avant
+l'archivage, extract_pack deplace les sidecars de l'arborescence dans une
+archive interne PRISME_STATE_DIR/sidecars/<nom du ZIP> (memes chemins).
+"""
+import csv
+import importlib.util
+import io
+import json
+import numbers
+import os
+import zipfile
+from pathlib import Path, PurePosixPath
+
+BASE_DIR = Path(__file__).parent
+PACKS_DIR = Path(os.environ.get("PRISME_STATE_DIR", BASE_DIR / "state")) / "sidecars"
+
+FORMATS = ("xlsx", "parquet", "csv")
+CSV_SEP = ";"
+
+# Detection sans import : pyarrow n'est charge qu'a la premiere table ecrite / lue
+HAS_PARQUET = importlib.util.find_spec("pyarrow") is not None
+
+# Formats utilises quand un consommateur interne genere lui-meme un pack
+INTERNAL_FORMATS = ("xlsx", "parquet") if HAS_PARQUET else ("xlsx", "csv")
+
+
+def resolve_formats(formats=None):
+    """Normalise l'option de format -> tuple ordonne, sous-ensemble de FORMATS."""
+    if formats is None:
+        formats = os.environ.get("PRISME_OUTPUT_FORMATS", "xlsx")
+    if isinstance(formats, str):
+        formats = formats.split(",")
+    wanted = {str(f).strip().lower() for f in formats if str(f).strip()}
+    unknown = wanted - set(FORMATS)
+    if unknown:
+        raise ValueError(f"Format(s) de sortie inconnu(s): {sorted(unknown)} (attendus: {FORMATS})")
+    if "parquet" in wanted and not HAS_PARQUET:
+        print("[WARN] pyarrow absent : sidecar parquet remplace par csv")
+        wanted.discard("parquet")
+        wanted.add("csv")
+    if not wanted:
+        wanted = {"xlsx"}
+    return tuple(f for f in FORMATS if f in wanted)
+
+
+def wants_sidecar(formats):
+    return any(f != "xlsx" for f in formats)
+
+
+def _stem(xlsx_path):
+    p = Path(xlsx_path)
+    return p.with_suffix("") if p.suffix.lower() == ".xlsx" else p
+
+
+def _normalize(value):
+    """Valeur lue -> meme type qu'une cellule openpyxl (entier si float entier)."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, float):
+        if value != value:  # NaN
+            return None
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+# ============================================================================
+# ECRITURE
+# ============================================================================
+
+def _write_csv(path, headers, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f, delimiter=CSV_SEP, quoting=csv.QUOTE_NONNUMERIC)
+        w.writerow(headers)
+        for row in rows:
+            w.writerow(["" if v is None else v for v in row])
+
+
+def _write_parquet(path, headers, rows):
+    import pandas as pd
+    names = [str(h) if h is not None else f"col{i}" for i, h in enumerate(headers)]
+    df = pd.DataFrame([list(r) + [None] * (len(names) - len(r)) for r in rows], columns=names)
+    for col in df.columns:
+        values = [v for v in df[col] if v is not None]
+        numeric = all(isinstance(v, numbers.Real) and not isinstance(v, bool) for v in values)
+        if not numeric:
+            # Colonne mixte (ex. codes 'DOM' / 97301) : texte, comme dans le xlsx
+            df[col] = [None if v is None else str(v) for v in df[col]]
+    df.to_parquet(path, index=False)
+
+
+def write_tables(xlsx_path, tables, formats):
+    """Ecrit les sidecars d'un classeur.
+
+    tables  : liste de (onglet, headers, rows) dans l'ordre du classeur
+    formats : tuple issu de resolve_formats (le xlsx est ecrit par l'appelant)
+    """
+    stem = _stem(xlsx_path)
+    written = []
+    for sheet, headers, rows in tables:
+        if "parquet" in formats:
+            _write_parquet(f"{stem}.{sheet}.parquet", headers, rows)
+        if "csv" in formats:
+            _write_csv(f"{stem}.{sheet}.csv", headers, rows)
+        written.append(sheet)
+    manifest = {
+        "source": f"{stem.name}.xlsx",
+        "sheets": written,
+        "formats": [f for f in formats if f != "xlsx"],
+    }
+    with open(f"{stem}.tables.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+
+def worksheet_table(ws):
+    """(headers, rows) d'une feuille openpyxl fraichement ecrite."""
+    rows = list(ws.iter_rows(values_only=True))
+    if not rows:
+        return [], []
+    return list(rows[0]), [list(r) for r in rows[1:]]
+
+
+def write_workbook_tables(xlsx_path, wb, formats):
+    """Sidecars de toutes les feuilles d'un Workbook deja rempli."""
+    tables = []
+    for ws in wb.worksheets:
+        headers, rows = worksheet_table(ws)
+        tables.append((ws.title, headers, rows))
+    write_tables(xlsx_path, tables, formats)
+
+
+# ============================================================================
+# LECTURE
+# ============================================================================
+
+def _read_csv_stream(stream):
+    reader = csv.reader(stream, delimiter=CSV_SEP, quoting=csv.QUOTE_NONNUMERIC)
+    rows = [[_normalize(v) for v in r] for r in reader]
+    if not rows:
+        return [], []
+    return rows[0], rows[1:]
+
+
+def _read_parquet_stream(stream):
+    import pandas as pd
+    df = pd.read_parquet(stream)
+    headers = list(df.columns)
+    rows = [[_normalize(v) for v in r] for r in df.astype(object).itertuples(index=False, name=None)]
+    return headers, rows
+
+
+def _read_with(opener, manifest_name, base):
+    """Lecture generique (fichier ou membre de ZIP) ; None si pas de sidecar."""
+    try:
+        manifest = json.loads(opener(manifest_name).decode("utf-8"))
+    except (KeyError, FileNotFoundError, OSError, ValueError):
+        return None
+    formats = manifest.get("formats", [])
+    tables = {}
+    for sheet in manifest.get("sheets", []):
+        table = None
+        if "parquet" in formats and HAS_PARQUET:
+            try:
+                table = _read_parquet_stream(io.BytesIO(opener(f"{base}.{sheet}.parquet")))
+            except (KeyError, FileNotFoundError, OSError):
+                table = None
+        if table is None and "csv" in formats:
+            try:
+                data = opener(f"{base}.{sheet}.csv").decode("utf-8")
+            except (KeyError, FileNotFoundError, OSError):
+                return None
+            table = _read_csv_stream(io.StringIO(data, newline=""))
+        if table is None:
+            return None
+        tables[sheet] = table
+    return tables
+
+
+def read_tables(xlsx_path):
+    """{onglet: (headers, rows)} depuis les sidecars d'un classeur, ou None."""
+    stem = _stem(xlsx_path)
+    return _read_with(lambda name: Path(name).read_bytes(), f"{stem}.tables.json", str(stem))
+
+
+def read_tables_from_zip(zf, xlsx_member):
+    """Idem pour un classeur membre d'un zipfile.ZipFile ouvert."""
+    member = PurePosixPath(xlsx_member)
+    stem = str(member.with_suffix("")) if member.suffix.lower() == ".xlsx" else str(member)
+    return _read_with(zf.read, f"{stem}.tables.json", stem)
+
+
+# ============================================================================
+# ARCHIVES INTERNES (sidecars d'un ZIP livre)
+# ============================================================================
+
+def pack_path(zip_path):
+    """Archive interne des sidecars du ZIP livre zip_path."""
+    return PACKS_DIR / Path(zip_path).name
+
+
+def _tree_sidecars(tree):
+    """Sidecars (manifestes et tables qu'ils listent) presents sous tree."""
+    files = []
+    for manifest_path in sorted(Path(tree).rglob("*.tables.json")):
+        base = str(manifest_path)[:-len(".tables.json")]
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            manifest = {}
+        for sheet in manifest.get("sheets", []):
+            for fmt in manifest.get("formats", []):
+                table = Path(f"{base}.{sheet}.{fmt}")
+                if table.is_file():
+                    files.append(table)
+        files.append(manifest_path)
+    return files
+
+
+def extract_pack(zip_path, root_dir, base_dir):
+    """Sort les sidecars de root_dir/base_dir vers pack_path(zip_path).
+
+    A appeler avant reproducible.make_archive(..., root_dir, base_dir) : le
+    ZIP livre ne contient alors que les classeurs. Sans sidecar, l'archive
+    interne d'une generation precedente (perimee) est supprimee.
+    Retourne le chemin de l'archive interne, ou None.
+    """
+    import reproducible
+
+    root = Path(root_dir)
+    target = pack_path(zip_path)
+    files = _tree_sidecars(root / base_dir)
+    if not files:
+        target.unlink(missing_ok=True)
+        return None
+    PACKS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = reproducible.tmp_path(target)
+    with reproducible.StableZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as zf:
+        for path in files:
+            zf.write(path, path.relative_to(root).as_posix())
+            path.unlink()
+    reproducible.replace_if_changed(tmp, target)
+    return target
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+PRISME - Cache disque des etapes de lecture des sources Open Data.
+
+Certaines sources (classeurs CepiDc, IRCOM, DREES...) coutent cher a relire
+alors qu'elles ne changent qu'a la main. Une etape de lecture peut stocker
+son resultat (JSON) sous PRISME_STATE_DIR/cache, indexe par l'empreinte
+SHA-1 du fichier source : toute modification du fichier invalide l'entree.
+
+    data = source_cache.cached("cepidc_cube", path, lambda: construire(path), version=1)
+
+`version` est a incrementer quand le format du resultat change. lookup() /
+store() exposent l'entree disque seule, pour qui calcule plusieurs entrees
+d'un meme fichier en parallele (scripts/extract_noyades_pdf.py). Une copie
+en memoire evite de relire le JSON tant que le fichier (mtime, taille) ne
+bouge pas.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from pathlib import Path
+
+import reproducible
+import timing
+
+BASE_DIR = Path(__file__).parent
+STATE_DIR = Path(os.environ.get("PRISME_STATE_DIR", BASE_DIR / "state"))
+CACHE_DIR = STATE_DIR / "cache"
+
+_memory = {}   # (kind, chemin) -> ((mtime_ns, taille), version, data)
+_lock = threading.Lock()
+
+
+def file_hash(path):
+    """SHA-1 du contenu d'un fichier (lecture par blocs)."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _entry_path(kind, path, digest):
+    return CACHE_DIR / f"{kind}_{Path(path).stem}_{digest[:16]}.json"
+
+
+def _store(kind, path, digest, version, data):
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        target = _entry_path(kind, path, digest)
+        # Fichier temporaire propre a l'appelant (app.py, workers, pool PDF...)
+        tmp = reproducible.tmp_path(target)
+        tmp.write_text(json.dumps({"version": version, "data": data}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, target)
+        # Entrees des versions precedentes du meme fichier (nom exact : pas
+        # celles d'un autre fichier dont le nom commence pareil)
+        same_source = re.compile(rf"{re.escape(kind)}_{re.escape(Path(path).stem)}_[0-9a-f]+\.json")
+        for old in CACHE_DIR.iterdir():
+            if old != target and same_source.fullmatch(old.name):
+                old.unlink(missing_ok=True)
+    except OSError as e:
+        print(f"[WARN] cache {kind} non ecrit ({e})")
+
+
+def lookup(kind, path, digest=None, version=1):
+    """Entree disque de ce fichier source, None si absente, perimee ou illisible."""
+    try:
+        payload = json.loads(_entry_path(kind, path, digest or file_hash(path)).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return payload.get("data") if payload.get("version") == version else None
+
+
+def store(kind, path, data, digest=None, version=1):
+    """Ecrit l'entree disque (pour les appelants qui construisent hors de cached())."""
+    _store(kind, path, digest or file_hash(path), version, data)
+
+
+def cached(kind, path, build, version=1):
+    """Resultat de build() pour ce fichier source, depuis le cache si son empreinte n'a pas change."""
+    path = Path(path)
+    stat = path.stat()
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    key = (kind, str(path.resolve()))
+    with _lock:
+        hit = _memory.get(key)
+        if hit and hit[0] == stamp and hit[1] == version:
+            timing.incr("cache_hit")
+            return hit[2]
+
+    digest = file_hash(path)
+    data = lookup(kind, path, digest, version)
+    if data is None:
+        timing.incr("cache_miss")
+        data = build()
+        _store(kind, path, digest, version, data)
+    else:
+        timing.incr("cache_hit")
+
+    with _lock:
+        _memory[key] = (stamp, version, data)
+    return data
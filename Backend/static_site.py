@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+PRISME - Service du frontend compile (Frontend/dist) par app.py.
+
+Le dossier est indexe une seule fois, au demarrage (StaticSite(dist)) :
+aucun is_file() par requete. Pour chaque fichier :
+    - variantes .br / .gz precalculees au build (Frontend/scripts/precompress.mjs),
+      choisies selon Accept-Encoding (Vary: Accept-Encoding) ; sans variante
+      .gz sur disque, gzip calcule au demarrage et garde en memoire pour les
+      fichiers texte
+    - ETag fort (SHA-256 du contenu, suffixe par encodage) : If-None-Match -> 304
+    - Cache-Control :
+        assets/ au nom hache par Vite (index-DxvLBm3J.js)  immuable, 1 an
+        index.html (garde en memoire)                     revalide a chaque
+                                                          chargement (PRISME_INDEX_MAX_AGE)
+        autres (robots.txt, video...)                     PRISME_STATIC_MAX_AGE
+Chemin inconnu : index.html (routes React Router), sauf sous assets/ (404).
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from pathlib import Path
+
+from fastapi.responses import FileResponse, Response
+
+from reproducible import etag_matches
+
+INDEX_MAX_AGE = int(os.environ.get("PRISME_INDEX_MAX_AGE", "0"))
+STATIC_MAX_AGE = int(os.environ.get("PRISME_STATIC_MAX_AGE", "3600"))
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Nom hache par Vite : <nom>-<8 caracteres>.<ext>
+HASHED_RE = re.compile(r"-[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+
+COMPRESSIBLE = {".js", ".mjs", ".css", ".html", ".svg", ".json", ".txt", ".map", ".xml", ".wasm"}
+MIN_COMPRESS_SIZE = 1024
+
+# Encodage -> suffixe du fichier precalcule, par ordre de preference
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+mimetypes.add_type("text/javascript", ".js")
+mimetypes.add_type("text/javascript", ".mjs")
+
+
+class _Entry:
+    """Un fichier de dist : identite (body en memoire ou path) et variantes."""
+    __slots__ = ("path", "media_type", "etag", "cache_control", "body", "encoded")
+
+    def __init__(self, path, media_type, etag, cache_control, body=None):
+        self.path = path
+        self.media_type = media_type
+        self.etag = etag
+        self.cache_control = cache_control
+        self.body = body
+        self.encoded = {}   # encodage -> bytes (memoire) ou Path (.br / .gz)
+
+
+def _accepted(header):
+    """Accept-Encoding -> {encodage: q}."""
+    accepted = {}
+    for part in (header or "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def negotiate(header, available):
+    """Meilleur encodage disponible accepte par le client (None = identite)."""
+    if not available:
+        return None
+    accepted = _accepted(header)
+    for encoding in ENCODINGS:
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class StaticSite:
+    def __init__(self, dist):
+        self.dist = Path(dist)
+        self.entries = {}
+        for path in sorted(self.dist.rglob("*")):
+            if not path.is_file():
+                continue
+            if path.suffix in (".br", ".gz") and path.with_suffix("").is_file():
+                continue  # variante d'un autre fichier
+            rel = path.relative_to(self.dist).as_posix()
+            self.entries[rel] = self._entry(path, rel)
+        self.index = self.entries.get("index.html")
+        encoded = sum(1 for e in self.entries.values() if e.encoded)
+        print(f"[OK] Frontend : {len(self.entries)} fichiers indexes, {encoded} avec variantes compressees")
+
+    def _entry(self, path, rel):
+        data = path.read_bytes()
+        media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        if rel == "index.html":
+            cache_control = f"public, max-age={INDEX_MAX_AGE}, must-revalidate"
+        elif rel.startswith("assets/") and HASHED_RE.search(path.name):
+            cache_control = IMMUTABLE
+        else:
+            cache_control = f"public, max-age={STATIC_MAX_AGE}"
+        entry = _Entry(path, media_type, f'"{hashlib.sha256(data).hexdigest()}"', cache_control,
+                       body=data if rel == "index.html" else None)
+
+        for encoding, suffix in ENCODINGS.items():
+            variant = path.with_name(path.name + suffix)
+            if variant.is_file():
+                entry.encoded[encoding] = variant
+        if "gzip" not in entry.encoded and path.suffix in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE:
+            packed = gzip.compress(data, compresslevel=6, mtime=0)
+            if len(packed) < len(data):
+                entry.encoded["gzip"] = packed
+        return entry
+
+    def response(self, rel, headers):
+        """Reponse pour le chemin rel (sans / initial) ; None = 404."""
+        entry = self.entries.get(rel)
+        if entry is None:
+            if rel.startswith("assets/") or self.index is None:
+                return None
+            entry = self.index
+
+        encoding = negotiate(headers.get("accept-encoding"), entry.encoded)
+        etag = entry.etag if encoding is None else f'{entry.etag[:-1]}-{ENCODINGS[encoding][1:]}"'
+        out = {"ETag": etag, "Cache-Control": entry.cache_control}
+        if entry.encoded:
+            out["Vary"] = "Accept-Encoding"
+        if etag_matches(headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=out)
+
+        if encoding is not None:
+            out["Content-Encoding"] = encoding
+            body = entry.encoded[encoding]
+        else:
+            body = entry.body if entry.body is not None else entry.path
+        if isinstance(body, bytes):
+            return Response(content=body, media_type=entry.media_type, headers=out)
+        return FileResponse(body, media_type=entry.media_type, headers=out)
@@ -0,0 +1,276 @@
+"""
+Tests du watchdog (generate_reports.Watchdog) contre une PocketBase locale
+simulée : serveur HTTP threadé qui sert l'API realtime (SSE) et les routes
+REST utilisées (inputs, reports). La génération Excel est remplacée par un
+ZIP minimal : seuls la prise en charge des inputs et l'upload sont testés.
+
+    python -m pytest Backend/test_watchdog.py -q
+"""
+import json
+import queue
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import generate_reports as gr
+
+
+# ============================================================================
+# POCKETBASE LOCALE
+# ============================================================================
+
+class FakePocketBase:
+    """PocketBase minimale en mémoire.
+
+    realtime=False : /api/realtime répond 404 (instance sans realtime, le
+    watchdog doit se rabattre sur le polling). drop_report_posts=N : les N
+    premiers POST de rapport sont enregistrés puis la connexion est coupée
+    sans réponse (coupure après création côté serveur).
+    """
+
+    def __init__(self, realtime=True, drop_report_posts=0):
+        self.realtime = realtime
+        self.drop_report_posts = drop_report_posts
+        self.inputs = {}
+        self.reports = {}
+        self.report_posts = 0
+        self.list_calls = 0
+        self.lock = threading.Lock()
+        self.clients = {}          # clientId -> (abonnements, file d'evenements)
+        self.stopping = threading.Event()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.stopping.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def subscribed(self):
+        with self.lock:
+            return any(subs for subs, _ in self.clients.values())
+
+    def add_input(self, **fields):
+        """Cree un input 'pending' et le diffuse aux abonnes realtime."""
+        record = {"id": uuid.uuid4().hex[:15], "status": "pending", "year": 2022,
+                  "theme": "educ", "updated": time.strftime("%Y-%m-%d %H:%M:%S"), **fields}
+        with self.lock:
+            self.inputs[record["id"]] = record
+            for subs, events in self.clients.values():
+                if "inputs" in subs:
+                    events.put(("inputs", {"action": "create", "record": dict(record)}))
+        return record["id"]
+
+    def wait_status(self, record_id, status, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.inputs[record_id]["status"] == status:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def _handler(self):
+        pb = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, data=None):
+                body = json.dumps(data if data is not None else {}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def _sse(self):
+                client_id = uuid.uuid4().hex
+                events = queue.Queue()
+                with pb.lock:
+                    pb.clients[client_id] = (set(), events)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")   # comme PocketBase (flush Go)
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                events.put(("PB_CONNECT", {"clientId": client_id}))
+                try:
+                    while not pb.stopping.is_set():
+                        try:
+                            name, data = events.get(timeout=0.1)
+                        except queue.Empty:
+                            continue
+                        chunk = f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        self.wfile.flush()
+                except OSError:
+                    pass
+                finally:
+                    with pb.lock:
+                        pb.clients.pop(client_id, None)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/api/realtime":
+                    if not pb.realtime:
+                        return self._json(404, {"message": "Not found"})
+                    return self._sse()
+                if path == "/api/collections/inputs/records":
+                    with pb.lock:
+                        pb.list_calls += 1
+                        items = [dict(r) for r in pb.inputs.values() if r["status"] == "pending"]
+                    return self._json(200, {"items": items})
+                m = re.fullmatch(r"/api/collections/(inputs|reports)/records/(\w+)", path)
+                store = m and (pb.inputs if m.group(1) == "inputs" else pb.reports)
+                if m and m.group(2) in store:
+                    return self._json(200, store[m.group(2)])
+                return self._json(404, {"message": "Not found"})
+
+            def do_PATCH(self):
+                m = re.fullmatch(r"/api/collections/inputs/records/(\w+)", self.path)
+                if not m or m.group(1) not in pb.inputs:
+                    return self._json(404, {"message": "Not found"})
+                with pb.lock:
+                    pb.inputs[m.group(1)].update(json.loads(self._body()))
+                return self._json(200, pb.inputs[m.group(1)])
+
+            def do_POST(self):
+                if self.path == "/api/realtime":
+                    data = json.loads(self._body())
+                    with pb.lock:
+                        if data["clientId"] in pb.clients:
+                            pb.clients[data["clientId"]][0].update(data["subscriptions"])
+                    self.send_response(204)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if self.path == "/api/collections/reports/records":
+                    body = self._body()
+                    report_id = re.search(rb'name="id"\r\n\r\n(\w+)\r\n', body).group(1).decode()
+                    with pb.lock:
+                        pb.report_posts += 1
+                        if report_id in pb.reports:
+                            return self._json(400, {"message": "id: value already in use"})
+                        pb.reports[report_id] = {"id": report_id, "size": len(body)}
+                        if pb.drop_report_posts > 0:
+                            pb.drop_report_posts -= 1
+                            self.close_connection = True
+                            return
+                    return self._json(200, pb.reports[report_id])
+                return self._json(404, {"message": "Not found"})
+
+        return Handler
+
+
+# ============================================================================
+# FIXTURES
+# ============================================================================
+
+def _fake_excel(theme, year, csv_dir=None, output_dir=None):
+    """Remplace generate_prisme_excel : dossier <annee>/ et ZIP minimal."""
+    year_dir = output_dir / str(year)
+    year_dir.mkdir(parents=True, exist_ok=True)
+    (year_dir / f"{theme}.xlsx").write_bytes(b"xlsx")
+    zip_path = output_dir / f"{theme}_{year}.zip"
+    zip_path.write_bytes(b"PK" + b"\0" * 2048)
+    return zip_path
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    monkeypatch.setattr(gr, "TEMP_DIR", tmp_path / "temp")
+    monkeypatch.setattr(gr, "OUTPUT_DIR", tmp_path / "output")
+    (tmp_path / "output").mkdir()
+    monkeypatch.setattr(gr, "generate_prisme_excel", _fake_excel)
+    monkeypatch.setattr(gr, "HTTP_BACKOFF", 0.01)
+    servers, watchdogs = [], []
+
+    def start(realtime=True, drop_report_posts=0, poll_interval=60):
+        fake = FakePocketBase(realtime=realtime, drop_report_posts=drop_report_posts)
+        servers.append(fake)
+        watchdog = gr.Watchdog(gr.PocketBaseClient(fake.url), workers=2,
+                               poll_interval=poll_interval, realtime=realtime)
+        watchdogs.append(watchdog)
+        threading.Thread(target=watchdog.run, daemon=True).start()
+        return fake, watchdog
+
+    yield start
+    for watchdog in watchdogs:
+        watchdog.stop()
+    for fake in servers:
+        fake.close()
+
+
+# ============================================================================
+# TESTS
+# ============================================================================
+
+def test_realtime_pickup(env, monkeypatch):
+    """Un input créé est traité sur l'événement realtime, sans attendre le polling."""
+    monkeypatch.setattr(gr, "POLL_INTERVAL_REALTIME", 60)
+    fake, watchdog = env(realtime=True, poll_interval=60)
+    assert watchdog.connected.wait(5)
+    deadline = time.monotonic() + 5
+    while not fake.subscribed() or fake.list_calls < 2:   # polls initial + connexion
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    polls = fake.list_calls
+
+    record_id = fake.add_input()
+    assert fake.wait_status(record_id, "processed", timeout=5)
+    assert fake.list_calls == polls
+    assert len(fake.reports) == 1
+
+
+def test_polling_fallback(env):
+    """Sans realtime (404), les inputs sont rattrapés par le polling."""
+    fake, watchdog = env(realtime=False, poll_interval=0.2)
+    record_id = fake.add_input()
+    assert fake.wait_status(record_id, "processed", timeout=5)
+    assert not watchdog.connected.is_set()
+    assert len(fake.reports) == 1
+
+
+def test_create_report_retry_is_idempotent(tmp_path, monkeypatch):
+    """Connexion coupée après création du rapport : le rejeu ne crée pas de doublon."""
+    monkeypatch.setattr(gr, "HTTP_BACKOFF", 0.01)
+    fake = FakePocketBase(realtime=False, drop_report_posts=1)
+    try:
+        report = tmp_path / "educ_2022.zip"
+        report.write_bytes(b"PK" + b"\0" * 4096)
+        pb = gr.PocketBaseClient(fake.url)
+        assert pb.create_report(2022, report, upload_key="input:abc:1")
+        assert pb.create_report(2022, report, upload_key="input:abc:1")
+        assert list(fake.reports) == [gr._report_id("input:abc:1")]
+        assert fake.report_posts == 2
+    finally:
+        fake.close()
+
+
+def test_worker_exception_marks_input_error(env, monkeypatch):
+    """Une exception hors de process_input est journalisée et passe l'input en 'error'."""
+    def boom(pb, item):
+        raise RuntimeError("coupure reseau")
+
+    monkeypatch.setattr(gr, "process_input", boom)
+    fake, watchdog = env(realtime=False, poll_interval=0.2)
+    record_id = fake.add_input()
+    assert fake.wait_status(record_id, "error", timeout=5)
+    assert fake.inputs[record_id]["logs"] == "coupure reseau"
+    deadline = time.monotonic() + 5
+    while watchdog._inflight:   # libere dans le finally, apres le statut
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
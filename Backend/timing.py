@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+PRISME - Chronometrage des etapes de generation (spans) et metriques.
+
+Les moteurs decoupent une generation en etapes nommees :
+    resolve     recherche des fichiers sources
+    decode      detection encodage / separateur et lecture brute
+    parse       parsing des sources -> donnees par niveau geo
+    fill        remplissage des tables (lignes des classeurs)
+    validate    controles de couverture (annees, niveaux, communes)
+    write_xlsx  ecriture des classeurs (et sidecars)
+    zip         archive finale
+
+    with timing.job("prisme", dataset="educ", year=2022):
+        with timing.span("parse"):
+            ...
+        timing.incr("bytes_written", zip_path.stat().st_size)
+
+A la fin d'un job, un enregistrement JSON (duree totale, spans, compteurs)
+est ajoute a PRISME_STATE_DIR/timings.jsonl et transmis aux listeners
+(app.py en tire /api/metrics). Un job ouvert dans un autre job devient un
+simple span du job englobant.
+
+Chaque span et chaque job portent aussi un bloc "memory" (RSS de fin et pic
+pendant l'etape, cf. memory.py ; PRISME_MEMORY=0 pour le retirer). capture()
+rend l'enregistrement du job a l'appelant (payload des endpoints).
+
+Desactive par defaut (PRISME_TIMING=1 ou enable() pour l'activer) : span()
+et job() rendent alors un contexte vide partage, sans autre cout qu'un test.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import memory
+
+BASE_DIR = Path(__file__).parent
+STATE_DIR = Path(os.environ.get("PRISME_STATE_DIR", BASE_DIR / "state"))
+TIMINGS_FILE = STATE_DIR / "timings.jsonl"
+TIMINGS_MAX_BYTES = 5 * 1024 * 1024   # au-dela : timings.jsonl -> timings.jsonl.1
+
+ENABLED = os.environ.get("PRISME_TIMING", "0").lower() in ("1", "true", "yes", "on")
+
+_current = contextvars.ContextVar("prisme_timing_job", default=None)
+_capture = contextvars.ContextVar("prisme_timing_capture", default=None)
+_listeners = []
+_write_lock = threading.Lock()
+
+
+class _Null:
+    """Contexte vide rendu quand le chronometrage est coupe."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _Null()
+
+
+def enable(flag=True):
+    global ENABLED
+    ENABLED = bool(flag)
+
+
+def add_listener(callback):
+    """callback(record) appele a la fin de chaque job (dans le thread du job)."""
+    _listeners.append(callback)
+
+
+def _labels(labels):
+    return {k: v if isinstance(v, (int, float, bool)) or v is None else str(v) for k, v in labels.items()}
+
+
+class _Span:
+    __slots__ = ("record", "stage", "labels", "t0", "mem")
+
+    def __init__(self, record, stage, labels):
+        self.record = record
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.mem = memory.begin(self.stage) if memory.ENABLED else None
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t1 = time.perf_counter()
+        entry = {
+            "stage": self.stage,
+            "start": round(self.t0 - self.record["_t0"], 6),
+            "seconds": round(t1 - self.t0, 6),
+        }
+        if self.labels:
+            entry["labels"] = _labels(self.labels)
+        if self.mem is not None:
+            entry["memory"] = memory.end(self.mem)
+        if exc_type is not None:
+            entry["error"] = exc_type.__name__
+        self.record["spans"].append(entry)
+        return False
+
+
+class _Job:
+    __slots__ = ("name", "labels", "record", "token", "t0", "mem")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        self.record = {
+            "job": self.name,
+            "labels": _labels(self.labels),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "spans": [],
+            "counters": {},
+            "_t0": self.t0,
+        }
+        self.token = _current.set(self.record)
+        self.mem = memory.begin() if memory.ENABLED else None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        record = self.record
+        del record["_t0"]
+        record["seconds"] = round(time.perf_counter() - self.t0, 6)
+        record["status"] = "ok" if exc_type is None else "error"
+        if exc_type is not None:
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        if self.mem is not None:
+            record["memory"] = memory.end(self.mem)
+            if memory.BUDGET_BYTES:
+                record["memory"]["budget_mb"] = round(memory.BUDGET_BYTES / (1024 * 1024), 1)
+        holder = _capture.get()
+        if holder is not None and holder.record is None:
+            holder.record = record
+        _emit(record)
+        return False
+
+
+def span(stage, **labels):
+    """Chronometre une etape du job courant (sans effet hors job ou si coupe)."""
+    if not ENABLED:
+        return _NULL
+    record = _current.get()
+    if record is None:
+        return _NULL
+    return _Span(record, stage, labels)
+
+
+def job(name, **labels):
+    """Ouvre un job (une generation) ; imbrique dans un autre job : span `name`."""
+    if not ENABLED:
+        return _NULL
+    if _current.get() is not None:
+        return span(name, **labels)
+    return _Job(name, labels)
+
+
+class Capture:
+    """Recoit l'enregistrement du premier job termine dans le bloc (ou None)."""
+    __slots__ = ("record", "token")
+
+    def __init__(self):
+        self.record = None
+
+    def __enter__(self):
+        self.token = _capture.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _capture.reset(self.token)
+        return False
+
+    def summary(self):
+        """Resume pour un payload d'API : duree, memoire, etapes."""
+        record = self.record
+        if record is None:
+            return None
+        out = {"job": record["job"], "seconds": record["seconds"], "status": record["status"]}
+        if "memory" in record:
+            out["memory"] = record["memory"]
+        stages = {}
+        for entry in record["spans"]:
+            st = stages.setdefault(entry["stage"], {"seconds": 0.0})
+            st["seconds"] = round(st["seconds"] + entry["seconds"], 6)
+            peak = (entry.get("memory") or {}).get("rss_peak_mb")
+            if peak is not None and peak > st.get("rss_peak_mb", 0):
+                st["rss_peak_mb"] = peak
+        out["stages"] = stages
+        if record["counters"]:
+            out["counters"] = record["counters"]
+        return out
+
+
+def capture():
+    """with timing.capture() as cap : ... ; cap.record / cap.summary() ensuite."""
+    return Capture()
+
+
+def incr(counter, value=1):
+    """Ajoute value au compteur du job courant (octets ecrits, hits de cache...)."""
+    if not ENABLED:
+        return
+    record = _current.get()
+    if record is not None:
+        record["counters"][counter] = record["counters"].get(counter, 0) + value
+
+
+def _emit(record):
+    line = json.dumps(record, ensure_ascii=False)
+    try:
+        with _write_lock:
+            STATE_DIR.mkdir(parents=True, exist_ok=True)
+            if TIMINGS_FILE.exists() and TIMINGS_FILE.stat().st_size > TIMINGS_MAX_BYTES:
+                os.replace(TIMINGS_FILE, TIMINGS_FILE.with_suffix(".jsonl.1"))
+            with open(TIMINGS_FILE, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        print(f"[WARN] timing : ecriture {TIMINGS_FILE} impossible ({e})")
+    for callback in list(_listeners):
+        try:
+            callback(record)
+        except Exception as e:
+            print(f"[WARN] timing : listener en erreur ({e})")
+
+
+# ============================================================================
+# METRIQUES (FORMAT TEXTE PROMETHEUS)
+# ============================================================================
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    parts = []
+    for n, v in zip(names, values):
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{n}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Metrics:
+    """Registre minimal compteurs / jauges / histogrammes, rendu en texte Prometheus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}   # nom -> [type, aide, noms de labels, {valeurs: etat}, buckets]
+
+    def _family(self, kind, name, help_text, labelnames, buckets=None):
+        fam = self._families.get(name)
+        if fam is None:
+            fam = self._families[name] = [kind, help_text, tuple(labelnames), {}, buckets]
+        return fam
+
+    def counter(self, name, help_text, labelnames=()):
+        self._family("counter", name, help_text, labelnames)
+
+    def gauge(self, name, help_text, labelnames=()):
+        self._family("gauge", name, help_text, labelnames)
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self._family("histogram", name, help_text, labelnames, tuple(buckets))
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            fam = self._families[name]
+            key = tuple(str(labels.get(n, "")) for n in fam[2])
+            fam[3][key] = fam[3].get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            fam = self._families[name]
+            fam[3][tuple(str(labels.get(n, "")) for n in fam[2])] = value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            fam = self._families[name]
+            key = tuple(str(labels.get(n, "")) for n in fam[2])
+            state = fam[3].get(key)
+            if state is None:
+                state = fam[3][key] = {"counts": [0] * len(fam[4]), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(fam[4]):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, labelnames, values, buckets) in self._families.items():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, state in sorted(values.items()):
+                    if kind != "histogram":
+                        lines.append(f"{name}{_label_text(labelnames, key)} {state}")
+                        continue
+                    for bound, n in zip(buckets, state["counts"]):
+                        lines.append(f"{name}_bucket{_label_text(labelnames + ('le',), key + (bound,))} {n}")
+                    lines.append(f"{name}_bucket{_label_text(labelnames + ('le',), key + ('+Inf',))} {state['count']}")
+                    lines.append(f"{name}_sum{_label_text(labelnames, key)} {round(state['sum'], 6)}")
+                    lines.append(f"{name}_count{_label_text(labelnames, key)} {state['count']}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+PRISME - Lecture en flux des classeurs xlsx sources (IRCOM, DREES...).
+
+Les classeurs publies par l'administration ont plusieurs onglets, des lignes
+de titre avant l'en-tete et des milliers de lignes dont on n'utilise qu'une
+partie. pd.read_excel(sheet_name=None / header=None) charge tout en
+DataFrame ; ici on passe par openpyxl read_only + iter_rows :
+    - read_sheets      : seulement les onglets demandes (lignes brutes)
+    - locate_header    : ligne d'en-tete trouvee par predicat, position
+                         memorisee par empreinte du fichier (source_cache)
+    - iter_records     : lignes de donnees apres l'en-tete, restreintes aux
+                         colonnes demandees (et au filtre `where`)
+
+Les indices de ligne sont ceux de pd.read_excel(header=None) : 0 = ligne 1.
+"""
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+import source_cache
+
+HEADER_CACHE_VERSION = 1
+
+
+def _open(path):
+    return load_workbook(str(path), read_only=True, data_only=True)
+
+
+def _resolve_sheet(wb, sheet):
+    """Onglet par nom ou par position (0 = premier onglet).
+
+    En read_only openpyxl s'arrete a la balise <dimension> du fichier, parfois
+    perimee (classeurs modifies par d'autres outils) : dimensions recalculees
+    a la lecture, comme le lecteur openpyxl de pandas.
+    """
+    ws = wb.worksheets[sheet] if isinstance(sheet, int) else wb[sheet]
+    ws.reset_dimensions()
+    return ws
+
+
+def sheet_names(path):
+    wb = _open(path)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+def read_sheets(path, sheets):
+    """{onglet: [tuple de valeurs, ...]} pour les onglets demandes, en une ouverture.
+
+    Les lignes vides en fin d'onglet sont retirees (comme pd.read_excel).
+    """
+    wb = _open(path)
+    try:
+        out = {}
+        for sheet in sheets:
+            rows = list(_resolve_sheet(wb, sheet).iter_rows(values_only=True))
+            while rows and all(v is None for v in rows[-1]):
+                rows.pop()
+            out[sheet] = rows
+        return out
+    finally:
+        wb.close()
+
+
+def cell(rows, i, j):
+    """rows[i][j], None hors des bornes (lignes courtes en read_only)."""
+    row = rows[i]
+    return row[j] if j < len(row) else None
+
+
+def _header_labels(values):
+    return [str(v).strip() if v is not None else f"col_{i}" for i, v in enumerate(values)]
+
+
+def locate_header(path, predicate, sheet=0, max_scan=30, cache_kind=None):
+    """(index de ligne, libelles) de la premiere ligne ou predicate(valeurs_minuscules) est vrai.
+
+    Avec cache_kind, la position est memorisee par empreinte du fichier :
+    les appels suivants ne rescannent pas les lignes de titre.
+    """
+    def scan():
+        wb = _open(path)
+        try:
+            ws = _resolve_sheet(wb, sheet)
+            for i, values in enumerate(ws.iter_rows(max_row=max_scan, values_only=True)):
+                lowered = [str(v).strip().lower() if v is not None else "" for v in values]
+                if predicate(lowered):
+                    return {"row": i, "headers": _header_labels(values)}
+        finally:
+            wb.close()
+        return None
+
+    found = source_cache.cached(cache_kind, path, scan, version=HEADER_CACHE_VERSION) if cache_kind else scan()
+    if found is None:
+        raise ValueError(f"En-tete non detecte dans {Path(path).name}")
+    return found["row"], found["headers"]
+
+
+def match_columns(headers, columns):
+    """{cle: predicat(libelle_minuscule)} -> {cle: index de la premiere colonne qui correspond}.
+
+    Les cles sans colonne correspondante sont absentes du resultat.
+    """
+    lowered = [h.lower() for h in headers]
+    found = {}
+    for key, pred in columns.items():
+        idx = next((i for i, h in enumerate(lowered) if pred(h)), None)
+        if idx is not None:
+            found[key] = idx
+    return found
+
+
+def iter_records(path, header_row, columns, sheet=0, where=None):
+    """Lignes de donnees sous l'en-tete, en dicts restreints aux colonnes utiles.
+
+    columns : {cle: index de colonne} (cf. match_columns)
+    where   : predicat(dict) optionnel applique a chaque ligne
+    Les lignes entierement vides sont ignorees.
+    """
+    wb = _open(path)
+    try:
+        ws = _resolve_sheet(wb, sheet)
+        for values in ws.iter_rows(min_row=header_row + 2, values_only=True):
+            if all(v is None for v in values):
+                continue
+            rec = {key: (values[idx] if idx < len(values) else None) for key, idx in columns.items()}
+            if where is None or where(rec):
+                yield rec
+    finally:
+        wb.close()
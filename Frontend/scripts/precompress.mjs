@@ -0,0 +1,46 @@
+// Precompression de dist/ apres `vite build` : variantes .br (brotli 11) et
+// .gz (gzip 9) des fichiers texte, servies selon Accept-Encoding par app.py
+// (Backend/static_site.py). Une variante qui ne gagne rien n'est pas ecrite.
+import { readdirSync, readFileSync, rmSync, statSync, writeFileSync } from 'node:fs'
+import { extname, join, relative } from 'node:path'
+import { fileURLToPath } from 'node:url'
+import { brotliCompressSync, constants, gzipSync } from 'node:zlib'
+
+const DIST = fileURLToPath(new URL('../dist/', import.meta.url))
+const EXTENSIONS = new Set(['.js', '.mjs', '.css', '.html', '.svg', '.json', '.txt', '.map', '.xml', '.wasm'])
+const MIN_SIZE = 1024
+
+const VARIANTS = {
+  '.br': (data) => brotliCompressSync(data, {
+    params: {
+      [constants.BROTLI_PARAM_QUALITY]: constants.BROTLI_MAX_QUALITY,
+      [constants.BROTLI_PARAM_SIZE_HINT]: data.length,
+    },
+  }),
+  '.gz': (data) => gzipSync(data, { level: 9 }),
+}
+
+function* walk(dir) {
+  for (const entry of readdirSync(dir, { withFileTypes: true })) {
+    const path = join(dir, entry.name)
+    if (entry.isDirectory()) yield* walk(path)
+    else yield path
+  }
+}
+
+let before = 0
+let after = 0
+for (const path of [...walk(DIST)].sort()) {
+  if (!EXTENSIONS.has(extname(path)) || statSync(path).size < MIN_SIZE) continue
+  const data = readFileSync(path)
+  for (const [suffix, compress] of Object.entries(VARIANTS)) {
+    const packed = compress(data)
+    if (packed.length < data.length) writeFileSync(path + suffix, packed)
+    else rmSync(path + suffix, { force: true })
+  }
+  const br = statSync(path + '.br', { throwIfNoEntry: false })
+  before += data.length
+  after += br ? br.size : data.length
+  console.log(`[OK] ${relative(DIST, path)} : ${data.length} -> ${br ? br.size : data.length} octets (br)`)
+}
+console.log(`[OK] precompression : ${before} -> ${after} octets`)
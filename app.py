@@ -1,11 +1,15 @@
 import sys
 import os
 import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
@@ -19,13 +23,43 @@ FRONTEND_DIST = BASE_DIR / "Frontend" / "dist"
 # Add Backend to path to import the engine
 sys.path.append(str(BACKEND_DIR))
 
-# Import Engine Logic (prisme_engine.py - config-driven avec tous les datasets)
-try:
-    from prisme_engine import generate_prisme_excel, OUTPUT_DIR, CSV_SOURCES_DIR
-    from generate_from_opendata import generate_theme
-except ImportError as e:
-    print(f"CRITICAL ERROR: Could not import generation engine. {e}")
-    sys.exit(1)
+import geo_index  # leger : pandas / moteurs importes seulement a la construction
+import memory
+import profiler
+import reproducible
+import timing
+
+# Moteurs de generation (prisme_engine, generate_from_opendata) : charges a la
+# demande. Leur import (pandas, openpyxl, themes_config.json) coute ~0.5 s ;
+# uvicorn ouvre le port tout de suite et un thread de warm-up les importe en
+# arriere-plan (PRISME_WARMUP=0 pour le desactiver).
+OUTPUT_DIR = BACKEND_DIR / "output"
+_warmup_state = {"status": "pending", "seconds": None, "error": None}
+
+
+def _prisme_engine():
+    import prisme_engine
+    return prisme_engine
+
+
+def _opendata_engine():
+    import generate_from_opendata
+    return generate_from_opendata
+
+
+def _warm_up_engines():
+    _warmup_state["status"] = "running"
+    t0 = time.time()
+    try:
+        _prisme_engine()
+        _opendata_engine()
+    except ImportError as e:
+        _warmup_state.update(status="error", error=str(e))
+        print(f"CRITICAL ERROR: Could not import generation engine. {e}")
+        return
+    _warmup_state.update(status="done", seconds=round(time.time() - t0, 2))
+    print(f"Engines loaded in {_warmup_state['seconds']}s")
+
 
 # Ensure output directory exists
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
@@ -45,10 +79,91 @@ def load_themes_config():
     return _themes_config_cache
 
 
+# ==========================================
+# METRIQUES (/api/metrics)
+# ==========================================
+# Les moteurs chronometrent leurs etapes (Backend/timing.py) ; chaque job
+# termine alimente les histogrammes ci-dessous. PRISME_METRICS=0 coupe le
+# chronometrage (les compteurs des endpoints restent tenus).
+METRICS = timing.Metrics()
+METRICS.histogram("prisme_generation_seconds", "Duree des generations par endpoint", ("kind", "dataset"))
+METRICS.counter("prisme_generations_total", "Generations terminees", ("kind", "dataset", "status"))
+METRICS.gauge("prisme_generations_in_progress", "Generations en cours ou en attente d'un thread")
+METRICS.histogram("prisme_stage_seconds", "Duree des etapes des moteurs", ("job", "stage"))
+METRICS.counter("prisme_bytes_written_total", "Octets ecrits (ZIP / xlsx)", ("job",))
+METRICS.counter("prisme_cache_requests_total", "Acces aux caches (tables /api/data, sources)", ("cache", "result"))
+METRICS.gauge("prisme_job_peak_rss_megabytes", "Pic RSS du dernier job par type et dataset", ("job", "dataset"))
+METRICS.gauge("prisme_memory_rss_bytes", "RSS du process")
+METRICS.gauge("prisme_memory_usage_bytes", "Memoire comptee contre le budget (cgroup ou RSS)")
+METRICS.gauge("prisme_memory_budget_bytes", "Budget memoire (PRISME_MEMORY_BUDGET_MB ou 80 % cgroup)")
+METRICS.counter("prisme_chunked_reads_total", "Lectures CSV par morceaux (pression memoire)", ("job",))
+METRICS.set("prisme_generations_in_progress", 0)
+
+_in_progress = {"count": 0}
+_in_progress_lock = threading.Lock()
+
+
+def _record_job_metrics(record):
+    for span in record["spans"]:
+        METRICS.observe("prisme_stage_seconds", span["seconds"], job=record["job"], stage=span["stage"])
+    counters = record["counters"]
+    if counters.get("bytes_written"):
+        METRICS.inc("prisme_bytes_written_total", counters["bytes_written"], job=record["job"])
+    for result in ("hit", "miss"):
+        if counters.get(f"cache_{result}"):
+            METRICS.inc("prisme_cache_requests_total", counters[f"cache_{result}"], cache="source", result=result)
+    if counters.get("chunked_reads"):
+        METRICS.inc("prisme_chunked_reads_total", counters["chunked_reads"], job=record["job"])
+    peak = (record.get("memory") or {}).get("rss_peak_mb")
+    if peak is not None:
+        METRICS.set("prisme_job_peak_rss_megabytes", peak, job=record["job"],
+                     dataset=record["labels"].get("dataset", ""))
+
+
+if os.environ.get("PRISME_METRICS", "1") != "0":
+    timing.enable()
+    timing.add_listener(_record_job_metrics)
+
+
+def _generation_started():
+    with _in_progress_lock:
+        _in_progress["count"] += 1
+        METRICS.set("prisme_generations_in_progress", _in_progress["count"])
+    return time.perf_counter()
+
+
+def _generation_done(kind, dataset, t0, success):
+    with _in_progress_lock:
+        _in_progress["count"] -= 1
+        METRICS.set("prisme_generations_in_progress", _in_progress["count"])
+    METRICS.observe("prisme_generation_seconds", time.perf_counter() - t0, kind=kind, dataset=dataset)
+    METRICS.inc("prisme_generations_total", kind=kind, dataset=dataset, status="ok" if success else "error")
+
+
+def _with_profile(payload, prof, cap=None, waited=0):
+    """Ajoute a la reponse l'identifiant du profil ecrit (profiler.py) et le
+    resume du job (durees, pic memoire par etape, cf. timing.capture)."""
+    if prof.job_id:
+        payload["profile_id"] = prof.job_id
+    job = cap.summary() if cap is not None else None
+    if job is not None:
+        if waited:
+            job["queued_seconds"] = waited
+        payload["job"] = job
+    return payload
+
+
 # ==========================================
 # FASTAPI APP
 # ==========================================
-app = FastAPI(title="PRISME Engine V3", version="3.0.0")
+@asynccontextmanager
+async def lifespan(app):
+    if os.environ.get("PRISME_WARMUP", "1") != "0":
+        threading.Thread(target=_warm_up_engines, name="engine-warmup", daemon=True).start()
+    yield
+
+
+app = FastAPI(title="PRISME Engine V3", version="3.0.0", lifespan=lifespan)
 
 # CORS setup (Allow all for local reliability)
 app.add_middleware(
@@ -63,26 +178,31 @@ app.add_middleware(
 # ==========================================
 
 @app.post("/api/generate")
-async def generate_report(theme: str, year: int):
+def generate_report(theme: str, year: int, profile: bool = False):
     """
     Triggers the generation of the Excel report.
     This runs synchronously in the threadpool (FastAPI default behavior for def),
     which is acceptable for this use case.
+    ?profile=1 : profil cProfile + flamegraph, cf. /api/jobs/{id}/profile.
     """
     print(f"Request: Generate {theme} for {year}")
-    
+    t0 = _generation_started()
+    success = False
     try:
         # Call the engine (prisme_engine.generate_prisme_excel(dataset_id, year))
-        output_path = generate_prisme_excel(theme, year)
+        # memory.gate : sous pression memoire, une generation a la fois
+        with memory.gate() as waited, profiler.request(force=profile) as prof, timing.capture() as cap:
+            output_path = _prisme_engine().generate_prisme_excel(theme, year)
         
         if output_path and output_path.exists():
             filename = output_path.name
             print(f"Success: {filename}")
-            return {
+            success = True
+            return _with_profile({
                 "success": True, 
                 "filename": filename,
                 "message": "Fichier généré avec succès"
-            }
+            }, prof, cap, waited)
         else:
             print("Failure: Engine returned None")
             return {
@@ -96,17 +216,21 @@ async def generate_report(theme: str, year: int):
             "success": False, 
             "error": str(e)
         }
+    finally:
+        _generation_done("moca", theme, t0, success)
 
 @app.post("/api/generate-opendata")
-async def generate_opendata(theme: str, year: int):
+def generate_opendata(theme: str, year: int, profile: bool = False):
     """
     Triggers Open Data file generation.
     """
     print(f"Request: Generate Open Data {theme} for {year}")
-    
+    t0 = _generation_started()
+    success = False
     try:
         # Call the Open Data Engine
-        root_dir = generate_theme(theme, year)
+        with memory.gate() as waited, profiler.request(force=profile) as prof, timing.capture() as cap:
+            root_dir = _opendata_engine().generate_theme(theme, year)
         
         # The zip file is generated at OUTPUT_DIR / f"{theme}_opendata_{year}.zip"
         filename = f"{theme}_opendata_{year}.zip"
@@ -114,11 +238,12 @@ async def generate_opendata(theme: str, year: int):
         
         if zip_path.exists():
             print(f"Success Open Data: {filename}")
-            return {
+            success = True
+            return _with_profile({
                 "success": True, 
                 "filename": filename,
                 "message": "Fichier Open Data généré avec succès"
-            }
+            }, prof, cap, waited)
         else:
             print("Failure: Open Data Engine returned but file not found")
             return {
@@ -132,6 +257,8 @@ async def generate_opendata(theme: str, year: int):
             "success": False, 
             "error": str(e)
         }
+    finally:
+        _generation_done("opendata", theme, t0, success)
 
 # Open Data Years Mapping
 OPENDATA_YEARS = {
@@ -168,9 +295,12 @@ async def get_available_years_opendata(dataset: str):
     return {"success": True, "years": years}
 
 @app.get("/api/download/{filename}")
-async def download_file(filename: str):
+def download_file(filename: str, request: Request):
     """
     Serves the generated file from the output directory.
+
+    ETag fort (SHA-256 du contenu, cf. reproducible) : If-None-Match -> 304 ;
+    Range / If-Range -> 206 (FileResponse).
     """
     file_path = OUTPUT_DIR / filename
     
@@ -187,16 +317,59 @@ async def download_file(filename: str):
         media_type = 'application/zip'
     elif filename.endswith('.xlsx'):
         media_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        
+
+    headers = {"ETag": reproducible.etag(file_path), "Cache-Control": "no-cache"}
+    if reproducible.etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
     return FileResponse(
         path=file_path, 
         filename=filename, 
-        media_type=media_type
+        media_type=media_type,
+        headers=headers,
     )
 
+@app.get("/api/metrics")
+def get_metrics():
+    """Prometheus text exposition (generations, etapes des moteurs, caches, memoire)."""
+    METRICS.set("prisme_memory_rss_bytes", memory.rss_bytes() or 0)
+    METRICS.set("prisme_memory_usage_bytes", memory.usage_bytes() or 0)
+    METRICS.set("prisme_memory_budget_bytes", memory.BUDGET_BYTES or 0)
+    return Response(content=METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+PROFILE_MEDIA_TYPES = {
+    "prof": "application/octet-stream",
+    "collapsed": "text/plain; charset=utf-8",
+}
+
+
+@app.get("/api/jobs")
+def list_jobs():
+    """Generations profilees (?profile=1 ou PRISME_PROFILE=1), plus recentes d'abord."""
+    return {"success": True, "profiles": profiler.list_profiles()}
+
+
+@app.get("/api/jobs/{job_id}/profile")
+def get_job_profile(job_id: str, format: str = "json"):
+    """Profil d'une generation : meta (json), cProfile (prof) ou piles repliees (collapsed)."""
+    if format != "json" and format not in PROFILE_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format attendu : json, prof ou collapsed")
+    path = profiler.find(job_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Profil introuvable : {job_id}")
+    if format == "json":
+        return profiler.read_meta(job_id)
+    file_path = path / profiler.FILES[format]
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail=f"{file_path.name} absent pour {job_id}")
+    return FileResponse(path=file_path, filename=f"{job_id}_{file_path.name}",
+                        media_type=PROFILE_MEDIA_TYPES[format])
+
+
 @app.get("/api/health")
 async def health_check():
-    return {"status": "ok", "engine": "python-fastapi"}
+    return {"status": "ok", "engine": "python-fastapi", "warmup": _warmup_state, "memory": memory.status()}
 
 
 @app.get("/api/files")
@@ -231,7 +404,6 @@ async def list_files():
             source = "Open Data" if is_opendata else "MOCA-O"
 
             base = f.name.replace(".zip", "")
-            import re
             theme_id = re.sub(r"_opendata_\d{4}.*$", "", base)
             theme_id = re.sub(r"_\d{4}.*$", "", theme_id)
 
@@ -259,37 +431,245 @@ async def get_themes():
 
 
 @app.get("/api/available-years")
-async def get_available_years(dataset: str):
+def get_available_years(dataset: str):
     """Returns available years for a dataset in MOCA-O mode."""
     try:
-        from prisme_engine import detect_available_years
-        years = detect_available_years(dataset)
+        years = _prisme_engine().detect_available_years(dataset)
         return {"success": True, "years": years}
     except Exception as e:
         return {"success": False, "years": [], "error": str(e)}
 
+# ==========================================
+# DATA API (JSON / ARROW, SANS EXCEL)
+# ==========================================
+# Sert les lignes exactes des classeurs (build_prisme_tables / theme_tables)
+# sans ecrire de xlsx ni de ZIP : apercus et graphiques du frontend. Les
+# tables calculees sont gardees en memoire (LRU, PRISME_DATA_CACHE_SIZE
+# entrees) et invalidees quand les sources changent (mtime des CSV, des
+# fichiers Open Data ou de themes_config.json, relus au plus toutes les
+# PRISME_SIGNATURE_TTL s).
+GEO_LEVELS = ("com", "reg", "dom", "fh", "fra")
+DATA_CACHE_SIZE = int(os.environ.get("PRISME_DATA_CACHE_SIZE", "32"))
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+YEAR_RE = re.compile(r"^\d{4}(-\d{4})?$")
+
+_data_cache = OrderedDict()  # (source, dataset, year) -> (signature, tables)
+_data_cache_lock = threading.Lock()
+_data_build_locks = {}
+
+
+def _plain(value):
+    """Valeur de cellule -> type JSON (NaN -> null, scalaires numpy -> Python)."""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def _build_tables(source, dataset, year):
+    if source == "moca":
+        # themes_config.json modifie : relu par le moteur (plans recompiles)
+        tables = _prisme_engine().build_prisme_tables(dataset, year)
+        if tables is None:
+            raise HTTPException(status_code=404, detail=f"Aucune donnee pour {dataset} {year}")
+    else:
+        engine = _opendata_engine()
+        if dataset not in engine.THEME_CONFIGS:
+            raise HTTPException(status_code=404, detail=f"Theme Open Data inconnu: {dataset}")
+        try:
+            all_levels, _ = engine.build_theme_levels(dataset, year)
+        except (FileNotFoundError, ValueError) as e:
+            # ValueError : annee absente de la source (ex. noyades avant 2021)
+            raise HTTPException(status_code=404, detail=str(e))
+        tables = engine.theme_tables(dataset, year, all_levels)
+    return {
+        geo_key: (list(headers), [[_plain(v) for v in row] for row in rows])
+        for geo_key, (headers, rows) in tables.items()
+    }
+
+
+def _data_tables(source, dataset, year):
+    """Tables {geo_key: (headers, rows)} depuis le cache ou calculees. -> (tables, cached)"""
+    key = (source, dataset, year)
+    signature = geo_index.sources_signature(source)
+    with _data_cache_lock:
+        entry = _data_cache.get(key)
+        if entry and entry[0] == signature:
+            _data_cache.move_to_end(key)
+            return entry[1], True
+        build_lock = _data_build_locks.setdefault(key, threading.Lock())
+
+    # Une seule construction par cle : les requetes concurrentes attendent la premiere
+    try:
+        with build_lock:
+            with _data_cache_lock:
+                entry = _data_cache.get(key)
+                if entry and entry[0] == signature:
+                    return entry[1], True
+            tables = _build_tables(source, dataset, year)
+            with _data_cache_lock:
+                _data_cache[key] = (signature, tables)
+                _data_cache.move_to_end(key)
+                while len(_data_cache) > DATA_CACHE_SIZE:
+                    _data_cache.popitem(last=False)
+    finally:
+        # Verrou retire par le dernier constructeur (pas de verrou par cle orpheline)
+        with _data_cache_lock:
+            if _data_build_locks.get(key) is build_lock and not build_lock.locked():
+                del _data_build_locks[key]
+    return tables, False
+
+
+def _arrow_payload(headers, rows):
+    """Flux Arrow IPC d'une table (colonnes mixtes en texte, comme les sidecars)."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=406, detail="format=arrow indisponible (pyarrow non installe)")
+    arrays = []
+    for i in range(len(headers)):
+        values = [row[i] if i < len(row) else None for row in rows]
+        present = [v for v in values if v is not None]
+        if present and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+            kind = pa.int64() if all(isinstance(v, int) for v in present) else pa.float64()
+            arrays.append(pa.array(values, type=kind))
+        else:
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=pa.string()))
+    table = pa.Table.from_arrays(arrays, names=[str(h) for h in headers])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+@app.get("/api/data/{dataset}/{year}")
+def get_dataset_rows(dataset: str, year: str, level: str = None,
+                     format: str = "json", source: str = "moca"):
+    """
+    Returns the rows generate_prisme_excel (source=moca) or generate_theme
+    (source=opendata) would write, without building any xlsx / ZIP.
+    level : com | reg | dom | fh | fra (all levels if omitted, json only)
+    format : json | arrow
+    """
+    if source not in ("moca", "opendata"):
+        raise HTTPException(status_code=400, detail="source doit valoir moca ou opendata")
+    if format not in ("json", "arrow"):
+        raise HTTPException(status_code=400, detail="format doit valoir json ou arrow")
+    if level is not None and level not in GEO_LEVELS:
+        raise HTTPException(status_code=400, detail=f"level doit valoir {' | '.join(GEO_LEVELS)}")
+    if format == "arrow" and level is None:
+        raise HTTPException(status_code=400, detail="format=arrow requiert level (une table par niveau)")
+    # Annee (2022) ou periode MOCA-O (2015-2020)
+    if not YEAR_RE.match(year):
+        raise HTTPException(status_code=400, detail="annee invalide (AAAA ou AAAA-AAAA)")
+    year_key = int(year) if year.isdigit() else year
+    if source == "opendata" and not isinstance(year_key, int):
+        raise HTTPException(status_code=400, detail="annee invalide")
+
+    t0 = time.time()
+    tables, cached = _data_tables(source, dataset, year_key)
+    METRICS.inc("prisme_cache_requests_total", cache="data", result="hit" if cached else "miss")
+    levels = [level] if level else list(tables)
+
+    if format == "arrow":
+        headers, rows = tables[level]
+        return Response(content=_arrow_payload(headers, rows), media_type=ARROW_MEDIA_TYPE,
+                        headers={"X-Prisme-Cache": "hit" if cached else "miss"})
+
+    return {
+        "success": True,
+        "source": source,
+        "dataset": dataset,
+        "year": year_key,
+        "cached": cached,
+        "elapsed_ms": round((time.time() - t0) * 1000, 1),
+        "levels": {
+            k: {"columns": tables[k][0], "rows": tables[k][1]} for k in levels
+        },
+    }
+
+
+# ==========================================
+# PROFIL D'UN TERRITOIRE (INDEX GEO)
+# ==========================================
+# Index (codgeo, annee) de tous les datasets MOCA-O et themes Open Data
+# (Backend/geo_index.py). Construit en arriere-plan au premier appel, puis
+# reconstruit quand les sources changent ; l'ancien index reste servi
+# pendant la reconstruction.
+_geo_index_build = {"running": False, "error": None}
+_geo_index_lock = threading.Lock()
+
+
+def _rebuild_geo_index():
+    try:
+        geo_index.build_index()
+        _geo_index_build["error"] = None
+    except Exception as e:
+        _geo_index_build["error"] = str(e)
+        print(f"[ERROR] Index geo : {e}")
+    finally:
+        _geo_index_build["running"] = False
+
+
+def _ensure_geo_index(state):
+    """Lance une reconstruction si l'index est absent ou perime (une a la fois)."""
+    if state is not None and not state["stale"]:
+        return
+    with _geo_index_lock:
+        if _geo_index_build["running"]:
+            return
+        _geo_index_build["running"] = True
+    threading.Thread(target=_rebuild_geo_index, name="geo-index", daemon=True).start()
+
+
+@app.get("/api/geo/{codgeo}")
+def get_geo_profile(codgeo: str, level: str = None):
+    """
+    Returns every indexed variable for a territory (commune, region, DOM,
+    FH, FRA), all datasets and years, in one read of the geo index.
+    """
+    if level is not None and level not in GEO_LEVELS:
+        raise HTTPException(status_code=400, detail=f"level doit valoir {' | '.join(GEO_LEVELS)}")
+    state = geo_index.status()
+    _ensure_geo_index(state)
+    profile = geo_index.lookup(codgeo, level) if state else None
+    if profile is None:
+        raise HTTPException(status_code=503, detail="Index geographique en construction, reessayer dans quelques minutes")
+    if not profile["sources"]:
+        raise HTTPException(status_code=404, detail=f"Aucune donnee pour le territoire {codgeo}")
+    return {
+        "success": True,
+        "codgeo": codgeo,
+        **profile,
+        "index": {
+            "built_at": state["built_at"],
+            "stale": state["stale"],
+            "rebuilding": _geo_index_build["running"],
+        },
+    }
+
+
 # ==========================================
 # STATIC FILES SERVING (REACT APP)
 # ==========================================
 
 if FRONTEND_DIST.exists():
     print(f"Serving Frontend from: {FRONTEND_DIST}")
-    
-    # Mount assets (CSS, JS, Images)
-    if (FRONTEND_DIST / "assets").exists():
-        app.mount("/assets", StaticFiles(directory=FRONTEND_DIST / "assets"), name="assets")
-    
+
+    # dist indexe une fois : variantes .br/.gz, ETag, Cache-Control (cf. static_site)
+    import static_site
+    STATIC_SITE = static_site.StaticSite(FRONTEND_DIST)
+
     # Catch-all route for SPA (Single Page Application)
     # This must be defined AFTER API routes
     @app.get("/{catchall:path}")
-    async def serve_react_app(catchall: str):
-        # 1. Check if the specific file exists in dist root (e.g. favicon.ico, etc.)
-        file_path = FRONTEND_DIST / catchall
-        if file_path.is_file():
-            return FileResponse(file_path)
-            
-        # 2. Otherwise return index.html (React Router handles the rest)
-        return FileResponse(FRONTEND_DIST / "index.html")
+    async def serve_react_app(catchall: str, request: Request):
+        # Fichier de dist (assets, favicon...) sinon index.html (React Router)
+        response = STATIC_SITE.response(catchall, request.headers)
+        if response is None:
+            raise HTTPException(status_code=404, detail="Fichier introuvable")
+        return response
 else:
     print("WARNING: Frontend dist folder not found. API mode only.")
 